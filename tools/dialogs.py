@@ -2,6 +2,7 @@
 import sys
 import os.path
 import string
+import re
 
 import gobject
 import glib
@@ -19,6 +20,11 @@ from objects import Service
 from objects import Task
 from objects import RegistryKey
 from objects import RegistryValue
+from objects import RegistrySearchOptions
+
+from regquery import CSVResultWriter
+from regquery import read_hosts
+from regusage import CSVUsageWriter
 
 
 class AboutDialog(gtk.AboutDialog):
@@ -2110,12 +2116,188 @@ class RegRenameDialog(gtk.Dialog):
         else:
             self.reg_key.name = self.name_entry.get_text()
 
+class RegGoToPathDialog(gtk.Dialog):
+    
+    def __init__(self, path = ""):
+        super(RegGoToPathDialog, self).__init__()
+        
+        self.path = path
+        
+        self.create()
+        self.path_entry.set_text(self.path)
+        
+    def create(self):
+        self.set_title("Go to registry path")
+        self.set_border_width(5)
+        
+        self.icon_registry_filename = os.path.join(sys.path[0], "images", "registry.png")
+        self.set_icon_from_file(self.icon_registry_filename)
+
+        self.set_default_size(500, -1)
+
+
+        # path
+        
+        hbox = gtk.HBox()
+        self.vbox.pack_start(hbox, False, False, 10)
+        
+        label = gtk.Label("Path:")
+        hbox.pack_start(label, False, True, 10)
+        
+        self.path_entry = gtk.Entry()
+        self.path_entry.set_activates_default(True)
+        self.path_entry.set_tooltip_text("For example HKLM\\SOFTWARE\\Microsoft\\Windows")
+        hbox.pack_start(self.path_entry, True, True, 10)
+        
+
+        # dialog buttons
+        
+        self.action_area.set_layout(gtk.BUTTONBOX_END)
+        
+        self.cancel_button = gtk.Button("Cancel", gtk.STOCK_CANCEL)
+        self.cancel_button.set_flags(gtk.CAN_DEFAULT)
+        self.add_action_widget(self.cancel_button, gtk.RESPONSE_CANCEL)
+        
+        self.ok_button = gtk.Button("Go", gtk.STOCK_JUMP_TO)
+        self.ok_button.set_flags(gtk.CAN_DEFAULT)
+        self.add_action_widget(self.ok_button, gtk.RESPONSE_OK)
+        
+        self.set_default_response(gtk.RESPONSE_OK)
+        
+        
+        # signals/events
+
+    def check_for_problems(self):
+        if (len(self.path_entry.get_text().strip().strip("\\")) == 0):
+            return "Please specify a path."
+        return None
+    
+    def get_path(self):
+        return self.path_entry.get_text().strip()
+
+
+class RegCompareDialog(gtk.Dialog):
+    
+    def __init__(self, path = ""):
+        super(RegCompareDialog, self).__init__()
+        
+        self.path = path
+        
+        self.create()
+        self.path_entry.set_text(self.path)
+        self.on_radio_toggled(None)
+        
+    def create(self):
+        self.set_title("Compare the registry")
+        self.set_border_width(5)
+        
+        self.icon_registry_filename = os.path.join(sys.path[0], "images", "registry.png")
+        self.set_icon_from_file(self.icon_registry_filename)
+
+        self.set_default_size(500, -1)
+
+
+        # path
+        
+        hbox = gtk.HBox()
+        self.vbox.pack_start(hbox, False, False, 10)
+        
+        label = gtk.Label("Compare:")
+        hbox.pack_start(label, False, True, 10)
+        
+        self.path_entry = gtk.Entry()
+        self.path_entry.set_activates_default(True)
+        self.path_entry.set_tooltip_text("The key to compare, with everything below it. For example HKLM\\SOFTWARE\\Microsoft")
+        hbox.pack_start(self.path_entry, True, True, 10)
+        
+        
+        # other side
+        
+        frame = gtk.Frame("With:")
+        self.vbox.pack_start(frame, False, True, 0)
+        
+        vbox = gtk.VBox()
+        vbox.set_border_width(4)
+        frame.add(vbox)
+        
+        self.server_radio = gtk.RadioButton(None, "The same key on another server")
+        self.server_radio.set_tooltip_text("The first comparison lists every key on both servers. Later ones don't list the keys that haven't been written to on either server since")
+        vbox.pack_start(self.server_radio, False, False, 0)
+        
+        hbox = gtk.HBox()
+        vbox.pack_start(hbox, False, False, 0)
+        
+        self.file_radio = gtk.RadioButton(self.server_radio, "The same key in an export:")
+        hbox.pack_start(self.file_radio, False, False, 0)
+        
+        self.file_chooser_button = gtk.FileChooserButton("Choose an export")
+        file_filter = gtk.FileFilter()
+        file_filter.set_name("Registry files (*.reg, *.regb)")
+        file_filter.add_pattern("*.reg")
+        file_filter.add_pattern("*.regb")
+        self.file_chooser_button.add_filter(file_filter)
+        hbox.pack_start(self.file_chooser_button, True, True, 5)
+        
+        self.check_compare_times = gtk.CheckButton("The export is from this server, skip keys that haven't been written to since")
+        self.check_compare_times.set_tooltip_text("Only compact exports (*.regb) have the times keys were last written to")
+        self.check_compare_times.set_active(True)
+        vbox.pack_start(self.check_compare_times, False, False, 0)
+        
+
+        # dialog buttons
+        
+        self.action_area.set_layout(gtk.BUTTONBOX_END)
+        
+        self.cancel_button = gtk.Button("Cancel", gtk.STOCK_CANCEL)
+        self.cancel_button.set_flags(gtk.CAN_DEFAULT)
+        self.add_action_widget(self.cancel_button, gtk.RESPONSE_CANCEL)
+        
+        self.ok_button = gtk.Button("Compare", gtk.STOCK_OK)
+        self.ok_button.set_flags(gtk.CAN_DEFAULT)
+        self.add_action_widget(self.ok_button, gtk.RESPONSE_OK)
+        
+        self.set_default_response(gtk.RESPONSE_OK)
+        
+        
+        # signals/events
+        
+        self.server_radio.connect("toggled", self.on_radio_toggled)
+        self.file_radio.connect("toggled", self.on_radio_toggled)
+
+    def check_for_problems(self):
+        if (len(self.path_entry.get_text().strip().strip("\\")) == 0):
+            return "Please specify a path."
+        if (self.file_radio.get_active() and self.file_chooser_button.get_filename() == None):
+            return "Please choose an export to compare with."
+        return None
+    
+    def get_path(self):
+        return self.path_entry.get_text().strip()
+    
+    def get_filename(self):
+        """returns the export to compare with, or None to compare with another server"""
+        if (self.server_radio.get_active()):
+            return None
+        return self.file_chooser_button.get_filename()
+    
+    def get_compare_times(self):
+        return (self.file_radio.get_active() and self.check_compare_times.get_active())
+    
+    def on_radio_toggled(self, widget):
+        self.file_chooser_button.set_sensitive(self.file_radio.get_active())
+        self.check_compare_times.set_sensitive(self.file_radio.get_active())
+
+
 class RegSearchDialog(gtk.Dialog):
     
-    def __init__(self):
+    RESPONSE_FIND_ALL = 1
+    
+    def __init__(self, find_all = False, index_available = False):
         super(RegSearchDialog, self).__init__()
         
         self.warned = False
+        self.find_all = find_all
+        self.index_available = index_available
         
         self.create()
         
@@ -2164,6 +2346,49 @@ class RegSearchDialog(gtk.Dialog):
         self.check_match_whole_string = gtk.CheckButton("Match whole string only")
         self.vbox.pack_start(self.check_match_whole_string, False, False, 5)
         
+        self.check_match_whole_word = gtk.CheckButton("Match whole words only")
+        self.vbox.pack_start(self.check_match_whole_word, False, False, 0)
+        
+        self.check_match_case = gtk.CheckButton("Match case")
+        self.vbox.pack_start(self.check_match_case, False, False, 0)
+        
+        self.check_use_regex = gtk.CheckButton("Use regular expression")
+        self.check_use_regex.set_tooltip_text("Search for the text as one regular expression instead of a list of words")
+        self.vbox.pack_start(self.check_use_regex, False, False, 5)
+        
+        
+        # performance
+        
+        frame = gtk.Frame("Speed:")
+        self.vbox.pack_start(frame, False, True, 0)
+        
+        vbox = gtk.VBox()
+        vbox.set_border_width(4)
+        frame.add(vbox)
+        
+        hbox = gtk.HBox()
+        vbox.pack_start(hbox, False, False, 0)
+        
+        label = gtk.Label("Connections to use: ")
+        hbox.pack_start(label, False, True, 0)
+        
+        self.pipe_count_spin_button = gtk.SpinButton(gtk.Adjustment(4, 1, 16, 1, 4), 1, 0)
+        self.pipe_count_spin_button.set_tooltip_text("Searching with more connections is faster on slow links, but puts more load on the server")
+        hbox.pack_start(self.pipe_count_spin_button, False, True, 0)
+        
+        self.check_unordered = gtk.CheckButton("Take the first match found, even if it's not the first in the tree")
+        vbox.pack_start(self.check_unordered, False, False, 0)
+        
+        self.check_use_index = gtk.CheckButton("Search the offline index")
+        self.check_use_index.set_tooltip_text("Much faster, but only finds what was there when the index was last updated (Edit > Update Search Index)")
+        self.check_use_index.set_sensitive(self.index_available)
+        vbox.pack_start(self.check_use_index, False, False, 0)
+        
+        self.check_verify_index = gtk.CheckButton("Check matches with the server")
+        self.check_verify_index.set_active(True)
+        self.check_verify_index.set_sensitive(False)
+        vbox.pack_start(self.check_verify_index, False, False, 0)
+        
 
         # dialog buttons
         
@@ -2173,20 +2398,32 @@ class RegSearchDialog(gtk.Dialog):
         self.cancel_button.set_flags(gtk.CAN_DEFAULT)
         self.add_action_widget(self.cancel_button, gtk.RESPONSE_CANCEL)
         
+        self.find_all_button = gtk.Button("Find All")
+        self.find_all_button.set_flags(gtk.CAN_DEFAULT)
+        self.find_all_button.set_tooltip_text("List every match in a separate window")
+        self.add_action_widget(self.find_all_button, RegSearchDialog.RESPONSE_FIND_ALL)
+        
         self.ok_button = gtk.Button("Search", gtk.STOCK_FIND)
         self.ok_button.set_flags(gtk.CAN_DEFAULT)
         self.add_action_widget(self.ok_button, gtk.RESPONSE_OK)
         
-        self.set_default_response(gtk.RESPONSE_OK)
+        self.set_default_response([gtk.RESPONSE_OK, RegSearchDialog.RESPONSE_FIND_ALL][self.find_all])
         
         
         # signals/events
+        
+        self.check_use_index.connect("toggled", self.on_check_use_index_toggled)
 
     def check_for_problems(self):
         if self.search_entry.get_text() == "":
             return ("You must enter text to search for!", gtk.MESSAGE_ERROR)
         elif not self.check_match_data.get_active() and not self.check_match_keys.get_active() and not self.check_match_values.get_active():
             return ("You much select at least one of: keys, values, or data to search", gtk.MESSAGE_ERROR)
+        elif self.check_use_regex.get_active():
+            try:
+                re.compile(self.search_entry.get_text())
+            except re.error as ex:
+                return ("The regular expression is not valid: %s." % (str(ex)), gtk.MESSAGE_ERROR)
         elif not self.check_match_whole_string.get_active() and not self.warned:
             for ch in self.search_entry.get_text():
                 if ch in string.punctuation:
@@ -2195,6 +2432,980 @@ class RegSearchDialog(gtk.Dialog):
             
         return None
     
+    def get_search_options(self, find_all = False):
+        options = RegistrySearchOptions(self.search_entry.get_text(), 
+                                        self.check_match_keys.get_active(), 
+                                        self.check_match_values.get_active(), 
+                                        self.check_match_data.get_active(), 
+                                        self.check_match_whole_string.get_active())
+        options.match_whole_word = self.check_match_whole_word.get_active()
+        options.match_case = self.check_match_case.get_active()
+        options.use_regex = self.check_use_regex.get_active()
+        options.pipe_count = self.pipe_count_spin_button.get_value_as_int()
+        options.ordered = not self.check_unordered.get_active()
+        options.find_all = find_all
+        options.use_index = self.check_use_index.get_active()
+        options.verify_index = self.check_verify_index.get_active()
+        
+        return options
+    
+    def on_check_use_index_toggled(self, widget):
+        self.check_verify_index.set_sensitive(self.check_use_index.get_active())
+        self.pipe_count_spin_button.set_sensitive(not self.check_use_index.get_active())
+        self.check_unordered.set_sensitive(not self.check_use_index.get_active())
+
+
+class RegSearchResultsWindow(gtk.Window):
+    
+    def __init__(self, text, activate_callback = None, stop_callback = None):
+        super(RegSearchResultsWindow, self).__init__()
+        
+        self.text = text
+        self.activate_callback = activate_callback #called with the SearchResult the user double clicks
+        self.stop_callback = stop_callback #called when the user stops the search or closes the window
+        
+        self.create()
+        
+    def create(self):
+        self.set_title("Search results for \'%s\'" % (self.text))
+        self.set_border_width(5)
+        self.set_default_size(700, 400)
+        
+        self.icon_registry_filename = os.path.join(sys.path[0], "images", "registry.png")
+        self.set_icon_from_file(self.icon_registry_filename)
+        
+        vbox = gtk.VBox(False, 5)
+        self.add(vbox)
+        
+        
+        # results
+        
+        scrolledwindow = gtk.ScrolledWindow(None, None)
+        scrolledwindow.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scrolledwindow.set_shadow_type(gtk.SHADOW_IN)
+        vbox.pack_start(scrolledwindow, True, True, 0)
+        
+        self.results_tree_view = gtk.TreeView()
+        scrolledwindow.add(self.results_tree_view)
+        
+        column = gtk.TreeViewColumn()
+        column.set_title("Path")
+        column.set_resizable(True)
+        column.set_fixed_width(380)
+        column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+        column.set_sort_column_id(0)
+        renderer = gtk.CellRendererText()
+        renderer.set_property("ellipsize", pango.ELLIPSIZE_START)
+        column.pack_start(renderer, True)
+        self.results_tree_view.append_column(column)
+        column.add_attribute(renderer, "text", 0)
+        
+        column = gtk.TreeViewColumn()
+        column.set_title("Match")
+        column.set_resizable(True)
+        column.set_sort_column_id(1)
+        renderer = gtk.CellRendererText()
+        column.pack_start(renderer, True)
+        self.results_tree_view.append_column(column)
+        column.add_attribute(renderer, "text", 1)
+        
+        column = gtk.TreeViewColumn()
+        column.set_title("Data")
+        column.set_resizable(True)
+        column.set_expand(True)
+        renderer = gtk.CellRendererText()
+        renderer.set_property("ellipsize", pango.ELLIPSIZE_END)
+        column.pack_start(renderer, True)
+        self.results_tree_view.append_column(column)
+        column.add_attribute(renderer, "text", 2)
+        
+        self.results_store = gtk.ListStore(gobject.TYPE_STRING, gobject.TYPE_STRING, gobject.TYPE_STRING, gobject.TYPE_PYOBJECT)
+        self.results_tree_view.set_model(self.results_store)
+        
+        
+        # statistics & buttons
+        
+        hbox = gtk.HBox(False, 5)
+        vbox.pack_start(hbox, False, False, 0)
+        
+        self.stats_label = gtk.Label("Searching...")
+        self.stats_label.set_alignment(0, 0.5)
+        self.stats_label.set_ellipsize(pango.ELLIPSIZE_END)
+        hbox.pack_start(self.stats_label, True, True, 0)
+        
+        self.stop_button = gtk.Button("Stop", gtk.STOCK_STOP)
+        hbox.pack_start(self.stop_button, False, False, 0)
+        
+        self.close_button = gtk.Button("Close", gtk.STOCK_CLOSE)
+        hbox.pack_start(self.close_button, False, False, 0)
+        
+        
+        # signals/events
+        
+        self.connect("delete_event", self.on_self_delete)
+        self.results_tree_view.connect("row-activated", self.on_results_tree_view_row_activated)
+        self.stop_button.connect("clicked", self.on_stop_button_clicked)
+        self.close_button.connect("clicked", self.on_close_button_clicked)
+        
+    def add_results(self, result_list):
+        match_strings = {"key":"Key", "value":"Value name", "data":"Data"}
+        
+        for result in result_list:
+            if (result.value == None):
+                data = ""
+            elif (result.data_text != None): #from the index, the value's data isn't loaded
+                data = result.data_text.encode("utf-8")
+            else:
+                data = result.value.get_data_string()
+            self.results_store.append([result.get_absolute_path(), match_strings[result.match_type], data, result])
+    
+    def set_stats(self, text):
+        self.stats_label.set_text(text)
+    
+    def set_finished(self):
+        self.stop_button.set_sensitive(False)
+    
+    def on_self_delete(self, widget, event):
+        self.on_close_button_clicked(None)
+        return True
+    
+    def on_results_tree_view_row_activated(self, widget, path, column):
+        result = self.results_store.get_value(self.results_store.get_iter(path), 3)
+        if (self.activate_callback != None):
+            self.activate_callback(result)
+    
+    def on_stop_button_clicked(self, widget):
+        self.set_finished()
+        if (self.stop_callback != None):
+            self.stop_callback()
+    
+    def on_close_button_clicked(self, widget):
+        if (self.stop_button.get_property("sensitive")):
+            self.on_stop_button_clicked(None)
+        self.hide()
+
+
+class RegImportPreviewWindow(gtk.Window):
+    
+    def __init__(self, filename, apply_callback = None, stop_callback = None):
+        super(RegImportPreviewWindow, self).__init__()
+        
+        self.filename = filename
+        self.apply_callback = apply_callback #called when the user wants the changes made
+        self.stop_callback = stop_callback #called when the user stops the preview or closes the window
+        
+        self.create()
+        
+    def create(self):
+        self.set_title("Changes that importing %s would make" % (os.path.basename(self.filename)))
+        self.set_border_width(5)
+        self.set_default_size(800, 400)
+        
+        self.icon_registry_filename = os.path.join(sys.path[0], "images", "registry.png")
+        self.set_icon_from_file(self.icon_registry_filename)
+        
+        vbox = gtk.VBox(False, 5)
+        self.add(vbox)
+        
+        
+        # changes
+        
+        scrolledwindow = gtk.ScrolledWindow(None, None)
+        scrolledwindow.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scrolledwindow.set_shadow_type(gtk.SHADOW_IN)
+        vbox.pack_start(scrolledwindow, True, True, 0)
+        
+        self.changes_tree_view = gtk.TreeView()
+        scrolledwindow.add(self.changes_tree_view)
+        
+        column = gtk.TreeViewColumn()
+        column.set_title("Change")
+        column.set_resizable(True)
+        column.set_sort_column_id(0)
+        renderer = gtk.CellRendererText()
+        column.pack_start(renderer, True)
+        self.changes_tree_view.append_column(column)
+        column.add_attribute(renderer, "text", 0)
+        
+        column = gtk.TreeViewColumn()
+        column.set_title("Path")
+        column.set_resizable(True)
+        column.set_fixed_width(380)
+        column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+        column.set_sort_column_id(1)
+        renderer = gtk.CellRendererText()
+        renderer.set_property("ellipsize", pango.ELLIPSIZE_START)
+        column.pack_start(renderer, True)
+        self.changes_tree_view.append_column(column)
+        column.add_attribute(renderer, "text", 1)
+        
+        column = gtk.TreeViewColumn()
+        column.set_title("Old Data")
+        column.set_resizable(True)
+        column.set_fixed_width(150)
+        column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+        renderer = gtk.CellRendererText()
+        renderer.set_property("ellipsize", pango.ELLIPSIZE_END)
+        column.pack_start(renderer, True)
+        self.changes_tree_view.append_column(column)
+        column.add_attribute(renderer, "text", 2)
+        
+        column = gtk.TreeViewColumn()
+        column.set_title("New Data")
+        column.set_resizable(True)
+        column.set_expand(True)
+        renderer = gtk.CellRendererText()
+        renderer.set_property("ellipsize", pango.ELLIPSIZE_END)
+        column.pack_start(renderer, True)
+        self.changes_tree_view.append_column(column)
+        column.add_attribute(renderer, "text", 3)
+        
+        self.changes_store = gtk.ListStore(gobject.TYPE_STRING, gobject.TYPE_STRING, gobject.TYPE_STRING, gobject.TYPE_STRING)
+        self.changes_tree_view.set_model(self.changes_store)
+        
+        
+        # statistics & buttons
+        
+        hbox = gtk.HBox(False, 5)
+        vbox.pack_start(hbox, False, False, 0)
+        
+        self.stats_label = gtk.Label("Comparing...")
+        self.stats_label.set_alignment(0, 0.5)
+        self.stats_label.set_ellipsize(pango.ELLIPSIZE_END)
+        hbox.pack_start(self.stats_label, True, True, 0)
+        
+        self.stop_button = gtk.Button("Stop", gtk.STOCK_STOP)
+        hbox.pack_start(self.stop_button, False, False, 0)
+        
+        self.apply_button = gtk.Button("Import", gtk.STOCK_APPLY)
+        self.apply_button.set_tooltip_text("Make these changes")
+        self.apply_button.set_sensitive(False)
+        hbox.pack_start(self.apply_button, False, False, 0)
+        
+        self.close_button = gtk.Button("Close", gtk.STOCK_CLOSE)
+        hbox.pack_start(self.close_button, False, False, 0)
+        
+        
+        # signals/events
+        
+        self.connect("delete_event", self.on_self_delete)
+        self.stop_button.connect("clicked", self.on_stop_button_clicked)
+        self.apply_button.connect("clicked", self.on_apply_button_clicked)
+        self.close_button.connect("clicked", self.on_close_button_clicked)
+        
+    def add_changes(self, change_list):
+        for change in change_list:
+            old_data = ""
+            if (change.old_value != None):
+                old_data = change.old_value.get_data_string()
+            new_data = ""
+            if (change.new_value != None):
+                new_data = change.new_value.get_data_string()
+            self.changes_store.append([change.action.capitalize(), change.get_absolute_path(), old_data, new_data])
+    
+    def set_stats(self, text):
+        self.stats_label.set_text(text)
+    
+    def set_finished(self, complete = True):
+        """'complete' is False if the comparison was stopped or failed, then the changes can't be applied from here."""
+        self.stop_button.set_sensitive(False)
+        self.apply_button.set_sensitive(complete and len(self.changes_store) > 0)
+    
+    def on_self_delete(self, widget, event):
+        self.on_close_button_clicked(None)
+        return True
+    
+    def on_stop_button_clicked(self, widget):
+        self.set_finished(False)
+        if (self.stop_callback != None):
+            self.stop_callback()
+    
+    def on_apply_button_clicked(self, widget):
+        self.hide()
+        if (self.apply_callback != None):
+            self.apply_callback()
+    
+    def on_close_button_clicked(self, widget):
+        if (self.stop_button.get_property("sensitive")):
+            self.on_stop_button_clicked(None)
+        self.hide()
+
+
+
+class RegDiffWindow(gtk.Window):
+    
+    status_strings = {"same":"", "changed":"Changed", "added":"Added", "removed":"Removed"}
+    
+    def __init__(self, name_a, name_b, activate_callback = None, stop_callback = None):
+        super(RegDiffWindow, self).__init__()
+        
+        self.name_a = name_a
+        self.name_b = name_b
+        self.activate_callback = activate_callback #called with the path of the key the user double clicks
+        self.stop_callback = stop_callback #called when the user stops the comparison or closes the window
+        
+        self.create()
+        
+    def create(self):
+        self.set_title("Differences between %s and %s" % (self.name_a, self.name_b))
+        self.set_border_width(5)
+        self.set_default_size(800, 500)
+        
+        self.icon_registry_filename = os.path.join(sys.path[0], "images", "registry.png")
+        self.set_icon_from_file(self.icon_registry_filename)
+        
+        vbox = gtk.VBox(False, 5)
+        self.add(vbox)
+        
+        
+        # differences
+        
+        scrolledwindow = gtk.ScrolledWindow(None, None)
+        scrolledwindow.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scrolledwindow.set_shadow_type(gtk.SHADOW_IN)
+        vbox.pack_start(scrolledwindow, True, True, 0)
+        
+        self.diff_tree_view = gtk.TreeView()
+        scrolledwindow.add(self.diff_tree_view)
+        
+        column = gtk.TreeViewColumn()
+        column.set_title("Name")
+        column.set_resizable(True)
+        column.set_fixed_width(300)
+        column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+        renderer = gtk.CellRendererText()
+        renderer.set_property("ellipsize", pango.ELLIPSIZE_END)
+        column.pack_start(renderer, True)
+        self.diff_tree_view.append_column(column)
+        column.add_attribute(renderer, "text", 0)
+        
+        column = gtk.TreeViewColumn()
+        column.set_title("Difference")
+        column.set_resizable(True)
+        renderer = gtk.CellRendererText()
+        column.pack_start(renderer, True)
+        self.diff_tree_view.append_column(column)
+        column.add_attribute(renderer, "text", 1)
+        
+        column = gtk.TreeViewColumn()
+        column.set_title(self.name_a)
+        column.set_resizable(True)
+        column.set_fixed_width(180)
+        column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+        renderer = gtk.CellRendererText()
+        renderer.set_property("ellipsize", pango.ELLIPSIZE_END)
+        column.pack_start(renderer, True)
+        self.diff_tree_view.append_column(column)
+        column.add_attribute(renderer, "text", 2)
+        
+        column = gtk.TreeViewColumn()
+        column.set_title(self.name_b)
+        column.set_resizable(True)
+        column.set_expand(True)
+        renderer = gtk.CellRendererText()
+        renderer.set_property("ellipsize", pango.ELLIPSIZE_END)
+        column.pack_start(renderer, True)
+        self.diff_tree_view.append_column(column)
+        column.add_attribute(renderer, "text", 3)
+        
+        self.diff_store = gtk.TreeStore(gobject.TYPE_STRING, gobject.TYPE_STRING, gobject.TYPE_STRING, gobject.TYPE_STRING, gobject.TYPE_STRING)
+        self.diff_tree_view.set_model(self.diff_store)
+        
+        
+        # statistics & buttons
+        
+        hbox = gtk.HBox(False, 5)
+        vbox.pack_start(hbox, False, False, 0)
+        
+        self.stats_label = gtk.Label("Comparing...")
+        self.stats_label.set_alignment(0, 0.5)
+        self.stats_label.set_ellipsize(pango.ELLIPSIZE_END)
+        hbox.pack_start(self.stats_label, True, True, 0)
+        
+        self.stop_button = gtk.Button("Stop", gtk.STOCK_STOP)
+        hbox.pack_start(self.stop_button, False, False, 0)
+        
+        self.close_button = gtk.Button("Close", gtk.STOCK_CLOSE)
+        hbox.pack_start(self.close_button, False, False, 0)
+        
+        
+        # signals/events
+        
+        self.connect("delete_event", self.on_self_delete)
+        self.diff_tree_view.connect("row-activated", self.on_diff_tree_view_row_activated)
+        self.stop_button.connect("clicked", self.on_stop_button_clicked)
+        self.close_button.connect("clicked", self.on_close_button_clicked)
+        
+    def set_diff(self, root):
+        """Fills the tree with the DiffNode 'root' and everything below it."""
+        self.diff_store.clear()
+        if (root == None):
+            return
+        
+        self.add_node(None, root)
+        self.diff_tree_view.expand_all()
+    
+    def add_node(self, parent_iter, node):
+        iter = self.diff_store.append(parent_iter, [node.name, RegDiffWindow.status_strings[node.status], "", "", node.path])
+        
+        for value_diff in node.value_diffs:
+            data_a = ""
+            if (value_diff.value_a != None):
+                data_a = value_diff.value_a.get_data_string()
+            data_b = ""
+            if (value_diff.value_b != None):
+                data_b = value_diff.value_b.get_data_string()
+            self.diff_store.append(iter, [value_diff.name, "Value " + value_diff.status, data_a, data_b, node.path])
+        
+        for child in node.children:
+            self.add_node(iter, child)
+    
+    def set_stats(self, text):
+        self.stats_label.set_text(text)
+    
+    def set_finished(self):
+        self.stop_button.set_sensitive(False)
+    
+    def on_self_delete(self, widget, event):
+        self.on_close_button_clicked(None)
+        return True
+    
+    def on_diff_tree_view_row_activated(self, widget, path, column):
+        key_path = self.diff_store.get_value(self.diff_store.get_iter(path), 4)
+        if (self.activate_callback != None):
+            self.activate_callback(key_path)
+    
+    def on_stop_button_clicked(self, widget):
+        self.set_finished()
+        if (self.stop_callback != None):
+            self.stop_callback()
+    
+    def on_close_button_clicked(self, widget):
+        if (self.stop_button.get_property("sensitive")):
+            self.on_stop_button_clicked(None)
+        self.hide()
+
+    
+
+class RegUsageWindow(gtk.Window):
+    
+    def __init__(self, path, activate_callback = None, stop_callback = None):
+        super(RegUsageWindow, self).__init__()
+        
+        self.path = path
+        self.activate_callback = activate_callback #called with the path of the key the user double clicks
+        self.stop_callback = stop_callback #called when the user stops the analysis or closes the window
+        
+        self.root = None #the KeyUsage we're showing, for saving
+        
+        self.create()
+    
+    def create(self):
+        self.set_title("Size of %s" % (self.path))
+        self.set_border_width(5)
+        self.set_default_size(800, 500)
+        
+        self.icon_registry_filename = os.path.join(sys.path[0], "images", "registry.png")
+        self.set_icon_from_file(self.icon_registry_filename)
+        
+        vbox = gtk.VBox(False, 5)
+        self.add(vbox)
+        
+        
+        # keys
+        
+        scrolledwindow = gtk.ScrolledWindow(None, None)
+        scrolledwindow.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scrolledwindow.set_shadow_type(gtk.SHADOW_IN)
+        vbox.pack_start(scrolledwindow, True, True, 0)
+        
+        self.usage_tree_view = gtk.TreeView()
+        scrolledwindow.add(self.usage_tree_view)
+        
+        #name, total bytes, total keys, total values, own values, own bytes, levels below, path, KeyUsage (None for the placeholder row of keys that haven't been expanded yet)
+        self.usage_store = gtk.TreeStore(gobject.TYPE_STRING, gobject.TYPE_INT64, gobject.TYPE_INT, gobject.TYPE_INT, 
+                                         gobject.TYPE_INT, gobject.TYPE_INT64, gobject.TYPE_INT, gobject.TYPE_STRING, gobject.TYPE_PYOBJECT)
+        
+        titles = ["Name", "Size", "Keys", "Values", "Own Values", "Own Size", "Depth"]
+        for index in range(len(titles)):
+            column = gtk.TreeViewColumn()
+            column.set_title(titles[index])
+            column.set_resizable(True)
+            column.set_sort_column_id(index)
+            renderer = gtk.CellRendererText()
+            if (index == 0):
+                renderer.set_property("ellipsize", pango.ELLIPSIZE_END)
+                column.set_fixed_width(300)
+                column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+            else:
+                renderer.set_property("xalign", 1.0)
+            column.pack_start(renderer, True)
+            self.usage_tree_view.append_column(column)
+            if (index in [1, 5]):
+                column.set_cell_data_func(renderer, self.size_data_func, index)
+            else:
+                column.add_attribute(renderer, "text", index)
+        
+        self.usage_store.set_sort_column_id(1, gtk.SORT_DESCENDING) #biggest first
+        self.usage_tree_view.set_model(self.usage_store)
+        
+        
+        # statistics & buttons
+        
+        hbox = gtk.HBox(False, 5)
+        vbox.pack_start(hbox, False, False, 0)
+        
+        self.stats_label = gtk.Label("Reading keys...")
+        self.stats_label.set_alignment(0, 0.5)
+        self.stats_label.set_ellipsize(pango.ELLIPSIZE_END)
+        hbox.pack_start(self.stats_label, True, True, 0)
+        
+        self.stop_button = gtk.Button("Stop", gtk.STOCK_STOP)
+        hbox.pack_start(self.stop_button, False, False, 0)
+        
+        self.save_button = gtk.Button("Save as CSV", gtk.STOCK_SAVE_AS)
+        self.save_button.set_sensitive(False)
+        hbox.pack_start(self.save_button, False, False, 0)
+        
+        self.close_button = gtk.Button("Close", gtk.STOCK_CLOSE)
+        hbox.pack_start(self.close_button, False, False, 0)
+        
+        
+        # signals/events
+        
+        self.connect("delete_event", self.on_self_delete)
+        self.usage_tree_view.connect("row-activated", self.on_usage_tree_view_row_activated)
+        self.usage_tree_view.connect("row-expanded", self.on_usage_tree_view_row_expanded)
+        self.stop_button.connect("clicked", self.on_stop_button_clicked)
+        self.save_button.connect("clicked", self.on_save_button_clicked)
+        self.close_button.connect("clicked", self.on_close_button_clicked)
+    
+    def size_data_func(self, column, renderer, model, iter, index):
+        if (model.get_value(iter, 8) == None): #the placeholder row
+            renderer.set_property("text", "")
+            return
+        size = model.get_value(iter, index)
+        if (size >= 1048576):
+            renderer.set_property("text", "%.1f MB" % (size / 1048576.0))
+        elif (size >= 1024):
+            renderer.set_property("text", "%.1f KB" % (size / 1024.0))
+        else:
+            renderer.set_property("text", "%d bytes" % (size))
+    
+    def set_usage(self, root):
+        """Shows the KeyUsage 'root'. The rows for the keys below it are only made when their parents are expanded, so huge
+        trees don't take long to show."""
+        self.root = root
+        self.usage_store.clear()
+        self.save_button.set_sensitive(root != None)
+        if (root == None):
+            return
+        
+        iter = self.add_node(None, root)
+        self.usage_tree_view.expand_row(self.usage_store.get_path(iter), False)
+    
+    def add_node(self, parent_iter, node):
+        iter = self.usage_store.append(parent_iter, [node.key.name, node.total_bytes, node.total_keys, node.total_values, 
+                                                     node.value_count, node.value_bytes or 0, node.max_depth, node.get_absolute_path(), node])
+        if (len(node.children) > 0):
+            self.usage_store.append(iter, ["", 0, 0, 0, 0, 0, 0, "", None]) #so it can be expanded
+        return iter
+    
+    def set_stats(self, text):
+        self.stats_label.set_text(text)
+    
+    def set_finished(self):
+        self.stop_button.set_sensitive(False)
+    
+    def on_self_delete(self, widget, event):
+        self.on_close_button_clicked(None)
+        return True
+    
+    def on_usage_tree_view_row_activated(self, widget, path, column):
+        key_path = self.usage_store.get_value(self.usage_store.get_iter(path), 7)
+        if (self.activate_callback != None and key_path != ""):
+            self.activate_callback(key_path)
+    
+    def on_usage_tree_view_row_expanded(self, widget, iter, path):
+        child_iter = self.usage_store.iter_children(iter)
+        if (child_iter == None or self.usage_store.get_value(child_iter, 8) != None): #already filled in
+            return
+        
+        self.usage_store.remove(child_iter)
+        for child in self.usage_store.get_value(iter, 8).children:
+            self.add_node(iter, child)
+    
+    def on_stop_button_clicked(self, widget):
+        self.set_finished()
+        if (self.stop_callback != None):
+            self.stop_callback()
+    
+    def on_save_button_clicked(self, widget):
+        dialog = gtk.FileChooserDialog("Save as CSV", self, gtk.FILE_CHOOSER_ACTION_SAVE, 
+                                       (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL, gtk.STOCK_SAVE, gtk.RESPONSE_OK))
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name("size.csv")
+        response_id = dialog.run()
+        filename = dialog.get_filename()
+        dialog.destroy()
+        
+        if (response_id != gtk.RESPONSE_OK or filename == None):
+            return
+        
+        try:
+            file = open(filename, "wb")
+            try:
+                CSVUsageWriter(file).write_tree(self.root)
+            finally:
+                file.close()
+        except IOError as ex:
+            message_box = gtk.MessageDialog(self, gtk.DIALOG_MODAL, gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "Failed to save %s: %s." % (filename, ex.strerror))
+            message_box.run()
+            message_box.destroy()
+    
+    def on_close_button_clicked(self, widget):
+        if (self.stop_button.get_property("sensitive")):
+            self.on_stop_button_clicked(None)
+        self.hide()
+
+
+class RegQueryDialog(gtk.Dialog):
+    
+    def __init__(self, path = "", username = "", password = ""):
+        super(RegQueryDialog, self).__init__()
+        
+        self.path = path
+        self.username = username
+        self.password = password
+        
+        self.create()
+        self.path_entry.set_text(self.path)
+        self.username_entry.set_text(self.username)
+        self.password_entry.set_text(self.password)
+    
+    def create(self):
+        self.set_title("Query many servers")
+        self.set_border_width(5)
+        
+        self.icon_registry_filename = os.path.join(sys.path[0], "images", "registry.png")
+        self.set_icon_from_file(self.icon_registry_filename)
+        
+        self.set_default_size(450, 450)
+        
+        
+        # servers
+        
+        frame = gtk.Frame("Servers, one per line:")
+        self.vbox.pack_start(frame, True, True, 0)
+        
+        scrolledwindow = gtk.ScrolledWindow(None, None)
+        scrolledwindow.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scrolledwindow.set_shadow_type(gtk.SHADOW_IN)
+        scrolledwindow.set_border_width(4)
+        frame.add(scrolledwindow)
+        
+        self.hosts_text_view = gtk.TextView()
+        scrolledwindow.add(self.hosts_text_view)
+        
+        self.hosts_file_button = gtk.Button("Read From File...")
+        self.hosts_file_button.set_tooltip_text("Add the servers listed in a text file, one per line")
+        self.vbox.pack_start(self.hosts_file_button, False, False, 5)
+        
+        
+        # what to query
+        
+        table = gtk.Table(4, 2, False)
+        table.set_border_width(5)
+        table.set_row_spacings(2)
+        table.set_col_spacings(6)
+        self.vbox.pack_start(table, False, False, 0)
+        
+        label = gtk.Label("Key:")
+        label.set_alignment(0, 0.5)
+        table.attach(label, 0, 1, 0, 1, gtk.FILL, gtk.FILL | gtk.EXPAND, 0, 0)
+        
+        self.path_entry = gtk.Entry()
+        self.path_entry.set_activates_default(True)
+        self.path_entry.set_tooltip_text("For example HKLM\\SOFTWARE\\Microsoft\\Windows NT\\CurrentVersion")
+        table.attach(self.path_entry, 1, 2, 0, 1, gtk.FILL | gtk.EXPAND, gtk.FILL | gtk.EXPAND, 0, 0)
+        
+        label = gtk.Label("Value:")
+        label.set_alignment(0, 0.5)
+        table.attach(label, 0, 1, 1, 2, gtk.FILL, gtk.FILL | gtk.EXPAND, 0, 0)
+        
+        self.value_entry = gtk.Entry()
+        self.value_entry.set_activates_default(True)
+        self.value_entry.set_tooltip_text("Leave this empty to get every value in the key")
+        table.attach(self.value_entry, 1, 2, 1, 2, gtk.FILL | gtk.EXPAND, gtk.FILL | gtk.EXPAND, 0, 0)
+        
+        label = gtk.Label("Username:")
+        label.set_alignment(0, 0.5)
+        table.attach(label, 0, 1, 2, 3, gtk.FILL, gtk.FILL | gtk.EXPAND, 0, 0)
+        
+        self.username_entry = gtk.Entry()
+        table.attach(self.username_entry, 1, 2, 2, 3, gtk.FILL | gtk.EXPAND, gtk.FILL | gtk.EXPAND, 0, 0)
+        
+        label = gtk.Label("Password:")
+        label.set_alignment(0, 0.5)
+        table.attach(label, 0, 1, 3, 4, gtk.FILL, gtk.FILL | gtk.EXPAND, 0, 0)
+        
+        self.password_entry = gtk.Entry()
+        self.password_entry.set_visibility(False)
+        self.password_entry.set_activates_default(True)
+        table.attach(self.password_entry, 1, 2, 3, 4, gtk.FILL | gtk.EXPAND, gtk.FILL | gtk.EXPAND, 0, 0)
+        
+        
+        # performance
+        
+        frame = gtk.Frame("Speed:")
+        self.vbox.pack_start(frame, False, True, 0)
+        
+        hbox = gtk.HBox(False, 5)
+        hbox.set_border_width(4)
+        frame.add(hbox)
+        
+        label = gtk.Label("Servers at a time:")
+        hbox.pack_start(label, False, True, 0)
+        
+        self.workers_spin_button = gtk.SpinButton(gtk.Adjustment(16, 1, 128, 1, 8), 1, 0)
+        hbox.pack_start(self.workers_spin_button, False, True, 0)
+        
+        label = gtk.Label("Give up after (seconds):")
+        hbox.pack_start(label, False, True, 5)
+        
+        self.timeout_spin_button = gtk.SpinButton(gtk.Adjustment(30, 1, 600, 1, 10), 1, 0)
+        self.timeout_spin_button.set_tooltip_text("Servers that haven't answered by then are listed as timed out")
+        hbox.pack_start(self.timeout_spin_button, False, True, 0)
+        
+        
+        # dialog buttons
+        
+        self.action_area.set_layout(gtk.BUTTONBOX_END)
+        
+        self.cancel_button = gtk.Button("Cancel", gtk.STOCK_CANCEL)
+        self.cancel_button.set_flags(gtk.CAN_DEFAULT)
+        self.add_action_widget(self.cancel_button, gtk.RESPONSE_CANCEL)
+        
+        self.ok_button = gtk.Button("Query", gtk.STOCK_OK)
+        self.ok_button.set_flags(gtk.CAN_DEFAULT)
+        self.add_action_widget(self.ok_button, gtk.RESPONSE_OK)
+        
+        self.set_default_response(gtk.RESPONSE_OK)
+        
+        
+        # signals/events
+        
+        self.hosts_file_button.connect("clicked", self.on_hosts_file_button_clicked)
+    
+    def check_for_problems(self):
+        if (len(self.get_hosts()) == 0):
+            return "Please list at least one server."
+        if (len(self.path_entry.get_text().strip().strip("\\")) == 0):
+            return "Please specify a key."
+        return None
+    
+    def get_hosts(self):
+        """returns a list of host names, without duplicates, in the order they were listed"""
+        buffer = self.hosts_text_view.get_buffer()
+        text = buffer.get_text(buffer.get_start_iter(), buffer.get_end_iter())
+        
+        hosts = []
+        for host in read_hosts(text.splitlines()):
+            if (host.lower() not in [known_host.lower() for known_host in hosts]):
+                hosts.append(host)
+        return hosts
+    
+    def get_path(self):
+        return self.path_entry.get_text().strip()
+    
+    def get_value_name(self):
+        """returns the name of the value to get, or None to get every value in the key"""
+        if (self.value_entry.get_text() == ""):
+            return None
+        return self.value_entry.get_text()
+    
+    def get_username(self):
+        return self.username_entry.get_text()
+    
+    def get_password(self):
+        return self.password_entry.get_text()
+    
+    def get_max_workers(self):
+        return self.workers_spin_button.get_value_as_int()
+    
+    def get_timeout(self):
+        return self.timeout_spin_button.get_value_as_int()
+    
+    def on_hosts_file_button_clicked(self, widget):
+        dialog = gtk.FileChooserDialog("Read Servers From", self, gtk.FILE_CHOOSER_ACTION_OPEN, 
+                                       (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL, gtk.STOCK_OPEN, gtk.RESPONSE_OK))
+        response_id = dialog.run()
+        filename = dialog.get_filename()
+        dialog.destroy()
+        
+        if (response_id != gtk.RESPONSE_OK or filename == None):
+            return
+        
+        try:
+            file = open(filename, "r")
+            try:
+                hosts = read_hosts(file)
+            finally:
+                file.close()
+        except IOError as ex:
+            message_box = gtk.MessageDialog(self, gtk.DIALOG_MODAL, gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "Failed to read %s: %s." % (filename, ex.strerror))
+            message_box.run()
+            message_box.destroy()
+            return
+        
+        buffer = self.hosts_text_view.get_buffer()
+        text = buffer.get_text(buffer.get_start_iter(), buffer.get_end_iter())
+        if (text != "" and not text.endswith("\n")):
+            buffer.insert(buffer.get_end_iter(), "\n")
+        buffer.insert(buffer.get_end_iter(), "\n".join(hosts) + "\n")
+
+
+class RegQueryResultsWindow(gtk.Window):
+    
+    def __init__(self, path, value_name, stop_callback = None):
+        super(RegQueryResultsWindow, self).__init__()
+        
+        self.path = path
+        self.value_name = value_name
+        self.stop_callback = stop_callback #called when the user stops the query or closes the window
+        
+        self.results = [] #every HostQueryResult so far, for saving
+        
+        self.create()
+    
+    def create(self):
+        if (self.value_name != None):
+            self.set_title("%s\\%s on many servers" % (self.path, self.value_name))
+        else:
+            self.set_title("%s on many servers" % (self.path))
+        self.set_border_width(5)
+        self.set_default_size(800, 400)
+        
+        self.icon_registry_filename = os.path.join(sys.path[0], "images", "registry.png")
+        self.set_icon_from_file(self.icon_registry_filename)
+        
+        vbox = gtk.VBox(False, 5)
+        self.add(vbox)
+        
+        
+        # results
+        
+        scrolledwindow = gtk.ScrolledWindow(None, None)
+        scrolledwindow.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scrolledwindow.set_shadow_type(gtk.SHADOW_IN)
+        vbox.pack_start(scrolledwindow, True, True, 0)
+        
+        self.results_tree_view = gtk.TreeView()
+        scrolledwindow.add(self.results_tree_view)
+        
+        self.results_store = gtk.ListStore(gobject.TYPE_STRING, gobject.TYPE_STRING, gobject.TYPE_STRING, gobject.TYPE_STRING, 
+                                           gobject.TYPE_STRING, gobject.TYPE_INT, gobject.TYPE_INT, gobject.TYPE_STRING)
+        
+        titles = ["Server", "Status", "Value", "Type", "Data", "Connect (ms)", "Query (ms)", "Error"]
+        for index in range(len(titles)):
+            column = gtk.TreeViewColumn()
+            column.set_title(titles[index])
+            column.set_resizable(True)
+            column.set_sort_column_id(index)
+            renderer = gtk.CellRendererText()
+            if (index in [4, 7]):
+                renderer.set_property("ellipsize", pango.ELLIPSIZE_END)
+                column.set_fixed_width(150)
+                column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+            column.pack_start(renderer, True)
+            self.results_tree_view.append_column(column)
+            column.add_attribute(renderer, "text", index)
+        
+        self.results_tree_view.set_model(self.results_store)
+        
+        
+        # statistics & buttons
+        
+        hbox = gtk.HBox(False, 5)
+        vbox.pack_start(hbox, False, False, 0)
+        
+        self.stats_label = gtk.Label("Querying...")
+        self.stats_label.set_alignment(0, 0.5)
+        self.stats_label.set_ellipsize(pango.ELLIPSIZE_END)
+        hbox.pack_start(self.stats_label, True, True, 0)
+        
+        self.stop_button = gtk.Button("Stop", gtk.STOCK_STOP)
+        hbox.pack_start(self.stop_button, False, False, 0)
+        
+        self.save_button = gtk.Button("Save as CSV", gtk.STOCK_SAVE_AS)
+        hbox.pack_start(self.save_button, False, False, 0)
+        
+        self.close_button = gtk.Button("Close", gtk.STOCK_CLOSE)
+        hbox.pack_start(self.close_button, False, False, 0)
+        
+        
+        # signals/events
+        
+        self.connect("delete_event", self.on_self_delete)
+        self.stop_button.connect("clicked", self.on_stop_button_clicked)
+        self.save_button.connect("clicked", self.on_save_button_clicked)
+        self.close_button.connect("clicked", self.on_close_button_clicked)
+    
+    def add_results(self, result_list):
+        for result in result_list:
+            self.results.append(result)
+            for row in result.get_rows():
+                #the times are -1 if we never got that far
+                row[5] = int(row[5] or -1)
+                row[6] = int(row[6] or -1)
+                self.results_store.append(row)
+    
+    def set_stats(self, text):
+        self.stats_label.set_text(text)
+    
+    def set_finished(self):
+        self.stop_button.set_sensitive(False)
+    
+    def on_self_delete(self, widget, event):
+        self.on_close_button_clicked(None)
+        return True
+    
+    def on_stop_button_clicked(self, widget):
+        self.set_finished()
+        if (self.stop_callback != None):
+            self.stop_callback()
+    
+    def on_save_button_clicked(self, widget):
+        dialog = gtk.FileChooserDialog("Save as CSV", self, gtk.FILE_CHOOSER_ACTION_SAVE, 
+                                       (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL, gtk.STOCK_SAVE, gtk.RESPONSE_OK))
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name("query.csv")
+        response_id = dialog.run()
+        filename = dialog.get_filename()
+        dialog.destroy()
+        
+        if (response_id != gtk.RESPONSE_OK or filename == None):
+            return
+        
+        try:
+            file = open(filename, "wb")
+            try:
+                writer = CSVResultWriter(file)
+                for result in self.results:
+                    writer.write_result(result)
+            finally:
+                file.close()
+        except IOError as ex:
+            message_box = gtk.MessageDialog(self, gtk.DIALOG_MODAL, gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "Failed to save %s: %s." % (filename, ex.strerror))
+            message_box.run()
+            message_box.destroy()
+    
+    def on_close_button_clicked(self, widget):
+        if (self.stop_button.get_property("sensitive")):
+            self.on_stop_button_clicked(None)
+        self.hide()
+
+
 class RegPermissionsDialog(gtk.Dialog):
     
     def __init__(self, users, permissions):
@@ -1,8 +1,6 @@
 
 import datetime;
 
-import gtk;
-
 from samba.dcerpc import svcctl
 from samba.dcerpc import winreg
 from samba.dcerpc import misc
@@ -108,11 +106,24 @@ class Service:
 
 class RegistryValue:
     
+    type_names = [
+                  ("REG_NONE", misc.REG_NONE), 
+                  ("REG_SZ", misc.REG_SZ), 
+                  ("REG_EXPAND_SZ", misc.REG_EXPAND_SZ), 
+                  ("REG_BINARY", misc.REG_BINARY), 
+                  ("REG_DWORD", misc.REG_DWORD), 
+                  ("REG_DWORD_BIG_ENDIAN", misc.REG_DWORD_BIG_ENDIAN), 
+                  ("REG_MULTI_SZ", misc.REG_MULTI_SZ), 
+                  ("REG_QWORD", misc.REG_QWORD)
+                  ]
+    
     def __init__(self, name, type, data, parent):
         self.name = name
         self.type = type
         self.data = data
         self.parent = parent
+        self.data_loaded = True #False if the value was listed by name only and the data hasn't been fetched yet
+        self.data_size = None #the size of the data the server reported, for values that aren't loaded
         
     def get_absolute_path(self):
         if (self.parent == None):
@@ -120,7 +131,18 @@ class RegistryValue:
         else:
             return self.parent.get_absolute_path() + "\\" + self.name
         
+    def get_data_size(self):
+        if (not self.data_loaded):
+            return self.data_size
+        elif (self.data == None):
+            return 0
+        else:
+            return len(self.data)
+        
     def get_data_string(self):
+        if (not self.data_loaded):
+            return ""
+        
         interpreted_data = self.get_interpreted_data()
         
         if (interpreted_data == None or len(self.data) == 0):
@@ -297,6 +319,25 @@ class RegistryValue:
                         }
         
         return type_strings[type]
+    
+    @staticmethod
+    def get_type_name(type):
+        """returns the name the type has in the Windows headers, such as 'REG_SZ'"""
+        for (name, value_type) in RegistryValue.type_names:
+            if (value_type == type):
+                return name
+        return str(type)
+    
+    @staticmethod
+    def get_type_from_name(name):
+        """returns the type called 'name' (such as 'REG_SZ' or just 'sz', in any case), or None if there's no such type"""
+        name = name.upper()
+        if (not name.startswith("REG_")):
+            name = "REG_" + name
+        for (type_name, value_type) in RegistryValue.type_names:
+            if (type_name == name):
+                return value_type
+        return None
 
 
 class RegistryKey:
@@ -306,6 +347,12 @@ class RegistryKey:
         self.parent = parent
         
         self.handle = None
+        self.class_name = None #the class the server gave when the parent was listed, None if we don't know it
+        
+        #what we got the last time this key was listed, so a refresh can skip keys that haven't been written to since
+        self.last_write_time = None
+        self.subkeys = None #list of RegistryKey, None if the key hasn't been listed
+        self.values = None #list of RegistryValue, None if the key hasn't been listed
         
     def get_absolute_path(self):
         if (self.parent == None):
@@ -323,6 +370,27 @@ class RegistryKey:
         return [self.name, self]
 
 
+class RegistrySearchOptions:
+    
+    default_pipe_count = 4
+    
+    def __init__(self, text, search_keys = True, search_values = True, search_data = True, match_whole_string = False):
+        self.text = text
+        self.search_keys = search_keys
+        self.search_values = search_values
+        self.search_data = search_data
+        self.match_whole_string = match_whole_string
+        self.match_case = False
+        self.match_whole_word = False
+        self.use_regex = False #True means 'text' is a regular expression
+        
+        self.pipe_count = RegistrySearchOptions.default_pipe_count #number of connections to search with
+        self.ordered = True #False means we take whichever match is found first instead of the first one in the tree
+        self.find_all = False #True means we list every match instead of stopping at the first one
+        self.use_index = False #True means we search the offline RegistryIndex instead of the server
+        self.verify_index = True #True means matches from the index are checked with the server before they're shown
+
+
 class Task:
     
     def __init__(self, command, id):
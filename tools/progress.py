@@ -0,0 +1,195 @@
+
+import threading
+
+import gobject
+import gtk
+
+
+class ProgressChannel:
+    """Carries progress updates from worker threads to the GTK main loop without taking the gdk lock for every one.
+    
+    A worker thread posts a function and its arguments to a slot, which is a single dictionary store, so it never waits
+    on anything. Only the latest update in every slot is kept. A timeout drains the channel a few times a second and
+    calls the functions from the main loop, with the gdk lock held. However many keys a second the workers get through,
+    the GUI is only updated as often as anyone can read it, and the workers never wait for GTK to redraw.
+    
+    Results that all have to be shown, like search matches, are appended to a slot instead: the function gets a list of
+    everything appended since the last drain. Functions that should be called on every drain (to keep a speed up to date
+    while nothing comes in) are added with repeat(). Within a drain, batches are handed over first, then the posted
+    updates, then the repeated functions, so an update posted after an append always sees the appended items."""
+    
+    def __init__(self, interval = 100):
+        self.interval = interval #milliseconds between drains
+        self.pending = {} #slot: (function, args)
+        self.lock = threading.Lock() #for 'batches' and 'repeats', which can't be swapped atomically
+        self.batches = {} #slot: (function, list of items)
+        self.repeats = [] #(function, args)
+        self.drained = 0
+        self.running = False
+    
+    def start(self):
+        if (self.running):
+            return
+        self.running = True
+        gobject.timeout_add(self.interval, self.on_timeout)
+    
+    def stop(self):
+        self.running = False
+    
+    def post(self, slot, function, *args):
+        """Makes 'function' get called with 'args' from the main loop, unless something else is posted to 'slot' first.
+        This can be called from any thread."""
+        self.pending[slot] = (function, args)
+    
+    def append(self, slot, function, item):
+        """Makes 'function' get called from the main loop with a list of every 'item' appended to 'slot' since the last drain.
+        Nothing appended is dropped. This can be called from any thread."""
+        self.lock.acquire()
+        try:
+            if (self.batches.has_key(slot)):
+                self.batches[slot][1].append(item)
+            else:
+                self.batches[slot] = (function, [item])
+        finally:
+            self.lock.release()
+    
+    def repeat(self, function, *args):
+        """Makes 'function' get called with 'args' from the main loop on every drain, until it returns False.
+        This can be called from any thread."""
+        self.lock.acquire()
+        self.repeats.append((function, args))
+        self.lock.release()
+    
+    def discard(self, slot):
+        """Forgets whatever is waiting in 'slot', for when the main loop has shown something newer.
+        NOTE: This function requires the gdk lock."""
+        self.pending.pop(slot, None)
+    
+    def drain(self):
+        """Calls the functions waiting in the channel.
+        NOTE: This function requires the gdk lock.
+        
+        returns how many functions were called"""
+        updates = []
+        while True:
+            try:
+                updates.append(self.pending.popitem()[1]) #atomic, so a worker can post while we drain
+            except KeyError:
+                break
+        
+        self.lock.acquire()
+        batches = self.batches
+        self.batches = {}
+        repeats = self.repeats
+        self.repeats = []
+        self.lock.release()
+        
+        for (function, items) in batches.values():
+            self.call(function, (items, ))
+        for (function, args) in updates:
+            self.call(function, args)
+        
+        keep = []
+        for (function, args) in repeats:
+            if (self.call(function, args)): #one that raises isn't called again
+                keep.append((function, args))
+        self.lock.acquire()
+        self.repeats = keep + self.repeats #repeat() may have been called by one of the functions
+        self.lock.release()
+        
+        count = len(batches) + len(updates) + len(repeats)
+        self.drained += count
+        return count
+    
+    def call(self, function, args):
+        """Calls one of the functions from the channel. An exception is printed rather than raised, so one window that's
+        gone away doesn't stop the updates for everything else.
+        
+        returns what the function returned, or None if it raised"""
+        try:
+            return function(*args)
+        except Exception as ex:
+            print "Failed to show progress with %s: %s." % (getattr(function, "__name__", str(function)), str(ex))
+            return None
+    
+    def on_timeout(self):
+        if (not self.running):
+            return False
+        
+        gtk.gdk.threads_enter()
+        try:
+            self.drain()
+        except Exception as ex:
+            print "Failed to drain the progress channel: %s." % (str(ex))
+        finally:
+            gtk.gdk.threads_leave()
+        
+        return True
+
+
+if __name__ == "__main__":
+    #a quick benchmark of the status bar updates a listing makes, the old way (gdk lock per key) against the channel
+    import sys
+    import time
+    import threading
+    
+    gtk.gdk.threads_init()
+    
+    count = 20000
+    if (len(sys.argv) > 1):
+        count = int(sys.argv[1])
+    
+    window = gtk.Window()
+    box = gtk.VBox()
+    statusbar = gtk.Statusbar()
+    progressbar = gtk.ProgressBar()
+    box.pack_start(progressbar, False, False)
+    box.pack_start(statusbar, False, False)
+    window.add(box)
+    window.show_all()
+    
+    def set_status(message):
+        statusbar.pop(0)
+        statusbar.push(0, message)
+    
+    def show_progress(index):
+        set_status("Fetching key: key%d" % (index))
+        progressbar.set_fraction(float(index) / count)
+    
+    def locked_worker(times):
+        start = time.time()
+        for index in xrange(count):
+            gtk.gdk.threads_enter()
+            try:
+                show_progress(index)
+            finally:
+                gtk.gdk.threads_leave()
+        times.append(time.time() - start)
+        gobject.idle_add(gtk.main_quit)
+    
+    def channel_worker(times, channel):
+        start = time.time()
+        for index in xrange(count):
+            channel.post("status", show_progress, index)
+        times.append(time.time() - start)
+        gobject.idle_add(gtk.main_quit)
+    
+    locked_times = []
+    threading.Thread(target = locked_worker, args = (locked_times, )).start()
+    gtk.gdk.threads_enter()
+    gtk.main()
+    gtk.gdk.threads_leave()
+    
+    channel = ProgressChannel()
+    channel.start()
+    channel_times = []
+    threading.Thread(target = channel_worker, args = (channel_times, channel)).start()
+    gtk.gdk.threads_enter()
+    gtk.main()
+    channel.drain()
+    channel.stop()
+    gtk.gdk.threads_leave()
+    
+    print "%d progress updates" % (count)
+    print "gdk lock per update: %.2fs (%.0f/sec)" % (locked_times[0], count / max(locked_times[0], 0.001))
+    print "progress channel:    %.2fs (%.0f/sec), %d of them shown" % (channel_times[0], count / max(channel_times[0], 0.001), channel.drained)
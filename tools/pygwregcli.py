@@ -0,0 +1,562 @@
+#!/usr/bin/python
+
+import sys
+import os.path
+import getopt
+import getpass
+import threading
+import binascii
+import json
+import StringIO
+
+from samba.dcerpc import misc
+
+from objects import RegistryValue
+from objects import RegistrySearchOptions
+
+from winregpipe import WinRegPipeManager
+from regsearch import RegistrySearchEngine
+from regfile import RegFileWriter
+from regfile import RegBinaryWriter
+from regfile import RegistryExporter
+from regfile import RegistryImporter
+from regfile import open_reader
+from regdelete import RegistryDeleter
+from regusage import RegistryUsageAnalyzer
+from regusage import CSVUsageWriter
+from regquery import RegistryMultiQuery
+from regquery import CSVResultWriter
+from regquery import JSONResultWriter
+from regquery import read_hosts
+
+
+class RegistryCommandLine:
+    """Runs the commands of the headless client against the server 'pipe_manager' is connected to.
+    Everything a command finds is written to 'output' as one JSON object per line, so it can be piped into other tools.
+    Errors go to stderr. Nothing in here touches GTK, so this can run from cron on machines without a display."""
+    
+    def __init__(self, pipe_manager, output = sys.stdout, connections = 4):
+        self.pipe_manager = pipe_manager
+        self.output = output
+        self.connections = connections #how many pipes find, export and import use
+        self.output_lock = threading.Lock() #find and import write from their worker threads
+        
+        self.commands = {
+                         "ls":self.cmd_ls,
+                         "get":self.cmd_get,
+                         "set":self.cmd_set,
+                         "delete":self.cmd_delete,
+                         "find":self.cmd_find,
+                         "export":self.cmd_export,
+                         "import":self.cmd_import,
+                         "du":self.cmd_du
+                         }
+    
+    def run(self, command, args):
+        """Runs 'command' with the list of arguments 'args'.
+        
+        returns the exit code: 0 on success, 1 if the command failed and 2 if it was used wrong"""
+        if (not self.commands.has_key(command)):
+            print >>sys.stderr, "Unknown command \'%s\'." % (command)
+            return 2
+        
+        try:
+            return self.commands[command](args)
+        except RuntimeError as re:
+            print >>sys.stderr, "%s failed: %s." % (command, re.args[-1])
+            return 1
+        except ValueError as ex:
+            print >>sys.stderr, "%s failed: %s." % (command, str(ex))
+            return 1
+    
+    def write_record(self, record):
+        self.output_lock.acquire()
+        try:
+            self.output.write(json.dumps(record) + "\n")
+        finally:
+            self.output_lock.release()
+    
+    @staticmethod
+    def get_key_record(key):
+        return {"type":"key", "path":key.get_absolute_path(), "name":key.name}
+    
+    @staticmethod
+    def get_value_record(value):
+        """Strings, numbers and multi-strings are written as they are, everything else as a hex string.
+        The data is null if it wasn't fetched or the value isn't set."""
+        record = {"type":"value", "path":value.parent.get_absolute_path(), "name":value.name, "value_type":RegistryValue.get_type_name(value.type)}
+        
+        if (not value.data_loaded or value.data == None or (value.name == "(Default)" and value.get_data_size() == 0)):
+            record["data"] = None
+        elif (value.type in [misc.REG_SZ, misc.REG_EXPAND_SZ, misc.REG_MULTI_SZ, misc.REG_DWORD, misc.REG_DWORD_BIG_ENDIAN, misc.REG_QWORD]):
+            record["data"] = value.get_interpreted_data()
+        else:
+            record["data"] = binascii.hexlify(str(bytearray(value.data)))
+        
+        return record
+    
+    @staticmethod
+    def parse_data(value, args):
+        """Sets the data of 'value' from the command line arguments 'args', the way get_value_record() writes it.
+        Multi-strings take one argument per string, everything else takes one argument."""
+        if (value.type == misc.REG_MULTI_SZ):
+            value.set_interpreted_data([arg.decode("utf-8") for arg in args])
+            return
+        
+        if (len(args) != 1):
+            raise ValueError("%s takes exactly one argument for the data" % (RegistryValue.get_type_name(value.type)))
+        
+        if (value.type in [misc.REG_SZ, misc.REG_EXPAND_SZ]):
+            value.set_interpreted_data(args[0].decode("utf-8"))
+        elif (value.type in [misc.REG_DWORD, misc.REG_DWORD_BIG_ENDIAN, misc.REG_QWORD]):
+            value.set_interpreted_data(int(args[0], 0))
+        else:
+            text = args[0].replace(",", "").replace(" ", "")
+            try:
+                value.data = [ord(ch) for ch in binascii.unhexlify(text)]
+            except TypeError:
+                raise ValueError("\'%s\' is not a hex string" % (args[0]))
+    
+    def get_pipe_managers(self):
+        """Opens more pipes to the server for the commands that work in parallel.
+        
+        returns a list of pipe managers, the first one is ours. The others should be closed with close_pipe_managers()"""
+        pipe_managers = [self.pipe_manager]
+        for index in range(self.connections - 1):
+            try:
+                pipe_managers.append(self.pipe_manager.clone())
+            except RuntimeError as re:
+                print >>sys.stderr, "Failed to open another connection, carrying on with %d: %s." % (len(pipe_managers), re.args[-1])
+                break
+        
+        return pipe_managers
+    
+    def close_pipe_managers(self, pipe_managers):
+        for pipe_manager in pipe_managers[1:]:
+            pipe_manager.close()
+    
+    def cmd_ls(self, args):
+        if (len(args) != 1):
+            print >>sys.stderr, "Usage: ls KEY"
+            return 2
+        
+        key = self.pipe_manager.get_key_for_path(args[0])
+        (subkey_list, value_list) = self.pipe_manager.ls_key(key)
+        
+        for subkey in subkey_list:
+            self.write_record(RegistryCommandLine.get_key_record(subkey))
+        for value in value_list:
+            self.write_record(RegistryCommandLine.get_value_record(value))
+        return 0
+    
+    def cmd_get(self, args):
+        if (len(args) not in [1, 2]):
+            print >>sys.stderr, "Usage: get KEY [VALUE]"
+            return 2
+        
+        key = self.pipe_manager.get_key_for_path(args[0])
+        
+        self.pipe_manager.lock.acquire()
+        try:
+            if (len(args) == 1):
+                value_list = self.pipe_manager.get_values_for_key(key)
+            else:
+                try:
+                    value_list = [self.pipe_manager.get_value(key, args[1].decode("utf-8"))]
+                except RuntimeError as re:
+                    if (re.args[0] != 0x2): #0x2 is WERR_BADFILE
+                        raise re
+                    print >>sys.stderr, "%s doesn't have a value called \'%s\'." % (key.get_absolute_path(), args[1])
+                    return 1
+        finally:
+            self.pipe_manager.lock.release()
+        
+        for value in value_list:
+            self.write_record(RegistryCommandLine.get_value_record(value))
+        return 0
+    
+    def cmd_set(self, args):
+        if (len(args) < 3):
+            print >>sys.stderr, "Usage: set KEY VALUE TYPE [DATA...]"
+            return 2
+        
+        type = RegistryValue.get_type_from_name(args[2])
+        if (type == None):
+            print >>sys.stderr, "Unknown type \'%s\'." % (args[2])
+            return 2
+        
+        key = self.pipe_manager.get_key_for_path(args[0], False) #set_values() creates the key if it isn't there
+        value = RegistryValue(args[1].decode("utf-8"), type, [], key)
+        RegistryCommandLine.parse_data(value, args[3:])
+        
+        self.pipe_manager.lock.acquire()
+        try:
+            self.pipe_manager.set_values(key, [value])
+        finally:
+            self.pipe_manager.lock.release()
+        return 0
+    
+    def cmd_delete(self, args):
+        if (len(args) not in [1, 2]):
+            print >>sys.stderr, "Usage: delete KEY [VALUE]"
+            return 2
+        
+        key = self.pipe_manager.get_key_for_path(args[0])
+        
+        if (len(args) == 2):
+            self.pipe_manager.lock.acquire()
+            try:
+                self.pipe_manager.unset_value(RegistryValue(args[1].decode("utf-8"), misc.REG_NONE, None, key))
+            finally:
+                self.pipe_manager.lock.release()
+            return 0
+        
+        if (key.parent == None):
+            print >>sys.stderr, "Root keys can't be deleted."
+            return 1
+        
+        pipe_managers = self.get_pipe_managers()
+        try:
+            deleter = RegistryDeleter(pipe_managers)
+            deleter.run(key)
+        finally:
+            self.close_pipe_managers(pipe_managers)
+        
+        for (path, message) in deleter.failed_keys:
+            print >>sys.stderr, "Failed to delete %s: %s." % (path, message)
+        if (len(deleter.failed_keys) > 0):
+            return 1
+        return 0
+    
+    def cmd_find(self, args):
+        try:
+            opts, args = getopt.getopt(args, "", ["keys", "values", "data", "whole-string", "whole-word", "match-case", "regex"])
+        except getopt.GetoptError as ex:
+            print >>sys.stderr, str(ex)
+            return 2
+        if (len(args) < 1):
+            print >>sys.stderr, "Usage: find [--keys] [--values] [--data] [--whole-string] [--whole-word] [--match-case] [--regex] TEXT [KEY...]"
+            return 2
+        
+        flags = [opt[2:] for (opt, arg) in opts]
+        match_everything = ("keys" not in flags and "values" not in flags and "data" not in flags)
+        options = RegistrySearchOptions(args[0].decode("utf-8"),
+                                        match_everything or "keys" in flags,
+                                        match_everything or "values" in flags,
+                                        match_everything or "data" in flags,
+                                        "whole-string" in flags)
+        options.match_whole_word = ("whole-word" in flags)
+        options.match_case = ("match-case" in flags)
+        options.use_regex = ("regex" in flags)
+        options.find_all = True
+        
+        if (len(args) > 1):
+            keys = [self.pipe_manager.get_key_for_path(path) for path in args[1:]]
+        else:
+            keys = list(self.pipe_manager.well_known_keys)
+        
+        pipe_managers = self.get_pipe_managers()
+        try:
+            engine = RegistrySearchEngine(pipe_managers, options, None, self.on_search_result)
+            engine.add_roots(keys)
+            engine.run()
+        finally:
+            self.close_pipe_managers(pipe_managers)
+        return 0
+    
+    def on_search_result(self, result):
+        """Called by the search engine's worker threads for every match."""
+        if (result.value == None):
+            record = RegistryCommandLine.get_key_record(result.key)
+        else:
+            record = RegistryCommandLine.get_value_record(result.value)
+            if (record["data"] == None and result.data_text != None):
+                record["data"] = result.data_text
+        record["match"] = result.match_type
+        
+        self.write_record(record)
+    
+    def cmd_export(self, args):
+        if (len(args) != 2):
+            print >>sys.stderr, "Usage: export KEY FILE"
+            return 2
+        
+        key = self.pipe_manager.get_key_for_path(args[0])
+        
+        if (args[1] == "-"):
+            file = self.output
+        else:
+            try:
+                file = open(args[1], "wb")
+            except IOError as ex:
+                print >>sys.stderr, "Failed to open %s: %s." % (args[1], ex.strerror)
+                return 1
+        
+        if (args[1].lower().endswith(".regb")):
+            writer = RegBinaryWriter(file)
+        else:
+            writer = RegFileWriter(file)
+        
+        pipe_managers = self.get_pipe_managers()
+        try:
+            exporter = RegistryExporter(pipe_managers, writer)
+            exporter.run(key)
+        finally:
+            self.close_pipe_managers(pipe_managers)
+            if (file is self.output):
+                file.flush()
+            else:
+                writer.close()
+        
+        for path in exporter.failed_keys:
+            print >>sys.stderr, "Failed to read %s, it was left out of the export." % (path)
+        if (len(exporter.failed_keys) > 0):
+            return 1
+        return 0
+    
+    def cmd_du(self, args):
+        try:
+            opts, args = getopt.getopt(args, "d:c", ["depth=", "count-only"])
+        except getopt.GetoptError as ex:
+            print >>sys.stderr, str(ex)
+            return 2
+        if (len(args) != 1):
+            print >>sys.stderr, "Usage: du [--depth N] [--count-only] KEY"
+            return 2
+        
+        max_depth = 1
+        count_bytes = True
+        for (opt, arg) in opts:
+            if (opt in ("-d", "--depth")):
+                max_depth = int(arg)
+            elif (opt in ("-c", "--count-only")):
+                count_bytes = False
+        
+        key = self.pipe_manager.get_key_for_path(args[0])
+        
+        pipe_managers = self.get_pipe_managers()
+        try:
+            analyzer = RegistryUsageAnalyzer(pipe_managers, count_bytes)
+            root = analyzer.run(key)
+        finally:
+            self.close_pipe_managers(pipe_managers)
+        
+        CSVUsageWriter(self.output).write_tree(root, max_depth)
+        
+        for (path, message) in analyzer.failed_keys:
+            print >>sys.stderr, "Failed to read %s: %s." % (path, message)
+        if (len(analyzer.failed_keys) > 0):
+            return 1
+        return 0
+    
+    def cmd_import(self, args):
+        try:
+            opts, args = getopt.getopt(args, "n", ["dry-run"])
+        except getopt.GetoptError as ex:
+            print >>sys.stderr, str(ex)
+            return 2
+        if (len(args) != 1):
+            print >>sys.stderr, "Usage: import [-n --dry-run] FILE"
+            return 2
+        dry_run = (len(opts) > 0)
+        
+        try:
+            if (args[0] == "-"):
+                file = StringIO.StringIO(sys.stdin.read()) #the readers need to seek
+            else:
+                file = open(args[0], "rb")
+        except IOError as ex:
+            print >>sys.stderr, "Failed to read %s: %s." % (args[0], ex.strerror)
+            return 1
+        
+        pipe_managers = self.get_pipe_managers()
+        try:
+            importer = RegistryImporter(pipe_managers, list(self.pipe_manager.well_known_keys), None, self.on_import_change, dry_run)
+            importer.run(open_reader(file))
+        finally:
+            self.close_pipe_managers(pipe_managers)
+            file.close()
+        
+        for (path, message) in importer.failed_keys:
+            print >>sys.stderr, "Failed to import %s: %s." % (path, message)
+        if (len(importer.failed_keys) > 0):
+            return 1
+        return 0
+    
+    def on_import_change(self, change):
+        """Called by the importer's worker threads for every change a dry run finds."""
+        record = {"type":"change", "action":change.action, "path":change.key_path, "name":change.name, "old_data":None, "new_data":None}
+        if (change.old_value != None):
+            record["old_data"] = RegistryCommandLine.get_value_record(change.old_value)["data"]
+        if (change.new_value != None):
+            record["value_type"] = RegistryValue.get_type_name(change.new_value.type)
+            record["new_data"] = RegistryCommandLine.get_value_record(change.new_value)["data"]
+        
+        self.write_record(record)
+
+#************ END OF CLASS ***************
+
+def RunQuery(hosts_file, path = "", value_name = None, output = None, max_workers = 16, timeout = 30,
+             username = "", password = None, transport_type = 0, json_lines = False, **ignored):
+    """Queries every server listed in 'hosts_file' for 'path' (and 'value_name') and writes what they say as CSV, or as JSON lines.
+    
+    returns the exit code: 0 if every server answered, 1 otherwise"""
+    if (path == ""):
+        print >>sys.stderr, "Please give the key to get."
+        return 2
+    
+    try:
+        if (hosts_file == "-"):
+            hosts = read_hosts(sys.stdin)
+        else:
+            file = open(hosts_file, "r")
+            try:
+                hosts = read_hosts(file)
+            finally:
+                file.close()
+    except IOError as ex:
+        print >>sys.stderr, "Failed to read %s: %s." % (hosts_file, ex.strerror)
+        return 2
+    
+    if (password == None):
+        password = GetPassword(username)
+    
+    if (output != None):
+        try:
+            file = open(output, "wb")
+        except IOError as ex:
+            print >>sys.stderr, "Failed to open %s: %s." % (output, ex.strerror)
+            return 2
+    else:
+        file = sys.stdout
+    
+    if (json_lines):
+        writer = JSONResultWriter(file)
+    else:
+        writer = CSVResultWriter(file)
+    query = RegistryMultiQuery(WinRegPipeManager, hosts, path, value_name, username, password, transport_type,
+                               max_workers, timeout, writer.write_result)
+    try:
+        results = query.run()
+    except KeyboardInterrupt:
+        query.cancel()
+        results = query.results
+    finally:
+        if (file is not sys.stdout):
+            file.close()
+    
+    failed = len([result for result in results if result.status not in ["ok", "not found"]])
+    print >>sys.stderr, "%d of %d servers answered." % (len(results) - failed, len(hosts))
+    if (failed > 0 or len(results) < len(hosts)):
+        return 1
+    return 0
+
+def GetPassword(username):
+    """The password comes from the PYGWREGEDIT_PASSWORD environment variable if it's set, so scheduled jobs don't have
+    to put it on the command line. Otherwise the user is asked for it."""
+    if (os.environ.has_key("PYGWREGEDIT_PASSWORD")):
+        return os.environ["PYGWREGEDIT_PASSWORD"]
+    return getpass.getpass("Password for %s: " % (username))
+
+def PrintUseage():
+    print "Usage: %s [OPTIONS] COMMAND [ARGUMENTS]" % (str(os.path.split(__file__)[-1]))
+    print "Works with the registry of a remote server without a window. Results are written to stdout as one JSON object per line.\n"
+    print "  -s  --server\t\tspecify the server to connect to."
+    print "  -u  --user\t\tspecify the user."
+    print "  -p  --password\tThe password for the user. The PYGWREGEDIT_PASSWORD environment variable is used if it's not given."
+    print "  -t  --transport\tTransport type.\n\t\t\t\t0 for RPC, SMB, TCP/IP\n\t\t\t\t1 for RPC, TCP/IP\n\t\t\t\t2 for localhost."
+    print "  -n  --connections\tHow many connections find, export, import, delete and du use, 4 by default."
+    print "\nCommands:"
+    print "  ls KEY\t\t\tList the subkeys and values of KEY, for example HKLM\\\\SOFTWARE\\\\Microsoft."
+    print "  get KEY [VALUE]\tGet one value, or every value in KEY."
+    print "  set KEY VALUE TYPE DATA\tSet a value, creating KEY if needed. TYPE is REG_SZ, REG_DWORD, REG_BINARY (as hex)..."
+    print "\t\t\t\tREG_MULTI_SZ takes one argument per string."
+    print "  delete KEY [VALUE]\tDelete a value, or KEY with everything below it."
+    print "  find [--keys] [--values] [--data] [--whole-string] [--whole-word] [--match-case] [--regex] TEXT [KEY...]"
+    print "\t\t\tList every match, in the whole registry or below the given keys."
+    print "  export KEY FILE\tExport KEY as a .reg file, or a compact export if FILE ends in .regb. Use - for stdout."
+    print "  import [--dry-run] FILE\tImport a .reg file or compact export. Use - for stdin. --dry-run lists the changes instead."
+    print "  du [--depth N] [--count-only] KEY"
+    print "\t\t\tAdd up the subkeys, values and bytes of value data below KEY, and below its subkeys down to N levels (1 by default)."
+    print "\t\t\tWritten as CSV, biggest first. --count-only doesn't ask for the sizes of the values, which is quicker."
+    print "  query [--csv] [--workers N] [--timeout SECONDS] HOSTS_FILE KEY [VALUE]"
+    print "\t\t\tGet KEY or VALUE from every server listed in HOSTS_FILE (one per line, - for stdin). -s isn't needed."
+
+def ParseArgs(argv):
+    arguments = {}
+    
+    try: #get arguments into a nicer format
+        opts, args = getopt.getopt(argv, "hu:s:p:t:n:", ["help", "user=", "server=", "password=", "transport=", "connections="])
+    except getopt.GetoptError:
+        PrintUseage()
+        sys.exit(2)
+    
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            PrintUseage()
+            sys.exit(0)
+        elif opt in ("-s", "--server"):
+            arguments.update({"server":arg})
+        elif opt in ("-u", "--user"):
+            arguments.update({"username":arg})
+        elif opt in ("-p", "--password"):
+            arguments.update({"password":arg})
+        elif opt in ("-t", "--transport"):
+            arguments.update({"transport_type":int(arg)})
+        elif opt in ("-n", "--connections"):
+            arguments.update({"connections":int(arg)})
+    
+    if (len(args) == 0):
+        PrintUseage()
+        sys.exit(2)
+    return (arguments, args[0], args[1:])
+
+def Main(argv):
+    (arguments, command, args) = ParseArgs(argv)
+    username = arguments.get("username", "")
+    transport_type = arguments.get("transport_type", 0)
+    
+    if (command == "query"):
+        try:
+            opts, args = getopt.getopt(args, "", ["csv", "workers=", "timeout="])
+        except getopt.GetoptError as ex:
+            print >>sys.stderr, str(ex)
+            return 2
+        if (len(args) not in [2, 3]):
+            print >>sys.stderr, "Usage: query [--csv] [--workers N] [--timeout SECONDS] HOSTS_FILE KEY [VALUE]"
+            return 2
+        
+        query_arguments = {"json_lines":True}
+        for opt, arg in opts:
+            if (opt == "--csv"):
+                query_arguments["json_lines"] = False
+            elif (opt == "--workers"):
+                query_arguments["max_workers"] = int(arg)
+            elif (opt == "--timeout"):
+                query_arguments["timeout"] = int(arg)
+        if (len(args) == 3):
+            query_arguments["value_name"] = args[2].decode("utf-8")
+        
+        return RunQuery(args[0], args[1], username = username, password = arguments.get("password"), transport_type = transport_type, **query_arguments)
+    
+    if (not arguments.has_key("server")):
+        print >>sys.stderr, "Please give the server to connect to with -s."
+        return 2
+    
+    password = arguments.get("password")
+    if (password == None):
+        password = GetPassword(username)
+    
+    try:
+        pipe_manager = WinRegPipeManager(arguments["server"], transport_type, username, password)
+    except RuntimeError as re:
+        print >>sys.stderr, "Failed to connect to %s: %s." % (arguments["server"], re.args[-1])
+        return 1
+    
+    try:
+        return RegistryCommandLine(pipe_manager, sys.stdout, arguments.get("connections", 4)).run(command, args)
+    finally:
+        pipe_manager.close()
+
+if __name__ == "__main__":
+    sys.exit(Main(sys.argv[1:])) #the [1:] ignores the first argument, which is the path to our utility
@@ -11,702 +11,1294 @@ import gobject
 import gtk
 import pango
 
-from samba import credentials
-from samba.dcerpc import winreg, security
 from samba.dcerpc import misc
 
-from objects import RegistryKey
-from objects import RegistryValue
 from objects import User
+from objects import RegistryKey
+from objects import RegistrySearchOptions
+
+from winregpipe import WinRegPipeManager
+from regsearch import RegistrySearchEngine
+from regsearch import SearchCursor
+from regcache import RegistryTreeCache
+from regindex import RegistryIndex
+from regindex import RegistryCrawler
+from regfile import RegFileWriter
+from regfile import RegBinaryWriter
+from regfile import RegistryExporter
+from regfile import RegistryImporter
+from regfile import open_reader
+from regdelete import RegistryDeleter
+from regdiff import RegistryDiff
+from regdiff import LiveSource
+from regdiff import SnapshotSource
+from regquery import RegistryMultiQuery
+from regusage import RegistryUsageAnalyzer
+from regtreemodel import RegistryKeyTreeModel
+from progress import ProgressChannel
+from regworker import PRIORITY_INTERACTIVE
+from regworker import PRIORITY_NORMAL
+from regworker import PRIORITY_BACKGROUND
 
 from dialogs import WinRegConnectDialog
 from dialogs import RegValueEditDialog
 from dialogs import RegKeyEditDialog
 from dialogs import RegRenameDialog
 from dialogs import RegSearchDialog
+from dialogs import RegSearchResultsWindow
+from dialogs import RegImportPreviewWindow
+from dialogs import RegCompareDialog
+from dialogs import RegDiffWindow
+from dialogs import RegUsageWindow
+from dialogs import RegQueryDialog
+from dialogs import RegQueryResultsWindow
+from dialogs import RegGoToPathDialog
 from dialogs import RegPermissionsDialog
 from dialogs import AboutDialog
 
+from pygwregcli import RunQuery
 
-class WinRegPipeManager:
-    
-    def __init__(self, server_address, transport_type, username, password):
-        self.service_list = []
-        self.lock = threading.RLock()
+
+class KeyFetchThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window, selected_key, iter):
+        super(KeyFetchThread, self).__init__()
         
-        creds = credentials.Credentials()
-        if (username.count("\\") > 0):
-            creds.set_domain(username.split("\\")[0])
-            creds.set_username(username.split("\\")[1])
-        elif (username.count("@") > 0):
-            creds.set_domain(username.split("@")[1])
-            creds.set_username(username.split("@")[0])
-        else:
-            creds.set_domain("")
-            creds.set_username(username)
-        creds.set_workstation("")
-        creds.set_password(password)
+        self.name = "KeyFetchThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
+        self.selected_key = selected_key
+        #the row can be removed while we're fetching (if its parent is refreshed), so we keep a reference rather than the iter
+        self.row_reference = gtk.TreeRowReference(regedit_window.keys_store, regedit_window.keys_store.get_path(iter))
         
-        binding = ["ncacn_np:%s", "ncacn_ip_tcp:%s", "ncalrpc:%s"][transport_type]
-        self.pipe = winreg.winreg(binding % (server_address), credentials = creds)
+    def get_iter(self):
+        """NOTE: This function requires the gdk lock.
         
-        self.open_well_known_keys()
+        returns the iter for our row, or None if it's gone"""
+        if (not self.row_reference.valid()):
+            return None
+        return self.regedit_window.keys_store.get_iter(self.row_reference.get_path())
         
-    def close(self):
-        pass # apparently there's no .Close() method for this pipe
-
-    def ls_key(self, key, regedit_window=None, progress_bar=True, confirm=True):
-        """this function gets a list of values and subkeys
-        NOTE: this function will acquire the pipe manager lock and gdk lock on its own. Do Not Acquire Either Lock Before Calling This Function!
-        \tThis means you can NOT call this function from the main thread with the regedit_window argument or you will have a deadlock. Calling without the regedit_window argument is fine.
+    def run(self):
+        msg = None
+        try:
+            #if we've listed this key before (maybe in an earlier session) we show that straight away and check it with the server after
+            shown = self.pipe_manager.load_cached_key(self.selected_key)
+            if (shown):
+                gtk.gdk.threads_enter()
+                iter = self.get_iter()
+                if (iter != None):
+                    self.regedit_window.refresh_keys_tree_view(iter, self.selected_key.subkeys)
+                    self.regedit_window.refresh_values_tree_view(self.selected_key.values)
+                gtk.gdk.threads_leave()
+            
+            #the refresh_key function will grab the pipe lock. It goes through the pipe's worker so it doesn't wait behind background work
+            (key_list, value_list, changed) = self.pipe_manager.get_worker().call(self.pipe_manager.refresh_key, 
+                                                                                  (self.selected_key, self.regedit_window.on_ls_key_progress), 
+                                                                                  PRIORITY_INTERACTIVE)
+            
+            gtk.gdk.threads_enter()
+            iter = self.get_iter()
+            if (iter == None):
+                pass #the key isn't in the tree any more
+            elif (not shown):
+                self.regedit_window.refresh_keys_tree_view(iter, key_list)
+                #columns_autosize() already called by refresh_keys_tree_view()
+                
+                self.regedit_window.refresh_values_tree_view(value_list)
+            elif (changed):
+                self.regedit_window.update_keys_tree_view(iter, key_list)
+                self.regedit_window.refresh_values_tree_view(value_list)
+            self.regedit_window.update_sensitivity()
+            #threads_leave in the finally: section
+        except RuntimeError as re:
+            msg = "Failed to fetch information about %s: %s." % (self.selected_key.get_absolute_path(), re.args[1])
+            print msg
+            
+            gtk.gdk.threads_enter()
+            iter = self.get_iter()
+            if (iter != None):
+                self.regedit_window.keys_store.clear_loading(iter)
         
-        returns (subkey_list, value_list)"""
-        subkey_list = []
-        value_list = []
+        finally:
+            gtk.gdk.threads_leave()
+            
+            if (msg != None):
+                gtk.gdk.threads_enter()
+                self.regedit_window.set_status(msg)
+                self.regedit_window.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
+                gtk.gdk.threads_leave()
+
+
+class KeyRefreshThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window):
+        """This thread refreshes every expanded key in the tree, and the selected key with its values.
+        Keys that haven't been written to since they were listed only cost one QueryInfoKey call each."""
+        super(KeyRefreshThread, self).__init__()
         
-        update_GUI = (regedit_window != None)
+        self.name = "KeyRefreshThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
         
-        self.lock.acquire()
-        try: #this can cause access denied errors
-            path_handles = self.open_path(key)
-        except Exception as ex:
-            raise ex
+    def run(self):
+        gtk.gdk.threads_enter()
+        try:
+            (selected_iter, selected_key) = self.regedit_window.get_selected_registry_key()
+            rows = self.regedit_window.get_expanded_rows()
+            if (selected_key != None and selected_key not in [key for (key, row_reference) in rows]):
+                row_reference = gtk.TreeRowReference(self.regedit_window.keys_store, self.regedit_window.keys_store.get_path(selected_iter))
+                rows.append((selected_key, row_reference))
         finally:
-            self.lock.release()
-        
-        key_handle = path_handles[-1]
-        blank_buff = WinRegPipeManager.winreg_string_buf("")
+            gtk.gdk.threads_leave()
         
-        if (update_GUI and progress_bar):
-            num_subkeys = 4800.0 #backup value
-            self.lock.acquire()
+        changed_count = 0
+        for (key, row_reference) in rows: #parents come before their children, so removed keys have lost their rows by the time we get to them
+            gtk.gdk.threads_enter()
+            valid = row_reference.valid()
+            gtk.gdk.threads_leave()
+            if (not valid):
+                continue
+            
             try:
-                num_subkeys = float(self.pipe.QueryInfoKey(key_handle, WinRegPipeManager.winreg_string(""))[1])
+                #one key at a time through the pipe's worker, so anything the user clicks on in the meantime goes first
+                (subkey_list, value_list, changed) = self.pipe_manager.get_worker().call(self.pipe_manager.refresh_key, (key, ), PRIORITY_BACKGROUND)
             except RuntimeError as re:
-                print "Failed to fetch key information for %s: %s." % (key.get_absolute_path(), re.args[1])
+                print "Failed to refresh %s: %s." % (key.get_absolute_path(), re.args[1])
+                continue
+            
+            if (not changed):
+                continue
+            changed_count += 1
+            
+            gtk.gdk.threads_enter()
+            try:
+                if (row_reference.valid()):
+                    self.regedit_window.update_keys_tree_view(self.regedit_window.keys_store.get_iter(row_reference.get_path()), subkey_list)
+                if (key is selected_key):
+                    self.regedit_window.refresh_values_tree_view(value_list)
             finally:
-                self.lock.release()
+                gtk.gdk.threads_leave()
+        
+        gtk.gdk.threads_enter()
+        self.regedit_window.set_status("Refreshed %d keys, %d of them had changed." % (len(rows), changed_count))
+        gtk.gdk.threads_leave()
 
-        index = 0
-        while True: #get a list of subkeys
-            try:
-                self.lock.acquire()
-                (subkey_name, subkey_class, subkey_changed_time) = self.pipe.EnumKey(key_handle, 
-                                                                                     index, 
-                                                                                     blank_buff, 
-                                                                                     blank_buff, 
-                                                                                     None
-                                                                                     )
-                self.lock.release() #we want to release the pipe lock before grabbing the gdk lock or else we might cause a deadlock!
-                
-                subkey = RegistryKey(subkey_name.name, key)
-                subkey_list.append(subkey)
-                
-                if (update_GUI):
-                    gtk.gdk.threads_enter()
-                    regedit_window.set_status("Fetching key: %s" % (subkey_name.name))
-                    if (progress_bar):
-                        if (index < num_subkeys): #the value of total was a guess so this may cause a GtkWarning for setting fraction to a value above 1.0
-                            regedit_window.progressbar.set_fraction(index/num_subkeys) 
-                            regedit_window.progressbar.show() #other threads calling ls_key() may finish and hide the progress bar.
-                    gtk.gdk.threads_leave()
-                
-                index += 1
 
-            except RuntimeError as re:
-                self.lock.release()
-                if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS, so we're done
-                    if (update_GUI and progress_bar):
-                        gtk.gdk.threads_enter()
-                        regedit_window.progressbar.hide()
-                        gtk.gdk.threads_leave()
-                    break
-                else:
-                    raise re
+class ValueDataFetchThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window, value_list):
+        """This thread fetches the data of values that were listed by name only and shows it in the values pane."""
+        super(ValueDataFetchThread, self).__init__()
+        
+        self.name = "ValueDataFetchThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
+        self.value_list = value_list
+        
+    def run(self):
+        try:
+            self.pipe_manager.get_worker().call(self.fetch, (), PRIORITY_NORMAL)
+        except RuntimeError as re:
+            print "Failed to fetch value data for %s: %s." % (self.value_list[0].parent.get_absolute_path(), re.args[1])
+        
+        gtk.gdk.threads_enter()
+        try:
+            self.regedit_window.update_value_rows(self.value_list)
+        finally:
+            gtk.gdk.threads_leave()
+    
+    def fetch(self):
+        self.pipe_manager.lock.acquire()
+        try:
+            self.pipe_manager.fetch_value_data(self.value_list)
+        finally:
+            self.pipe_manager.lock.release()
+
 
-        index = 0
-        while True: #get a list of values for the key
+class GoToPathThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window, path = None, key = None, value = None, status = None):
+        """This thread opens 'path' (or 'key') directly, fetches the subkey lists of its ancestors that aren't in the tree yet and then selects it.
+        If 'value' is given it gets selected as well. 'status' is shown in the status bar when we're done."""
+        super(GoToPathThread, self).__init__()
+        
+        self.name = "GoToPathThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
+        self.path = path
+        self.key = key
+        self.value = value
+        self.status = status
+        
+        if (self.path == None):
+            self.path = key.get_absolute_path()
+        
+    def run(self):
+        msg = None
+        try:
+            if (self.key == None):
+                #the whole path is opened with one call, so a bad path fails before we fetch anything
+                self.pipe_manager.lock.acquire()
+                try:
+                    key = self.pipe_manager.get_key_for_path(self.path)
+                finally:
+                    self.pipe_manager.lock.release()
+            else:
+                key = self.key
+            
+            ancestors = []
+            while (key != None):
+                ancestors.append(key)
+                key = key.parent
+            ancestors.reverse()
+            
+            #find out how much of the path is already in the tree. We only fetch subkey lists from there on
+            gtk.gdk.threads_enter()
             try:
-                self.lock.acquire()
-                (value_name, value_type, value_data, value_length) = self.pipe.EnumValue(key_handle,
-                                                                                         index, 
-                                                                                         WinRegPipeManager.winreg_val_name_buf(""), 
-                                                                                         0, 
-                                                                                         [], 
-                                                                                         8192
-                                                                                         )
-                self.lock.release()
-                
-                value = RegistryValue(value_name.name, value_type, value_data, key)
-                value_list.append(value)
+                if (not self.regedit_window.connected()):
+                    return
+                iter = None
+                depth = 0 #ancestors[depth] is the deepest ancestor that has an iter
+                while (depth < len(ancestors)):
+                    child_iter = self.regedit_window.get_child_iter_by_name(iter, ancestors[depth].name)
+                    if (child_iter == None):
+                        break
+                    iter = child_iter
+                    ancestors[depth] = self.regedit_window.keys_store.get_value(iter, 1) #use the key that's in the tree
+                    if (depth + 1 < len(ancestors)):
+                        ancestors[depth + 1].parent = ancestors[depth]
+                    depth += 1
+                depth = max(depth - 1, 0)
+            finally:
+                gtk.gdk.threads_leave()
+            
+            subkey_lists = []
+            self.pipe_manager.lock.acquire()
+            try:
+                for index in xrange(depth, len(ancestors) - 1):
+                    subkey_list = self.pipe_manager.get_subkeys_for_key(ancestors[index])
+                    subkey_lists.append(subkey_list)
+                    
+                    #swap in the key from the list, it has the proper spelling of the name
+                    name = ancestors[index + 1].name.lower()
+                    matching_keys = [subkey for subkey in subkey_list if subkey.name.lower() == name]
+                    if (len(matching_keys) == 0): #it was deleted since we opened the path
+                        raise RuntimeError(2, "WERR_BADFILE")
+                    ancestors[index + 1] = matching_keys[0]
+                    if (index + 2 < len(ancestors)):
+                        ancestors[index + 2].parent = matching_keys[0]
+            finally:
+                self.pipe_manager.lock.release()
+            
+            #we fetch the key's contents here as well, rather than letting the selection handler do it from the main thread
+            (key_list, value_list) = self.pipe_manager.ls_key(ancestors[-1], fetch_data=False)
+            
+            gtk.gdk.threads_enter()
+            try:
+                if (not self.regedit_window.connected()):
+                    return
+                self.regedit_window.ignore_selection_change = True #we don't want to fetch values for every ancestor
+                try:
+                    iter = None
+                    for index in xrange(depth + 1):
+                        iter = self.regedit_window.get_child_iter_by_name(iter, ancestors[index].name)
+                    for index in xrange(len(subkey_lists)):
+                        self.regedit_window.refresh_keys_tree_view(iter, subkey_lists[index])
+                        iter = self.regedit_window.get_child_iter_by_name(iter, ancestors[depth + index + 1].name)
+                    
+                    self.regedit_window.refresh_keys_tree_view(iter, key_list)
+                    self.regedit_window.refresh_values_tree_view(value_list)
+                finally:
+                    self.regedit_window.ignore_selection_change = False
                 
-                #there's no need to update GUI here since there's usually few Values. 
-                #Additionally, many values are named "" which is later changed to "(Default)". 
-                #So printing '"fetching: "+value.name' might look like a glitch to the user.
+                value_iter = None
+                if (self.value != None):
+                    value_iter = self.regedit_window.get_iter_for_value(self.value)
+                self.regedit_window.highlight_search_result(iter, value_iter)
+                self.regedit_window.keys_tree_view.scroll_to_cell(self.regedit_window.keys_store.get_path(iter), None, True, 0.5, 0.0)
+                if (value_iter == None):
+                    self.regedit_window.keys_tree_view.grab_focus()
                 
-                index += 1
-
-            except RuntimeError as re:
-                self.lock.release()
-                if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS
-                    break
+                if (self.status != None):
+                    self.regedit_window.set_status(self.status)
                 else:
-                    raise re
+                    self.regedit_window.set_status("Selected path \'%s\'." % (ancestors[-1].get_absolute_path()))
+                self.regedit_window.update_sensitivity()
+            finally:
+                gtk.gdk.threads_leave()
+            
+        except RuntimeError as re:
+            if (re.args[0] == 2): #WERR_BADFILE
+                msg = "Failed to go to %s: the key does not exist." % (self.path)
+            else:
+                msg = "Failed to go to %s: %s." % (self.path, re.args[1])
+        except ValueError as ve:
+            msg = "Failed to go to %s: %s." % (self.path, str(ve))
+        
+        if (msg != None):
+            print msg
+            gtk.gdk.threads_enter()
+            self.regedit_window.set_status(msg)
+            self.regedit_window.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
+            gtk.gdk.threads_leave()
 
-        self.lock.acquire()
-        try:
-            self.close_path(path_handles)
-        finally:
-            self.lock.release()
+
+class SearchThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window, options, cursor=None, starting_key=None):
+        """This thread searches the registry using the RegistrySearchOptions in 'options'. 
+        If 'cursor' is supplied then it carries on from that SearchCursor, otherwise if 'starting_key' is supplied
+        then it will search only from that key onward."""
+        super(SearchThread, self).__init__()
         
-        default_value_list = [value for value in value_list if value.name == ""]
-        if (len(default_value_list) == 0):
-            value = RegistryValue("(Default)", misc.REG_SZ, [], key)
-            value_list.append(value)
-        else:
-            default_value_list[0].name = "(Default)"
+        self.explode = False; #so we can kill this thread if we want to
+        
+        self.name = "SearchThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
+        self.cursor = cursor
+        self.starting_key = starting_key
+        self.options = options
+        self.engine = None
+        
+    def run(self):
+        self.pipe_manager.lock.acquire()
+        root_keys = list(self.pipe_manager.well_known_keys)
+        self.pipe_manager.lock.release()
         
-        if (update_GUI and confirm):
+        if (self.options.use_index):
+            self.run_index_search(root_keys)
+            return
+        
+        if (self.cursor == None and self.starting_key != None): #The user moved the selection and pressed find next.
+            try:
+                #search only the keys that come after the selected key
+                self.cursor = SearchCursor.from_key(self.pipe_manager, self.starting_key)
+            except (RuntimeError, ValueError) as ex:
+                if (self.explode):
+                    return
+                gtk.gdk.threads_enter()
+                self.regedit_window.search_thread = None
+                self.regedit_window.set_status("Search failed.")
+                self.regedit_window.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "Failed to search from %s: %s." % (self.starting_key.get_absolute_path(), ex.args[-1]))
+                gtk.gdk.threads_leave()
+                return
+        
+        #the search gets its own pipes, so it doesn't hold up the main pipe manager
+        pipe_managers = self.regedit_window.get_search_pipe_managers(self.options.pipe_count)
+        if (self.explode):
+            return
+        
+        self.engine = RegistrySearchEngine(pipe_managers, self.options, self.on_key_searched)
+        if (self.cursor != None):
+            self.engine.add_cursor(self.cursor, root_keys)
+        else: #start a normal search
+            self.engine.add_roots(root_keys)
+        result = self.engine.run()
+        
+        if (self.explode):
+            return
+        
+        if (result != None):
+            msg = "Found %s at: %s." % (result.match_type, result.get_absolute_path())
+            
+            #run() the thread here rather than start() it, we're already in the background
+            GoToPathThread(self.pipe_manager, self.regedit_window, key = result.key, value = result.value, status = msg).run()
+            
+            #remember where we stopped so find next can carry on from there
+            cursor = self.engine.get_cursor()
             gtk.gdk.threads_enter()
-            regedit_window.set_status("Successfully fetched keys and values of %s." % (key.name))
+            self.regedit_window.search_cursor = cursor
+            self.regedit_window.search_cursor_key_path = result.key.get_absolute_path().lower()
+            self.regedit_window.search_thread = None
+            self.regedit_window.update_sensitivity()
             gtk.gdk.threads_leave()
-            
-#        #The reference count to Py_None is still not right: It climbs to infinity!
-#        print "Finish ls_key()", sys.getrefcount(None)
-        return (subkey_list, value_list)
+            return
     
-    def get_subkeys_for_key(self, key):
-        """this function gets a list subkeys for 'key'
+        #if we are here then the search has finished and found nothing
+        msg = "Search query not found."
+        if self.options.match_whole_string: msg += "\n\nConsider searching again with 'Match whole string' unchecked"
+        gtk.gdk.threads_enter()
+        self.regedit_window.search_thread = None
+        self.regedit_window.search_cursor = None
+        self.regedit_window.search_cursor_key_path = None
+        self.regedit_window.update_sensitivity()
+        self.regedit_window.set_status("Search query not found.")
+        self.regedit_window.run_message_dialog(gtk.MESSAGE_INFO, gtk.BUTTONS_OK, msg)
+        gtk.gdk.threads_leave()
+    
+    def run_index_search(self, root_keys):
+        """Looks the search up in the window's RegistryIndex instead of going through the registry.
+        Matches are checked with the server first if the options say so, ones that have gone are skipped.
+        The index finds matches in the same order as a search of the server, so both carry on from the same SearchCursor."""
+        index = self.regedit_window.search_index
+        
+        position = None
+        if (index != None and self.starting_key != None): #The user moved the selection and pressed find next.
+            position = index.get_position(self.starting_key, root_keys)
+        elif (self.cursor != None and self.cursor.is_empty()): #the last search got to the end
+            index = None
+        elif (self.cursor != None): #carry on from the first part of the registry the last search didn't get to
+            position = min([RegistrySearchEngine.lower_bound(entry) for entry in self.cursor.entries])
+        
+        found = None
+        while (found == None and index != None and not self.explode):
+            result_list = index.search(self.options, root_keys, position, 50)
+            for result in result_list:
+                position = result.position
+                if (self.explode):
+                    return
+                if (not self.options.verify_index or RegistryIndex.verify_result(self.pipe_manager, result, self.options)):
+                    found = result
+                    break
+            
+            if (len(result_list) < 50): #that was the last of them
+                break
         
-        returns subkey_list"""
+        if (self.explode):
+            return
         
-        subkey_list = []
-        path_handles = self.open_path(key)
-        key_handle = path_handles[-1]
-        blank_buff = WinRegPipeManager.winreg_string_buf("")
-        index = 0
+        gtk.gdk.threads_enter()
+        self.regedit_window.search_thread = None
+        self.regedit_window.search_cursor = None
+        self.regedit_window.search_cursor_key_path = None
+        self.regedit_window.update_sensitivity()
+        gtk.gdk.threads_leave()
         
-        while True: #get a list of subkeys
-            try:
-                (subkey_name, 
-                 subkey_class, 
-                 subkey_changed_time) = self.pipe.EnumKey(key_handle, index, blank_buff, blank_buff, None)
-                
-                subkey = RegistryKey(subkey_name.name, key)
-                subkey_list.append(subkey)
-                
-                index += 1
-
-            except RuntimeError as re:
-                if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS, so we're done
-                    break
-                else:
-                    raise re
-
-        self.close_path(path_handles)
+        if (found != None):
+            msg = "Found %s at: %s." % (found.match_type, found.get_absolute_path())
+            GoToPathThread(self.pipe_manager, self.regedit_window, key = found.key, value = found.value, status = msg).run()
+            
+            #carry on after the key's name, or after the value that matched, like the search engine does
+            value_start = 0
+            if (found.value != None):
+                value_start = found.position[-2] + 1
+            cursor = index.get_cursor(found.key, root_keys, value_start, self.options)
+            
+            gtk.gdk.threads_enter()
+            self.regedit_window.search_cursor = cursor
+            self.regedit_window.search_cursor_key_path = found.key.get_absolute_path().lower()
+            self.regedit_window.update_sensitivity()
+            gtk.gdk.threads_leave()
+            return
         
-        return subkey_list
-    
-    def get_values_for_key(self, key):
-        """this function gets a list of values for 'key'
+        gtk.gdk.threads_enter()
+        self.regedit_window.set_status("Search query not found.")
+        self.regedit_window.run_message_dialog(gtk.MESSAGE_INFO, gtk.BUTTONS_OK, "Search query not found in the index.")
+        gtk.gdk.threads_leave()
         
-        returns a list of values"""
+    def on_key_searched(self, key):
+        """Called by the search engine's worker threads for every key they search."""
+        self.regedit_window.post_status(self.show_progress, key)
         
-        value_list = []
-        path_handles = self.open_path(key)
-        key_handle = path_handles[-1]
-        index = 0
+    def show_progress(self, key):
+        if (not self.explode):
+            self.regedit_window.set_status("Searching %s." % key.get_absolute_path())
         
-        while True: #get a list of values for the key
-            try:
-                (value_name, 
-                 value_type, 
-                 value_data, 
-                 value_length) = self.pipe.EnumValue(key_handle,
-                                                     index, 
-                                                     WinRegPipeManager.winreg_val_name_buf(""), 
-                                                     0, 
-                                                     [], 
-                                                     8192
-                                                     )
-                
-                value = RegistryValue(value_name.name, value_type, value_data, key)
-                value_list.append(value)
+    def self_destruct(self):
+        """This function will only stop the thread, it will not clean up anything or display anything to the user.
+        This way the calling thread can do it and it's guaranteed to happen right away."""
+        #this probably isn't safe. But who cares, we're killing the thread anyways
+        self.explode = True
+        if (self.engine != None):
+            self.engine.cancel()
 
-                index += 1
 
-            except RuntimeError as re:
-                if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS
+class FindAllThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window, options, results_window):
+        """This thread searches the whole registry once and lists every match in 'results_window'.
+        Matches are collected from the search workers and handed to the GUI in batches by the window's progress channel."""
+        super(FindAllThread, self).__init__()
+        
+        self.explode = False
+        
+        self.name = "FindAllThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
+        self.options = options
+        self.results_window = results_window
+        self.engine = None
+        
+        self.result_count = 0
+        self.start_time = time.time()
+        self.finished = False
+        
+    def run(self):
+        self.pipe_manager.lock.acquire()
+        keys = list(self.pipe_manager.well_known_keys)
+        self.pipe_manager.lock.release()
+        
+        if (self.options.use_index):
+            self.run_index_search(keys)
+            return
+        
+        pipe_managers = self.regedit_window.get_search_pipe_managers(self.options.pipe_count)
+        
+        if (not self.explode):
+            self.engine = RegistrySearchEngine(pipe_managers, self.options, None, self.on_result)
+            self.engine.add_roots(keys)
+            
+            self.start_time = time.time()
+            self.regedit_window.progress_channel.repeat(self.on_stats_tick)
+            self.engine.run()
+        
+        self.finished = True
+        self.regedit_window.progress_channel.post(self, self.update_stats)
+    
+    def run_index_search(self, root_keys):
+        index = self.regedit_window.search_index
+        
+        self.start_time = time.time()
+        self.regedit_window.progress_channel.repeat(self.on_stats_tick)
+        
+        if (index != None):
+            for result in index.search(self.options, root_keys):
+                if (self.explode):
                     break
-                else:
-                    raise re
-
-        self.close_path(path_handles)
+                if (not self.options.verify_index or RegistryIndex.verify_result(self.pipe_manager, result, self.options)):
+                    self.on_result(result)
         
-        #Every key is supposted to have a default value. If this key doesn't have one, we'll display a blank one
-        default_value_list = [value for value in value_list if value.name == ""]
-        if (len(default_value_list) == 0):
-            value = RegistryValue("(Default)", misc.REG_SZ, [], key)
-            value_list.append(value)
-        else:
-            default_value_list[0].name = "(Default)"
+        self.finished = True
+        self.regedit_window.progress_channel.post(self, self.update_stats)
+    
+    def on_result(self, result):
+        """Called by the search engine's worker threads for every match."""
+        self.regedit_window.progress_channel.append(self, self.add_results, result)
+    
+    def add_results(self, result_list):
+        """NOTE: This function requires the gdk lock."""
+        self.result_count += len(result_list)
+        self.results_window.add_results(result_list)
+    
+    def on_stats_tick(self):
+        """Keeps the speed up to date while few matches are coming in. The progress channel calls this until it returns False."""
+        if (self.finished):
+            return False
         
-        return value_list
+        self.update_stats()
+        return True
     
-    def get_key_security(self, key):
-        #TODO: this
+    def update_stats(self):
+        """NOTE: This function requires the gdk lock."""
+        if (self.options.use_index):
+            stats = "%d matches in the search index." % (self.result_count)
+            if (self.options.verify_index):
+                stats = "%d matches in the search index that are still on the server." % (self.result_count)
+            
+            if (not self.finished):
+                self.results_window.set_stats(stats)
+            else:
+                self.update_finished_stats(stats)
+            return
         
-        path_handles = self.open_path(key)
-        key_handle = path_handles[-1]
+        keys_searched = 0
+        values_searched = 0
+        if (self.engine != None):
+            keys_searched = self.engine.keys_searched
+            values_searched = self.engine.values_searched
+        elapsed = max(time.time() - self.start_time, 0.001)
+        
+        stats = "%d matches. Searched %d keys (%.0f/sec) and %d values (%.0f/sec)." % (self.result_count, 
+                                                                                      keys_searched, 
+                                                                                      keys_searched / elapsed, 
+                                                                                      values_searched, 
+                                                                                      values_searched / elapsed)
+        if (not self.finished):
+            self.results_window.set_stats(stats)
+            return
         
+        self.update_finished_stats(stats)
+    
+    def update_finished_stats(self, stats):
+        """NOTE: This function requires the gdk lock."""
+        if (self.explode):
+            self.results_window.set_stats("Stopped. " + stats)
+        else:
+            self.results_window.set_stats("Done. " + stats)
+            self.regedit_window.set_status("Search finished, %d matches found." % (self.result_count))
+        self.results_window.set_finished()
+        if (self.regedit_window.search_thread is self):
+            self.regedit_window.search_thread = None
         
-        key_sec_data = winreg.KeySecurityData()
-        key_sec_data.size = 99999999 #TODO: find a better number.
-        #Fetch the DACL
-        result = self.pipe.GetKeySecurity(key_handle, security.SECINFO_DACL , key_sec_data)
+    def self_destruct(self):
+        """Stops the search. The matches found so far stay in the results window."""
+        self.explode = True
+        if (self.engine != None):
+            self.engine.cancel()
+
+
+class IndexCrawlThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window):
+        """This thread brings the window's search index up to date with the whole registry, see RegistryCrawler."""
+        super(IndexCrawlThread, self).__init__()
         
-        #This is what Vista does. I don't know what it means...
-        vista_key_sec_data1 = self.pipe.GetKeySecurity(key_handle, 0x0e4fcce7 , key_sec_data)
-        #vista_key_sec_data2 = self.pipe.GetKeySecurity(key_handle, 0xb234a886 , key_sec_data) #this crashes, "Expected type int"
+        self.name = "IndexCrawlThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
+        self.crawler = None
+        self.explode = False
         
+    def run(self):
+        pipe_managers = self.regedit_window.open_job_pipe_managers()
+        try:
+            self.run_job(pipe_managers)
+        finally:
+            self.regedit_window.close_job_pipe_managers(pipe_managers)
         
+    def run_job(self, pipe_managers):
+        self.pipe_manager.lock.acquire()
+        root_keys = list(self.pipe_manager.well_known_keys)
+        self.pipe_manager.lock.release()
         
-        self.close_path(path_handles)
+        if (self.explode):
+            return
         
-        return key_sec_data
+        start_time = time.time()
+        self.crawler = RegistryCrawler(pipe_managers, self.regedit_window.search_index, self.on_key_crawled)
+        self.crawler.run(root_keys)
         
-
-    def create_key(self, key):
-        path_handles = self.open_path(key.parent)
-        key_handle = path_handles[len(path_handles) - 1]
+        if (self.explode):
+            return
         
-        (new_handle, action_taken) = self.pipe.CreateKey(
-            key_handle,
-            WinRegPipeManager.winreg_string(key.name),
-            WinRegPipeManager.winreg_string(key.name),
-            0,
-            winreg.KEY_ENUMERATE_SUB_KEYS | winreg.KEY_CREATE_SUB_KEY | winreg.KEY_QUERY_VALUE | winreg.KEY_SET_VALUE,
-            None,
-            winreg.REG_ACTION_NONE) #why this value isn't winreg.REG_CREATED_NEW_KEY is beyond me. I'm not even sure why this value is needed, what were the designers thinking?
+        gtk.gdk.threads_enter()
+        self.regedit_window.index_thread = None
+        self.regedit_window.set_status("Search index updated in %.0f seconds: checked %d keys, %d of them had changed." % (time.time() - start_time, 
+                                                                                                                         self.crawler.keys_checked, 
+                                                                                                                         self.crawler.keys_updated))
+        gtk.gdk.threads_leave()
+    
+    def on_key_crawled(self, key):
+        """Called by the crawler's worker threads for every key they look at."""
+        self.regedit_window.post_status(self.show_progress, key)
         
-        path_handles.append(new_handle)
+    def show_progress(self, key):
+        if (not self.explode):
+            self.regedit_window.set_status("Indexing %s." % key.get_absolute_path())
         
-        self.close_path(path_handles)
+    def self_destruct(self):
+        self.explode = True
+        if (self.crawler != None):
+            self.crawler.cancel()
 
-    def move_key(self, key, old_name):
-        #TODO: implement this
-        raise NotImplementedError("Not implemented")
 
-    def remove_key(self, key):
-        """Deletes 'key' and recursively deletes all subkeys under it.
+class ExportThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window, key, writer, filename):
+        """This thread exports 'key' and everything below it with 'writer', see RegistryExporter."""
+        super(ExportThread, self).__init__()
         
-        """
-        subkey_list = self.get_subkeys_for_key(key)
+        self.explode = False
         
-        for subkey in subkey_list:
-            self.remove_key(subkey)
+        self.name = "ExportThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
+        self.key = key
+        self.writer = writer
+        self.filename = filename
+        self.exporter = None
+        self.start_time = time.time()
         
-        path_handles = self.open_path(key)
-        key_handle = path_handles[len(path_handles) - 2]
+    def run(self):
+        pipe_managers = self.regedit_window.open_job_pipe_managers()
+        try:
+            self.run_job(pipe_managers)
+        finally:
+            self.regedit_window.close_job_pipe_managers(pipe_managers)
         
-        self.pipe.DeleteKey(key_handle, WinRegPipeManager.winreg_string(key.name))
-        self.close_path(path_handles)
-
-    def set_value(self, value):
-        path_handles = self.open_path(value.parent)
-        key_handle = path_handles[len(path_handles) - 1]
+    def run_job(self, pipe_managers):
+        try:
+            if (not self.explode):
+                self.start_time = time.time()
+                self.exporter = RegistryExporter(pipe_managers, self.writer, self.on_key_exported)
+                self.exporter.run(self.key)
+        except IOError as ex:
+            if (self.exporter != None):
+                self.exporter.cancel()
+            gtk.gdk.threads_enter()
+            self.regedit_window.export_thread = None
+            self.regedit_window.set_status("Export failed.")
+            self.regedit_window.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "Failed to write %s: %s." % (self.filename, ex.strerror))
+            gtk.gdk.threads_leave()
+            return
+        finally:
+            self.writer.close()
         
-        if (value.name == "(Default)"):
-            name = ""
-        else:
-            name = value.name
+        if (self.explode):
+            return
         
-        self.pipe.SetValue(key_handle, WinRegPipeManager.winreg_string(name), value.type, value.data)
-        self.close_path(path_handles)
-
-    def unset_value(self, value):
-        path_handles = self.open_path(value.parent)
-        key_handle = path_handles[len(path_handles) - 1]
+        gtk.gdk.threads_enter()
+        self.regedit_window.export_thread = None
+        self.regedit_window.set_status("Exported %s to %s. %s" % (self.key.get_absolute_path(), self.filename, self.get_stats()))
+        if (len(self.exporter.failed_keys) > 0):
+            msg = "%d keys couldn't be read and were left out of the export:\n\n%s" % (len(self.exporter.failed_keys), "\n".join(self.exporter.failed_keys[:20]))
+            self.regedit_window.run_message_dialog(gtk.MESSAGE_WARNING, gtk.BUTTONS_OK, msg)
+        gtk.gdk.threads_leave()
+    
+    def get_stats(self):
+        elapsed = max(time.time() - self.start_time, 0.001)
+        return "%d keys and %d values (%.0f values/sec, %.1f MB)." % (self.exporter.keys_exported, 
+                                                                       self.exporter.values_exported, 
+                                                                       self.exporter.values_exported / elapsed, 
+                                                                       self.writer.bytes_written / 1048576.0)
+    
+    def on_key_exported(self, key):
+        """Called by the exporter for every key it writes."""
+        self.regedit_window.post_status(self.show_progress, key)
         
-        if (value.name == "(Default)"):
-            name = ""
-        else:
-            name = value.name
+    def show_progress(self, key):
+        if (not self.explode):
+            self.regedit_window.set_status("Exporting %s. %s" % (key.get_absolute_path(), self.get_stats()))
         
-        self.pipe.DeleteValue(key_handle, WinRegPipeManager.winreg_string(name))
-        self.close_path(path_handles)
+    def self_destruct(self):
+        self.explode = True
+        if (self.exporter != None):
+            self.exporter.cancel()
+
 
-    def move_value(self, value, old_name):
-        path_handles = self.open_path(value.parent)
-        key_handle = path_handles[len(path_handles) - 1]
+class ImportThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window, filename, preview_window = None):
+        """This thread imports a .reg file or compact registry export, see RegistryImporter.
+        If 'preview_window' is given nothing is changed, the changes the import would make are listed in the window instead."""
+        super(ImportThread, self).__init__()
         
-        self.pipe.DeleteValue(key_handle, WinRegPipeManager.winreg_string(old_name))
-        self.pipe.SetValue(key_handle, WinRegPipeManager.winreg_string(value.name), value.type, value.data)
+        self.explode = False
         
-        self.close_path(path_handles)
-
-    def open_well_known_keys(self):
-        self.well_known_keys = []
+        self.name = "ImportThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
+        self.filename = filename
+        self.preview_window = preview_window
+        self.importer = None
+        self.start_time = time.time()
         
-        #additional permissions need to be added to properly fetch security information.
-        #winreg.REG_KEY_ALL works but it's best to figure out what permission is actually needed
+        self.change_count = 0
         
-        key_handle = self.pipe.OpenHKCR(None, winreg.KEY_ENUMERATE_SUB_KEYS | winreg.KEY_CREATE_SUB_KEY | winreg.KEY_QUERY_VALUE | winreg.KEY_SET_VALUE)
-        key = RegistryKey("HKEY_CLASSES_ROOT", None)
-        key.handle = key_handle
-        self.well_known_keys.append(key)
-    
-        key_handle = self.pipe.OpenHKCU(None, winreg.KEY_ENUMERATE_SUB_KEYS | winreg.KEY_CREATE_SUB_KEY | winreg.KEY_QUERY_VALUE | winreg.KEY_SET_VALUE)
-        key = RegistryKey("HKEY_CURRENT_USER", None)
-        key.handle = key_handle
-        self.well_known_keys.append(key)
+    def run(self):
+        pipe_managers = self.regedit_window.open_job_pipe_managers()
+        try:
+            self.run_job(pipe_managers)
+        finally:
+            self.regedit_window.close_job_pipe_managers(pipe_managers)
         
-        key_handle = self.pipe.OpenHKLM(None, winreg.KEY_ENUMERATE_SUB_KEYS | winreg.KEY_CREATE_SUB_KEY | winreg.KEY_QUERY_VALUE | winreg.KEY_SET_VALUE)
-        key = RegistryKey("HKEY_LOCAL_MACHINE", None)
-        key.handle = key_handle
-        self.well_known_keys.append(key)
-    
-        key_handle = self.pipe.OpenHKU(None, winreg.KEY_ENUMERATE_SUB_KEYS | winreg.KEY_CREATE_SUB_KEY | winreg.KEY_QUERY_VALUE | winreg.KEY_SET_VALUE)
-        key = RegistryKey("HKEY_USERS", None)
-        key.handle = key_handle
-        self.well_known_keys.append(key)
+    def run_job(self, pipe_managers):
+        self.pipe_manager.lock.acquire()
+        root_keys = list(self.pipe_manager.well_known_keys)
+        self.pipe_manager.lock.release()
         
-        key_handle = self.pipe.OpenHKCC(None, winreg.KEY_ENUMERATE_SUB_KEYS | winreg.KEY_CREATE_SUB_KEY | winreg.KEY_QUERY_VALUE | winreg.KEY_SET_VALUE)
-        key = RegistryKey("HKEY_CURRENT_CONFIG", None)
-        key.handle = key_handle
-        self.well_known_keys.append(key)
+        error = None
+        try:
+            file = open(self.filename, "rb")
+            try:
+                if (not self.explode):
+                    self.start_time = time.time()
+                    self.importer = RegistryImporter(pipe_managers, root_keys, self.on_key_imported, self.on_change, self.preview_window != None)
+                    self.importer.run(open_reader(file))
+            finally:
+                file.close()
+        except IOError as ex:
+            error = "Failed to read %s: %s." % (self.filename, ex.strerror)
+        except ValueError as ex:
+            error = "Failed to import %s: %s" % (self.filename, str(ex))
+        
+        if (self.explode):
+            return
+        
+        gtk.gdk.threads_enter()
+        try:
+            self.regedit_window.progress_channel.drain() #so the preview has every change before we count them
+            self.regedit_window.import_thread = None
+            
+            if (self.preview_window != None):
+                self.preview_window.set_stats("%d changes. %s" % (self.change_count, error or ""))
+                self.preview_window.set_finished(error == None)
+                self.regedit_window.set_status("Compared %s with the registry." % (self.filename))
+            else:
+                self.regedit_window.set_status("Imported %s. %s" % (self.filename, self.get_stats()))
+                KeyRefreshThread(self.pipe_manager, self.regedit_window).start()
+            
+            if (error != None):
+                self.regedit_window.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, error)
+            elif (len(self.importer.failed_keys) > 0):
+                failures = ["%s: %s" % (path, message) for (path, message) in self.importer.failed_keys[:20]]
+                msg = "%d keys couldn't be imported:\n\n%s" % (len(self.importer.failed_keys), "\n".join(failures))
+                self.regedit_window.run_message_dialog(gtk.MESSAGE_WARNING, gtk.BUTTONS_OK, msg)
+        finally:
+            gtk.gdk.threads_leave()
     
-    def open_path(self, key):
-        if (key.parent == None):
-            return [key.handle]
+    def get_stats(self):
+        elapsed = max(time.time() - self.start_time, 0.001)
+        keys_imported = 0
+        values_imported = 0
+        if (self.importer != None):
+            keys_imported = self.importer.keys_imported
+            values_imported = self.importer.values_imported
+        return "%d keys and %d values (%.0f values/sec)." % (keys_imported, values_imported, values_imported / elapsed)
+    
+    def on_key_imported(self, key):
+        """Called by the importer's worker threads for every key they apply."""
+        self.regedit_window.post_status(self.show_progress, key)
+        
+    def show_progress(self, key):
+        if (self.explode):
+            return
+        if (self.preview_window != None):
+            self.regedit_window.set_status("Comparing %s. %s" % (key.get_absolute_path(), self.get_stats()))
         else:
-            path = self.open_path(key.parent)
-            parent_handle = path[-1]
+            self.regedit_window.set_status("Importing %s. %s" % (key.get_absolute_path(), self.get_stats()))
+    
+    def on_change(self, change):
+        """Called by the importer's worker threads for every change a preview finds."""
+        self.regedit_window.progress_channel.append(self, self.add_changes, change)
+    
+    def add_changes(self, change_list):
+        """NOTE: This function requires the gdk lock."""
+        self.change_count += len(change_list)
+        self.preview_window.add_changes(change_list)
+        self.preview_window.set_stats("%d changes so far." % (self.change_count))
+        
+    def self_destruct(self):
+        self.explode = True
+        if (self.importer != None):
+            self.importer.cancel()
+        if (self.regedit_window.import_thread is self):
+            self.regedit_window.import_thread = None
+
+
+class DeleteKeyThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window, key):
+        """This thread deletes 'key' and everything below it, see RegistryDeleter."""
+        super(DeleteKeyThread, self).__init__()
+        
+        self.explode = False
+        
+        self.name = "DeleteKeyThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
+        self.key = key
+        self.deleter = None
+        
+    def run(self):
+        pipe_managers = self.regedit_window.open_job_pipe_managers()
+        try:
+            self.run_job(pipe_managers)
+        finally:
+            self.regedit_window.close_job_pipe_managers(pipe_managers)
+        
+    def run_job(self, pipe_managers):
+        if (not self.explode):
+            self.deleter = RegistryDeleter(pipe_managers, self.on_key_deleted)
+            self.deleter.run(self.key)
+        
+        self.pipe_manager.invalidate_path(self.key) #the deleter only cleans up after itself on its own pipes
+        if (self.pipe_manager.tree_cache != None):
+            self.pipe_manager.tree_cache.remove_key(self.key)
+        
+        if (self.explode):
+            return
+        
+        self.pipe_manager.lock.acquire()
+        try:
+            key_list = self.pipe_manager.get_subkeys_for_key(self.key.parent)
+        except RuntimeError as re:
+            print "Failed to refresh %s: %s." % (self.key.parent.get_absolute_path(), re.args[1])
+            key_list = None
+        finally:
+            self.pipe_manager.lock.release()
+        
+        gtk.gdk.threads_enter()
+        try:
+            self.regedit_window.delete_thread = None
             
-            key_handle = self.pipe.OpenKey(
-                                      parent_handle,
-                                      WinRegPipeManager.winreg_string(key.name), 
-                                      0, 
-                                      winreg.KEY_ENUMERATE_SUB_KEYS | winreg.KEY_CREATE_SUB_KEY | winreg.KEY_QUERY_VALUE | winreg.KEY_SET_VALUE
-                                      )
+            parent_iter = self.regedit_window.get_iter_for_key(self.key.parent)
+            if (parent_iter != None and key_list != None):
+                self.regedit_window.refresh_keys_tree_view(parent_iter, key_list)
             
-            return path + [key_handle]
+            if (len(self.deleter.failed_keys) > 0):
+                self.regedit_window.set_status("Failed to delete \'%s\'. %d keys deleted." % (self.key.get_absolute_path(), self.deleter.keys_deleted))
+                failures = ["%s: %s" % (path, message) for (path, message) in self.deleter.failed_keys[:20]]
+                msg = "%d keys couldn't be deleted, so neither could the keys above them:\n\n%s" % (len(self.deleter.failed_keys), "\n".join(failures))
+                self.regedit_window.run_message_dialog(gtk.MESSAGE_WARNING, gtk.BUTTONS_OK, msg)
+            else:
+                self.regedit_window.set_status("Key \'%s\' successfully deleted." % (self.key.get_absolute_path()))
+        finally:
+            gtk.gdk.threads_leave()
+    
+    def on_key_deleted(self, key):
+        """Called by the deleter's worker threads for every key they delete."""
+        self.regedit_window.post_status(self.show_progress)
+        
+    def show_progress(self):
+        if (not self.explode):
+            self.regedit_window.set_status("Deleting %s. %d keys deleted." % (self.key.get_absolute_path(), self.deleter.keys_deleted))
         
-    def close_path(self, path_handles):
-        for handle in path_handles[:0:-1]:
-            self.pipe.CloseKey(handle)
+    def self_destruct(self):
+        self.explode = True
+        if (self.deleter != None):
+            self.deleter.cancel()
+        if (self.regedit_window.delete_thread is self):
+            self.regedit_window.delete_thread = None
+
 
-    @staticmethod
-    def winreg_string(string):
-        ws = winreg.String()
-        ws.name = unicode(string)
-        ws.name_len = len(string)
-        ws.name_size = 8192
+class MoveKeyThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window, key, old_name):
+        """This thread renames the key 'old_name' to the name of 'key', see WinRegPipeManager.move_key()."""
+        super(MoveKeyThread, self).__init__()
         
-        return ws
-    
-    @staticmethod
-    def winreg_string_buf(string):
-        wsb = winreg.StringBuf()
-        wsb.name = unicode(string)
-        wsb.length = len(string)
-        wsb.size = 8192
+        self.explode = False
+        
+        self.name = "MoveKeyThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
+        self.key = key
+        self.old_name = old_name
+        self.keys_copied_lock = threading.Lock() #the copier's workers all count
+        self.keys_copied = 0
+        
+    def run(self):
+        pipe_managers = self.regedit_window.open_job_pipe_managers()
+        try:
+            self.run_job(pipe_managers)
+        finally:
+            self.regedit_window.close_job_pipe_managers(pipe_managers)
+        
+    def run_job(self, pipe_managers):
+        old_key = RegistryKey(self.old_name, self.key.parent)
+        
+        #the move only uses pipes of its own, disconnecting closes the main pipe but not these
+        error = None
+        key_list = None
+        if (len(pipe_managers) == 0 or pipe_managers[0] is self.pipe_manager):
+            error = "Failed to rename key: couldn't open a pipe for it."
+        else:
+            try:
+                pipe_managers[0].move_key(self.key, self.old_name, pipe_managers, self.on_key_copied)
+            except RuntimeError as re:
+                error = "Failed to rename key: %s." % (re.args[1])
+            except ValueError as ex:
+                error = "Failed to rename key: %s." % (str(ex))
+            
+            pipe_managers[0].lock.acquire()
+            try:
+                key_list = pipe_managers[0].get_subkeys_for_key(self.key.parent)
+            except RuntimeError as re:
+                print "Failed to refresh %s: %s." % (self.key.parent.get_absolute_path(), re.args[1])
+            finally:
+                pipe_managers[0].lock.release()
         
-        return wsb
+        if (self.explode): #the main pipe has been closed
+            return
         
-    @staticmethod
-    def winreg_val_name_buf(string):
-        wvnb = winreg.ValNameBuf()
-        wvnb.name = unicode(string)
-        wvnb.length = len(string)
-        wvnb.size = 8192
+        self.pipe_manager.invalidate_path(old_key) #the main pipe may still have handles to the old key cached
+        if (self.pipe_manager.tree_cache != None):
+            self.pipe_manager.tree_cache.remove_key(old_key)
         
-        return wvnb
+        gtk.gdk.threads_enter()
+        try:
+            if (self.explode):
+                return
+            self.regedit_window.move_thread = None
+            
+            parent_iter = self.regedit_window.get_iter_for_key(self.key.parent)
+            if (parent_iter != None and key_list != None):
+                select_me_key = None
+                if (error == None):
+                    select_me_key = ([subkey for subkey in key_list if subkey.name == self.key.name] + [None])[0]
+                self.regedit_window.refresh_keys_tree_view(parent_iter, key_list, select_me_key)
+            
+            if (error != None):
+                self.regedit_window.set_status(error)
+                self.regedit_window.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, error)
+            else:
+                self.regedit_window.set_status("Key \'%s\' renamed." % (self.key.get_absolute_path()))
+        finally:
+            gtk.gdk.threads_leave()
+    
+    def on_key_copied(self, key):
+        """Called by the copier's worker threads for every key they copy."""
+        self.keys_copied_lock.acquire()
+        self.keys_copied += 1
+        self.keys_copied_lock.release()
+        self.regedit_window.post_status(self.show_progress)
+        
+    def show_progress(self):
+        if (not self.explode):
+            self.regedit_window.set_status("Renaming %s. %d keys copied." % (self.key.get_absolute_path(), self.keys_copied))
+        
+    def self_destruct(self):
+        """Stops us from touching the window or the main pipe. The move itself carries on on its own pipes, which are closed
+        when it's done, since stopping it half way would leave two half keys behind."""
+        self.explode = True
+        if (self.regedit_window.move_thread is self):
+            self.regedit_window.move_thread = None
 
-class KeyFetchThread(threading.Thread):
-    def __init__(self, pipe_manager, regedit_window, selected_key, iter):
-        super(KeyFetchThread, self).__init__()
+
+class DiffThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window, path, diff_window, other_pipe_manager = None, filename = None, compare_times = False):
+        """This thread compares the key at 'path' with the same key on the server 'other_pipe_manager' is connected to, or in the
+        export 'filename', and shows the differences in 'diff_window'. See RegistryDiff.
+        'other_pipe_manager' belongs to this thread and is closed when it's done."""
+        super(DiffThread, self).__init__()
         
-        self.name = "KeyFetchThread"
+        self.explode = False
+        
+        self.name = "DiffThread"
         self.pipe_manager = pipe_manager
         self.regedit_window = regedit_window
-        self.selected_key = selected_key
-        #TODO: this should take a path instead of an iter. It's possible (though not likely) that a node gets deleted
-        #      because of a refresh to it's parent key. This would invalididate the iter.
-        self.iter = iter
+        self.path = path
+        self.diff_window = diff_window
+        self.other_pipe_manager = other_pipe_manager
+        self.filename = filename
+        self.compare_times = compare_times
+        self.diff = None
+        self.finished = False
+        self.start_time = time.time()
         
     def run(self):
-        msg = None
+        gobject.timeout_add(1000, self.on_stats_timeout)
+        
+        root = None
+        error = None
         try:
-            #the ls_key function will grab the pipe lock
-            (key_list, value_list) = self.pipe_manager.ls_key(self.selected_key, self.regedit_window)
-            
-            gtk.gdk.threads_enter()
-            self.regedit_window.refresh_keys_tree_view(self.iter, key_list)
-            #self.regedit_window.keys_tree_view.get_selection().select_iter(self.iter) #select the key, in case selection has changed during fetching. This causes problems
-            #columns_autosize() already called by refresh_keys_tree_view()
+            source_a = LiveSource(self.pipe_manager, self.path, self.regedit_window.get_diff_remembered(self.pipe_manager))
+            if (self.other_pipe_manager != None):
+                source_b = LiveSource(self.other_pipe_manager, self.path, self.regedit_window.get_diff_remembered(self.other_pipe_manager))
+            else:
+                file = open(self.filename, "rb")
+                try:
+                    source_b = SnapshotSource(open_reader(file), source_a.get_root().get_absolute_path(), os.path.basename(self.filename))
+                finally:
+                    file.close()
             
-            self.regedit_window.refresh_values_tree_view(value_list)
-            self.regedit_window.update_sensitivity()
-            #threads_leave in the finally: section
+            if (not self.explode):
+                self.start_time = time.time()
+                self.diff = RegistryDiff(source_a, source_b, self.compare_times)
+                root = self.diff.run()
         except RuntimeError as re:
-            msg = "Failed to fetch information about %s: %s." % (self.selected_key.get_absolute_path(), re.args[1])
-            print msg
+            error = "Failed to compare %s: %s." % (self.path, re.args[-1])
+        except IOError as ex:
+            error = "Failed to read %s: %s." % (self.filename, ex.strerror)
+        except ValueError as ex:
+            error = "Failed to compare %s: %s" % (self.path, str(ex))
+        finally:
+            self.finished = True
+            if (self.other_pipe_manager != None):
+                self.other_pipe_manager.close()
         
+        gtk.gdk.threads_enter()
+        try:
+            self.regedit_window.report_threads.discard(self)
+            if (self.explode):
+                return
+            
+            self.diff_window.set_diff(root)
+            self.diff_window.set_finished()
+            if (error != None):
+                self.diff_window.set_stats(error)
+                self.regedit_window.set_status("Comparison failed.")
+                self.regedit_window.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, error)
+            elif (root == None):
+                self.diff_window.set_stats("No differences. " + self.get_stats())
+                self.regedit_window.set_status("Comparison finished.")
+            else:
+                self.diff_window.set_stats("Done. " + self.get_stats())
+                self.regedit_window.set_status("Comparison finished.")
         finally:
             gtk.gdk.threads_leave()
-            
-            if (msg != None):
-                gtk.gdk.threads_enter()
-                self.regedit_window.set_status(msg)
-                self.regedit_window.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
-                gtk.gdk.threads_leave()
+    
+    def get_stats(self):
+        if (self.diff == None):
+            return ""
+        elapsed = max(time.time() - self.start_time, 0.001)
+        return "%d differences. Compared %d keys (%.0f/sec), %d of them had to be listed." % (self.diff.differences, 
+                                                                                             self.diff.keys_compared, 
+                                                                                             self.diff.keys_compared / elapsed, 
+                                                                                             self.diff.keys_listed)
+    
+    def on_stats_timeout(self):
+        """Timeout callback that shows how far we've got."""
+        if (self.finished):
+            return False
+        
+        gtk.gdk.threads_enter()
+        self.diff_window.set_stats(self.get_stats())
+        gtk.gdk.threads_leave()
+        
+        return True
+        
+    def self_destruct(self):
+        self.explode = True
+        if (self.diff != None):
+            self.diff.cancel()
+
+
+class UsageThread(threading.Thread):
+    def __init__(self, pipe_manager, regedit_window, key, usage_window):
+        """This thread adds up the sizes of 'key' and everything below it and shows them in 'usage_window'. See RegistryUsageAnalyzer."""
+        super(UsageThread, self).__init__()
+        
+        self.explode = False
+        
+        self.name = "UsageThread"
+        self.pipe_manager = pipe_manager
+        self.regedit_window = regedit_window
+        self.key = key
+        self.usage_window = usage_window
+        self.analyzer = None
+        self.finished = False
+        self.start_time = time.time()
+    
+    def run(self):
+        pipe_managers = self.regedit_window.open_job_pipe_managers()
+        try:
+            self.run_job(pipe_managers)
+        finally:
+            self.regedit_window.close_job_pipe_managers(pipe_managers)
+        
+    def run_job(self, pipe_managers):
+        gobject.timeout_add(1000, self.on_stats_timeout)
+        
+        root = None
+        try:
+            if (not self.explode):
+                self.start_time = time.time()
+                self.analyzer = RegistryUsageAnalyzer(pipe_managers)
+                root = self.analyzer.run(self.key)
+        finally:
+            self.finished = True
+        
+        gtk.gdk.threads_enter()
+        try:
+            self.regedit_window.report_threads.discard(self)
+            self.usage_window.set_usage(root) #whatever we got before we were stopped
+            self.usage_window.set_finished()
+            if (self.explode):
+                self.usage_window.set_stats("Stopped. " + self.get_stats())
+            else:
+                self.usage_window.set_stats("Done. " + self.get_stats())
+            if (not self.explode):
+                self.regedit_window.set_status("Added up the sizes of the keys below %s." % (self.key.get_absolute_path()))
+        finally:
+            gtk.gdk.threads_leave()
+    
+    def get_stats(self):
+        if (self.analyzer == None):
+            return ""
+        elapsed = max(time.time() - self.start_time, 0.001)
+        stats = "Read %d keys (%.0f/sec) with %d values." % (self.analyzer.keys_read, self.analyzer.keys_read / elapsed, self.analyzer.values_counted)
+        if (len(self.analyzer.failed_keys) > 0):
+            stats += " %d keys couldn't be read." % (len(self.analyzer.failed_keys))
+        return stats
+    
+    def on_stats_timeout(self):
+        """Timeout callback that shows how far we've got."""
+        if (self.finished):
+            return False
+        
+        gtk.gdk.threads_enter()
+        self.usage_window.set_stats(self.get_stats())
+        gtk.gdk.threads_leave()
+        
+        return True
+    
+    def self_destruct(self):
+        self.explode = True
+        if (self.analyzer != None):
+            self.analyzer.cancel()
 
 
-class SearchThread(threading.Thread):
-    def __init__(self, pipe_manager, regedit_window, options, starting_key_iter=None):
-        """This thread searches the registry using the options specified in 'options'. 
-        If 'starting_key_iter' is supplied then it will search only from that key onward."""
-        super(SearchThread, self).__init__()
+class QueryThread(threading.Thread):
+    def __init__(self, regedit_window, query, results_window):
+        """This thread runs a RegistryMultiQuery and lists what every server says in 'results_window' as the answers come in."""
+        super(QueryThread, self).__init__()
         
-        self.explode = False; #so we can kill this thread if we want to
+        self.explode = False
         
-        self.name = "SearchThread"
-        self.pipe_manager = pipe_manager
+        self.name = "QueryThread"
         self.regedit_window = regedit_window
-        self.starting_key_iter = starting_key_iter
-        
-        #options are passed in a bit of a weird way.
-        (self.text, 
-         self.search_keys, 
-         self.search_values, 
-         self.search_data, 
-         self.match_whole_string) = options
-        
-    def run(self):
-        if (self.match_whole_string):
-            search_items = [self.text]
-        else:
-            search_items = self.text.split()
+        self.query = query
+        self.query.result_callback = self.on_result
+        self.results_window = results_window
         
-        if self.starting_key_iter == None: #Add root keys, start a normal search
-            #this will be a depth-first traversal of the key tree
-            stack = [] #we'll push keys onto this stack
-            
-            self.pipe_manager.lock.acquire()
-            well_known_keys = self.pipe_manager.well_known_keys
-            self.pipe_manager.lock.release()
-            
-            gtk.gdk.threads_enter()
-            for key in well_known_keys: #push the root keys onto the stack
-                stack.append((key, self.regedit_window.get_iter_for_key(key), ))
-            gtk.gdk.threads_leave()
-            stack.reverse() #we pop keys from the end of the list. Without this we'd be searching from the last root key first
-                
-        else: #The user pressed find next.
-            #create the stack with only the keys we haven't searched yet
-            gtk.gdk.threads_enter() #the function below requires the GUI gui_lock because it has to get info from the gtk data structures. But i'm not positive this gui_lock is needed
-            stack = self.fill_stack()
-            gtk.gdk.threads_leave()
-            
-        #stuff we need
-        model = self.regedit_window.keys_tree_view.get_model()
-        i = 999 #This is so we can print every x statements, to save CPU
-        
-        #Stuff simply to speed things up
-        search_keys = self.search_keys
-        search_values = self.search_values
-        search_data = self.search_data
-        #dot operations addresses are looked up at run time, so this saves us many lookups
-        gui_lock = gtk.gdk.threads_enter
-        gui_unlock = gtk.gdk.threads_leave
-        pipe_lock = self.pipe_manager.lock.acquire
-        pipe_unlock = self.pipe_manager.lock.release
-        append_to_key_store = self.regedit_window.keys_store.append
-        set_status = self.regedit_window.set_status
-        
-        while stack != []:
-            if self.explode:
-                return
-            
-            (key, key_iter) = stack.pop()
-            
-            #For the sake of about 8% faster search, we only display a message every few values
-            if (i >= 5):
-                i = 0
-                gui_lock()
-                set_status("Searching %s." % key.get_absolute_path())
-                gui_unlock()
-            else:
-                i += 1
-            
-            #check if this key's name matches any of our search queries
-            if (search_keys):
-                for text in search_items:
-                    if (key.name.find(text) >= 0): #find() returns the index, so anything greater than -1 means found
-                        gui_lock()
-                        self.regedit_window.highlight_search_result(key_iter)
-                        msg = "Found key at: %s." % key.get_absolute_path()
-                        self.regedit_window.set_status(msg)
-                        self.regedit_window.search_thread = None
-                        gui_unlock()
-                        return
-            
-            #fetch a list of values for this key
-            if (search_values or search_data):
-                pipe_lock()
-                try:
-                    value_list = self.pipe_manager.get_values_for_key(key)
-                except RuntimeError as ex:
-                    #probably a WERR_ACCESS_DENIED exception. We'll just skip over keys that can't be fetched
-                    print "Failed to fetch values for %s: %s." % (key.get_absolute_path(), ex.args[1])
-                    continue
-                finally:
-                    pipe_unlock()
-                            
-            #Search values' names
-            if (search_values):
-               for value in value_list: #go through every value for this key
-                   for text in search_items: #and check those values for each search string
-                        if (value.name.find(text) >= 0): #check if it's in the value's name
-                            gui_lock()
-                            self.regedit_window.refresh_values_tree_view(value_list) #Fill in the values, we'll need this to hightlight the result
-                            value_iter = self.regedit_window.get_iter_for_value(value)
-                            self.regedit_window.highlight_search_result(key_iter, value_iter)
-                            msg = "Found value at: %s." % value.get_absolute_path()
-                            self.regedit_window.set_status(msg)
-                            self.regedit_window.search_thread = None
-                            gui_unlock()
-                            return
-                        
-            #search values' data
-            if (search_data):
-               for value in value_list: #go through every value for this key
-                   for text in search_items: #and check those values for each search string
-                        if (value.get_data_string().find(text) >= 0): #check if it's in the value's data
-                            gui_lock()
-                            self.regedit_window.refresh_values_tree_view(value_list) #Fill in the values, we'll need this to hightlight the result
-                            value_iter = self.regedit_window.get_iter_for_value(value)
-                            self.regedit_window.highlight_search_result(key_iter, value_iter)
-                            msg = "Found data at: %s." % value.get_absolute_path()
-                            self.regedit_window.set_status(msg)
-                            self.regedit_window.search_thread = None
-                            gui_unlock()
-                            return
-                            
-                
-            #fetch a list of subkeys for this key and append to the stack
-            append_list = []
-            gui_lock()
-            subkey_iter = model.iter_children(key_iter)
-            if subkey_iter != None: #if the subkeys already exist in the tree view
-                while subkey_iter != None:
-                    append_list.append((model.get_value(subkey_iter, 1), subkey_iter, ))
-                    subkey_iter = model.iter_next(subkey_iter)
-                gui_unlock()
-            else: #If we don't already have them, we have to get them
-                gui_unlock()
-                try: 
-                    pipe_lock()
-                    subkey_list = self.pipe_manager.get_subkeys_for_key(key)
-                except RuntimeError as re:
-                    #probably a WERR_ACCESS_DENIED exception. We'll just skip over keys that can't be fetched
-                    print "Failed to fetch subkeys for %s: %s." % (key.get_absolute_path(), re.args[1])
-                    continue
-                finally:
-                    pipe_unlock()
-                    
-                #Append these keys to the parent in the TreeStore.
-                #Since we're fetching them we might as well add them to the TreeStore so that we don't have to fetch them again later
-                gui_lock()
-                #key_iter = self.regedit_window.get_iter_for_key(key)
-                for current_key in subkey_list:
-                    child_iter = append_to_key_store(key_iter, current_key.list_view_representation())
-                    append_list.append((current_key, child_iter, ))
-                gui_unlock()
-                
-            append_list.reverse() #again we have to do this or else we'll search the list from bottom to top
-            stack.extend(append_list)
+        self.status_counts = {}
+        self.start_time = time.time()
+        self.finished = False
     
-        #if we are here then the loop has finished and found nothing
-        msg = "Search query not found."
-        if self.match_whole_string: msg += "\n\nConsider searching again with 'Match whole string' unchecked"
-        gtk.gdk.threads_enter()
-        self.regedit_window.search_thread = None
-        self.regedit_window.run_message_dialog(gtk.MESSAGE_INFO, gtk.BUTTONS_OK, msg)
-        gtk.gdk.threads_leave()
+    def run(self):
+        self.regedit_window.progress_channel.repeat(self.on_stats_tick)
         
-    def fill_stack(self): 
-        """Fills the stack with the keys we need to search. This only gets called to create the stack when the user presses 'find next'.
-        NOTE: This function requires the gdk lock. Make sure you hold the lock before calling this function."""
-        model = self.regedit_window.keys_tree_view.get_model()
-        key = model.get_value(self.starting_key_iter, 1)
-        root_key = key.get_root_key()
-        stack = []
+        self.start_time = time.time()
+        self.query.run()
         
-        self.pipe_manager.lock.acquire()
-        well_known_keys = self.pipe_manager.well_known_keys
-        self.pipe_manager.lock.release()
+        self.finished = True
+        self.regedit_window.progress_channel.post(self, self.update_stats)
+    
+    def on_result(self, result):
+        self.regedit_window.progress_channel.append(self, self.add_results, result)
+    
+    def add_results(self, result_list):
+        """NOTE: This function requires the gdk lock."""
+        for result in result_list:
+            self.status_counts[result.status] = self.status_counts.get(result.status, 0) + 1
+        self.results_window.add_results(result_list)
+    
+    def on_stats_tick(self):
+        if (self.finished):
+            return False
         
-        #we need to add all keys below the current root key into the stack
-        for n in range(len(well_known_keys)):
-            if well_known_keys[n].name == root_key.name: #so our root key is the nth key.
-                break
-        n += 1 #we don't want to add the current root key to the stack
-        append_list = []
-        while n < len(well_known_keys):
-            append_list.append((well_known_keys[n], self.regedit_window.get_iter_for_key(well_known_keys[n]) ,))
-            n += 1
-        append_list.reverse()
-        stack.extend(append_list)
-        
-        iter_parents = [] #no parents, WOOHOO!
-        iter_current_parent = self.starting_key_iter #yes, we consider the current key a parent also
-        
-        #Here we add all ancestors of self.starting_key_iter (the selected key) to key_parents and iter_parents
-        while iter_current_parent != None:
-            #we'll add each child_iter's iter_current_parent to the key_parents list until we get to the root
-            iter_parents.append(iter_current_parent)
-            iter_current_parent = model.iter_parent(iter_current_parent)
-        
-        iter_parents.reverse()
-        for parent_iter in iter_parents:
-            iter = model.iter_next(parent_iter) #This will point to the key right after the parent key of our last search result
-            append_list = []
-            while (iter != None):
-                append_list.append((model.get_value(iter, 1), iter, ))
-                iter = model.iter_next(iter)
-            append_list.reverse()
-            stack.extend(append_list)
-        
-        #Can't forget to add the starting key's children
-        key_iter = model.iter_children(self.starting_key_iter)
-        append_list = []
-        while key_iter != None:
-            append_list.append((model.get_value(key_iter, 1), key_iter, ))
-            key_iter = model.iter_next(key_iter)
-        append_list.reverse()
-        stack.extend(append_list)
-
-        return stack
+        self.update_stats()
+        return True
+    
+    def update_stats(self):
+        """NOTE: This function requires the gdk lock."""
+        done = sum(self.status_counts.values())
+        elapsed = max(time.time() - self.start_time, 0.001)
+        stats = "%d of %d servers (%.1f/sec)" % (done, len(self.query.hosts), done / elapsed)
+        for status in ["ok", "not found", "error", "timed out"]:
+            if (self.status_counts.has_key(status)):
+                stats += ", %d %s" % (self.status_counts[status], status)
+        stats += "."
+        
+        if (not self.finished):
+            self.results_window.set_stats(stats)
+            return
         
+        self.regedit_window.report_threads.discard(self)
+        if (self.explode):
+            self.results_window.set_stats("Stopped. " + stats)
+        else:
+            self.results_window.set_stats("Done. " + stats)
+            self.regedit_window.set_status("Query finished, %d servers answered." % (self.status_counts.get("ok", 0) + self.status_counts.get("not found", 0)))
+        self.results_window.set_finished()
+    
     def self_destruct(self):
-        """This function will only stop the thread, it will not clean up anything or display anything to the user.
-        This way the calling thread can do it and it's guaranteed to happen right away."""
-        #this probably isn't safe. But who cares, we're killing the thread anyways
+        """Stops the query. Servers that haven't answered yet aren't listed."""
         self.explode = True
+        self.query.cancel()
 
 
 class RegEditWindow(gtk.Window):
 
-    def __init__(self, info_callback = None, server = "", username = "", password = "", transport_type = 0, connect_now = False):
+    def __init__(self, info_callback = None, server = "", username = "", password = "", transport_type = 0, connect_now = False, path = ""):
         super(RegEditWindow, self).__init__()
         #Note: Any change to these arguments should probably also be changed in on_connect_item_activate()
         
         self.create()
         self.pipe_manager = None
+        self.search_pipe_managers = [] #extra pipes for the search engine, opened when a search needs them
+        self.pipe_managers_lock = threading.Lock() #for search_pipe_managers, which background threads add to
+        self.requested_values = set() #values in the values pane that we're fetching the data for
+        self.value_iters = {} #maps the names of the values in the values pane to their rows
+        self.progress_channel = ProgressChannel() #status updates from the worker threads
+        self.progress_channel.start()
+        self.use_tree_cache = RegistryTreeCache.is_available()
         self.search_thread = None
         self.search_last_options = None
+        self.search_cursor = None #where find next carries on from
+        self.search_cursor_key_path = None #lower case path of the key the last search stopped at
+        self.search_index = None #a RegistryIndex for the server, opened when it's first needed
+        self.index_data = True #False means value data is kept out of the search index
+        self.index_thread = None
+        self.export_thread = None
+        self.import_thread = None
+        self.delete_thread = None
+        self.move_thread = None
+        self.report_threads = set() #the running comparisons, usage counts and queries, only changed with the gdk lock held
+        self.diff_remembered = {} #(server, username): the keys comparisons have listed there, see LiveSource
         self.ignore_selection_change = False
         self.update_sensitivity()
         
@@ -717,6 +1309,9 @@ class RegEditWindow(gtk.Window):
         
         self.on_connect_item_activate(None, server, transport_type, username, password, connect_now)
         
+        if (path and self.connected()):
+            self.go_to_path(path)
+        
         #This is used so the parent program can grab the server info after we've connected.
         if info_callback != None:
             info_callback(server = self.server_address, username = self.username, transport_type = self.transport_type)
@@ -737,6 +1332,15 @@ class RegEditWindow(gtk.Window):
         self.icon_registry_number_pixbuf = gtk.gdk.pixbuf_new_from_file_at_size(self.icon_registry_number_filename, 22, 22)
         self.icon_registry_string_pixbuf = gtk.gdk.pixbuf_new_from_file_at_size(self.icon_registry_string_filename, 22, 22)
         self.icon_registry_binary_pixbuf = gtk.gdk.pixbuf_new_from_file_at_size(self.icon_registry_binary_filename, 22, 22)
+        self.value_type_pixbufs = { #change misc back to winreg when the constants are in the right place
+                                   misc.REG_SZ:self.icon_registry_string_pixbuf,
+                                   misc.REG_EXPAND_SZ:self.icon_registry_string_pixbuf,
+                                   misc.REG_BINARY:self.icon_registry_binary_pixbuf,
+                                   misc.REG_DWORD:self.icon_registry_number_pixbuf,
+                                   misc.REG_DWORD_BIG_ENDIAN:self.icon_registry_number_pixbuf,
+                                   misc.REG_MULTI_SZ:self.icon_registry_string_pixbuf,
+                                   misc.REG_QWORD:self.icon_registry_number_pixbuf,
+                                   }
 
         self.set_icon(self.icon_pixbuf)
         
@@ -766,11 +1370,10 @@ class RegEditWindow(gtk.Window):
         file_menu.add(menu_separator_item)
         
         self.import_item = gtk.MenuItem("_Import...", accel_group)
-        # TODO: implement import & export
-        #file_menu.add(self.import_item) 
+        file_menu.add(self.import_item)
         
         self.export_item = gtk.MenuItem("_Export...", accel_group)
-        #file_menu.add(self.export_item)
+        file_menu.add(self.export_item)
         
 #        menu_separator_item = gtk.SeparatorMenuItem()
 #        file_menu.add(menu_separator_item)
@@ -837,6 +1440,9 @@ class RegEditWindow(gtk.Window):
         self.copy_item = gtk.MenuItem("_Copy Registry Path", accel_group)
         self.edit_menu.add(self.copy_item)
 
+        self.go_to_path_item = gtk.MenuItem("_Go to Path...", accel_group)
+        self.edit_menu.add(self.go_to_path_item)
+
         self.edit_menu.add(gtk.SeparatorMenuItem())
 
         self.find_item = gtk.ImageMenuItem(gtk.STOCK_FIND, accel_group)
@@ -846,6 +1452,36 @@ class RegEditWindow(gtk.Window):
         self.find_next_item = gtk.MenuItem("Find _Next", accel_group)
         self.edit_menu.add(self.find_next_item)
 
+        self.find_all_item = gtk.MenuItem("Find _All...", accel_group)
+        self.edit_menu.add(self.find_all_item)
+
+        self.save_search_item = gtk.MenuItem("_Save Search Position...", accel_group)
+        self.edit_menu.add(self.save_search_item)
+
+        self.resume_search_item = gtk.MenuItem("_Resume Saved Search...", accel_group)
+        self.edit_menu.add(self.resume_search_item)
+
+        self.update_index_item = gtk.MenuItem("Update Search _Index", accel_group)
+        self.update_index_item.set_tooltip_text("Go through the whole registry and remember it, so searches can use the index")
+        self.edit_menu.add(self.update_index_item)
+
+        self.index_data_item = gtk.CheckMenuItem("Index Value _Data")
+        self.index_data_item.set_tooltip_text("Keep value data in the search index so it can be searched. Turn this off to keep passwords and the like out of it")
+        self.index_data_item.set_active(True)
+        self.edit_menu.add(self.index_data_item)
+
+        self.compare_item = gtk.MenuItem("_Compare With...", accel_group)
+        self.compare_item.set_tooltip_text("List the differences between a key and the same key on another server or in an export")
+        self.edit_menu.add(self.compare_item)
+        
+        self.usage_item = gtk.MenuItem("Key Si_zes...", accel_group)
+        self.usage_item.set_tooltip_text("Find out which keys below the selected key have the most subkeys, values and data")
+        self.edit_menu.add(self.usage_item)
+        
+        self.query_item = gtk.MenuItem("_Query Many Servers...", accel_group)
+        self.query_item.set_tooltip_text("Get a key or value from a list of servers")
+        self.edit_menu.add(self.query_item)
+
         self.view_item = gtk.MenuItem("_View")
         self.menubar.add(self.view_item)
         
@@ -855,6 +1491,11 @@ class RegEditWindow(gtk.Window):
         self.refresh_item = gtk.ImageMenuItem(gtk.STOCK_REFRESH, accel_group)
         view_menu.add(self.refresh_item)
 
+        self.tree_cache_item = gtk.CheckMenuItem("_Remember Keys Between Sessions")
+        self.tree_cache_item.set_active(RegistryTreeCache.is_available())
+        self.tree_cache_item.set_sensitive(RegistryTreeCache.is_available())
+        view_menu.add(self.tree_cache_item)
+
         self.help_item = gtk.MenuItem("_Help")
         self.menubar.add(self.help_item)
 
@@ -929,6 +1570,7 @@ class RegEditWindow(gtk.Window):
         renderer = gtk.CellRendererPixbuf()
         renderer.set_property("stock-id", gtk.STOCK_DIRECTORY)
         column.pack_start(renderer, True)
+        column.set_cell_data_func(renderer, self.key_icon_data_func)
         self.keys_tree_view.append_column(column)
 
         column = gtk.TreeViewColumn()
@@ -938,7 +1580,7 @@ class RegEditWindow(gtk.Window):
         self.keys_tree_view.append_column(column)
         column.add_attribute(renderer, "text", 0)
 
-        self.keys_store = gtk.TreeStore(gobject.TYPE_STRING, gobject.TYPE_PYOBJECT)
+        self.keys_store = RegistryKeyTreeModel()
         self.keys_tree_view.set_model(self.keys_store)
         
         
@@ -1040,9 +1682,19 @@ class RegEditWindow(gtk.Window):
         self.delete_item.connect("activate", self.on_delete_item_activate)
         self.rename_item.connect("activate", self.on_rename_item_activate)
         self.copy_item.connect("activate", self.on_copy_item_activate)
+        self.go_to_path_item.connect("activate", self.on_go_to_path_item_activate)
         self.find_item.connect("activate", self.on_find_item_activate)
         self.find_next_item.connect("activate", self.on_find_next_item_activate)
+        self.find_all_item.connect("activate", self.on_find_all_item_activate)
+        self.save_search_item.connect("activate", self.on_save_search_item_activate)
+        self.resume_search_item.connect("activate", self.on_resume_search_item_activate)
+        self.update_index_item.connect("activate", self.on_update_index_item_activate)
+        self.index_data_item.connect("toggled", self.on_index_data_item_toggled)
+        self.compare_item.connect("activate", self.on_compare_item_activate)
+        self.usage_item.connect("activate", self.on_usage_item_activate)
+        self.query_item.connect("activate", self.on_query_item_activate)
         self.refresh_item.connect("activate", self.on_refresh_item_activate)
+        self.tree_cache_item.connect("toggled", self.on_tree_cache_item_toggled)
         self.about_item.connect("activate", self.on_about_item_activate)
 
         self.connect_button.connect("clicked", self.on_connect_item_activate)
@@ -1060,6 +1712,7 @@ class RegEditWindow(gtk.Window):
         self.values_tree_view.get_selection().connect("changed", self.on_values_tree_view_selection_changed)
         self.values_tree_view.connect("button_press_event", self.on_values_tree_view_button_press)
         self.values_tree_view.connect("focus-in-event", self.on_tree_views_focus_in)
+        self.values_tree_view.get_vadjustment().connect("value-changed", self.on_values_tree_view_scrolled)
         
         self.add_accel_group(accel_group)
 
@@ -1078,16 +1731,15 @@ class RegEditWindow(gtk.Window):
             self.pipe_manager.lock.acquire()
             well_known_keys = self.pipe_manager.well_known_keys
             self.pipe_manager.lock.release()
-            for key in well_known_keys:
-                self.keys_store.append(None, key.list_view_representation())
+            self.keys_store.set_children(None, well_known_keys)
 
         else:
-            #Delete any children the selected key has
-            while (self.keys_store.iter_children(iter)):
-                self.keys_store.remove(self.keys_store.iter_children(iter))
-            #add keys from key_list as children.
-            for key in key_list:
-                self.keys_store.append(iter, key.list_view_representation())
+            #the tree view does work for every row that's added below an expanded row, it's much quicker to
+            #replace the children while the row is collapsed and lay them out in one go when it's expanded again
+            path = self.keys_store.get_path(iter)
+            if (self.keys_tree_view.row_expanded(path)):
+                self.keys_tree_view.collapse_row(path)
+            self.keys_store.set_children(iter, key_list)
 
         if (iter != None):
             #expand the selected row
@@ -1119,35 +1771,94 @@ class RegEditWindow(gtk.Window):
         #self.keys_tree_view.columns_autosize() #This doesn't really help, it just slows down long lists
         self.update_sensitivity()
         
+    def key_icon_data_func(self, column, renderer, model, iter):
+        renderer.set_property("visible", model.get_value(iter, 1) != None) #no folder for the "Loading..." row
+        
+    def update_keys_tree_view(self, iter, key_list):
+        """Makes the children of 'iter' match 'key_list' without rebuilding them. Rows of keys that are still in 'key_list' are kept
+        (along with their children and whether they're expanded), rows of keys that are gone are removed and new keys are inserted in order.
+        Where a row matches a key in 'key_list' by name, the row keeps its own key and 'key_list' is changed to hold that key instead.
+        NOTE: This function requires the gdk lock."""
+        self.keys_store.update_children(iter, key_list)
+        
+    def get_expanded_rows(self):
+        """Gets every expanded key in the keys tree view, parents before their children.
+        NOTE: This function requires the gdk lock.
+        
+        returns a list of (RegistryKey, gtk.TreeRowReference)"""
+        rows = []
+        
+        stack = []
+        iter = self.keys_store.get_iter_first()
+        while (iter != None):
+            stack.append(iter)
+            iter = self.keys_store.iter_next(iter)
+        stack.reverse()
+        
+        while (len(stack) > 0):
+            iter = stack.pop()
+            path = self.keys_store.get_path(iter)
+            if (not self.keys_tree_view.row_expanded(path)):
+                continue
+            
+            rows.append((self.keys_store.get_value(iter, 1), gtk.TreeRowReference(self.keys_store, path)))
+            
+            children = []
+            child_iter = self.keys_store.iter_children(iter)
+            while (child_iter != None):
+                children.append(child_iter)
+                child_iter = self.keys_store.iter_next(child_iter)
+            children.reverse()
+            stack.extend(children)
+        
+        return rows
+    
     def refresh_values_tree_view(self, value_list):
+        """Makes the values pane show the values in 'value_list'. Only the rows of values that were added, removed or changed
+        are touched, so the selection stays where it is and the data strings of the rest aren't worked out again.
+        Where a row's value hasn't changed, the row keeps its own value and 'value_list' is changed to hold that value instead."""
         if (not self.connected()):
             return
         
-        type_pixbufs = { #change misc back to winreg when the constants are in the right place
-                        misc.REG_SZ:self.icon_registry_string_pixbuf,
-                        misc.REG_EXPAND_SZ:self.icon_registry_string_pixbuf,
-                        misc.REG_BINARY:self.icon_registry_binary_pixbuf,
-                        misc.REG_DWORD:self.icon_registry_number_pixbuf,
-                        misc.REG_DWORD_BIG_ENDIAN:self.icon_registry_number_pixbuf,
-                        misc.REG_MULTI_SZ:self.icon_registry_string_pixbuf,
-                        misc.REG_QWORD:self.icon_registry_number_pixbuf,
-                        }
-        
         (model, selected_paths) = self.values_tree_view.get_selection().get_selected_rows()
-
-        self.values_store.clear()
         
-        for value in value_list:
-            try: #This can fail when we get a value of a type that isn't in type_pixbufs (such as REG_NONE)
-                self.values_store.append([type_pixbufs[value.type]] + value.list_view_representation())
-            except (KeyError, IndexError, ) as er:
+        names = set([value.name for value in value_list])
+        gone_names = [name for name in self.value_iters.keys() if name not in names]
+        if (len(gone_names) == len(self.value_iters)): #usually another key, there's nothing to keep
+            self.values_store.clear()
+            self.value_iters.clear()
+        else:
+            for name in gone_names:
+                self.values_store.remove(self.value_iters.pop(name))
+        
+        for (index, value) in enumerate(value_list):
+            pixbuf = self.value_type_pixbufs.get(value.type)
+            if (pixbuf == None):
                 #TODO: handle REG_NONE types better.
                 if value.type == misc.REG_NONE: 
                     print "Not displaying a hidden value at %s." % (value.get_absolute_path())
                 else:
                     print "Failed to display %s in the value tree: values of type %s cannot be handled." % (value.get_absolute_path(), str(value.type))
+                if (self.value_iters.has_key(value.name)): #it had another type before
+                    self.values_store.remove(self.value_iters.pop(value.name))
+                continue
+            
+            iter = self.value_iters.get(value.name)
+            if (iter == None):
+                self.value_iters[value.name] = self.values_store.append([pixbuf] + value.list_view_representation())
+                continue
+            
+            old_value = self.values_store.get_value(iter, 4)
+            if (self.is_value_unchanged(old_value, value)):
+                value_list[index] = old_value
+            else:
+                self.values_store.set_row(iter, [pixbuf] + value.list_view_representation())
+        
+        #the values are listed by name only, their data is fetched once the rows have been laid out and we know which ones are visible
+        self.requested_values.intersection_update(value_list) #fetches for rows we kept carry on
+        gobject.idle_add(self.on_values_idle)
                     
-        if (len(selected_paths) > 0):
+        if (len(selected_paths) > 0 and self.get_selected_registry_value()[1] == None): #the selected value has gone
             try:
                 sel_iter = self.values_store.get_iter(selected_paths[0])
                 self.values_tree_view.get_selection().select_iter(sel_iter)
@@ -1161,6 +1872,99 @@ class RegEditWindow(gtk.Window):
         
         self.update_sensitivity()
 
+    def is_value_unchanged(self, old_value, value):
+        """returns True if the row showing 'old_value' can show 'value' as it is"""
+        if (old_value is value):
+            return True
+        if (old_value.parent is not value.parent or old_value.type != value.type): #a value with the same name in another key isn't the same value
+            return False
+        if (value.data_loaded):
+            return (old_value.data_loaded and old_value.data == value.data)
+        #we don't know what the data is, the row is only right if it doesn't show any either
+        return (not old_value.data_loaded and old_value.data_size == value.data_size)
+    
+    def fetch_visible_value_data(self):
+        """Starts fetching the data of the values that are visible in the values pane and haven't been fetched yet.
+        NOTE: This function requires the gdk lock."""
+        if (not self.connected()):
+            return
+        
+        visible_range = self.values_tree_view.get_visible_range()
+        if (visible_range == None):
+            return
+        
+        (start_path, end_path) = visible_range
+        value_list = []
+        for index in xrange(start_path[0], end_path[0] + 1):
+            value = self.values_store[index][4]
+            if (not value.data_loaded and value not in self.requested_values):
+                value_list.append(value)
+        
+        if (len(value_list) > 0):
+            self.requested_values.update(value_list)
+            ValueDataFetchThread(self.pipe_manager, self, value_list).start()
+        
+    def update_value_rows(self, value_list):
+        """Shows the data of values that has just been fetched.
+        NOTE: This function requires the gdk lock."""
+        for value in value_list:
+            iter = self.value_iters.get(value.name)
+            if (iter != None and self.values_store.get_value(iter, 4) is value):
+                self.values_store.set_value(iter, 3, value.get_data_string())
+            self.requested_values.discard(value)
+        
+        self.update_sensitivity()
+        
+    def load_value_data(self, value, callback):
+        """Makes sure the data of 'value' has been fetched before 'callback' is called with it, since the values pane only lists
+        names until the rows are visible. The data is fetched by the worker of the main pipe and 'callback' is called from the
+        main loop once it's there. If it can't be fetched the user is told and 'callback' isn't called."""
+        if (value == None):
+            return
+        if (value.data_loaded):
+            callback(value)
+            return
+        
+        self.set_status("Fetching the data of %s." % (value.get_absolute_path()))
+        self.submit_pipe_request(self.fetch_value_data_on_pipe, (self.pipe_manager, value), 
+                                 lambda request: self.on_value_data_loaded(request, value, callback))
+    
+    def fetch_value_data_on_pipe(self, pipe_manager, value):
+        """Called by the pipe worker, see load_value_data()."""
+        pipe_manager.lock.acquire()
+        try:
+            pipe_manager.fetch_value_data([value])
+        finally:
+            pipe_manager.lock.release()
+        
+        if (not value.data_loaded):
+            raise ValueError("it's gone")
+    
+    def on_value_data_loaded(self, request, value, callback):
+        try:
+            request.wait() #it's done, so this doesn't block
+        except RuntimeError as re:
+            self.show_pipe_error("Failed to fetch the data of %s: %s." % (value.get_absolute_path(), re.args[-1]))
+            return
+        except Exception as ex:
+            self.show_pipe_error("Failed to fetch the data of %s: %s." % (value.get_absolute_path(), str(ex)))
+            return
+        
+        self.update_value_rows([value])
+        self.set_status("Selected path \'%s\'." % (value.get_absolute_path()))
+        callback(value)
+    
+    def show_pipe_error(self, msg):
+        """Tells the user about a call that the pipe worker made for us and that failed.
+        NOTE: This function requires the gdk lock."""
+        print msg
+        self.set_status(msg)
+        self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
+    
+    def get_listed_value_names(self, key):
+        """returns the lower case names of the values of 'key' in the values pane, which may be none if another key's values are shown"""
+        return [name.lower() for (name, iter) in self.value_iters.items() if self.values_store.get_value(iter, 4).parent is key]
+        
     def get_selected_registry_key(self):
         """Get the registry key that is currently selected in the tree view. Also returns the iter for that key in the tree view
         
@@ -1188,60 +1992,75 @@ class RegEditWindow(gtk.Window):
             return (iter, model.get_value(iter, 4))
         
     def get_iter_for_value(self, value):
-        """This function takes a value and gets the iterator for that value in the gtk.TreeStore.
+        """This function takes a value and gets the iterator for that value in the values pane.
         
         Returns an iterator or None"""
         if not self.connected():
             return
         
-        model = self.values_tree_view.get_model()
-        iter = model.get_iter_first()
-        while iter != None:
-            current_value = model.get_value(iter, 4)
-            if (current_value.name == value.name):
-                return iter
-            iter = model.iter_next(iter)
-        return None
+        return self.value_iters.get(value.name)
     
     def get_iter_for_key(self, key):
-        """This function takes a key and gets the iterator for that key in the gtk.TreeStore.
-        Note: this function is SLOW. Only call this function if you cannot figure out a better method.
+        """This function takes a key and gets the iterator for that key in the keys tree, if the key and all its ancestors are in the tree.
         
         Returns an iterator or None"""
         if not self.connected():
             return
         
-        model = self.keys_tree_view.get_model()
-        path = key.get_absolute_path()
+        iter = None
+        for name in key.get_absolute_path().split("\\"):
+            iter = self.keys_store.find_child(iter, name)
+            if (iter == None):
+                return None
         
-        key_names = path.split("\\")
+        return iter
+
+    def get_child_iter_by_name(self, parent_iter, name):
+        """Gets the iterator for the child of 'parent_iter' called 'name'. Names are compared case insensitively, like the registry does.
+        If 'parent_iter' is None then the root keys are searched.
         
-        model = self.keys_tree_view.get_model()
-        current_key_iter = model.get_iter_first() #get iter to the first root node
-        
-        step = 0 #currently checking this index in key_names
-        while (current_key_iter != None):
-            current_key = model.get_value(current_key_iter, 1)
-            if current_key.name == key_names[step]:
-                if (step >= len(key_names) - 1): #if this is the last step then we've found the key! (cue audio from Zelda)
-                    return current_key_iter
-                current_key_iter = model.iter_children(current_key_iter) #step to the decendant, start itering their children (that sounds wrong...)
-                step += 1
-            else:
-                current_key_iter = model.iter_next(current_key_iter)
-            
-        return None
+        Returns an iterator or None"""
+        return self.keys_store.find_child(parent_iter, name)
+
+    def go_to_path(self, path):
+        """Selects the key at 'path' (for example 'HKLM\\SOFTWARE\\Microsoft'), fetching whatever is needed in the background."""
+        if not self.connected():
+            return
+        
+        self.set_status("Opening %s." % (path))
+        GoToPathThread(self.pipe_manager, self, path).start()
 
     def set_status(self, message):
+        self.progress_channel.discard("status") #anything a thread posted before now is out of date
         self.statusbar.pop(0)
         self.statusbar.push(0, message)
+    
+    def post_status(self, function, *args):
+        """Makes 'function' get called with 'args' from the main loop to show progress in the status bar, see ProgressChannel.
+        Only the latest one is called if there are several before the channel is drained. This can be called from any thread."""
+        self.progress_channel.post("status", function, *args)
+    
+    def on_ls_key_progress(self, key, index, count, subkey):
+        """Progress callback for WinRegPipeManager.ls_key(), it's called from the thread doing the listing.
+        It doesn't take the gdk lock, the progress is shown when the progress channel is next drained."""
+        if (subkey == None):
+            self.post_status(self.set_status, "Successfully fetched keys and values of %s." % (key.name))
+            self.progress_channel.post("progressbar", self.progressbar.hide)
+        else:
+            self.post_status(self.set_status, "Fetching key: %s" % (subkey.name))
+            if (index < count): #subkeys may have been added since we asked, this would cause a GtkWarning for setting fraction to a value above 1.0
+                self.progress_channel.post("progressbar", self.show_progress, float(index) / count)
+    
+    def show_progress(self, fraction):
+        self.progressbar.set_fraction(fraction)
+        self.progressbar.show() #other threads listing keys may finish and hide the progress bar.
 
     def update_sensitivity(self):
         connected = self.connected()
         
         key_selected = (self.get_selected_registry_key()[1] != None)
         value_selected = (self.get_selected_registry_value()[1] != None)
-        value_set = (value_selected and len(self.get_selected_registry_value()[1].data) > 0)
+        value_set = (value_selected and self.get_selected_registry_value()[1].get_data_size() > 0)
         value_default = (value_selected and self.get_selected_registry_value()[1].name == "(Default)")
         key_focused = self.keys_tree_view.is_focus()
         if (connected):
@@ -1252,7 +2071,7 @@ class RegEditWindow(gtk.Window):
         self.connect_item.set_sensitive(not connected)
         self.disconnect_item.set_sensitive(connected)
         self.import_item.set_sensitive(connected)
-        self.export_item.set_sensitive(connected)
+        self.export_item.set_sensitive(connected and key_selected)
         self.modify_item.set_sensitive(connected and value_selected)
         self.modify_binary_item.set_sensitive(connected and value_selected)
         self.new_key_item.set_sensitive(connected and key_selected)
@@ -1269,8 +2088,15 @@ class RegEditWindow(gtk.Window):
             self.delete_item.set_sensitive(connected and value_selected and (value_set or not value_default))
             self.rename_item.set_sensitive(connected and value_selected and not value_default)
         self.copy_item.set_sensitive(connected and key_selected)
+        self.go_to_path_item.set_sensitive(connected)
         self.find_item.set_sensitive(connected)
         self.find_next_item.set_sensitive(connected)
+        self.find_all_item.set_sensitive(connected)
+        self.save_search_item.set_sensitive(self.search_cursor != None)
+        self.resume_search_item.set_sensitive(connected)
+        self.update_index_item.set_sensitive(connected and RegistryIndex.is_available())
+        self.compare_item.set_sensitive(connected)
+        self.usage_item.set_sensitive(connected)
         self.refresh_item.set_sensitive(connected)
 
         self.connect_button.set_sensitive(self.connect_item.state != gtk.STATE_INSENSITIVE)
@@ -1401,7 +2227,8 @@ class RegEditWindow(gtk.Window):
         else:
             return dialog.reg_key
    
-    def run_connect_dialog(self, pipe_manager, server_address, transport_type, username, password = "", connect_now = False):
+    def run_connect_dialog(self, pipe_manager, server_address, transport_type, username, password = "", connect_now = False, remember = True):
+        """'remember' is False when we're connecting to a second server, then the window keeps the details of the first one."""
         dialog = WinRegConnectDialog(server_address, transport_type, username, password)
         dialog.show_all()
         
@@ -1419,12 +2246,13 @@ class RegEditWindow(gtk.Window):
             else:
                 try:
                     server_address = dialog.get_server_address()
-                    self.server_address = server_address
                     transport_type = dialog.get_transport_type()
-                    self.transport_type = transport_type
                     username = dialog.get_username()
-                    self.username = username
                     password = dialog.get_password()
+                    if (remember):
+                        self.server_address = server_address
+                        self.transport_type = transport_type
+                        self.username = username
                     
                     pipe_manager = WinRegPipeManager(server_address, transport_type, username, password)
                     
@@ -1464,15 +2292,16 @@ class RegEditWindow(gtk.Window):
         dialog.hide()
         return pipe_manager
     
-    def run_search_dialog(self):
-        dialog = RegSearchDialog()
+    def run_search_dialog(self, find_all = False):
+        index_available = (RegistryIndex.is_available() and RegistryIndex.exists(self.server_address, self.username))
+        dialog = RegSearchDialog(find_all, index_available)
         dialog.show_all()
         
         # loop to handle the applies
         while True:
             response_id = dialog.run()
             
-            if (response_id == gtk.RESPONSE_OK): #the search button returns RESPONSE_OK
+            if (response_id in [gtk.RESPONSE_OK, RegSearchDialog.RESPONSE_FIND_ALL]): #the search button returns RESPONSE_OK
                 problem_msg = dialog.check_for_problems()
                 if (problem_msg != None):
                     self.run_message_dialog(problem_msg[1], gtk.BUTTONS_OK, problem_msg[0])
@@ -1482,90 +2311,253 @@ class RegEditWindow(gtk.Window):
             else:
                 dialog.hide()
                 return
-        #this isn't very elegant, but conforms with the way other dialogs are done here
-        return (dialog.search_entry.get_text(), 
-                dialog.check_match_keys.get_active(), 
-                dialog.check_match_values.get_active(), 
-                dialog.check_match_data.get_active(),
-                dialog.check_match_whole_string.get_active())
+        return dialog.get_search_options(response_id == RegSearchDialog.RESPONSE_FIND_ALL)
+    
+    def run_go_to_path_dialog(self, path = ""):
+        dialog = RegGoToPathDialog(path)
+        dialog.show_all()
+        
+        while True:
+            response_id = dialog.run()
+            
+            if (response_id == gtk.RESPONSE_OK):
+                problem_msg = dialog.check_for_problems()
+                if (problem_msg != None):
+                    self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, problem_msg, dialog)
+                else:
+                    dialog.hide()
+                    break
+            else:
+                dialog.hide()
+                return None
+        
+        return dialog.get_path()
+    
+    def run_compare_dialog(self, path = ""):
+        dialog = RegCompareDialog(path)
+        dialog.show_all()
+        
+        while True:
+            response_id = dialog.run()
+            
+            if (response_id == gtk.RESPONSE_OK):
+                problem_msg = dialog.check_for_problems()
+                if (problem_msg != None):
+                    self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, problem_msg, dialog)
+                else:
+                    dialog.hide()
+                    break
+            else:
+                dialog.hide()
+                return None
+        
+        return (dialog.get_path(), dialog.get_filename(), dialog.get_compare_times())
+    
+    def run_query_dialog(self, path = ""):
+        password = ""
+        if (self.connected()):
+            password = self.pipe_manager.password
+        dialog = RegQueryDialog(path, self.username, password)
+        dialog.show_all()
+        
+        while True:
+            response_id = dialog.run()
+            
+            if (response_id == gtk.RESPONSE_OK):
+                problem_msg = dialog.check_for_problems()
+                if (problem_msg != None):
+                    self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, problem_msg, dialog)
+                else:
+                    dialog.hide()
+                    break
+            else:
+                dialog.hide()
+                return None
+        
+        return RegistryMultiQuery(WinRegPipeManager, dialog.get_hosts(), dialog.get_path(), dialog.get_value_name(), 
+                                  dialog.get_username(), dialog.get_password(), self.transport_type, 
+                                  dialog.get_max_workers(), dialog.get_timeout())
     
     def connected(self):
         return self.pipe_manager != None
     
-    def update_value_callback(self, value):
-        (iter, selected_key) = self.get_selected_registry_key()
-        if (selected_key == None):
-            return False
-        
+    def submit_pipe_request(self, function, args, callback, priority = PRIORITY_INTERACTIVE):
+        """Has the worker of the main pipe call 'function' with 'args', and then calls 'callback' with the PipeRequest from the
+        main loop, with the gdk lock held. Nothing waits on the pipe, so the window stays responsive while the call is made.
+        The callback isn't called if we've disconnected in the meantime.
+        
+        returns the PipeRequest"""
+        pipe_manager = self.pipe_manager
+        return pipe_manager.get_worker().submit(function, args, priority, 
+                                                lambda request: gobject.idle_add(self.on_pipe_request_done, pipe_manager, callback, request))
+    
+    def on_pipe_request_done(self, pipe_manager, callback, request):
+        gtk.gdk.threads_enter()
         try:
-            self.pipe_manager.lock.acquire()
-            self.pipe_manager.set_value(value)
-            value_list = self.pipe_manager.get_values_for_key(selected_key)
-            
-            self.refresh_values_tree_view(value_list)
-            self.set_status("Value \'%s\' updated." % (value.get_absolute_path()))
-            return True
-        except RuntimeError, re:
-            msg = "Failed to update value: %s." % (re.args[1])
-            print msg
-            self.set_status(msg)
-            traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
-        except Exception, ex:
-            msg = "Failed to update value: %s." % (str(ex))
-            print msg
-            self.set_status(msg)
-            traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
+            if (self.pipe_manager is pipe_manager):
+                callback(request)
         finally:
-            self.pipe_manager.lock.release()    
-            
+            gtk.gdk.threads_leave()
+        
         return False
+    
+    def get_search_pipe_managers(self, count):
+        """Gets 'count' pipe managers for the search engine, opening more pipes to the server if needed.
+        The pipes are kept for the next search, until we disconnect.
+        NOTE: this function talks to the server, so it shouldn't be called from the main thread.
+        
+        returns a list of pipe managers"""
+        self.pipe_managers_lock.acquire()
+        try:
+            pipe_manager = self.pipe_manager
+            if (pipe_manager == None):
+                return []
             
-    def rename_key_callback(self, key):
+            self.search_pipe_managers.extend(self.clone_pipe_manager(pipe_manager, count - len(self.search_pipe_managers)))
+            if (len(self.search_pipe_managers) == 0): #we'll have to share
+                return [pipe_manager]
+            
+            return self.search_pipe_managers[:count]
+        finally:
+            self.pipe_managers_lock.release()
+    
+    def open_job_pipe_managers(self):
+        """Opens pipes of its own for a background job (indexing, exporting, importing, deleting, renaming...), as many as the
+        user last searched with. Jobs don't share their pipes, so two of them don't wait on each other, and disconnecting doesn't
+        close the pipes under a job that's still running. Give them back to close_job_pipe_managers() when the job is done.
+        NOTE: this function talks to the server, so it shouldn't be called from the main thread.
+        
+        returns a list of pipe managers"""
+        self.pipe_managers_lock.acquire()
+        try:
+            pipe_manager = self.pipe_manager
+            count = RegistrySearchOptions.default_pipe_count
+            if (self.search_last_options != None):
+                count = self.search_last_options.pipe_count
+        finally:
+            self.pipe_managers_lock.release()
+        
+        if (pipe_manager == None):
+            return []
+        
+        pipe_managers = self.clone_pipe_manager(pipe_manager, count)
+        if (len(pipe_managers) == 0): #we'll have to share
+            return [pipe_manager]
+        
+        return pipe_managers
+    
+    def close_job_pipe_managers(self, pipe_managers):
+        for pipe_manager in pipe_managers:
+            if (pipe_manager is not self.pipe_manager): #unless we had to share the main pipe
+                pipe_manager.close()
+    
+    def clone_pipe_manager(self, pipe_manager, count):
+        """returns a list of up to 'count' new pipe managers connected like 'pipe_manager', fewer if the server won't let us open them"""
+        pipe_managers = []
+        while (len(pipe_managers) < count):
+            try:
+                pipe_managers.append(pipe_manager.clone())
+            except RuntimeError as re:
+                print "Failed to open another pipe: %s." % (re.args[1])
+                break
+        
+        return pipe_managers
+    
+    def update_value_callback(self, value):
         (iter, selected_key) = self.get_selected_registry_key()
         if (selected_key == None):
             return False
         
-        if (key.name == key.old_name):
-            return True
-
-        #performance would be better if we released the lock between pipe manager calls, but that would make for very complex code - not worth it
-        self.pipe_manager.lock.acquire()
+        #the worker makes the call, we show the values again when it's done
+        self.set_status("Updating %s." % (value.get_absolute_path()))
+        self.submit_pipe_request(self.set_value_on_pipe, (self.pipe_manager, selected_key, value), 
+                                 lambda request: self.on_value_edited(request, selected_key, "update value", "Value \'%s\' updated." % (value.get_absolute_path())))
+        return True
+    
+    def set_value_on_pipe(self, pipe_manager, key, value, new = False):
+        """Called by the pipe worker to set 'value' in 'key'. If 'new' is True a value that's already there isn't overwritten.
+        
+        returns the values 'key' has now"""
+        pipe_manager.lock.acquire()
         try:
-            key_list = self.pipe_manager.get_subkeys_for_key(selected_key.parent)
-            
-            #check if a key with that name already exists
-            if (len([k for k in key_list if k.name == key.name]) > 0):
-                self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "This key already exists. Please choose another name.", self)
-                return False
-            
-            self.pipe_manager.move_key(key, key.old_name)
-            key_list = self.pipe_manager.get_subkeys_for_key(selected_key.parent)
+            if (new and value.name.lower() in [v.name.lower() for v in pipe_manager.get_values_for_key(key, False)]):
+                raise ValueError("This value already exists")
             
-            key.old_name = key.name
-            parent_iter = self.keys_store.iter_parent(iter)
-            self.refresh_keys_tree_view(parent_iter, key_list, key)
-            
-            self.set_status("Key \'%s\' renamed." % (key.get_absolute_path()))
-            return True
+            pipe_manager.set_value(value)
+            return pipe_manager.get_values_for_key(key, False)
+        finally:
+            pipe_manager.lock.release()
+    
+    def move_value_on_pipe(self, pipe_manager, key, value, old_name):
+        """Called by the pipe worker to rename the value 'old_name' of 'key' to the name of 'value'.
+        
+        returns the values 'key' has now"""
+        pipe_manager.lock.acquire()
+        try:
+            if (value.name.lower() != old_name.lower() and 
+                value.name.lower() in [v.name.lower() for v in pipe_manager.get_values_for_key(key, False)]):
+                raise ValueError("This value already exists")
             
-        except RuntimeError, re:
-            msg = "Failed to rename key: %s." % (re.args[1])
-            print msg
-            self.set_status(msg)
-            traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
-        except Exception, ex:
-            msg = "Failed to rename key: %s." % (str(ex))
-            print msg
-            self.set_status(msg)
-            traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
+            pipe_manager.move_value(value, old_name)
+            return pipe_manager.get_values_for_key(key, False)
         finally:
-            self.pipe_manager.lock.release()
+            pipe_manager.lock.release()
+    
+    def unset_value_on_pipe(self, pipe_manager, value):
+        """Called by the pipe worker to delete 'value'. A value that's already gone is fine.
+        
+        returns the values its key has now"""
+        pipe_manager.lock.acquire()
+        try:
+            try:
+                pipe_manager.unset_value(value)
+            except RuntimeError as re:
+                if (re.args[0] != 0x2): #0x2 is WERR_BADFILE
+                    raise re
+            return pipe_manager.get_values_for_key(value.parent, False)
+        finally:
+            pipe_manager.lock.release()
+    
+    def on_value_edited(self, request, key, action, status):
+        """Shows the values of 'key' after the pipe worker has changed one of them, or what went wrong."""
+        try:
+            value_list = request.wait() #it's done, so this doesn't block
+        except RuntimeError as re:
+            self.show_pipe_error("Failed to %s: %s." % (action, re.args[-1]))
+            return
+        except Exception as ex:
+            self.show_pipe_error("Failed to %s: %s." % (action, str(ex)))
+            return
+        
+        if (self.get_selected_registry_key()[1] is key): #unless the user has moved on
+            self.refresh_values_tree_view(value_list)
+        self.set_status(status)
             
-        return False
+    def rename_key_callback(self, key):
+        (iter, selected_key) = self.get_selected_registry_key()
+        if (selected_key == None):
+            return False
+        
+        if (key.name == key.old_name):
+            return True
+        if (self.move_thread != None):
+            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "Another key is still being renamed. Please wait for it to finish.", self)
+            return False
+
+        #check if the tree has a key with that name already, other than the one we're renaming (the case may be all that changes).
+        #move_key() checks with the server again before it copies anything.
+        other_iter = self.keys_store.find_child(self.keys_store.iter_parent(iter), key.name)
+        if (other_iter != None and self.keys_store.get_value(other_iter, 1) not in [key, selected_key]):
+            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "This key already exists. Please choose another name.", self)
+            return False
+        
+        #a rename is a copy of everything below the key followed by a delete, so it runs in the background
+        self.set_status("Renaming %s." % (key.get_absolute_path()))
+        self.move_thread = MoveKeyThread(self.pipe_manager, self, key, key.old_name)
+        self.move_thread.start()
+        
+        key.old_name = key.name
+        return True
             
     def rename_value_callback(self, value):
         (iter_key, selected_key) = self.get_selected_registry_key()
@@ -1578,39 +2570,18 @@ class RegEditWindow(gtk.Window):
 
         if (value.name == value.old_name):
             return True
-
-        self.pipe_manager.lock.acquire()
-        try:
-            value_list = self.pipe_manager.get_values_for_key(selected_key)
         
-            if (len([v for v in value_list if v.name == value.name]) > 0):
-                self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "This value already exists. Please choose another name.", self)
-                return False
-            
-            self.pipe_manager.move_value(value, value.old_name)
-            value_list = self.pipe_manager.get_values_for_key(selected_key)
-            
-            value.old_name = value.name
-            self.refresh_values_tree_view(value_list)
-            self.set_status("Value \'%s\' renamed." % (value.get_absolute_path()))
-            return True
-            
-        except RuntimeError, re:
-            msg = "Failed to rename value: %s." % (re.args[1])
-            print msg
-            self.set_status(msg)
-            traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
-        except Exception, ex:
-            msg = "Failed to rename value: %s." % (str(ex))
-            print msg
-            self.set_status(msg)
-            traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
-        finally:
-            self.pipe_manager.lock.release()
-            
-        return False
+        #the worker checks with the server again before it renames anything
+        if (value.name.lower() != value.old_name.lower() and value.name.lower() in self.get_listed_value_names(selected_key)):
+            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "This value already exists. Please choose another name.", self)
+            return False
+        
+        self.set_status("Renaming %s." % (value.get_absolute_path()))
+        self.submit_pipe_request(self.move_value_on_pipe, (self.pipe_manager, selected_key, value, value.old_name), 
+                                 lambda request: self.on_value_edited(request, selected_key, "rename value", "Value \'%s\' renamed." % (value.get_absolute_path())))
+        
+        value.old_name = value.name
+        return True
             
     def new_value(self, type):
         (iter, selected_key) = self.get_selected_registry_key()
@@ -1622,35 +2593,15 @@ class RegEditWindow(gtk.Window):
             return
         
         new_value.parent = selected_key
-
-        self.pipe_manager.lock.acquire()
-        try:
-            
-            value_list = self.pipe_manager.get_values_for_key(selected_key)
         
-            if (len([v for v in value_list if v.name == new_value.name]) > 0):
-                self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "This value already exists.", self)
-                return False
-            
-            self.pipe_manager.set_value(new_value)
-            value_list = self.pipe_manager.get_values_for_key(selected_key)
-            self.refresh_values_tree_view(value_list)
-            self.set_status("Value \'%s\' successfully added." % (new_value.get_absolute_path()))
+        #the worker checks with the server again before it sets anything
+        if (new_value.name.lower() in self.get_listed_value_names(selected_key)):
+            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "This value already exists.", self)
+            return
         
-        except RuntimeError, re:
-            msg = "Failed to create value: %s." % (re.args[1])
-            self.set_status(msg)
-            print msg
-            traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
-        except Exception, ex:
-            msg = "Failed to create value: %s."  % (str(ex))
-            self.set_status(msg)
-            print msg
-            traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
-        finally:
-            self.pipe_manager.lock.release()
+        self.set_status("Adding %s." % (new_value.get_absolute_path()))
+        self.submit_pipe_request(self.set_value_on_pipe, (self.pipe_manager, selected_key, new_value, True), 
+                                 lambda request: self.on_value_edited(request, selected_key, "create value", "Value \'%s\' successfully added." % (new_value.get_absolute_path())))
             
     def highlight_search_result(self, key_iter, value_iter=None):
         """Select key_iter in the tree store. If value_iter is not none then value_iter will also be selected.
@@ -1695,6 +2646,8 @@ class RegEditWindow(gtk.Window):
             self.on_rename_item_activate(None)
         elif event.keyval == gtk.keysyms.Delete:
             self.on_delete_item_activate(None)
+        elif event.keyval == gtk.keysyms.l and (event.state & gtk.gdk.CONTROL_MASK):
+            self.on_go_to_path_item_activate(None)
         elif event.keyval == gtk.keysyms.Return:
             myev = gtk.gdk.Event(gtk.gdk._2BUTTON_PRESS) #emulate a double-click
             self.on_values_tree_view_button_press(None, myev)
@@ -1716,28 +2669,221 @@ class RegEditWindow(gtk.Window):
         self.pipe_manager = self.run_connect_dialog(None, server, transport_type, username, password, connect_now)
         self.set_status("Connected to %s." % (self.server_address))
         
+        self.open_tree_cache()
         self.refresh_keys_tree_view(None, None)
+        self.fill_keys_tree_view_from_cache()
     
     def on_disconnect_item_activate(self, widget):
         if self.search_thread != None:
             self.search_thread.self_destruct()
             self.search_thread = None
+        if self.index_thread != None:
+            self.index_thread.self_destruct()
+            self.index_thread = None
+        if self.export_thread != None:
+            self.export_thread.self_destruct()
+            self.export_thread = None
+        if self.import_thread != None:
+            self.import_thread.self_destruct()
+            self.import_thread = None
+        if self.delete_thread != None:
+            self.delete_thread.self_destruct()
+            self.delete_thread = None
+        if self.move_thread != None:
+            self.move_thread.self_destruct()
+            self.move_thread = None
+        for thread in list(self.report_threads):
+            thread.self_destruct()
+        self.report_threads.clear()
+        self.close_search_index()
         if (self.pipe_manager != None):
+            self.close_tree_cache()
             self.pipe_manager.close()
             self.pipe_manager = None
+        self.pipe_managers_lock.acquire()
+        for pipe_manager in self.search_pipe_managers:
+            pipe_manager.close()
+        self.search_pipe_managers = []
+        self.pipe_managers_lock.release()
         
         self.keys_store.clear()
         self.values_store.clear()
+        self.value_iters.clear()
         self.keys_tree_view.columns_autosize()
         self.update_sensitivity() 
         
         self.set_status("Disconnected.")
     
+    def open_tree_cache(self):
+        if (not self.connected() or not self.use_tree_cache or self.pipe_manager.tree_cache != None):
+            return
+        
+        try:
+            self.pipe_manager.tree_cache = RegistryTreeCache(self.server_address, self.username)
+        except Exception as ex:
+            print "Failed to open the registry cache: %s." % (str(ex))
+    
+    def close_tree_cache(self):
+        if (not self.connected() or self.pipe_manager.tree_cache == None):
+            return
+        
+        tree_cache = self.pipe_manager.tree_cache
+        self.pipe_manager.tree_cache = None
+        tree_cache.close()
+    
+    def fill_keys_tree_view_from_cache(self):
+        """Adds the cached subkeys of the root keys to the tree, so there's something to click on before anything is fetched.
+        They get checked against the server when they're selected."""
+        if (not self.connected() or self.pipe_manager.tree_cache == None):
+            return
+        
+        iter = self.keys_store.get_iter_first()
+        while (iter != None):
+            key = self.keys_store.get_value(iter, 1)
+            if (self.pipe_manager.load_cached_key(key)):
+                self.keys_store.set_children(iter, key.subkeys)
+            iter = self.keys_store.iter_next(iter)
+    
+    def on_tree_cache_item_toggled(self, widget):
+        self.use_tree_cache = self.tree_cache_item.get_active()
+        if (self.use_tree_cache):
+            self.open_tree_cache()
+        else:
+            self.close_tree_cache()
+    
+    def open_search_index(self):
+        """returns the RegistryIndex for the server we're connected to, or None if it can't be opened"""
+        if (self.search_index == None):
+            try:
+                self.search_index = RegistryIndex(self.server_address, self.username, index_data = self.index_data)
+            except Exception as ex:
+                print "Failed to open the search index: %s." % (str(ex))
+        
+        return self.search_index
+    
+    def on_index_data_item_toggled(self, widget):
+        self.index_data = self.index_data_item.get_active()
+        if (self.search_index != None):
+            self.search_index.set_index_data(self.index_data) #this empties the index if it had the data the other way
+    
+    def close_search_index(self):
+        if (self.search_index == None):
+            return
+        
+        search_index = self.search_index
+        self.search_index = None
+        search_index.close()
+    
     def on_export_item_activate(self, widget):
-        pass
+        if not self.connected():
+            return
+        (iter, key) = self.get_selected_registry_key()
+        if (key == None):
+            return
+        if (self.export_thread != None):
+            msg = "An export is already under way.\n\nCancel it?"
+            if (self.run_message_dialog(gtk.MESSAGE_QUESTION, gtk.BUTTONS_YES_NO, msg) != gtk.RESPONSE_YES):
+                return
+            self.export_thread.self_destruct()
+            self.export_thread = None
+            self.set_status("Export canceled.")
+            return
+        
+        dialog = gtk.FileChooserDialog("Export %s" % (key.get_absolute_path()), self, gtk.FILE_CHOOSER_ACTION_SAVE, 
+                                       (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL, gtk.STOCK_SAVE, gtk.RESPONSE_OK))
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name(key.name + ".reg")
+        
+        reg_filter = gtk.FileFilter()
+        reg_filter.set_name("Registration files (*.reg)")
+        reg_filter.add_pattern("*.reg")
+        dialog.add_filter(reg_filter)
+        
+        binary_filter = gtk.FileFilter()
+        binary_filter.set_name("Compact registry exports (*.regb)")
+        binary_filter.add_pattern("*.regb")
+        dialog.add_filter(binary_filter)
+        
+        response_id = dialog.run()
+        filename = dialog.get_filename()
+        binary = (dialog.get_filter() is binary_filter or (filename != None and filename.lower().endswith(".regb")))
+        dialog.destroy()
+        
+        if (response_id != gtk.RESPONSE_OK or filename == None):
+            return
+        
+        try:
+            file = open(filename, "wb")
+        except IOError as ex:
+            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "Failed to open %s: %s." % (filename, ex.strerror))
+            return
+        
+        if (binary):
+            writer = RegBinaryWriter(file)
+        else:
+            writer = RegFileWriter(file)
+        
+        self.set_status("Exporting %s." % (key.get_absolute_path()))
+        self.export_thread = ExportThread(self.pipe_manager, self, key, writer, filename)
+        self.export_thread.start()
     
     def on_import_item_activate(self, widget):
-        pass
+        if not self.connected():
+            return
+        if (self.import_thread != None):
+            msg = "An import is already under way.\n\nCancel it? What has been imported so far stays in the registry."
+            if (self.run_message_dialog(gtk.MESSAGE_QUESTION, gtk.BUTTONS_YES_NO, msg) != gtk.RESPONSE_YES):
+                return
+            self.import_thread.self_destruct()
+            self.import_thread = None
+            self.set_status("Import canceled.")
+            return
+        
+        dialog = gtk.FileChooserDialog("Import", self, gtk.FILE_CHOOSER_ACTION_OPEN, 
+                                       (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL, gtk.STOCK_OPEN, gtk.RESPONSE_OK))
+        
+        file_filter = gtk.FileFilter()
+        file_filter.set_name("Registry files (*.reg, *.regb)")
+        file_filter.add_pattern("*.reg")
+        file_filter.add_pattern("*.regb")
+        dialog.add_filter(file_filter)
+        
+        file_filter = gtk.FileFilter()
+        file_filter.set_name("All files")
+        file_filter.add_pattern("*")
+        dialog.add_filter(file_filter)
+        
+        check_preview = gtk.CheckButton("Show the changes before making them")
+        check_preview.set_active(True)
+        dialog.set_extra_widget(check_preview)
+        
+        response_id = dialog.run()
+        filename = dialog.get_filename()
+        preview = check_preview.get_active()
+        dialog.destroy()
+        
+        if (response_id != gtk.RESPONSE_OK or filename == None):
+            return
+        
+        self.start_import(filename, preview)
+    
+    def start_import(self, filename, preview = False):
+        if not self.connected():
+            return
+        
+        preview_window = None
+        if (preview):
+            preview_window = RegImportPreviewWindow(filename, lambda: self.start_import(filename))
+            preview_window.set_icon(self.icon_pixbuf)
+            self.set_status("Comparing %s with the registry." % (filename))
+        else:
+            self.set_status("Importing %s." % (filename))
+        
+        self.import_thread = ImportThread(self.pipe_manager, self, filename, preview_window)
+        if (preview_window != None):
+            preview_window.stop_callback = self.import_thread.self_destruct
+            preview_window.show_all()
+        self.import_thread.start()
     
     def on_quit_item_activate(self, widget):
         self.on_self_delete(None, None)
@@ -1746,15 +2892,13 @@ class RegEditWindow(gtk.Window):
         if not self.connected():
             return
         (iter, edit_value) = self.get_selected_registry_value()
-        self.run_value_edit_dialog(edit_value, None, self.update_value_callback)
+        self.load_value_data(edit_value, lambda value: self.run_value_edit_dialog(value, None, self.update_value_callback))
         
     def on_modify_binary_item_activate(self, widget):
         if not self.connected():
             return
         (iter, edit_value) = self.get_selected_registry_value()
-        self.run_value_edit_dialog(edit_value, misc.REG_BINARY, self.update_value_callback)
-
-        self.set_status("Value \'%s\' updated." % (edit_value.get_absolute_path()))
+        self.load_value_data(edit_value, lambda value: self.run_value_edit_dialog(value, misc.REG_BINARY, self.update_value_callback))
     
     def on_new_key_item_activate(self, widget):
         (iter, selected_key) = self.get_selected_registry_key()
@@ -1766,34 +2910,44 @@ class RegEditWindow(gtk.Window):
             return
         
         new_key.parent = selected_key
-
-        self.pipe_manager.lock.acquire()
+        
+        #the worker checks with the server again, the key may not have been listed yet
+        if (self.keys_store.find_child(iter, new_key.name) != None):
+            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "This key already exists.", self)
+            return
+        
+        self.set_status("Adding %s." % (new_key.get_absolute_path()))
+        row_reference = gtk.TreeRowReference(self.keys_store, self.keys_store.get_path(iter))
+        self.submit_pipe_request(self.create_key_on_pipe, (self.pipe_manager, new_key), 
+                                 lambda request: self.on_key_created(request, new_key, row_reference))
+    
+    def create_key_on_pipe(self, pipe_manager, key):
+        """Called by the pipe worker to create 'key', unless it's already there.
+        
+        returns the subkeys its parent has now"""
+        pipe_manager.lock.acquire()
         try:
-            key_list = self.pipe_manager.get_subkeys_for_key(selected_key)
+            if (key.name.lower() in [k.name.lower() for k in pipe_manager.get_subkeys_for_key(key.parent)]):
+                raise ValueError("This key already exists")
             
-            if (len([k for k in key_list if k.name == new_key.name]) > 0):
-                self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "This key already exists.", self)
-                return False
-
-            self.pipe_manager.create_key(new_key)
-            key_list = self.pipe_manager.get_subkeys_for_key(selected_key)
-            self.refresh_keys_tree_view(iter, key_list, new_key)
-            self.set_status("Key \'%s\' successfully added." % (new_key.get_absolute_path()))
-        
-        except RuntimeError, re:
-            msg = "Failed to create key: %s." % (re.args[1])
-            self.set_status(msg)
-            print msg
-            traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
-        except Exception, ex:
-            msg = "Failed to create key: %s." % (str(ex))
-            self.set_status(msg)
-            print msg
-            traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
+            pipe_manager.create_key(key)
+            return pipe_manager.get_subkeys_for_key(key.parent)
         finally:
-            self.pipe_manager.lock.release()
+            pipe_manager.lock.release()
+    
+    def on_key_created(self, request, key, row_reference):
+        try:
+            key_list = request.wait() #it's done, so this doesn't block
+        except RuntimeError as re:
+            self.show_pipe_error("Failed to create key: %s." % (re.args[-1]))
+            return
+        except Exception as ex:
+            self.show_pipe_error("Failed to create key: %s." % (str(ex)))
+            return
+        
+        if (row_reference.valid()):
+            self.refresh_keys_tree_view(self.keys_store.get_iter(row_reference.get_path()), key_list, key)
+        self.set_status("Key \'%s\' successfully added." % (key.get_absolute_path()))
 
     def on_new_string_item_activate(self, widget):
         self.new_value(misc.REG_SZ)
@@ -1815,22 +2969,31 @@ class RegEditWindow(gtk.Window):
             return
         
         (iter, selected_key) = self.get_selected_registry_key()
+        if (selected_key == None):
+            return
+        
         #fetch permissions
-        self.pipe_manager.lock.acquire()
+        self.submit_pipe_request(self.get_key_security_on_pipe, (self.pipe_manager, selected_key), self.on_key_security_fetched)
+    
+    def get_key_security_on_pipe(self, pipe_manager, key):
+        """Called by the pipe worker.
+        
+        returns the security data of 'key'"""
+        pipe_manager.lock.acquire()
+        try:
+            return pipe_manager.get_key_security(key)
+        finally:
+            pipe_manager.lock.release()
+    
+    def on_key_security_fetched(self, request):
         try:
-            key_sec_data = self.pipe_manager.get_key_security(selected_key)
+            key_sec_data = request.wait() #it's done, so this doesn't block
         except RuntimeError as ex:
             msg = "Failed to fetch permissions: %s." % (ex.args[1])
             print msg
-#            traceback.print_exc()
-#            self.set_status(msg)
-        finally:
-            self.pipe_manager.lock.release()
-        
         
         dialog = RegPermissionsDialog(None, None)
         dialog.show_all()
-        pass
 
     def on_delete_item_activate(self, widget):
         key_focused = self.keys_tree_view.is_focus()
@@ -1839,9 +3002,23 @@ class RegEditWindow(gtk.Window):
             (iter, selected_key) = self.get_selected_registry_key()
             if (selected_key == None):
                 return
+            if (self.delete_thread != None):
+                msg = "A key is already being deleted.\n\nCancel it? What has been deleted so far stays deleted."
+                if (self.run_message_dialog(gtk.MESSAGE_QUESTION, gtk.BUTTONS_YES_NO, msg) != gtk.RESPONSE_YES):
+                    return
+                self.delete_thread.self_destruct()
+                self.delete_thread = None
+                self.set_status("Delete canceled.")
+                return
         
             if (self.run_message_dialog(gtk.MESSAGE_QUESTION, gtk.BUTTONS_YES_NO, "Do you want to delete key '%s'?" % selected_key.name) != gtk.RESPONSE_YES):
                 return 
+            
+            #big trees take a while, so the delete runs in the background and the tree gets refreshed when it's done
+            self.set_status("Deleting %s." % (selected_key.get_absolute_path()))
+            self.delete_thread = DeleteKeyThread(self.pipe_manager, self, selected_key)
+            self.delete_thread.start()
+            return
         else:
             (iter, selected_value) = self.get_selected_registry_value()
             if (selected_value == None):
@@ -1850,42 +3027,10 @@ class RegEditWindow(gtk.Window):
             if (self.run_message_dialog(gtk.MESSAGE_QUESTION, gtk.BUTTONS_YES_NO, "Do you want to delete value '%s'?" % selected_value.name) != gtk.RESPONSE_YES):
                 return 
         
-        self.pipe_manager.lock.acquire()
-        try:
-            if (key_focused):
-                
-                self.pipe_manager.remove_key(selected_key)
-                key_list = self.pipe_manager.get_subkeys_for_key(selected_key.parent)
-                
-                parent_iter = self.keys_store.iter_parent(iter)
-                self.refresh_keys_tree_view(parent_iter, key_list)
-                
-                self.set_status("Key \'%s\' successfully deleted." % (selected_key.get_absolute_path()))
-            else:
-                self.pipe_manager.unset_value(selected_value)
-                value_list = self.pipe_manager.get_values_for_key(selected_value.parent)
-                
-                self.refresh_values_tree_view(value_list)
-                self.set_status("Value \'%s\' successfully deleted." % (selected_value.get_absolute_path()))
-                
-        except RuntimeError, re:
-            if re.args[1] == 'WERR_BADFILE':
-                msg = "Failed to delete value: it's already gone!"
-                self.on_refresh_item_activate(None)
-            else:
-                msg = "Failed to delete value: %s." % (re.args[1])
-                self.set_status(msg)
-                print msg
-                traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
-        except Exception, ex:
-            msg = "Failed to delete value: %s." % (str(ex))
-            self.set_status(msg)
-            print msg
-            traceback.print_exc()
-            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, msg)
-        finally:
-            self.pipe_manager.lock.release()
+        #a value that's already gone is just taken out of the pane
+        self.set_status("Deleting %s." % (selected_value.get_absolute_path()))
+        self.submit_pipe_request(self.unset_value_on_pipe, (self.pipe_manager, selected_value), 
+                                 lambda request: self.on_value_edited(request, selected_value.parent, "delete value", "Value \'%s\' successfully deleted." % (selected_value.get_absolute_path())))
 
     def on_rename_item_activate(self, widget):
         if not self.connected():
@@ -1899,8 +3044,11 @@ class RegEditWindow(gtk.Window):
             
         else:
             (iter, rename_value) = self.get_selected_registry_value()
-            rename_value.old_name = rename_value.name
-            self.run_rename_dialog(None, rename_value, self.rename_value_callback)
+            self.load_value_data(rename_value, self.run_value_rename_dialog) #moving a value means setting its data under the new name
+    
+    def run_value_rename_dialog(self, value):
+        value.old_name = value.name
+        self.run_rename_dialog(None, value, self.rename_value_callback)
 
     def on_copy_item_activate(self, widget):
         if not self.connected():
@@ -1924,15 +3072,37 @@ class RegEditWindow(gtk.Window):
         clipboard = gtk.clipboard_get(gtk.gdk.SELECTION_CLIPBOARD)
         clipboard.set_text(path)
     
-    def on_find_item_activate(self, widget):
+    def on_go_to_path_item_activate(self, widget):
+        if not self.connected():
+            return
+        
+        (iter, selected_key) = self.get_selected_registry_key()
+        path = self.run_go_to_path_dialog(["", selected_key.get_absolute_path()][selected_key != None])
+        if (path == None):
+            return
+        
+        self.go_to_path(path)
+    
+    def on_find_item_activate(self, widget, find_all = False):
         if not self.connected():
             return
         
         if self.search_thread == None:
-            result = self.run_search_dialog()
+            result = self.run_search_dialog(find_all)
             if result == None: #The user pressed cancel
                 return
             
+            if (result.use_index and self.open_search_index() == None):
+                self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "Failed to open the search index.")
+                return
+            if (result.use_index and result.search_data and not self.search_index.index_data):
+                self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "The search index doesn't have value data in it. Search the server instead, or turn on Edit > Index Value Data and update the index.")
+                return
+            
+            if (result.find_all):
+                self.start_find_all(result)
+                return
+            
             self.search_last_options = result
             self.search_thread = SearchThread(self.pipe_manager, self, result)
             self.search_thread.start()
@@ -1945,7 +3115,27 @@ class RegEditWindow(gtk.Window):
                 self.search_thread.self_destruct()
                 self.search_thread = None
                 self.set_status("Search canceled.") #this may not get shown since the thread may not stop right away
-                self.on_find_item_activate(None) #Call this function again to get the new search started
+                self.on_find_item_activate(None, find_all) #Call this function again to get the new search started
+    
+    def on_find_all_item_activate(self, widget):
+        self.on_find_item_activate(widget, True)
+    
+    def start_find_all(self, options):
+        results_window = RegSearchResultsWindow(options.text, self.on_search_result_activated)
+        results_window.set_icon(self.icon_pixbuf)
+        
+        self.search_thread = FindAllThread(self.pipe_manager, self, options, results_window)
+        results_window.stop_callback = self.search_thread.self_destruct
+        
+        results_window.show_all()
+        self.set_status("Searching for all matches of \'%s\'." % (options.text))
+        self.search_thread.start()
+    
+    def on_search_result_activated(self, result):
+        if not self.connected():
+            return
+        
+        GoToPathThread(self.pipe_manager, self, key = result.key, value = result.value).start()
     
     def on_find_next_item_activate(self, widget):
         if not self.connected():
@@ -1958,64 +3148,169 @@ class RegEditWindow(gtk.Window):
             self.on_find_item_activate(None)
             return
         
-        #get selections. Stuff is selected by the search, or the user can select if he/she wants to search elsewhere
+        #Stuff is selected by the search, or the user can select if he/she wants to search elsewhere
         (sel_key_iter, sel_key) = self.get_selected_registry_key()
-        (sel_value_iter, sel_value) = self.get_selected_registry_value()
-        value_model = self.values_tree_view.get_model()
-        #get search options from the last search
-        (text, 
-         search_keys, 
-         search_values, 
-         search_data, 
-         match_whole_string) = self.search_last_options
-         
-        if (match_whole_string):
-            search_items = [text]
-        else:
-            search_items = text.split()
+        cursor = self.search_cursor
+        if (sel_key != None and sel_key.get_absolute_path().lower() != self.search_cursor_key_path):
+            #the user moved away from the last match, so we search from the selected key onward
+            self.search_thread = SearchThread(self.pipe_manager, self, self.search_last_options, starting_key = sel_key)
+        else: #carry on from where the last search stopped. If there's nothing left we start over
+            self.search_thread = SearchThread(self.pipe_manager, self, self.search_last_options, cursor)
+        self.search_thread.start()
+
+    def on_save_search_item_activate(self, widget):
+        if (self.search_cursor == None):
+            return
         
-        #search the remaining values in this key
-        if (search_values):
-            if sel_value_iter != None:
-                value_iter = value_model.iter_next(sel_value_iter) #point to the value after the one we just found
-            else:
-                value_iter = value_model.get_iter_first()
-            while (value_iter != None): #this will be none when there is no more values
-                current_value = value_model.get_value(value_iter, 4)
-                for text in search_items:
-                    if (current_value.name.find(text) >= 0): #check if it's in the value's name
-                        self.highlight_search_result(sel_key_iter, value_iter)
-                        msg = "Found value at: %s." % (current_value.get_absolute_path()) 
-                        self.set_status(msg)
-                        return
-                value_iter = value_model.iter_next(value_iter)
-        
-        #search the remaining data too
-        if (search_data):
-            if sel_value_iter != None:
-                value_iter = value_model.iter_next(sel_value_iter) #point to the value after the one we just found
-            else:
-                value_iter = value_model.get_iter_first()
-            while (value_iter != None):
-                current_value = value_model.get_value(value_iter, 4)
-                for text in search_items: #and check those values for each search string
-                    if (current_value.get_data_string().find(text) >= 0): #check if it's in the value's data
-                        self.highlight_search_result(sel_key_iter, value_iter)
-                        msg = "Found data at: %s." % (current_value.get_absolute_path())
-                        self.set_status(msg)
-                        return
-                value_iter = value_model.iter_next(value_iter)
-        
-        #so it's not in this key's values. Lets continue searching the rest of the registry
-        self.search_thread = SearchThread(self.pipe_manager, self, self.search_last_options, sel_key_iter)
+        dialog = gtk.FileChooserDialog("Save Search Position", self, gtk.FILE_CHOOSER_ACTION_SAVE, 
+                                       (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL, gtk.STOCK_SAVE, gtk.RESPONSE_OK))
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name("search.json")
+        response_id = dialog.run()
+        filename = dialog.get_filename()
+        dialog.destroy()
+        
+        if (response_id != gtk.RESPONSE_OK or filename == None):
+            return
+        
+        try:
+            self.search_cursor.save(filename)
+        except IOError as ex:
+            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "Failed to save the search position: %s." % (ex.strerror))
+            return
+        
+        self.set_status("Search position saved to %s." % (filename))
+
+    def on_resume_search_item_activate(self, widget):
+        if not self.connected():
+            return
+        if self.search_thread != None:
+            self.run_message_dialog(gtk.MESSAGE_INFO, gtk.BUTTONS_OK, "Calm down, we're still searching!")
+            return
+        
+        dialog = gtk.FileChooserDialog("Resume Saved Search", self, gtk.FILE_CHOOSER_ACTION_OPEN, 
+                                       (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL, gtk.STOCK_OPEN, gtk.RESPONSE_OK))
+        response_id = dialog.run()
+        filename = dialog.get_filename()
+        dialog.destroy()
+        
+        if (response_id != gtk.RESPONSE_OK or filename == None):
+            return
+        
+        try:
+            cursor = SearchCursor.load(filename)
+        except IOError as ex:
+            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "Failed to load the search position: %s." % (ex.strerror))
+            return
+        except (ValueError, KeyError, TypeError):
+            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "%s is not a saved search position." % (filename))
+            return
+        
+        if (cursor.options == None):
+            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "%s doesn't say what to search for." % (filename))
+            return
+        
+        self.search_last_options = cursor.options
+        self.search_cursor = cursor
+        self.search_cursor_key_path = None
+        self.search_thread = SearchThread(self.pipe_manager, self, cursor.options, cursor)
         self.search_thread.start()
 
+    def on_update_index_item_activate(self, widget):
+        if not self.connected():
+            return
+        if (self.index_thread != None):
+            self.run_message_dialog(gtk.MESSAGE_INFO, gtk.BUTTONS_OK, "The search index is already being updated.")
+            return
+        if (self.open_search_index() == None):
+            self.run_message_dialog(gtk.MESSAGE_ERROR, gtk.BUTTONS_OK, "Failed to open the search index.")
+            return
+        
+        self.set_status("Updating the search index.")
+        self.index_thread = IndexCrawlThread(self.pipe_manager, self)
+        self.index_thread.start()
+
+    def get_diff_remembered(self, pipe_manager):
+        """returns the dictionary the LiveSources for the server and user of 'pipe_manager' remember listed keys in"""
+        return self.diff_remembered.setdefault((pipe_manager.server_address.lower(), pipe_manager.username.lower()), {})
+    
+    def on_compare_item_activate(self, widget):
+        if not self.connected():
+            return
+        
+        (iter, key) = self.get_selected_registry_key()
+        path = ""
+        if (key != None):
+            path = key.get_absolute_path()
+        
+        result = self.run_compare_dialog(path)
+        if (result == None):
+            return
+        (path, filename, compare_times) = result
+        
+        other_pipe_manager = None
+        if (filename == None):
+            other_pipe_manager = self.run_connect_dialog(None, "", self.transport_type, self.username, remember = False)
+            if (other_pipe_manager == None):
+                return
+            other_name = other_pipe_manager.server_address
+        else:
+            other_name = os.path.basename(filename)
+        
+        diff_window = RegDiffWindow(self.server_address, other_name, self.go_to_path)
+        diff_window.set_icon(self.icon_pixbuf)
+        
+        diff_thread = DiffThread(self.pipe_manager, self, path, diff_window, other_pipe_manager, filename, compare_times)
+        diff_window.stop_callback = diff_thread.self_destruct
+        self.report_threads.add(diff_thread)
+        diff_window.show_all()
+        self.set_status("Comparing %s with %s." % (path, other_name))
+        diff_thread.start()
+
+    def on_usage_item_activate(self, widget):
+        if not self.connected():
+            return
+        
+        (iter, key) = self.get_selected_registry_key()
+        if (key == None):
+            return
+        
+        usage_window = RegUsageWindow(key.get_absolute_path(), self.go_to_path)
+        usage_window.set_icon(self.icon_pixbuf)
+        
+        usage_thread = UsageThread(self.pipe_manager, self, key, usage_window)
+        usage_window.stop_callback = usage_thread.self_destruct
+        self.report_threads.add(usage_thread)
+        usage_window.show_all()
+        self.set_status("Adding up the sizes of the keys below %s." % (key.get_absolute_path()))
+        usage_thread.start()
+    
+    def on_query_item_activate(self, widget):
+        path = ""
+        if (self.connected()):
+            (iter, key) = self.get_selected_registry_key()
+            if (key != None):
+                path = key.get_absolute_path()
+        
+        query = self.run_query_dialog(path)
+        if (query == None):
+            return
+        
+        results_window = RegQueryResultsWindow(query.path, query.value_name)
+        results_window.set_icon(self.icon_pixbuf)
+        
+        query_thread = QueryThread(self, query, results_window)
+        results_window.stop_callback = query_thread.self_destruct
+        self.report_threads.add(query_thread)
+        results_window.show_all()
+        self.set_status("Querying %d servers." % (len(query.hosts)))
+        query_thread.start()
+    
     def on_refresh_item_activate(self, widget):
-        (iter, selected_key) = self.get_selected_registry_key()
-        if (selected_key == None):
+        if not self.connected():
             return
         
-        KeyFetchThread(self.pipe_manager, self, selected_key, iter).start()
+        KeyRefreshThread(self.pipe_manager, self).start()
         
         #deselect any selected values
         (iter, value) = self.get_selected_registry_value()
@@ -2053,19 +3348,30 @@ class RegEditWindow(gtk.Window):
         #This is a minor flaw because fetching zero keys is fast
         child_count = self.keys_store.iter_n_children(iter)
         if (child_count == 0): 
-            #create a thread to fetch the keys. 
+            #create a thread to fetch the keys, with a "Loading..." row to show until it's done
+            self.keys_store.set_loading(iter)
             KeyFetchThread(self.pipe_manager, self, selected_key, iter).start()
+        elif (self.keys_store.is_loading(iter)):
+            return #we're already fetching it
         else:
-            self.pipe_manager.lock.acquire()
-            try:
-                value_list = self.pipe_manager.get_values_for_key(selected_key)
-                self.refresh_values_tree_view(value_list)
-            except Exception, ex:
-                msg = "Failed to get values for %s: %s." % (selected_key.get_absolute_path(), str(ex))
-                print msg
-                self.set_status(msg)
-            finally:
-                self.pipe_manager.lock.release()
+            #this is cheap if the key hasn't changed since we listed it, but it's still a call to the server, so we don't wait for it here
+            row_reference = gtk.TreeRowReference(self.keys_store, self.keys_store.get_path(iter))
+            self.submit_pipe_request(self.pipe_manager.refresh_key, (selected_key, ), 
+                                     lambda request: self.on_selected_key_refreshed(request, selected_key, row_reference))
+    
+    def on_selected_key_refreshed(self, request, key, row_reference):
+        try:
+            (key_list, value_list, changed) = request.wait() #it's done, so this doesn't block
+        except Exception, ex:
+            msg = "Failed to get values for %s: %s." % (key.get_absolute_path(), str(ex))
+            print msg
+            self.set_status(msg)
+            return
+        
+        if (changed and row_reference.valid()):
+            self.update_keys_tree_view(self.keys_store.get_iter(row_reference.get_path()), key_list)
+        if (self.get_selected_registry_key()[1] is key): #unless the user has moved on
+            self.refresh_values_tree_view(value_list)
 
     def on_keys_tree_view_row_collapsed_expanded(self, widget, iter, path):
         self.keys_tree_view.columns_autosize()
@@ -2096,6 +3402,18 @@ class RegEditWindow(gtk.Window):
             
         self.update_sensitivity()
 
+    def on_values_tree_view_scrolled(self, widget):
+        self.fetch_visible_value_data()
+
+    def on_values_idle(self):
+        gtk.gdk.threads_enter()
+        try:
+            self.fetch_visible_value_data()
+        finally:
+            gtk.gdk.threads_leave()
+        
+        return False
+
     def on_values_tree_view_button_press(self, widget, event):
         if (event.type == gtk.gdk._2BUTTON_PRESS): #double click
             (iter, selected_value) = self.get_selected_registry_value()
@@ -2120,12 +3438,21 @@ def PrintUseage():
     print "  -p  --password\tThe password for the user."
     print "  -t  --transport\tTransport type.\n\t\t\t\t0 for RPC, SMB, TCP/IP\n\t\t\t\t1 for RPC, TCP/IP\n\t\t\t\t2 for localhost."
     print "  -c  --connect-now\tSkip the connect dialog." 
+    print "  -k  --path\t\tGo to this key after connecting, for example HKLM\\SOFTWARE\\Microsoft."
+    print "\nTo get a key or value from many servers at once without opening a window:"
+    print "  -H  --hosts\t\tA file listing the servers to query, one per line. Use - to read them from stdin."
+    print "  -k  --path\t\tThe key to get."
+    print "  -v  --value\t\tThe value to get. Every value in the key is listed if this isn't given."
+    print "  -o  --output\t\tWrite the results to this CSV file instead of stdout."
+    print "  -w  --workers\t\tHow many servers to talk to at a time, 16 by default."
+    print "      --timeout\t\tSeconds to wait for each server, 30 by default."
 
 def ParseArgs(argv):
     arguments = {}
     
     try: #get arguments into a nicer format
-        opts, args = getopt.getopt(argv, "chu:s:p:t:", ["help", "user=", "server=", "password=", "connect-now", "transport="]) 
+        opts, args = getopt.getopt(argv, "chu:s:p:t:k:H:v:o:w:", ["help", "user=", "server=", "password=", "connect-now", "transport=", "path=", 
+                                                                   "hosts=", "value=", "output=", "workers=", "timeout="]) 
     except getopt.GetoptError:           
         PrintUseage()
         sys.exit(2)
@@ -2144,6 +3471,18 @@ def ParseArgs(argv):
             arguments.update({"transport_type":int(arg)})
         elif opt in ("-c", "--connect-now"):
             arguments.update({"connect_now":True})
+        elif opt in ("-k", "--path"):
+            arguments.update({"path":arg})
+        elif opt in ("-H", "--hosts"):
+            arguments.update({"hosts_file":arg})
+        elif opt in ("-v", "--value"):
+            arguments.update({"value_name":arg})
+        elif opt in ("-o", "--output"):
+            arguments.update({"output":arg})
+        elif opt in ("-w", "--workers"):
+            arguments.update({"max_workers":int(arg)})
+        elif opt == "--timeout":
+            arguments.update({"timeout":int(arg)})
     return (arguments)
 
 """
@@ -2158,6 +3497,9 @@ If you have to, you may acquire both locks at the same time as long as you get t
 if __name__ == "__main__":
     arguments = ParseArgs(sys.argv[1:]) #the [1:] ignores the first argument, which is the path to our utility
     
+    if (arguments.has_key("hosts_file")): #no window, just query the servers
+        sys.exit(RunQuery(**arguments))
+    
     gtk.gdk.threads_init()
     window = RegEditWindow(**arguments)
     window.show_all()
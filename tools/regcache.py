@@ -0,0 +1,180 @@
+
+import os
+import re
+import json
+import time
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None #the cache is optional, without sqlite we just don't have one
+
+from objects import RegistryKey
+from objects import RegistryValue
+
+
+def get_private_filename(directory, server_address, username, extension):
+    """Gets the name of the file we keep things about 'server_address' in, as seen by 'username'. Different users can see
+    different keys and values, so every user gets a file of their own.
+    
+    returns a path"""
+    name = "%s@%s" % (username.lower(), server_address.lower())
+    return os.path.join(directory, re.sub(r"[^\w.@-]", "_", name) + extension)
+
+
+def create_private_file(filename):
+    """Makes sure 'filename' exists and only we can read it or its directory, before sqlite opens it. The journal gets
+    the same mode as the file."""
+    directory = os.path.dirname(filename)
+    if (not os.path.isdir(directory)):
+        os.makedirs(directory, 0700)
+    try:
+        os.chmod(directory, 0700)
+    except OSError as ex:
+        print "Failed to make %s private: %s." % (directory, str(ex))
+    
+    os.close(os.open(filename, os.O_RDWR | os.O_CREAT, 0600))
+    os.chmod(filename, 0600)
+
+
+class RegistryTreeCache:
+    """Keeps the subkey names, value names, types and sizes and the last write time of every key we list on one server in
+    an SQLite database, so the tree can be filled straight away the next time we connect to that server.
+    
+    Nothing in here is trusted: a cached key still gets checked against the server with QueryInfoKey before it's used,
+    see WinRegPipeManager.refresh_key(). When there are more than 'max_keys' keys in the cache the least recently used ones
+    are dropped.
+    
+    The file is only readable by us. The data of values under HKEY_CURRENT_USER and HKEY_USERS is never kept, those hives
+    are where passwords and the like usually are.
+    
+    All the methods can be called from any thread."""
+    
+    default_directory = os.path.join(os.path.expanduser("~"), ".cache", "samba-gtk", "regedit")
+    max_data_size = 256 #only the data of values this small is kept, everything else is fetched when it's shown
+    private_roots = ["hkey_current_user", "hkey_users"] #we never keep the data of values under these
+    
+    def __init__(self, server_address, username, directory = None, max_keys = 100000):
+        if (sqlite3 == None):
+            raise RuntimeError("The registry cache needs the sqlite3 module.")
+        
+        if (directory == None):
+            directory = RegistryTreeCache.default_directory
+        
+        self.filename = get_private_filename(directory, server_address, username, ".sqlite")
+        create_private_file(self.filename)
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.stores_since_trim = 0
+        
+        self.connection = sqlite3.connect(self.filename, check_same_thread = False)
+        self.connection.execute("PRAGMA synchronous = OFF") #it's only a cache, losing the last few writes in a crash is fine
+        self.connection.execute("CREATE TABLE IF NOT EXISTS keys ("
+                                "path TEXT PRIMARY KEY, " #lower case absolute path
+                                "last_write_time INTEGER, "
+                                "last_used REAL, "
+                                "subkeys TEXT, " #json list of names
+                                "key_values TEXT)") #json list of [name, type, size, data or null]
+        self.connection.execute("CREATE INDEX IF NOT EXISTS keys_last_used ON keys (last_used)")
+        self.connection.commit()
+    
+    @staticmethod
+    def is_available():
+        return (sqlite3 != None)
+    
+    def close(self):
+        self.lock.acquire()
+        try:
+            self.connection.close()
+        finally:
+            self.lock.release()
+    
+    def load_key(self, key):
+        """Fills in the cached last write time, subkeys and values of 'key', if we have them.
+        
+        returns True if 'key' was in the cache"""
+        path = key.get_absolute_path().lower()
+        
+        self.lock.acquire()
+        try:
+            row = self.connection.execute("SELECT last_write_time, subkeys, key_values FROM keys WHERE path = ?", (path, )).fetchone()
+            if (row == None):
+                return False
+            self.connection.execute("UPDATE keys SET last_used = ? WHERE path = ?", (time.time(), path))
+            self.connection.commit()
+        except sqlite3.Error as ex:
+            print "Failed to read %s from the registry cache: %s." % (key.get_absolute_path(), str(ex))
+            return False
+        finally:
+            self.lock.release()
+        
+        (last_write_time, subkeys, key_values) = row
+        
+        key.subkeys = [RegistryKey(name, key) for name in json.loads(subkeys)]
+        key.values = []
+        for (name, type, size, data) in json.loads(key_values):
+            value = RegistryValue(name, type, data, key)
+            if (data == None):
+                value.data_loaded = False
+                value.data_size = size
+            key.values.append(value)
+        key.last_write_time = last_write_time
+        
+        return True
+    
+    def store_key(self, key):
+        """Saves the last write time, subkeys and values of 'key' that were just listed."""
+        if (key.subkeys == None or key.values == None or key.last_write_time == None):
+            return
+        
+        subkeys = json.dumps([subkey.name for subkey in key.subkeys])
+        keep_data = (key.get_root_key().name.lower() not in RegistryTreeCache.private_roots)
+        key_values = []
+        for value in key.values:
+            size = value.get_data_size()
+            if (keep_data and value.data_loaded and size <= RegistryTreeCache.max_data_size):
+                key_values.append([value.name, value.type, size, list(value.data or [])])
+            else:
+                key_values.append([value.name, value.type, size, None])
+        key_values = json.dumps(key_values)
+        
+        self.lock.acquire()
+        try:
+            self.connection.execute("INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?, ?)",
+                                    (key.get_absolute_path().lower(), key.last_write_time, time.time(), subkeys, key_values))
+            self.connection.commit()
+            
+            self.stores_since_trim += 1
+            if (self.stores_since_trim >= 100): #no need to count the rows every time
+                self.stores_since_trim = 0
+                self.trim()
+        except sqlite3.Error as ex:
+            print "Failed to save %s in the registry cache: %s." % (key.get_absolute_path(), str(ex))
+        finally:
+            self.lock.release()
+    
+    def remove_key(self, key):
+        """Drops 'key' and everything below it from the cache."""
+        path = key.get_absolute_path().lower()
+        
+        self.lock.acquire()
+        try:
+            #key names can have '_' and '%' in them, so we compare the prefix rather than use LIKE
+            self.connection.execute("DELETE FROM keys WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(path) + 1, path + "\\"))
+            self.connection.commit()
+        except sqlite3.Error as ex:
+            print "Failed to remove %s from the registry cache: %s." % (key.get_absolute_path(), str(ex))
+        finally:
+            self.lock.release()
+    
+    def trim(self):
+        """Drops the least recently used keys until we're 10% under the limit.
+        NOTE: the caller must hold self.lock"""
+        count = self.connection.execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+        if (count <= self.max_keys):
+            return
+        
+        self.connection.execute("DELETE FROM keys WHERE path IN (SELECT path FROM keys ORDER BY last_used LIMIT ?)",
+                                (count - int(self.max_keys * 0.9), ))
+        self.connection.commit()
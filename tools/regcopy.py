@@ -0,0 +1,232 @@
+
+import threading
+import collections
+
+from samba.dcerpc import security
+
+from objects import RegistryKey
+
+
+class CopyItem:
+    """A key waiting to be copied, or one that's been copied and is waiting to be verified."""
+    
+    def __init__(self, source_key, destination_key):
+        self.source_key = source_key
+        self.destination_key = destination_key
+        self.subkey_count = None #what the source had when we listed it
+        self.value_count = None
+        self.security_data = None #the source's security descriptor, set on the copy once everything below it is written
+
+
+class RegistryCopier:
+    """Copies a key with everything below it to another key on the same server.
+    
+    The copy goes breadth first. A worker thread per pipe manager in 'pipe_managers' takes a key off the shared queue,
+    lists it with buffers sized by a single QueryInfoKey() call, creates the destination key with one CreateKey() call
+    relative to the (cached) handle of its parent and writes all the values through the new handle before closing it.
+    The subkeys then go on the queue, so different branches are copied on different pipes at the same time. A key is
+    only queued once its parent exists, and only the queue is kept in memory, never the whole subtree.
+    
+    Class names are copied along, as long as the source keys have them (keys that were listed by enum_key() do), and so
+    are the DACLs. The DACLs are set once the whole subtree has been written, from the deepest keys up, so a DACL that
+    shuts us out of a key can't stop us from copying what's below it; until then every copied key's descriptor is kept.
+    A cancelled copy is left without them.
+    Keys that can't be read or written are skipped along with everything below them, see 'failed_keys'. 'error' is the
+    RuntimeError for the first of them. verify() checks the copy against the counts we read from the source."""
+    
+    def __init__(self, pipe_managers, progress_callback = None):
+        self.pipe_managers = pipe_managers
+        self.progress_callback = progress_callback #called with every source key that's copied, from the worker threads
+        
+        self.condition = threading.Condition()
+        self.queue = collections.deque() #CopyItem that no worker has taken yet
+        self.busy = 0 #items the workers are working on, they may queue more
+        self.stopped = False
+        
+        self.copied = [] #every CopyItem that was copied, for verify()
+        self.keys_copied = 0
+        self.values_copied = 0
+        self.failed_keys = [] #(absolute path, error message)
+        self.error = None
+    
+    def run(self, source_key, destination_key):
+        """Copies 'source_key' and everything below it to 'destination_key', and blocks until it's done or cancelled.
+        The destination's parent has to exist. If the destination exists too, the source is merged into it.
+        
+        returns True if everything was copied"""
+        source_path = source_key.get_absolute_path().lower()
+        destination_path = destination_key.get_absolute_path().lower()
+        if (destination_key.parent == None):
+            raise ValueError("Can't copy over a root key")
+        if (destination_path == source_path or destination_path.startswith(source_path + "\\")):
+            raise ValueError("Can't copy a key into itself")
+        
+        self.queue.append(CopyItem(source_key, destination_key))
+        self.run_workers(self.copy_item, "CopyWorker")
+        
+        #one depth at a time, so no key gets its DACL before all of its subkeys have theirs
+        depths = {}
+        for item in self.copied:
+            depths.setdefault(item.destination_key.get_absolute_path().count("\\"), []).append(item)
+        for depth in sorted(depths.keys(), reverse = True):
+            if (self.stopped):
+                break
+            self.queue.extend(depths[depth])
+            self.run_workers(self.set_security_item, "SecurityWorker")
+        
+        return (not self.stopped and len(self.failed_keys) == 0)
+    
+    def verify(self):
+        """Asks the server how many subkeys and values every copied key has, one QueryInfoKey() call each, and compares
+        them with what the source had. Mismatches are added to 'failed_keys'.
+        
+        returns True if the copy matches the source"""
+        if (len(self.failed_keys) > 0): #some of it wasn't copied at all
+            return False
+        
+        failure_count = len(self.failed_keys)
+        self.queue.extend(self.copied)
+        self.run_workers(self.verify_item, "VerifyWorker")
+        
+        return (not self.stopped and len(self.failed_keys) == failure_count)
+    
+    def cancel(self):
+        self.condition.acquire()
+        self.stopped = True
+        self.queue.clear()
+        self.condition.notifyAll()
+        self.condition.release()
+    
+    def run_workers(self, target, name):
+        workers = []
+        for index in xrange(len(self.pipe_managers)):
+            worker = threading.Thread(target = self.work, args = (self.pipe_managers[index], target), name = "%s-%d" % (name, index))
+            worker.setDaemon(True)
+            workers.append(worker)
+            worker.start()
+        
+        for worker in workers:
+            worker.join()
+    
+    def work(self, pipe_manager, target):
+        while True:
+            self.condition.acquire()
+            try:
+                while (len(self.queue) == 0 and self.busy > 0 and not self.stopped): #someone may still queue subkeys
+                    self.condition.wait(0.5)
+                if (len(self.queue) == 0 or self.stopped):
+                    self.condition.notifyAll()
+                    return
+                item = self.queue.popleft()
+                self.busy += 1
+            finally:
+                self.condition.release()
+            
+            subkey_items = []
+            try:
+                try:
+                    subkey_items = target(pipe_manager, item)
+                except RuntimeError as re:
+                    #probably WERR_ACCESS_DENIED, we skip the key and everything below it
+                    self.add_failure(item.source_key, re.args[-1], re)
+                except Exception as ex:
+                    #the copy is incomplete either way, and the other workers mustn't wait for this one forever
+                    self.add_failure(item.source_key, str(ex))
+                    raise
+            finally:
+                self.condition.acquire()
+                self.busy -= 1
+                if (not self.stopped):
+                    self.queue.extend(subkey_items)
+                self.condition.notifyAll()
+                self.condition.release()
+    
+    def add_failure(self, key, message, re = None):
+        self.condition.acquire()
+        try:
+            self.failed_keys.append((key.get_absolute_path(), message))
+            if (self.error == None):
+                self.error = re
+        finally:
+            self.condition.release()
+    
+    def copy_item(self, pipe_manager, item):
+        """Copies the key of 'item', its class and its values, and reads its DACL for set_security_item().
+        
+        returns a list of CopyItem for its subkeys"""
+        pipe_manager.lock.acquire()
+        try:
+            path_handles = pipe_manager.open_path(item.source_key.parent)
+            try:
+                key_handle = pipe_manager.open_subkey(path_handles[-1], item.source_key.name, security.SEC_STD_READ_CONTROL)
+                try:
+                    (subkey_list, value_list) = pipe_manager.list_open_key(key_handle, item.source_key)
+                    key_sec_data = pipe_manager.get_open_key_security(key_handle)
+                finally:
+                    pipe_manager.close_key(key_handle)
+            finally:
+                pipe_manager.close_path(path_handles)
+            
+            path_handles = pipe_manager.open_path(item.destination_key.parent)
+            try:
+                key_handle = pipe_manager.create_subkey(path_handles[-1], 
+                                                        item.destination_key.name, 
+                                                        item.source_key.class_name or "")
+                try:
+                    pipe_manager.write_values(key_handle, value_list)
+                finally:
+                    pipe_manager.close_key(key_handle)
+            finally:
+                pipe_manager.close_path(path_handles)
+        finally:
+            pipe_manager.lock.release()
+        
+        item.subkey_count = len(subkey_list)
+        item.value_count = len(value_list)
+        item.security_data = key_sec_data
+        
+        self.condition.acquire()
+        self.copied.append(item)
+        self.keys_copied += 1
+        self.values_copied += len(value_list)
+        self.condition.release()
+        
+        if (self.progress_callback != None):
+            self.progress_callback(item.source_key)
+        
+        return [CopyItem(subkey, RegistryKey(subkey.name, item.destination_key)) for subkey in subkey_list]
+    
+    def set_security_item(self, pipe_manager, item):
+        """Sets the DACL of the key 'item' was copied from on the copy.
+        
+        returns an empty list"""
+        pipe_manager.lock.acquire()
+        try:
+            path_handles = pipe_manager.open_path(item.destination_key.parent)
+            try:
+                key_handle = pipe_manager.open_subkey(path_handles[-1], item.destination_key.name, security.SEC_STD_WRITE_DAC)
+                try:
+                    pipe_manager.set_open_key_security(key_handle, item.security_data)
+                finally:
+                    pipe_manager.close_key(key_handle)
+            finally:
+                pipe_manager.close_path(path_handles)
+        finally:
+            pipe_manager.lock.release()
+        
+        item.security_data = None #we don't need it any more
+        return []
+    
+    def verify_item(self, pipe_manager, item):
+        pipe_manager.lock.acquire()
+        try:
+            info = pipe_manager.get_key_info(item.destination_key)
+        finally:
+            pipe_manager.lock.release()
+        
+        if (info.num_subkeys != item.subkey_count or info.num_values != item.value_count):
+            self.add_failure(item.destination_key, "has %d subkeys and %d values, the original has %d and %d" % (info.num_subkeys,
+                                                                                                                  info.num_values,
+                                                                                                                  item.subkey_count,
+                                                                                                                  item.value_count))
+        return []
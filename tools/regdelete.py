@@ -0,0 +1,213 @@
+
+import threading
+import collections
+
+
+class DeleteFrame:
+    """A key on the way down in RegistryDeleter.delete_subtree()."""
+    
+    def __init__(self, key, parent_handle):
+        self.key = key
+        self.parent_handle = parent_handle #open while we're below the parent
+        self.handle = None #our own handle, once we know we have subkeys
+        self.pending = None #subkeys (RegistryKey) that still have to be deleted
+        self.failed = False #True if something below us couldn't be deleted, so we can't be either
+
+
+class RegistryDeleter:
+    """Deletes a key with everything below it.
+    
+    Every subtree is deleted in post-order without recursion. The keys on the way down are kept open, so every subkey
+    is opened relative to its parent with one OpenKey() call, and all the subkeys of a key are listed with buffers sized
+    by a single QueryInfoKey() call. Keys are first deleted optimistically: a leaf (most of the keys in a big tree) costs
+    a single DeleteKey() call, and only keys the server refuses to delete because they still have subkeys are opened.
+    
+    With more than one pipe manager in 'pipe_managers' the subtrees of the key's subkeys are shared out between the
+    pipes, one worker thread each, and the key itself is deleted last on the first pipe.
+    
+    Keys that can't be deleted are skipped along with their ancestors, see 'failed_keys'. 'error' is the RuntimeError
+    for the first of them, so callers that want an exception can raise it."""
+    
+    def __init__(self, pipe_managers, progress_callback = None):
+        self.pipe_managers = pipe_managers
+        self.progress_callback = progress_callback #called with every key that's deleted, from the worker threads
+        
+        self.condition = threading.Condition()
+        self.subtrees = collections.deque() #subkeys of the key being deleted that no worker has taken yet
+        self.stopped = False
+        
+        self.keys_deleted = 0
+        self.failed_keys = [] #(absolute path, error message)
+        self.error = None
+    
+    def run(self, key):
+        """Deletes 'key' and everything below it, and blocks until it's done or cancelled."""
+        if (key.parent == None):
+            raise ValueError("Root keys can't be deleted")
+        
+        if (len(self.pipe_managers) > 1):
+            pipe_manager = self.pipe_managers[0]
+            pipe_manager.lock.acquire()
+            try:
+                self.subtrees.extend(pipe_manager.get_subkeys_for_key(key))
+            except RuntimeError as re:
+                if (re.args[0] != 0x2): #0x2 is WERR_BADFILE, it's already gone
+                    self.add_failure(key, re)
+                self.subtrees.clear()
+            finally:
+                pipe_manager.lock.release()
+            
+            workers = []
+            for index in xrange(min(len(self.pipe_managers), len(self.subtrees))):
+                worker = threading.Thread(target = self.work, args = (self.pipe_managers[index], ), name = "DeleteWorker-%d" % (index))
+                worker.setDaemon(True)
+                workers.append(worker)
+                worker.start()
+            
+            for worker in workers:
+                worker.join()
+        
+        if (not self.stopped and len(self.failed_keys) == 0):
+            self.delete_subtree(self.pipe_managers[0], key) #with the subkeys gone this is usually a single DeleteKey()
+        
+        for pipe_manager in self.pipe_managers:
+            pipe_manager.invalidate_path(key)
+            if (pipe_manager.tree_cache != None):
+                pipe_manager.tree_cache.remove_key(key)
+    
+    def cancel(self):
+        self.condition.acquire()
+        self.stopped = True
+        self.subtrees.clear()
+        self.condition.release()
+    
+    def work(self, pipe_manager):
+        while True:
+            self.condition.acquire()
+            try:
+                if (self.stopped or len(self.subtrees) == 0):
+                    return
+                key = self.subtrees.popleft()
+            finally:
+                self.condition.release()
+            
+            self.delete_subtree(pipe_manager, key)
+    
+    def add_failure(self, key, re):
+        self.condition.acquire()
+        try:
+            self.failed_keys.append((key.get_absolute_path(), re.args[-1]))
+            if (self.error == None):
+                self.error = re
+        finally:
+            self.condition.release()
+    
+    def key_deleted(self, key):
+        self.condition.acquire()
+        self.keys_deleted += 1
+        self.condition.release()
+        if (self.progress_callback != None):
+            self.progress_callback(key)
+    
+    def delete_subtree(self, pipe_manager, key):
+        """Deletes 'key' and everything below it using only 'pipe_manager'. The pipe lock is taken for one step at a time,
+        so other threads can use the pipe in between."""
+        pipe_manager.lock.acquire()
+        try:
+            path_handles = pipe_manager.open_path(key.parent)
+        except RuntimeError as re:
+            if (re.args[0] != 0x2): #0x2 is WERR_BADFILE, the parent is already gone
+                self.add_failure(key, re)
+            return
+        finally:
+            pipe_manager.lock.release()
+        
+        stack = [DeleteFrame(key, path_handles[-1])]
+        try:
+            while (len(stack) > 0 and not self.stopped):
+                frame = stack[-1]
+                
+                pipe_manager.lock.acquire()
+                try:
+                    if (frame.pending == None): #first time we get to this key
+                        if (self.try_delete(pipe_manager, frame)):
+                            stack.pop()
+                            continue
+                        
+                        frame.handle = pipe_manager.open_subkey(frame.parent_handle, frame.key.name)
+                        frame.pending = self.list_subkeys(pipe_manager, frame)
+                        frame.pending.reverse() #so they come off the end in the order the server listed them
+                    
+                    elif (len(frame.pending) > 0):
+                        stack.append(DeleteFrame(frame.pending.pop(), frame.handle))
+                    
+                    else: #everything below it is gone
+                        pipe_manager.close_key(frame.handle)
+                        frame.handle = None
+                        if (not frame.failed):
+                            pipe_manager.delete_subkey(frame.parent_handle, frame.key.name)
+                            self.key_deleted(frame.key)
+                        stack.pop()
+                        if (frame.failed and len(stack) > 0):
+                            stack[-1].failed = True
+                
+                except RuntimeError as re:
+                    #probably WERR_ACCESS_DENIED, we leave this key and its ancestors alone
+                    if (frame.handle != None):
+                        self.close_handle(pipe_manager, frame.handle)
+                        frame.handle = None
+                    stack.pop()
+                    if (re.args[0] != 0x2): #0x2 is WERR_BADFILE, someone else deleted it
+                        self.add_failure(frame.key, re)
+                        if (len(stack) > 0):
+                            stack[-1].failed = True
+                finally:
+                    pipe_manager.lock.release()
+        
+        finally:
+            #only left with open handles if we were cancelled or something went badly wrong
+            pipe_manager.lock.acquire()
+            try:
+                for frame in stack:
+                    if (frame.handle != None):
+                        self.close_handle(pipe_manager, frame.handle)
+                pipe_manager.close_path(path_handles)
+            finally:
+                pipe_manager.lock.release()
+    
+    def try_delete(self, pipe_manager, frame):
+        """Deletes the key of 'frame' if the server lets us, which it does if there's nothing below it.
+        
+        returns True if the key is gone"""
+        try:
+            pipe_manager.delete_subkey(frame.parent_handle, frame.key.name)
+        except RuntimeError as re:
+            if (re.args[0] == 0x2): #0x2 is WERR_BADFILE, it's already gone
+                return True
+            return False #it has subkeys, or we may not delete it, either way we have to look inside
+        
+        self.key_deleted(frame.key)
+        return True
+    
+    def list_subkeys(self, pipe_manager, frame):
+        """returns a list of RegistryKey for the subkeys of the opened key of 'frame'"""
+        info = pipe_manager.query_key_info(frame.handle)
+        
+        subkey_list = []
+        index = 0
+        while (index < info.num_subkeys):
+            try:
+                subkey_list.append(pipe_manager.enum_key(frame.handle, index, frame.key, info))
+                index += 1
+            except RuntimeError as re:
+                if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS, subkeys were deleted since we asked
+                    break
+                raise re
+        
+        return subkey_list
+    
+    def close_handle(self, pipe_manager, key_handle):
+        try:
+            pipe_manager.close_key(key_handle)
+        except RuntimeError:
+            pass
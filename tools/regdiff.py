@@ -0,0 +1,325 @@
+
+import hashlib
+
+from objects import RegistryKey
+from objects import RegistryValue
+
+
+def get_content_hash(subkey_names, value_list):
+    """Hashes the subkey names and the values of one key, ignoring the order they're listed in and the case of names.
+    
+    returns a string"""
+    digest = hashlib.sha1()
+    for name in sorted([name.lower() for name in subkey_names]):
+        digest.update(name.encode("utf-8") + "\x00")
+    digest.update("\x01")
+    for value in sorted(value_list, key = lambda value: value.name.lower()):
+        if (value.name == "(Default)" and value.get_data_size() == 0): #an unset default value, there's nothing there
+            continue
+        digest.update("%s\x00%d\x00%s\x00" % (value.name.lower().encode("utf-8"), value.type, str(bytearray(value.data or []))))
+    
+    return digest.hexdigest()
+
+
+class KeyState:
+    """What we can find out about a key without listing it."""
+    
+    def __init__(self, last_write_time, subkey_count, value_count):
+        self.last_write_time = last_write_time #None if it isn't known
+        self.subkey_count = subkey_count
+        self.value_count = value_count
+
+
+class LiveSource:
+    """One side of a diff: the subtree at 'path' on the server 'pipe_manager' is connected to.
+    
+    Every key costs one QueryInfoKey call. The hash and subkey names of every key that gets listed are remembered along
+    with its last write time, so comparing the same keys again later (against this or another source) doesn't have to
+    list the keys that haven't been written to since. A LiveSource only lives for one comparison, so the caller keeps
+    'remembered' and gives the same dictionary to every LiveSource for the same server and user."""
+    
+    def __init__(self, pipe_manager, path, remembered = None):
+        self.pipe_manager = pipe_manager
+        self.name = pipe_manager.server_address
+        self.root_key = pipe_manager.get_key_for_path(path)
+        if (remembered == None):
+            remembered = {}
+        self.remembered = remembered #lower case path: (last write time, content hash, subkey names)
+    
+    def get_root(self):
+        return self.root_key
+    
+    def get_child(self, key, name):
+        return RegistryKey(name, key)
+    
+    def get_state(self, key):
+        """returns a KeyState, or None if the key doesn't exist"""
+        self.pipe_manager.lock.acquire()
+        try:
+            info = self.pipe_manager.get_key_info(key)
+        except RuntimeError as re:
+            if (re.args[0] == 0x2): #0x2 is WERR_BADFILE, the key isn't there
+                return None
+            raise re
+        finally:
+            self.pipe_manager.lock.release()
+        
+        return KeyState(info.last_changed_time, info.num_subkeys, info.num_values)
+    
+    def get_remembered(self, key, state):
+        """returns (content hash, subkey names) if the key hasn't been written to since we listed it, otherwise None"""
+        entry = self.remembered.get(key.get_absolute_path().lower())
+        if (entry == None or entry[0] != state.last_write_time):
+            return None
+        return entry[1:]
+    
+    def list_key(self, key, state):
+        """returns (subkey names, list of RegistryValue) for 'key'"""
+        self.pipe_manager.lock.acquire()
+        try:
+            subkey_names = [subkey.name for subkey in self.pipe_manager.get_subkeys_for_key(key)]
+            value_list = self.pipe_manager.get_values_for_key(key)
+        finally:
+            self.pipe_manager.lock.release()
+        
+        self.remembered[key.get_absolute_path().lower()] = (state.last_write_time, get_content_hash(subkey_names, value_list), subkey_names)
+        return (subkey_names, value_list)
+
+
+class SnapshotKey:
+    
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.last_write_time = None
+        self.subkeys = []
+        self.values = []
+        self.content_hash = None
+    
+    def get_absolute_path(self):
+        return self.path
+
+
+class SnapshotSource:
+    """One side of a diff: the subtree at 'path' in a file read with a RegFileReader or RegBinaryReader.
+    The subtree is kept in memory. Compact exports (.regb) have the last write times of the keys, so they can be compared
+    with the live registry of the same server without listing the keys that haven't changed."""
+    
+    def __init__(self, reader, path, name):
+        self.name = name
+        self.root = None
+        
+        prefix = path.lower().rstrip("\\")
+        keys = {}
+        for (key_path, delete, value_list, last_write_time) in reader:
+            if (delete):
+                continue
+            lower_path = key_path.lower()
+            if (lower_path != prefix and not lower_path.startswith(prefix + "\\")):
+                continue
+            
+            key = self.get_key(keys, key_path)
+            key.last_write_time = last_write_time
+            key.values = [RegistryValue(value_name, type, data, key) for (value_name, type, data) in value_list if data != None]
+        
+        self.root = keys.get(prefix)
+        if (self.root == None):
+            raise ValueError("%s isn't in the file." % (path))
+    
+    def get_key(self, keys, path):
+        """Finds the key for 'path' in 'keys', adding it and any missing parents if needed."""
+        key = keys.get(path.lower())
+        if (key != None):
+            return key
+        
+        key = SnapshotKey(path.split("\\")[-1], path)
+        keys[path.lower()] = key
+        if ("\\" in path):
+            self.get_key(keys, path.rsplit("\\", 1)[0]).subkeys.append(key)
+        
+        return key
+    
+    def get_root(self):
+        return self.root
+    
+    def get_child(self, key, name):
+        for subkey in key.subkeys:
+            if (subkey.name.lower() == name.lower()):
+                return subkey
+        return None
+    
+    def get_state(self, key):
+        if (key == None):
+            return None
+        return KeyState(key.last_write_time, len(key.subkeys), len(key.values))
+    
+    def get_remembered(self, key, state):
+        if (key.content_hash == None):
+            key.content_hash = get_content_hash([subkey.name for subkey in key.subkeys], key.values)
+        return (key.content_hash, [subkey.name for subkey in key.subkeys])
+    
+    def list_key(self, key, state):
+        return ([subkey.name for subkey in key.subkeys], key.values)
+
+
+class ValueDiff:
+    
+    def __init__(self, status, name, value_a, value_b):
+        self.status = status #"added" (only in b), "removed" (only in a) or "changed"
+        self.name = name
+        self.value_a = value_a
+        self.value_b = value_b
+
+
+class DiffNode:
+    """A key in the tree of differences. Only keys that differ, or have something below them that differs, are in the tree."""
+    
+    def __init__(self, name, path, status = "same"):
+        self.name = name
+        self.path = path #the path on side a, or on side b for added keys
+        self.status = status #"same", "changed" (its values or subkeys differ), "added" (only in b) or "removed" (only in a)
+        self.value_diffs = []
+        self.children = []
+    
+    def has_differences(self):
+        return (self.status != "same" or len(self.children) > 0)
+
+
+class RegistryDiff:
+    """Compares the subtrees of two sources (LiveSource or SnapshotSource) and builds a tree of DiffNode.
+    
+    Keys only on one side are reported once, without going through everything below them. For keys on both sides:
+      - with 'compare_times' (both sources are the same registry at different times), keys with the same last write time
+        and the same number of subkeys and values haven't changed, so they aren't listed
+      - otherwise, keys whose content hashes are known on both sides (see LiveSource) and equal aren't listed either
+      - only the remaining keys are listed on both sides and compared value by value
+    Either way we still have to look at every key on both sides, since a change deep down doesn't change the last write
+    times of the keys above it."""
+    
+    def __init__(self, source_a, source_b, compare_times = False, progress_callback = None):
+        self.source_a = source_a
+        self.source_b = source_b
+        self.compare_times = compare_times
+        self.progress_callback = progress_callback #called with the path of every key that's compared
+        self.stopped = False
+        
+        self.keys_compared = 0
+        self.keys_listed = 0 #keys we had to list on both sides
+        self.differences = 0
+    
+    def cancel(self):
+        self.stopped = True
+    
+    def run(self):
+        """Compares the two sources and blocks until it's done or cancelled.
+        
+        returns the DiffNode for the root, or None if there are no differences"""
+        root_a = self.source_a.get_root()
+        root = DiffNode(root_a.name, root_a.get_absolute_path())
+        
+        nodes = [] #every node we make, in the order they're made, so parents come before their children
+        stack = [(root, root_a, self.source_b.get_root())]
+        while (len(stack) > 0 and not self.stopped):
+            (node, key_a, key_b) = stack.pop()
+            nodes.append(node)
+            
+            for (child, child_a, child_b) in self.compare_key(node, key_a, key_b):
+                node.children.append(child)
+                if (child.status not in ["added", "removed"]):
+                    stack.append((child, child_a, child_b))
+        
+        #drop the nodes that turned out to have nothing in them, children first
+        for node in reversed(nodes):
+            node.children = [child for child in node.children if child.has_differences()]
+        
+        if (root.has_differences()):
+            return root
+        return None
+    
+    def compare_key(self, node, key_a, key_b):
+        """Compares one key on both sides and records the differences in 'node'.
+        
+        returns a list of (DiffNode, key on side a, key on side b) for the subkeys"""
+        self.keys_compared += 1
+        if (self.progress_callback != None):
+            self.progress_callback(node.path)
+        
+        state_a = self.source_a.get_state(key_a)
+        state_b = self.source_b.get_state(key_b)
+        if (state_a == None and state_b == None):
+            return []
+        elif (state_b == None):
+            node.status = "removed"
+            self.differences += 1
+            return []
+        elif (state_a == None):
+            node.status = "added"
+            self.differences += 1
+            return []
+        
+        same_counts = (state_a.subkey_count == state_b.subkey_count and state_a.value_count == state_b.value_count)
+        subkey_names = None
+        
+        if (self.compare_times and same_counts and state_a.last_write_time != None and state_a.last_write_time == state_b.last_write_time):
+            subkey_names = self.get_known_subkey_names(key_a, state_a, key_b, state_b)
+        
+        if (subkey_names == None and same_counts):
+            remembered_a = self.source_a.get_remembered(key_a, state_a)
+            remembered_b = self.source_b.get_remembered(key_b, state_b)
+            if (remembered_a != None and remembered_b != None and remembered_a[0] == remembered_b[0]):
+                subkey_names = remembered_a[1]
+        
+        if (subkey_names != None): #nothing in this key has changed, we only have to look below it
+            return [(DiffNode(name, node.path + "\\" + name), self.source_a.get_child(key_a, name), self.source_b.get_child(key_b, name)) for name in subkey_names]
+        
+        self.keys_listed += 1
+        (names_a, values_a) = self.source_a.list_key(key_a, state_a)
+        (names_b, values_b) = self.source_b.list_key(key_b, state_b)
+        
+        self.compare_values(node, values_a, values_b)
+        
+        children = []
+        lower_names_b = dict([(name.lower(), name) for name in names_b])
+        for name in names_a:
+            if (lower_names_b.has_key(name.lower())):
+                children.append((DiffNode(name, node.path + "\\" + name), self.source_a.get_child(key_a, name), self.source_b.get_child(key_b, lower_names_b[name.lower()])))
+            else:
+                children.append((DiffNode(name, node.path + "\\" + name, "removed"), None, None))
+                self.differences += 1
+        
+        lower_names_a = set([name.lower() for name in names_a])
+        for name in names_b:
+            if (name.lower() not in lower_names_a):
+                children.append((DiffNode(name, node.path + "\\" + name, "added"), None, None))
+                self.differences += 1
+        
+        return children
+    
+    def get_known_subkey_names(self, key_a, state_a, key_b, state_b):
+        """Gets the subkey names of a key that hasn't changed between the sides from whichever side has them without listing.
+        
+        returns a list of names, or None if neither side has them"""
+        for (source, key, state) in [(self.source_a, key_a, state_a), (self.source_b, key_b, state_b)]:
+            remembered = source.get_remembered(key, state)
+            if (remembered != None):
+                return remembered[1]
+        return None
+    
+    def compare_values(self, node, values_a, values_b):
+        values_a = dict([(value.name.lower(), value) for value in values_a if value.name != "(Default)" or value.get_data_size() > 0])
+        values_b = dict([(value.name.lower(), value) for value in values_b if value.name != "(Default)" or value.get_data_size() > 0])
+        
+        for (name, value_a) in sorted(values_a.items()):
+            value_b = values_b.get(name)
+            if (value_b == None):
+                node.value_diffs.append(ValueDiff("removed", value_a.name, value_a, None))
+            elif (value_a.type != value_b.type or list(value_a.data or []) != list(value_b.data or [])):
+                node.value_diffs.append(ValueDiff("changed", value_a.name, value_a, value_b))
+        
+        for (name, value_b) in sorted(values_b.items()):
+            if (not values_a.has_key(name)):
+                node.value_diffs.append(ValueDiff("added", value_b.name, None, value_b))
+        
+        if (len(node.value_diffs) > 0):
+            node.status = "changed"
+            self.differences += len(node.value_diffs)
@@ -0,0 +1,652 @@
+
+import re
+import codecs
+import struct
+import heapq
+import threading
+import Queue
+
+from samba.dcerpc import misc
+
+from objects import RegistryValue
+from regsearch import key_from_path
+
+
+class RegFileWriter:
+    """Writes keys and values in the REGEDIT5 format that regedit.exe exports and imports (UTF-16 text with a byte order mark).
+    Every key is written as soon as it's given to us, nothing is kept in memory."""
+    
+    header = u"Windows Registry Editor Version 5.00\r\n"
+    line_length = 80 #regedit wraps hex data at this many characters
+    
+    hex_types = {
+                 misc.REG_NONE:u"hex(0)",
+                 misc.REG_SZ:u"hex(1)",
+                 misc.REG_EXPAND_SZ:u"hex(2)",
+                 misc.REG_BINARY:u"hex",
+                 misc.REG_DWORD:u"hex(4)",
+                 misc.REG_DWORD_BIG_ENDIAN:u"hex(5)",
+                 misc.REG_MULTI_SZ:u"hex(7)",
+                 misc.REG_QWORD:u"hex(b)",
+                 }
+    
+    def __init__(self, file):
+        self.file = file
+        self.bytes_written = 0
+        
+        self.write_text(u"\ufeff" + RegFileWriter.header) #byte order mark
+    
+    def write_text(self, text):
+        data = text.encode("utf-16-le")
+        self.file.write(data)
+        self.bytes_written += len(data)
+    
+    def write_key(self, path, value_list, last_write_time = None):
+        """.reg files have nowhere to put 'last_write_time', so it's ignored"""
+        lines = [u"", u"[%s]" % (path)]
+        for value in value_list:
+            if (value.name == "(Default)" and value.get_data_size() == 0): #not set, regedit doesn't export these
+                continue
+            lines.append(RegFileWriter.format_value(value))
+        lines.append(u"")
+        
+        self.write_text(u"\r\n".join(lines))
+    
+    def close(self):
+        self.file.close()
+    
+    @staticmethod
+    def escape(text):
+        return text.replace(u"\\", u"\\\\").replace(u"\"", u"\\\"")
+    
+    @staticmethod
+    def format_value(value):
+        """returns the line (or lines) that sets 'value' in a .reg file, without the line break at the end"""
+        if (value.name == "(Default)"):
+            prefix = u"@="
+        else:
+            prefix = u"\"%s\"=" % (RegFileWriter.escape(value.name))
+        
+        data = bytearray(value.data or [])
+        
+        if (value.type == misc.REG_SZ and len(data) % 2 == 0):
+            text = str(data).decode("utf-16-le", "replace")
+            if (text.endswith(u"\x00")):
+                text = text[:-1]
+            if (u"\x00" not in text): #anything else can't be written as a string
+                return prefix + u"\"%s\"" % (RegFileWriter.escape(text))
+        
+        elif (value.type == misc.REG_DWORD and len(data) == 4):
+            return prefix + u"dword:%08x" % (struct.unpack("<I", str(data))[0])
+        
+        hex_type = RegFileWriter.hex_types.get(value.type, u"hex(%x)" % (value.type))
+        
+        #regedit breaks long hex data over several lines, with a backslash at the end of all but the last line
+        lines = []
+        line = prefix + hex_type + u":"
+        for index in xrange(len(data)):
+            piece = u"%02x" % (data[index])
+            if (index < len(data) - 1):
+                piece += u","
+            if (len(line) + len(piece) + 1 > RegFileWriter.line_length):
+                lines.append(line + u"\\")
+                line = u"  "
+            line += piece
+        lines.append(line)
+        
+        return u"\r\n".join(lines)
+
+
+class RegBinaryWriter:
+    """Writes keys and values in a compact binary format that's much faster to write and read than a .reg file.
+    
+    The file starts with 'magic', then has one record per key followed by one record per value of that key:
+        key:   'K', path length (4 bytes), path in utf-8
+        time:  'T', last write time of the key (8 bytes), only if it's known
+        value: 'V', type (4 bytes), name length (4 bytes), name in utf-8, data length (4 bytes), data
+    Numbers are unsigned little endian. Default values are written with an empty name."""
+    
+    magic = "PYGWREG\x01"
+    
+    def __init__(self, file):
+        self.file = file
+        self.bytes_written = 0
+        
+        self.write_data(RegBinaryWriter.magic)
+    
+    def write_data(self, data):
+        self.file.write(data)
+        self.bytes_written += len(data)
+    
+    def write_key(self, path, value_list, last_write_time = None):
+        path = path.encode("utf-8")
+        records = ["K", struct.pack("<I", len(path)), path]
+        if (last_write_time != None):
+            records.extend(["T", struct.pack("<Q", last_write_time)])
+        
+        for value in value_list:
+            if (value.name == "(Default)"):
+                if (value.get_data_size() == 0):
+                    continue
+                name = ""
+            else:
+                name = value.name.encode("utf-8")
+            data = str(bytearray(value.data or []))
+            records.extend(["V", struct.pack("<II", value.type, len(name)), name, struct.pack("<I", len(data)), data])
+        
+        self.write_data("".join(records))
+    
+    def close(self):
+        self.file.close()
+
+
+class RegFileReader:
+    """Reads a .reg file (REGEDIT5 in UTF-16 or REGEDIT4 in ANSI) one key section at a time, so files of any size can be imported.
+    Iterating over the reader gives (path, delete, value_list, last_write_time) for every section. 'delete' is True for
+    [-path] sections, last_write_time is always None since .reg files don't have it, and value_list holds (name, type, data) with data as a list of bytes, or None for values that are to be deleted ("name"=-).
+    The default value is called "(Default)" like everywhere else.
+    
+    Raises ValueError for lines it doesn't understand."""
+    
+    value_regex = re.compile(r"^(?:dword:([0-9a-fA-F]{1,8})|hex(?:\(([0-9a-fA-F]+)\))?:([0-9a-fA-F, ]*))$")
+    
+    def __init__(self, file):
+        self.file = file
+        self.line_number = 0
+        
+        bom = file.read(2)
+        if (bom == codecs.BOM_UTF16_LE):
+            self.lines = codecs.getreader("utf-16-le")(file)
+            self.first_line = u""
+        else: #REGEDIT4 files are in the local code page, the best we can do is latin-1
+            self.lines = codecs.getreader("latin-1")(file)
+            self.first_line = bom.decode("latin-1")
+        
+        header = self.first_line + self.read_line()
+        if (header.strip() not in [u"Windows Registry Editor Version 5.00", u"REGEDIT4"]):
+            raise ValueError("This is not a registry file.")
+    
+    def read_line(self):
+        self.line_number += 1
+        return self.lines.readline()
+    
+    def read_logical_line(self):
+        """Joins lines that end in a backslash (long hex data) to the line after them.
+        
+        returns the line, or None at the end of the file"""
+        line = self.read_line()
+        if (line == u""):
+            return None
+        line = line.rstrip(u"\r\n")
+        
+        while (line.endswith(u"\\")):
+            next_line = self.read_line()
+            if (next_line == u""):
+                break
+            line = line[:-1] + next_line.strip()
+        
+        return line
+    
+    def __iter__(self):
+        path = None
+        delete = False
+        value_list = []
+        
+        while True:
+            line = self.read_logical_line()
+            if (line == None):
+                break
+            
+            line = line.strip()
+            if (line == u"" or line.startswith(u";")):
+                continue
+            
+            if (line.startswith(u"[") and line.endswith(u"]")):
+                if (path != None):
+                    yield (path, delete, value_list, None)
+                
+                path = line[1:-1]
+                delete = path.startswith(u"-")
+                if (delete):
+                    path = path[1:]
+                value_list = []
+                continue
+            
+            if (path == None):
+                raise ValueError("Line %d: the value isn't in a key." % (self.line_number))
+            value_list.append(self.parse_value(line))
+        
+        if (path != None):
+            yield (path, delete, value_list, None)
+    
+    def parse_value(self, line):
+        """returns (name, type, data) for a line like "name"="text" """
+        if (line.startswith(u"@=")):
+            name = "(Default)"
+            rest = line[2:]
+        else:
+            (name, end) = self.parse_string(line, 0)
+            if (not line[end:].startswith(u"=")):
+                raise ValueError("Line %d: expected '=' after the value name." % (self.line_number))
+            rest = line[end + 1:]
+        
+        if (rest == u"-"):
+            return (name, misc.REG_SZ, None)
+        
+        if (rest.startswith(u"\"")):
+            (text, end) = self.parse_string(rest, 0)
+            return (name, misc.REG_SZ, list(bytearray((text + u"\x00").encode("utf-16-le"))))
+        
+        match = RegFileReader.value_regex.match(rest)
+        if (match == None):
+            raise ValueError("Line %d: can't read the data of '%s'." % (self.line_number, name))
+        
+        (dword, hex_type, hex_data) = match.groups()
+        if (dword != None):
+            return (name, misc.REG_DWORD, list(bytearray(struct.pack("<I", int(dword, 16)))))
+        
+        if (hex_type == None):
+            type = misc.REG_BINARY
+        else:
+            type = int(hex_type, 16)
+        return (name, type, [int(byte, 16) for byte in hex_data.replace(u" ", u"").split(u",") if byte != u""])
+    
+    def parse_string(self, line, start):
+        """Reads the quoted string that starts at 'start' in 'line'.
+        
+        returns (the string without quotes or escapes, the index after the closing quote)"""
+        if (line[start:start + 1] != u"\""):
+            raise ValueError("Line %d: expected a quoted string." % (self.line_number))
+        
+        chars = []
+        index = start + 1
+        while (index < len(line)):
+            ch = line[index]
+            if (ch == u"\\" and index + 1 < len(line)):
+                chars.append(line[index + 1])
+                index += 2
+            elif (ch == u"\""):
+                return (u"".join(chars), index + 1)
+            else:
+                chars.append(ch)
+                index += 1
+        
+        raise ValueError("Line %d: the string isn't closed." % (self.line_number))
+
+
+class RegBinaryReader:
+    """Reads what RegBinaryWriter writes, one key at a time. Iterating gives the same tuples as RegFileReader.
+    Binary exports never delete anything, but they have the last write times of most keys."""
+    
+    def __init__(self, file):
+        self.file = file
+        
+        if (file.read(len(RegBinaryWriter.magic)) != RegBinaryWriter.magic):
+            raise ValueError("This is not a compact registry export.")
+    
+    def read(self, size):
+        data = self.file.read(size)
+        if (len(data) != size):
+            raise ValueError("The file is truncated.")
+        return data
+    
+    def __iter__(self):
+        path = None
+        value_list = []
+        last_write_time = None
+        
+        while True:
+            record = self.file.read(1)
+            if (record == "K" or record == ""):
+                if (path != None):
+                    yield (path, False, value_list, last_write_time)
+                if (record == ""):
+                    break
+                
+                (length, ) = struct.unpack("<I", self.read(4))
+                path = self.read(length).decode("utf-8")
+                value_list = []
+                last_write_time = None
+            
+            elif (record == "T" and path != None):
+                (last_write_time, ) = struct.unpack("<Q", self.read(8))
+            
+            elif (record == "V" and path != None):
+                (type, length) = struct.unpack("<II", self.read(8))
+                name = self.read(length).decode("utf-8") or "(Default)"
+                (length, ) = struct.unpack("<I", self.read(4))
+                value_list.append((name, type, list(bytearray(self.read(length)))))
+            
+            else:
+                raise ValueError("The file is corrupt.")
+
+
+def open_reader(file):
+    """returns a RegBinaryReader or RegFileReader for 'file', depending on what's in it"""
+    magic = file.read(len(RegBinaryWriter.magic))
+    file.seek(0)
+    
+    if (magic == RegBinaryWriter.magic):
+        return RegBinaryReader(file)
+    else:
+        return RegFileReader(file)
+
+
+class ImportChange:
+    """Something an import would change, see RegistryImporter."""
+    
+    def __init__(self, action, key_path, name = None, old_value = None, new_value = None):
+        self.action = action #"add key", "delete key", "add value", "change value" or "delete value"
+        self.key_path = key_path
+        self.name = name #the value's name, None for changes to keys
+        self.old_value = old_value #the RegistryValue on the server, if there is one
+        self.new_value = new_value #the RegistryValue from the file, if there is one
+    
+    def get_absolute_path(self):
+        if (self.name == None):
+            return self.key_path
+        else:
+            return self.key_path + "\\" + self.name
+
+
+class RegistryImporter:
+    """Applies what a RegFileReader or RegBinaryReader reads to the registry, one key section at a time.
+    
+    Each section is applied with one open of its key (see WinRegPipeManager.set_values()) by one of the worker threads, one
+    per pipe manager in 'pipe_managers'. Sections for the same key always go to the same worker, so they're applied in the
+    order they're in the file. Deleting a key waits for everything before it to be applied, and everything after it waits
+    for the delete. The queues are bounded, so only a few sections per worker are in memory at a time.
+    
+    With 'dry_run' nothing is written. Instead every difference between the file and the registry is passed to
+    'change_callback' as an ImportChange."""
+    
+    def __init__(self, pipe_managers, root_keys, progress_callback = None, change_callback = None, dry_run = False, queue_size = 16):
+        self.pipe_managers = pipe_managers
+        self.root_keys = root_keys
+        self.progress_callback = progress_callback #called with every key that's applied, from the worker threads
+        self.change_callback = change_callback #called with every ImportChange in dry runs, from the worker threads
+        self.dry_run = dry_run
+        
+        self.queues = [Queue.Queue(queue_size) for pipe_manager in pipe_managers]
+        self.stopped = False
+        
+        self.lock = threading.Lock() #for the counts, which all the workers add to
+        self.keys_imported = 0
+        self.values_imported = 0
+        self.failed_keys = [] #(absolute path, error message)
+    
+    def run(self, reader):
+        """Imports everything from 'reader' and blocks until it's done or cancelled. ValueErrors from 'reader' are raised
+        after the workers have finished with what was read before the error.
+        
+        returns True if everything was imported"""
+        workers = []
+        for index in xrange(len(self.pipe_managers)):
+            worker = threading.Thread(target = self.work, args = (self.pipe_managers[index], self.queues[index]), name = "ImportWorker-%d" % (index))
+            worker.setDaemon(True)
+            workers.append(worker)
+            worker.start()
+        
+        try:
+            for section in reader:
+                if (self.stopped):
+                    break
+                
+                (path, delete, value_list, last_write_time) = section
+                if (delete):
+                    self.wait_for_workers()
+                    self.put(self.queues[0], section)
+                    self.wait_for_workers()
+                else:
+                    self.put(self.queues[hash(path.lower()) % len(self.queues)], section)
+        finally:
+            for queue in self.queues:
+                queue.put(None) #tells the worker to stop when it gets to the end of its queue
+            for worker in workers:
+                worker.join()
+        
+        return (not self.stopped and len(self.failed_keys) == 0)
+    
+    def cancel(self):
+        self.stopped = True
+    
+    def put(self, queue, section):
+        while (not self.stopped):
+            try:
+                queue.put(section, True, 0.5)
+                return
+            except Queue.Full:
+                pass
+    
+    def wait_for_workers(self):
+        for queue in self.queues:
+            queue.join()
+    
+    def work(self, pipe_manager, queue):
+        while True:
+            section = queue.get()
+            try:
+                if (section == None):
+                    return
+                if (not self.stopped):
+                    self.import_section(pipe_manager, section)
+            finally:
+                queue.task_done()
+    
+    def import_section(self, pipe_manager, section):
+        (path, delete, value_list, last_write_time) = section
+        
+        key = key_from_path(self.root_keys, path)
+        if (key == None):
+            self.failed_keys.append((path, "not a root key"))
+            return
+        value_list = [RegistryValue(name, type, data, key) for (name, type, data) in value_list]
+        
+        pipe_manager.lock.acquire()
+        try:
+            if (self.dry_run):
+                self.diff_section(pipe_manager, key, delete, value_list)
+            elif (delete):
+                try:
+                    pipe_manager.remove_key(key)
+                except RuntimeError as re:
+                    if (re.args[0] != 0x2): #0x2 is WERR_BADFILE, it's already gone
+                        raise re
+            else:
+                pipe_manager.set_values(key, value_list)
+        except RuntimeError as re:
+            #probably a WERR_ACCESS_DENIED exception
+            print "Failed to import %s: %s." % (path, re.args[1])
+            self.failed_keys.append((path, re.args[1]))
+            return
+        finally:
+            pipe_manager.lock.release()
+        
+        self.lock.acquire()
+        self.keys_imported += 1
+        self.values_imported += len(value_list)
+        self.lock.release()
+        if (self.progress_callback != None):
+            self.progress_callback(key)
+    
+    def diff_section(self, pipe_manager, key, delete, value_list):
+        """Reports what applying the section would change.
+        NOTE: the caller must hold pipe_manager.lock"""
+        path = key.get_absolute_path()
+        
+        try:
+            old_value_list = pipe_manager.get_values_for_key(key)
+            exists = True
+        except RuntimeError as re:
+            if (re.args[0] != 0x2): #0x2 is WERR_BADFILE, the key isn't there
+                raise re
+            old_value_list = []
+            exists = False
+        
+        if (delete):
+            if (exists):
+                self.change_callback(ImportChange("delete key", path))
+            return
+        
+        if (not exists):
+            self.change_callback(ImportChange("add key", path))
+        
+        old_values = dict([(value.name.lower(), value) for value in old_value_list if value.name != "(Default)" or value.get_data_size() > 0])
+        for value in value_list:
+            old_value = old_values.get(value.name.lower())
+            if (value.data == None):
+                if (old_value != None):
+                    self.change_callback(ImportChange("delete value", path, value.name, old_value, None))
+            elif (old_value == None):
+                self.change_callback(ImportChange("add value", path, value.name, None, value))
+            elif (old_value.type != value.type or list(old_value.data or []) != value.data):
+                self.change_callback(ImportChange("change value", path, value.name, old_value, value))
+
+
+class ExportSlot:
+    """A key that RegistryExporter has to write. Its listing is fetched by one of the workers, ahead of the writer."""
+    
+    def __init__(self, key, position):
+        self.key = key
+        self.position = position #tuple of subkey indexes from the exported key, tuples sort in the order keys are written
+        self.submitted = False
+        self.done = False
+        self.subkeys = None
+        self.values = None
+        self.size = 0 #bytes of value data in the listing
+        self.error = None
+    
+    def __cmp__(self, other):
+        return cmp(self.position, other.position)
+
+
+class RegistryExporter:
+    """Writes a key and everything below it with a RegFileWriter or RegBinaryWriter, in the same depth first order as regedit.
+    
+    The keys are listed by one worker thread per pipe manager in 'pipe_managers'. The workers work ahead of the writer, on
+    the keys that will be written next, but never more than 'max_pending' keys or 'max_pending_bytes' bytes of value data ahead,
+    so memory use doesn't grow with the size of the export. Only the subkey names of keys waiting to be written are kept.
+    Everything the writer has written is dropped straight away."""
+    
+    def __init__(self, pipe_managers, writer, progress_callback = None, max_pending = 64, max_pending_bytes = 16 * 1024 * 1024):
+        self.pipe_managers = pipe_managers
+        self.writer = writer
+        self.progress_callback = progress_callback #called with every key as it's written, from the thread that called run()
+        self.max_pending = max_pending
+        self.max_pending_bytes = max_pending_bytes
+        
+        self.condition = threading.Condition()
+        self.queue = [] #heap of submitted ExportSlot that no worker has taken yet
+        self.pending_bytes = 0
+        self.stopped = False
+        
+        self.keys_exported = 0
+        self.values_exported = 0
+        self.failed_keys = [] #absolute paths of the keys we couldn't read
+    
+    def run(self, key):
+        """Exports 'key' and its subkeys and blocks until it's done or cancelled.
+        
+        returns True if everything was written"""
+        workers = []
+        for index in xrange(len(self.pipe_managers)):
+            worker = threading.Thread(target = self.work, args = (self.pipe_managers[index], ), name = "ExportWorker-%d" % (index))
+            worker.setDaemon(True)
+            workers.append(worker)
+            worker.start()
+        
+        try:
+            stack = [ExportSlot(key, ())]
+            self.submit(stack)
+            
+            while (len(stack) > 0):
+                slot = stack.pop()
+                
+                self.condition.acquire()
+                try:
+                    while (not slot.done and not self.stopped):
+                        self.condition.wait(0.5)
+                    if (self.stopped):
+                        return False
+                    self.pending_bytes -= slot.size
+                finally:
+                    self.condition.release()
+                
+                if (slot.error != None):
+                    self.failed_keys.append(slot.key.get_absolute_path())
+                else:
+                    self.writer.write_key(slot.key.get_absolute_path(), slot.values, slot.key.last_write_time)
+                    self.keys_exported += 1
+                    self.values_exported += len(slot.values)
+                    
+                    for index in xrange(len(slot.subkeys) - 1, -1, -1):
+                        stack.append(ExportSlot(slot.subkeys[index], slot.position + (index, )))
+                    
+                    if (self.progress_callback != None):
+                        self.progress_callback(slot.key)
+                
+                slot.subkeys = None
+                slot.values = None
+                self.submit(stack)
+        finally:
+            self.cancel() #stops the workers
+            for worker in workers:
+                worker.join()
+        
+        return (len(self.failed_keys) == 0)
+    
+    def cancel(self):
+        self.condition.acquire()
+        self.stopped = True
+        self.condition.notifyAll()
+        self.condition.release()
+    
+    def submit(self, stack):
+        """Hands the workers the keys nearest the top of 'stack', the ones that will be written next, as long as we're under
+        the limits. The top key is always handed out, otherwise the writer would wait for it forever."""
+        self.condition.acquire()
+        try:
+            seen = 0
+            for index in xrange(len(stack) - 1, -1, -1):
+                if (seen >= self.max_pending or (seen > 0 and self.pending_bytes >= self.max_pending_bytes)):
+                    break
+                seen += 1
+                
+                slot = stack[index]
+                if (not slot.submitted):
+                    slot.submitted = True
+                    heapq.heappush(self.queue, slot)
+            
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+    
+    def work(self, pipe_manager):
+        while True:
+            self.condition.acquire()
+            try:
+                while (len(self.queue) == 0 and not self.stopped):
+                    self.condition.wait(0.5)
+                if (self.stopped):
+                    return
+                slot = heapq.heappop(self.queue)
+            finally:
+                self.condition.release()
+            
+            pipe_manager.lock.acquire()
+            try:
+                slot.subkeys = pipe_manager.get_subkeys_for_key(slot.key)
+                slot.values = pipe_manager.get_values_for_key(slot.key)
+                slot.size = sum([value.get_data_size() for value in slot.values])
+            except RuntimeError as re:
+                #probably a WERR_ACCESS_DENIED exception. The key is left out of the export
+                print "Failed to export %s: %s." % (slot.key.get_absolute_path(), re.args[1])
+                slot.error = re
+            finally:
+                pipe_manager.lock.release()
+            
+            self.condition.acquire()
+            slot.done = True
+            self.pending_bytes += slot.size
+            self.condition.notifyAll()
+            self.condition.release()
@@ -0,0 +1,623 @@
+
+import os
+import re
+import json
+import binascii
+import threading
+import collections
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None #the index is optional, without sqlite we just don't have one
+
+from samba.dcerpc import misc
+
+from objects import RegistryKey
+from objects import RegistryValue
+from regsearch import SearchMatcher
+from regsearch import SearchResult
+from regsearch import SearchCursor
+from regsearch import key_from_path
+from regcache import get_private_filename
+from regcache import create_private_file
+
+
+def get_index_text(value, max_length):
+    """Gets the data of 'value' as text for the index, without building the whole display string of big values.
+    
+    returns a unicode string"""
+    if (value.data == None or not value.data_loaded):
+        return u""
+    
+    if (value.type in SearchMatcher.string_types):
+        return SearchMatcher.decode_string(value)[:max_length]
+    elif (value.type == misc.REG_BINARY):
+        return unicode(binascii.hexlify(str(bytearray(value.data[:max_length / 2]))).upper())
+    elif (value.type in [misc.REG_DWORD, misc.REG_DWORD_BIG_ENDIAN, misc.REG_QWORD]):
+        #both ways of writing the number, so either can be searched for
+        return u"%s %d" % (value.get_data_string(), value.get_interpreted_data())
+    else:
+        return unicode(value.get_data_string())[:max_length]
+
+
+def get_index_raw(value, max_length):
+    """Gets the bytes of 'value' as hex, for the types SearchMatcher.match_data() looks at the bytes of. Strings are
+    matched as text, so they don't need it.
+    
+    returns a string, or None for strings and values without data"""
+    if (value.data == None or not value.data_loaded or value.type in SearchMatcher.string_types):
+        return None
+    return binascii.hexlify(str(bytearray(value.data[:max_length / 2])))
+
+
+def get_index_numbers(value):
+    """The tokens that let numeric search terms (see SearchMatcher) find DWORD and QWORD values: '#' and the number.
+    Words can't have a '#' in them, so these don't get mixed up with the words of the text.
+    
+    returns a set of strings"""
+    if (value.data == None or not value.data_loaded or value.type not in [misc.REG_DWORD, misc.REG_DWORD_BIG_ENDIAN, misc.REG_QWORD]):
+        return set()
+    return set([u"#%d" % (value.get_interpreted_data())])
+
+
+def get_trigrams(text):
+    text = text.lower()
+    return set([text[index:index + 3] for index in xrange(len(text) - 2)])
+
+
+def get_tokens(text):
+    return set(re.findall(r"\w+", text.lower(), re.UNICODE))
+
+
+class RegistryIndex:
+    """An index of every key name, value name and value data on one server, kept in an SQLite database so searches can be
+    answered without going to the server.
+    
+    Every key and value is an item. Items are looked up through an inverted index of their trigrams (any search term of
+    3 characters or more) and of their words (whole word searches), and the candidates are checked with a SearchMatcher.
+    Keys remember their last write time, so RegistryCrawler only has to list the keys that changed since the last crawl.
+    
+    Matches get the position RegistrySearchEngine would give them, worked out from the subkey lists kept for every key
+    (in the order the server lists them), so the index finds them in the same order as a search of the server and
+    SearchCursors can be passed between the two.
+    
+    Data is checked with SearchMatcher.match_data() like a search of the server does, so both find the same values: the
+    bytes of values that aren't strings are kept for that, and DWORD and QWORD values are indexed by number. Only the
+    first 'max_data_length' characters (or half as many bytes) of every value can be found.
+    
+    The file is only readable by us. If 'index_data' is False value data isn't kept at all (it's where passwords and the
+    like are), only key and value names, and searches can't look at data.
+    
+    All the methods can be called from any thread."""
+    
+    default_directory = os.path.join(os.path.expanduser("~"), ".cache", "samba-gtk", "regedit")
+    max_data_length = 2048 #only this much of each value's data is indexed
+    version = "3" #indexes made by other versions are emptied when they're opened, the next crawl fills them again
+    
+    def __init__(self, server_address, username, directory = None, index_data = True):
+        if (sqlite3 == None):
+            raise RuntimeError("The registry index needs the sqlite3 module.")
+        
+        filename = RegistryIndex.get_filename(server_address, username, directory)
+        create_private_file(filename)
+        
+        self.index_data = None
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread = False)
+        self.connection.execute("PRAGMA synchronous = OFF") #a crash in the middle of a crawl just means crawling again
+        self.connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)")
+        row = self.connection.execute("SELECT value FROM settings WHERE name = 'version'").fetchone()
+        if (row == None or row[0] != RegistryIndex.version):
+            self.connection.executescript("""
+                DROP TABLE IF EXISTS keys;
+                DROP TABLE IF EXISTS items;
+                DROP TABLE IF EXISTS trigrams;
+                DROP TABLE IF EXISTS tokens;
+                """)
+            self.connection.execute("INSERT OR REPLACE INTO settings VALUES ('version', ?)", (RegistryIndex.version, ))
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS keys (
+                path TEXT PRIMARY KEY,
+                last_write_time INTEGER,
+                subkeys TEXT);
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                key_path TEXT,
+                display_path TEXT,
+                value_index INTEGER,
+                name TEXT,
+                type INTEGER,
+                data TEXT,
+                raw TEXT);
+            CREATE INDEX IF NOT EXISTS items_key_path ON items (key_path);
+            CREATE TABLE IF NOT EXISTS trigrams (trigram TEXT, item_id INTEGER);
+            CREATE INDEX IF NOT EXISTS trigrams_trigram ON trigrams (trigram);
+            CREATE INDEX IF NOT EXISTS trigrams_item_id ON trigrams (item_id);
+            CREATE TABLE IF NOT EXISTS tokens (token TEXT, item_id INTEGER);
+            CREATE INDEX IF NOT EXISTS tokens_token ON tokens (token);
+            CREATE INDEX IF NOT EXISTS tokens_item_id ON tokens (item_id);
+            """)
+        self.connection.commit()
+        
+        self.set_index_data(index_data)
+    
+    @staticmethod
+    def is_available():
+        return (sqlite3 != None)
+    
+    @staticmethod
+    def get_filename(server_address, username, directory = None):
+        if (directory == None):
+            directory = RegistryIndex.default_directory
+        return get_private_filename(directory, server_address, username, ".index.sqlite")
+    
+    @staticmethod
+    def exists(server_address, username, directory = None):
+        return os.path.exists(RegistryIndex.get_filename(server_address, username, directory))
+    
+    def set_index_data(self, index_data):
+        """Turns keeping value data on or off. When that changes everything in the index is dropped, so the next crawl
+        indexes every key again the new way."""
+        self.lock.acquire()
+        try:
+            row = self.connection.execute("SELECT value FROM settings WHERE name = 'index_data'").fetchone()
+            if (row != None and row[0] != str(index_data)):
+                self.connection.executescript("""
+                    DELETE FROM keys;
+                    DELETE FROM items;
+                    DELETE FROM trigrams;
+                    DELETE FROM tokens;
+                    """)
+            self.connection.execute("INSERT OR REPLACE INTO settings VALUES ('index_data', ?)", (str(index_data), ))
+            self.connection.commit()
+            self.index_data = index_data
+        finally:
+            self.lock.release()
+    
+    def close(self):
+        self.lock.acquire()
+        try:
+            self.connection.close()
+        finally:
+            self.lock.release()
+    
+    def commit(self):
+        self.lock.acquire()
+        try:
+            self.connection.commit()
+        finally:
+            self.lock.release()
+    
+    def get_key(self, key):
+        """Gets what the index knows about 'key'.
+        
+        returns (last_write_time, subkey names) or None if the key isn't indexed"""
+        self.lock.acquire()
+        try:
+            row = self.connection.execute("SELECT last_write_time, subkeys FROM keys WHERE path = ?", (key.get_absolute_path().lower(), )).fetchone()
+        finally:
+            self.lock.release()
+        
+        if (row == None):
+            return None
+        return (row[0], json.loads(row[1]))
+    
+    def update_key(self, key, last_write_time, subkey_list, value_list):
+        """Replaces everything the index has for 'key' itself with its new name, values and subkey list.
+        Subkeys that have gone are removed from the index along with everything below them."""
+        path = key.get_absolute_path().lower()
+        display_path = key.get_absolute_path()
+        subkey_names = [subkey.name for subkey in subkey_list]
+        
+        self.lock.acquire()
+        try:
+            items = [(-1, key.name, None, None, None, set())]
+            for (index, value) in enumerate(value_list):
+                if (self.index_data):
+                    items.append((index, value.name, value.type, get_index_text(value, RegistryIndex.max_data_length),
+                                  get_index_raw(value, RegistryIndex.max_data_length), get_index_numbers(value)))
+                else:
+                    items.append((index, value.name, value.type, None, None, set()))
+            
+            old = self.connection.execute("SELECT subkeys FROM keys WHERE path = ?", (path, )).fetchone()
+            if (old != None):
+                current_names = set([name.lower() for name in subkey_names])
+                for name in json.loads(old[0]):
+                    if (name.lower() not in current_names):
+                        self.remove_subtree(path + "\\" + name.lower())
+            
+            self.remove_items(path)
+            self.connection.execute("INSERT OR REPLACE INTO keys VALUES (?, ?, ?)", (path, last_write_time, json.dumps(subkey_names)))
+            
+            for (value_index, name, type, data, raw, numbers) in items:
+                cursor = self.connection.execute("INSERT INTO items (key_path, display_path, value_index, name, type, data, raw) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                                 (path, display_path, value_index, name, type, data, raw))
+                item_id = cursor.lastrowid
+                
+                text = name + u" " + (data or u"")
+                self.connection.executemany("INSERT INTO trigrams VALUES (?, ?)", [(trigram, item_id) for trigram in get_trigrams(name) | get_trigrams(data or u"")])
+                self.connection.executemany("INSERT INTO tokens VALUES (?, ?)", [(token, item_id) for token in get_tokens(text) | numbers])
+        finally:
+            self.lock.release()
+    
+    def remove_items(self, path):
+        """NOTE: the caller must hold self.lock"""
+        self.connection.execute("DELETE FROM trigrams WHERE item_id IN (SELECT id FROM items WHERE key_path = ?)", (path, ))
+        self.connection.execute("DELETE FROM tokens WHERE item_id IN (SELECT id FROM items WHERE key_path = ?)", (path, ))
+        self.connection.execute("DELETE FROM items WHERE key_path = ?", (path, ))
+    
+    def remove_subtree(self, path):
+        """Removes the key at the lower case 'path' and everything below it.
+        NOTE: the caller must hold self.lock"""
+        stack = [path]
+        while (len(stack) > 0):
+            path = stack.pop()
+            row = self.connection.execute("SELECT subkeys FROM keys WHERE path = ?", (path, )).fetchone()
+            if (row == None):
+                continue
+            stack.extend([path + "\\" + name.lower() for name in json.loads(row[0])])
+            
+            self.remove_items(path)
+            self.connection.execute("DELETE FROM keys WHERE path = ?", (path, ))
+    
+    def get_candidates(self, options, matcher):
+        """Uses the inverted index to narrow down the items that could match 'options'. 'matcher' is the SearchMatcher for them.
+        Numeric terms also find DWORD and QWORD values by number. Binary data is matched byte by byte (see SearchMatcher),
+        which the trigrams of its hex can't narrow down, so every binary value is a candidate for plain data searches.
+        NOTE: the caller must hold self.lock
+        
+        returns a set of item ids, or None if every item has to be checked"""
+        if (options.use_regex):
+            return None
+        
+        text = options.text
+        if (not isinstance(text, unicode)): #gtk gives us utf-8
+            text = text.decode("utf-8")
+        if (options.match_whole_string):
+            terms = [text]
+        else:
+            terms = text.split()
+        
+        candidates = set()
+        for term in terms:
+            term = term.lower()
+            if (options.match_whole_word and re.match(r"^\w+$", term, re.UNICODE) != None):
+                rows = self.connection.execute("SELECT item_id FROM tokens WHERE token = ?", (term, )).fetchall()
+            else:
+                trigrams = list(get_trigrams(term))
+                if (len(trigrams) == 0): #too short for the trigram index
+                    return None
+                rows = self.connection.execute("SELECT item_id FROM trigrams WHERE trigram IN (%s) GROUP BY item_id HAVING COUNT(*) = ?" % (", ".join(["?"] * len(trigrams))),
+                                               trigrams + [len(trigrams)]).fetchall()
+            candidates.update([row[0] for row in rows])
+        
+        if (options.search_data):
+            for number in matcher.numbers:
+                rows = self.connection.execute("SELECT item_id FROM tokens WHERE token = ?", (u"#%d" % (number), )).fetchall()
+                candidates.update([row[0] for row in rows])
+            if (matcher.match_raw):
+                rows = self.connection.execute("SELECT id FROM items WHERE type = ? AND raw IS NOT NULL", (misc.REG_BINARY, )).fetchall()
+                candidates.update([row[0] for row in rows])
+        
+        return candidates
+    
+    def search(self, options, root_keys, after = None, limit = None):
+        """Finds the keys and values in the index that match 'options', in the order a RegistrySearchEngine finds them.
+        'after' is a position (see RegistrySearchEngine), only matches after it are returned.
+        Keys are built on top of 'root_keys'. The values of the results have no data, but their 'data_text' is set.
+        
+        returns a list of SearchResult"""
+        matcher = SearchMatcher(options)
+        root_names = [root_key.name.lower() for root_key in root_keys]
+        positions = {} #lower case key path: position
+        subkey_lists = {} #lower case key path: subkey names
+        matches = []
+        
+        self.lock.acquire()
+        try:
+            candidates = self.get_candidates(options, matcher)
+            
+            query = "SELECT key_path, display_path, value_index, name, type, data, raw FROM items"
+            if (candidates != None):
+                self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS candidates (id INTEGER PRIMARY KEY)")
+                self.connection.execute("DELETE FROM candidates")
+                self.connection.executemany("INSERT INTO candidates VALUES (?)", [(item_id, ) for item_id in candidates])
+                query += " WHERE id IN (SELECT id FROM candidates)"
+            
+            for (key_path, display_path, value_index, name, type, data, raw) in self.connection.execute(query):
+                if (value_index < 0):
+                    if (options.search_keys and matcher.match(name)):
+                        match_type = "key"
+                    else:
+                        continue
+                elif (options.search_values and matcher.match(name)):
+                    match_type = "value"
+                elif (options.search_data and RegistryIndex.match_data(matcher, type, data, raw)):
+                    match_type = "data"
+                else:
+                    continue
+                
+                key_position = self.get_key_position(key_path, root_names, positions, subkey_lists)
+                if (key_position == None): #not under 'root_keys'
+                    continue
+                
+                if (value_index < 0):
+                    position = key_position + (0, )
+                elif (match_type == "value"):
+                    position = key_position + (1, value_index, 0)
+                else:
+                    position = key_position + (1, value_index, 1)
+                
+                if (after == None or position > after):
+                    matches.append((position, display_path, value_index, name, type, data, match_type))
+        finally:
+            self.lock.release()
+        
+        matches.sort()
+        if (limit != None):
+            matches = matches[:limit]
+        
+        results = []
+        for (position, display_path, value_index, name, type, data, match_type) in matches:
+            key = key_from_path(root_keys, display_path)
+            
+            value = None
+            if (value_index >= 0):
+                value = RegistryValue(name, type, None, key)
+                value.data_loaded = False
+            
+            result = SearchResult(position, key, value, match_type)
+            result.data_text = data
+            results.append(result)
+        
+        return results
+    
+    def get_subkey_names(self, path, subkey_lists):
+        """Gets the subkey names the index has for the key at the lower case 'path', in the order the server listed them.
+        'subkey_lists' caches them between calls.
+        NOTE: the caller must hold self.lock
+        
+        returns a list of unicode strings, or None if the key isn't indexed"""
+        if (not subkey_lists.has_key(path)):
+            row = self.connection.execute("SELECT subkeys FROM keys WHERE path = ?", (path, )).fetchone()
+            if (row == None):
+                subkey_lists[path] = None
+            else:
+                subkey_lists[path] = json.loads(row[0])
+        return subkey_lists[path]
+    
+    def get_key_position(self, path, root_names, positions, subkey_lists):
+        """Gets the position RegistrySearchEngine gives the key at the lower case 'path': the index of its root key in
+        'root_names' and then (2, subkey index) for every key below that. 'positions' and 'subkey_lists' cache what's
+        been worked out between calls.
+        NOTE: the caller must hold self.lock
+        
+        returns a tuple, or None if the key isn't under one of 'root_names' or a key on the way isn't indexed"""
+        if (positions.has_key(path)):
+            return positions[path]
+        
+        position = None
+        if ("\\" not in path):
+            if (path in root_names):
+                position = (root_names.index(path), )
+        else:
+            (parent_path, name) = path.rsplit("\\", 1)
+            parent_position = self.get_key_position(parent_path, root_names, positions, subkey_lists)
+            subkey_names = self.get_subkey_names(parent_path, subkey_lists)
+            if (parent_position != None and subkey_names != None):
+                names = [subkey_name.lower() for subkey_name in subkey_names]
+                if (name in names):
+                    position = parent_position + (2, names.index(name))
+        
+        positions[path] = position
+        return position
+    
+    @staticmethod
+    def match_data(matcher, type, data, raw):
+        """Checks the data of an item from the index with 'matcher' the way a search of the server checks the value.
+        
+        returns True if it matches"""
+        if (raw != None):
+            value = RegistryValue("", type, list(bytearray(binascii.unhexlify(raw))), None)
+            return matcher.match_data(value)
+        if (data == None):
+            return False
+        return matcher.match(data)
+    
+    def get_position(self, key, root_keys, value_start = -1):
+        """Gets the position to pass to search() as 'after' to search from 'key' onwards, like SearchCursor.from_key() does.
+        With the default 'value_start' the key's own name is skipped but its values are searched, otherwise the search
+        starts after the value at 'value_start'. If 'key' isn't indexed the search starts in the closest ancestor that is.
+        
+        returns a tuple, or None to search everything"""
+        root_names = [root_key.name.lower() for root_key in root_keys]
+        positions = {}
+        subkey_lists = {}
+        
+        self.lock.acquire()
+        try:
+            position = self.get_key_position(key.get_absolute_path().lower(), root_names, positions, subkey_lists)
+            while (position == None and key.parent != None):
+                key = key.parent
+                value_start = -1
+                position = self.get_key_position(key.get_absolute_path().lower(), root_names, positions, subkey_lists)
+        finally:
+            self.lock.release()
+        
+        if (position == None):
+            return None
+        if (value_start < 0):
+            return position + (0, )
+        return position + (1, value_start, 1)
+    
+    def get_cursor(self, key, root_keys, value_start = 0, options = None):
+        """Makes the SearchCursor that SearchCursor.from_key() would make, from the subkey lists in the index instead of the
+        server's, so a search can carry on from a match found in the index.
+        
+        returns a SearchCursor, or None if 'key' isn't indexed"""
+        ancestors = []
+        while (key != None):
+            ancestors.append(key)
+            key = key.parent
+        ancestors.reverse()
+        
+        entries = []
+        position = ()
+        self.lock.acquire()
+        try:
+            sibling_paths = [root_key.get_absolute_path() for root_key in root_keys]
+            for depth in xrange(len(ancestors)):
+                names = [sibling_path.split("\\")[-1].lower() for sibling_path in sibling_paths]
+                if (ancestors[depth].name.lower() not in names):
+                    return None
+                index = names.index(ancestors[depth].name.lower())
+                if (depth > 0):
+                    position += (2, )
+                
+                for sibling_index in xrange(index + 1, len(sibling_paths)):
+                    entries.append((position + (sibling_index, ), sibling_paths[sibling_index], -1))
+                position += (index, )
+                
+                if (depth < len(ancestors) - 1):
+                    subkey_names = self.get_subkey_names(ancestors[depth].get_absolute_path().lower(), {})
+                    if (subkey_names == None):
+                        return None
+                    sibling_paths = [ancestors[depth].get_absolute_path() + "\\" + name for name in subkey_names]
+        finally:
+            self.lock.release()
+        
+        entries.append((position, ancestors[-1].get_absolute_path(), value_start))
+        entries.sort()
+        
+        return SearchCursor(entries, options)
+    
+    @staticmethod
+    def verify_result(pipe_manager, result, options):
+        """Checks with the server that 'result' still matches, in case the registry changed since it was indexed.
+        
+        returns True if it does"""
+        matcher = SearchMatcher(options)
+        
+        pipe_manager.lock.acquire()
+        try:
+            key = pipe_manager.get_key_for_path(result.key.get_absolute_path())
+            if (result.value == None):
+                return matcher.match(key.name)
+            
+            value_list = pipe_manager.get_values_for_key(key, result.match_type == "data")
+        except (RuntimeError, ValueError):
+            return False
+        finally:
+            pipe_manager.lock.release()
+        
+        for value in value_list:
+            if (value.name.lower() == result.value.name.lower()):
+                if (result.match_type == "value"):
+                    return matcher.match(value.name)
+                else:
+                    return matcher.match_data(value)
+        return False
+
+
+class RegistryCrawler:
+    """Brings a RegistryIndex up to date, using one worker thread per pipe manager in 'pipe_managers'.
+    
+    Every key costs one QueryInfoKey call. Only keys whose last write time differs from the one in the index are listed
+    and indexed again; for the others we take the subkey list from the index. A key's last write time doesn't change when
+    something further down changes, so we still have to look at every key, but we don't have to list them."""
+    
+    def __init__(self, pipe_managers, index, progress_callback = None):
+        self.pipe_managers = pipe_managers
+        self.index = index
+        self.progress_callback = progress_callback #called with every key we look at, from the worker threads
+        
+        self.condition = threading.Condition()
+        self.keys = collections.deque()
+        self.outstanding = 0
+        self.stopped = False
+        
+        self.keys_checked = 0
+        self.keys_updated = 0
+    
+    def run(self, root_keys):
+        """Crawls everything below 'root_keys' and blocks until it's done or cancelled."""
+        self.keys.extend(root_keys)
+        self.outstanding = len(root_keys)
+        
+        workers = []
+        for index in xrange(len(self.pipe_managers)):
+            worker = threading.Thread(target = self.work, args = (self.pipe_managers[index], ), name = "CrawlWorker-%d" % (index))
+            worker.setDaemon(True)
+            workers.append(worker)
+            worker.start()
+        
+        for worker in workers:
+            worker.join()
+        
+        self.index.commit()
+    
+    def cancel(self):
+        self.condition.acquire()
+        self.stopped = True
+        self.condition.notifyAll()
+        self.condition.release()
+    
+    def work(self, pipe_manager):
+        while True:
+            self.condition.acquire()
+            try:
+                while (len(self.keys) == 0 and self.outstanding > 0 and not self.stopped):
+                    self.condition.wait(0.5)
+                if (self.stopped or len(self.keys) == 0):
+                    self.condition.notifyAll()
+                    return
+                key = self.keys.pop()
+            finally:
+                self.condition.release()
+            
+            subkey_list = []
+            try:
+                subkey_list = self.crawl_key(pipe_manager, key)
+            except RuntimeError as re:
+                #probably a WERR_ACCESS_DENIED exception. We'll just skip over keys that can't be fetched
+                print "Failed to index %s: %s." % (key.get_absolute_path(), re.args[1])
+            finally:
+                self.condition.acquire()
+                self.keys.extend(reversed(subkey_list))
+                self.outstanding += len(subkey_list) - 1
+                self.condition.notifyAll()
+                self.condition.release()
+    
+    def crawl_key(self, pipe_manager, key):
+        """Indexes 'key' again if it has changed.
+        
+        returns the list of its subkeys"""
+        self.condition.acquire()
+        self.keys_checked += 1
+        self.condition.release()
+        if (self.progress_callback != None):
+            self.progress_callback(key)
+        
+        pipe_manager.lock.acquire()
+        try:
+            info = pipe_manager.get_key_info(key)
+            
+            indexed = self.index.get_key(key)
+            if (indexed != None and indexed[0] == info.last_changed_time):
+                return [RegistryKey(name, key) for name in indexed[1]]
+            
+            subkey_list = pipe_manager.get_subkeys_for_key(key)
+            value_list = pipe_manager.get_values_for_key(key, self.index.index_data) #no need to fetch data we won't keep
+        finally:
+            pipe_manager.lock.release()
+        
+        self.index.update_key(key, info.last_changed_time, subkey_list, value_list)
+        self.condition.acquire()
+        self.keys_updated += 1
+        commit = (self.keys_updated % 200 == 0)
+        self.condition.release()
+        if (commit):
+            self.index.commit()
+        
+        return subkey_list
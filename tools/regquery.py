@@ -0,0 +1,214 @@
+
+import csv
+import json
+import time
+import threading
+
+from objects import RegistryValue
+
+
+class HostQueryResult:
+    """What one server said when RegistryMultiQuery asked it for the key or value."""
+    
+    def __init__(self, host):
+        self.host = host
+        self.status = "waiting" #"ok", "not found", "error" or "timed out" once it's done
+        self.values = [] #the RegistryValue, or all the key's values if no value name was given
+        self.error = None #the error message for "error" and "not found"
+        self.connect_time = None #seconds it took to connect
+        self.query_time = None #seconds it took to read the key or value once connected
+    
+    def get_rows(self):
+        """returns a list of rows for a CSV file or a table: host, status, value name, type, data, connect ms, query ms, error"""
+        connect_ms = ""
+        if (self.connect_time != None):
+            connect_ms = "%.0f" % (self.connect_time * 1000)
+        query_ms = ""
+        if (self.query_time != None):
+            query_ms = "%.0f" % (self.query_time * 1000)
+        
+        if (len(self.values) == 0):
+            return [[self.host, self.status, "", "", "", connect_ms, query_ms, self.error or ""]]
+        
+        rows = []
+        for value in self.values:
+            rows.append([self.host, self.status, value.name, RegistryValue.get_type_name(value.type), value.get_data_string(), connect_ms, query_ms, self.error or ""])
+        return rows
+
+
+class CSVResultWriter:
+    """Writes HostQueryResult rows to a CSV file as they come in."""
+    
+    header = ["host", "status", "value", "type", "data", "connect_ms", "query_ms", "error"]
+    
+    def __init__(self, file):
+        self.file = file
+        self.writer = csv.writer(file)
+        self.writer.writerow(CSVResultWriter.header)
+    
+    def write_result(self, result):
+        for row in result.get_rows():
+            self.writer.writerow([unicode(field).encode("utf-8") for field in row])
+        self.file.flush()
+
+
+class JSONResultWriter:
+    """Writes HostQueryResult rows to a file as JSON objects, one per line, with the same fields as CSVResultWriter."""
+
+    def __init__(self, file):
+        self.file = file
+
+    def write_result(self, result):
+        for row in result.get_rows():
+            self.file.write(json.dumps(dict(zip(CSVResultWriter.header, row))) + "\n")
+        self.file.flush()
+
+
+class RegistryMultiQuery:
+    """Reads one key, or one value in it, from many servers at once.
+    
+    Every server gets its own connection, made with 'pipe_manager_class' (WinRegPipeManager). At most 'max_workers' servers
+    are talked to at a time. Only the root key the path starts with is opened, then the key with a single OpenKey() call.
+    Servers that take more than 'timeout' seconds are reported as timed out and left behind, the RPC library gives us no way
+    to interrupt a call that's already been sent. Their threads still count towards 'max_workers' until the call returns,
+    so there are never more than that many threads. Where the library supports it the pipe's own request timeout is set too."""
+    
+    def __init__(self, pipe_manager_class, hosts, path, value_name, username, password, transport_type = 0,
+                 max_workers = 16, timeout = 30, result_callback = None):
+        self.pipe_manager_class = pipe_manager_class
+        self.hosts = hosts
+        self.path = path
+        self.value_name = value_name #None to read every value of the key
+        self.username = username
+        self.password = password
+        self.transport_type = transport_type
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.result_callback = result_callback #called with every HostQueryResult when its host is done, from the thread that called run()
+        
+        self.condition = threading.Condition()
+        self.stopped = False
+        
+        self.results = []
+    
+    def run(self):
+        """Queries every host and blocks until they're all done or the query is cancelled.
+        
+        returns the list of HostQueryResult, in the order the hosts finished"""
+        waiting = list(reversed(self.hosts))
+        running = [] #(start time, thread, result)
+        left_behind = [] #threads of hosts that timed out, still waiting for their call to return
+        
+        self.condition.acquire()
+        try:
+            while ((len(waiting) > 0 or len(running) > 0) and not self.stopped):
+                left_behind = [thread for thread in left_behind if thread.isAlive()]
+                while (len(waiting) > 0 and len(running) + len(left_behind) < self.max_workers):
+                    result = HostQueryResult(waiting.pop())
+                    thread = threading.Thread(target = self.query_host, args = (result, ), name = "QueryWorker-%s" % (result.host))
+                    thread.setDaemon(True) #so a server that never answers can't keep us from exiting
+                    thread.start()
+                    running.append((time.time(), thread, result))
+                
+                self.condition.wait(0.2)
+                
+                now = time.time()
+                still_running = []
+                for (start_time, thread, result) in running:
+                    if (result.status == "waiting" and now - start_time > self.timeout):
+                        result.status = "timed out"
+                        result.error = "No answer after %d seconds" % (self.timeout)
+                        left_behind.append(thread)
+                    if (result.status == "waiting"):
+                        still_running.append((start_time, thread, result))
+                        continue
+                    
+                    self.results.append(result)
+                    if (self.result_callback != None):
+                        self.condition.release() #so the workers can carry on while the callback runs
+                        try:
+                            self.result_callback(result)
+                        finally:
+                            self.condition.acquire()
+                running = still_running
+        finally:
+            self.condition.release()
+        
+        return self.results
+    
+    def cancel(self):
+        self.condition.acquire()
+        self.stopped = True
+        self.condition.notifyAll()
+        self.condition.release()
+    
+    def query_host(self, result):
+        """Runs in a worker thread for each host."""
+        status = "ok"
+        error = None
+        values = []
+        connect_time = None
+        query_time = None
+        
+        pipe_manager = None
+        start_time = time.time()
+        try:
+            pipe_manager = self.pipe_manager_class(result.host, self.transport_type, self.username, self.password, open_keys = False)
+            if (hasattr(pipe_manager.pipe, "request_timeout")): #newer versions of the library can time out calls themselves
+                pipe_manager.pipe.request_timeout = int(self.timeout)
+            connect_time = time.time() - start_time
+            
+            start_time = time.time()
+            key = pipe_manager.get_key_for_path(self.path)
+            if (self.value_name != None):
+                try:
+                    values = [pipe_manager.get_value(key, self.value_name)]
+                except RuntimeError as re:
+                    if (re.args[0] != 0x2): #0x2 is WERR_BADFILE
+                        raise re
+                    status = "not found"
+                    error = "The value doesn't exist"
+            else:
+                values = pipe_manager.get_values_for_key(key)
+            query_time = time.time() - start_time
+        
+        except RuntimeError as re:
+            if (re.args[0] == 0x2): #0x2 is WERR_BADFILE
+                status = "not found"
+                error = "The key doesn't exist"
+            else:
+                status = "error"
+                error = str(re.args[-1])
+        except Exception as ex:
+            status = "error"
+            error = str(ex)
+        finally:
+            if (pipe_manager != None):
+                try:
+                    pipe_manager.close()
+                except RuntimeError:
+                    pass
+        
+        self.condition.acquire()
+        try:
+            if (result.status == "waiting"): #otherwise we took too long and it's been reported already
+                result.values = values
+                result.error = error
+                result.connect_time = connect_time
+                result.query_time = query_time
+                result.status = status
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+
+def read_hosts(file):
+    """Reads one host name per line, skipping blank lines and lines that start with '#'.
+    
+    returns a list of host names"""
+    hosts = []
+    for line in file:
+        line = line.strip()
+        if (line != "" and not line.startswith("#")):
+            hosts.append(line)
+    return hosts
@@ -0,0 +1,628 @@
+
+import re
+import struct
+import binascii
+import threading
+import collections
+import json
+
+from samba.dcerpc import misc
+
+from objects import RegistryKey
+from objects import RegistrySearchOptions
+
+
+#a work item's value_start when all of its values have been searched and only its subkeys are left
+VALUES_DONE = 0x7FFFFFFF
+
+
+def key_from_path(root_keys, path):
+    """Builds a RegistryKey for 'path' on top of the matching key in 'root_keys'. Nothing is fetched from the server.
+    
+    returns a RegistryKey or None if the root key isn't in 'root_keys'"""
+    names = path.split("\\")
+    root_key_list = [key for key in root_keys if key.name.lower() == names[0].lower()]
+    if (len(root_key_list) == 0):
+        return None
+    
+    key = root_key_list[0]
+    for name in names[1:]:
+        key = RegistryKey(name, key)
+    return key
+
+
+class SearchMatcher:
+    """Matches names and data against every search term at once, using one regular expression compiled from the RegistrySearchOptions.
+    Numeric search terms (like 16 or 0x10) also match DWORD and QWORD values by number, whatever way the data is displayed.
+    
+    Data is matched against the raw bytes of the value: the search terms are encoded once as UTF-16LE and ASCII text,
+    as hex byte strings and as little endian DWORDs and QWORDs, so no display strings get built while searching.
+    Regular expressions and whole word searches can't be matched that way, so the data gets decoded for those."""
+    
+    string_types = [misc.REG_SZ, misc.REG_EXPAND_SZ, misc.REG_MULTI_SZ]
+    
+    def __init__(self, options):
+        self.numbers = set()
+        #for plain search terms it's much faster to lower() the text than to let the regular expression ignore case
+        self.fold_case = (not options.match_case and not options.use_regex)
+        #raw byte matching only works for plain search terms
+        self.match_raw = (not options.use_regex and not options.match_whole_word)
+        terms = []
+        
+        text = options.text
+        if (not isinstance(text, unicode)): #gtk gives us utf-8
+            text = text.decode("utf-8")
+        
+        if (options.use_regex):
+            patterns = [text]
+        else:
+            if (options.match_whole_string):
+                terms = [text]
+            else:
+                terms = text.split()
+            
+            for term in terms:
+                try:
+                    if (term.lower().startswith("0x")):
+                        self.numbers.add(int(term, 16))
+                    else:
+                        self.numbers.add(int(term))
+                except ValueError:
+                    pass
+            
+            #longest first, so whole words aren't cut short by a shorter term that matches the start of them
+            terms.sort(key = len, reverse = True)
+            if (self.fold_case):
+                patterns = [re.escape(term.lower()) for term in terms]
+            else:
+                patterns = [re.escape(term) for term in terms]
+        
+        if (len(patterns) == 0):
+            self.regex = None
+            return
+        
+        pattern = "|".join(patterns)
+        if (options.match_whole_word):
+            pattern = r"(?<!\w)(?:%s)(?!\w)" % (pattern)
+        
+        flags = re.UNICODE
+        if (not options.match_case and not self.fold_case):
+            flags |= re.IGNORECASE
+        
+        self.regex = re.compile(pattern, flags) #raises re.error if the user's regular expression is bad
+        
+        if (self.match_raw):
+            self.compile_raw_patterns(terms)
+    
+    def compile_raw_patterns(self, terms):
+        """Encodes 'terms' into the byte patterns that match_data() looks for."""
+        utf16_patterns = []
+        ascii_patterns = []
+        hex_patterns = []
+        
+        for term in terms:
+            utf16_patterns.append(self.encode_term(term, "utf-16-le"))
+            try:
+                ascii_patterns.append(self.encode_term(term, "ascii"))
+            except UnicodeError:
+                pass
+            
+            #binary data is displayed as hex, so hex digits are looked for as the bytes they stand for
+            if (len(term) % 2 == 0 and re.match(r"^[0-9a-fA-F]+$", term) != None):
+                hex_patterns.append(re.escape(binascii.unhexlify(term)))
+        
+        self.utf16_regex = re.compile("|".join(utf16_patterns))
+        self.binary_regex = re.compile("|".join(utf16_patterns + ascii_patterns + hex_patterns))
+        
+        self.packed_numbers = {}
+        for (type, format, limit) in [(misc.REG_DWORD, "<I", 0xFFFFFFFF), (misc.REG_DWORD_BIG_ENDIAN, ">I", 0xFFFFFFFF), (misc.REG_QWORD, "<Q", 0xFFFFFFFFFFFFFFFF)]:
+            self.packed_numbers[type] = set([struct.pack(format, number) for number in self.numbers if (number >= 0 and number <= limit)])
+    
+    def encode_term(self, term, codec):
+        """Builds a byte pattern that matches 'term' encoded with 'codec', in either case if we're ignoring case.
+        
+        returns a regular expression string"""
+        parts = []
+        for ch in term:
+            if (self.fold_case and ch.lower() != ch.upper()):
+                parts.append("(?:%s|%s)" % (re.escape(ch.lower().encode(codec)), re.escape(ch.upper().encode(codec))))
+            else:
+                parts.append(re.escape(ch.encode(codec)))
+        
+        return "".join(parts)
+    
+    def match(self, text):
+        if (self.regex == None):
+            return False
+        if (self.fold_case):
+            text = text.lower()
+        return (self.regex.search(text) != None)
+    
+    def match_data(self, value):
+        if (self.regex == None or value.data == None):
+            return False
+        
+        if (value.type in self.string_types):
+            if (self.match_raw):
+                for match in self.utf16_regex.finditer(str(bytearray(value.data))):
+                    if (match.start() % 2 == 0): #so we don't match the second half of one character and the first half of the next
+                        return True
+                return False
+            else:
+                return self.match(self.decode_string(value))
+        
+        elif (value.type == misc.REG_BINARY):
+            if (self.match_raw):
+                return (self.binary_regex.search(str(bytearray(value.data))) != None)
+            else:
+                return self.match(binascii.hexlify(str(bytearray(value.data))).upper())
+        
+        elif (value.type in [misc.REG_DWORD, misc.REG_DWORD_BIG_ENDIAN, misc.REG_QWORD]):
+            if (self.match_raw and str(bytearray(value.data)) in self.packed_numbers[value.type]):
+                return True
+            elif (value.get_interpreted_data() in self.numbers):
+                return True
+            #these are only a few bytes, so the display string is cheap to build
+            return self.match(value.get_data_string())
+        
+        else:
+            return self.match(value.get_data_string())
+    
+    @staticmethod
+    def decode_string(value):
+        """Decodes REG_SZ, REG_EXPAND_SZ and REG_MULTI_SZ data all at once, the same way it's displayed.
+        
+        returns a unicode string"""
+        data = bytearray(value.data)
+        if (len(data) % 2 == 1): #corrupt keys can have half a character at the end
+            data = data[:-1]
+        text = str(data).decode("utf-16-le", "replace")
+        
+        if (value.type == misc.REG_MULTI_SZ):
+            return text.rstrip(u"\x00").replace(u"\x00", u" ") + u" "
+        else:
+            return text.replace(u"\x00", u"")
+
+
+class SearchResult:
+    
+    def __init__(self, position, key, value, match_type):
+        self.position = position #where this result is in a depth first traversal, see RegistrySearchEngine
+        self.key = key
+        self.value = value #None if the key itself matched
+        self.match_type = match_type #"key", "value" or "data"
+        self.data_text = None #the data as text when 'value' comes without its data, see RegistryIndex
+    
+    def get_absolute_path(self):
+        if (self.value == None):
+            return self.key.get_absolute_path()
+        else:
+            return self.value.get_absolute_path()
+
+
+class SearchCursor:
+    """The part of the registry that a search hasn't covered yet, so it can carry on from where it stopped.
+    Entries are (position, absolute key path, value_start) tuples. value_start is -1 if the key's name still needs checking,
+    the index of the first value left to check, or VALUES_DONE if only the subkeys are left.
+    Cursors only hold paths, so they can be saved and resumed on another connection."""
+    
+    def __init__(self, entries = None, options = None):
+        self.entries = entries or []
+        self.options = options
+    
+    def is_empty(self):
+        return (len(self.entries) == 0)
+    
+    def to_string(self):
+        data = {"entries":[[list(position), path, value_start] for (position, path, value_start) in self.entries]}
+        if (self.options != None):
+            data["options"] = self.options.__dict__
+        
+        return json.dumps(data)
+    
+    @staticmethod
+    def from_string(string):
+        data = json.loads(string)
+        
+        options = None
+        if (data.has_key("options")):
+            options = RegistrySearchOptions("")
+            options.__dict__.update(data["options"])
+        entries = [(tuple(position), path, value_start) for (position, path, value_start) in data["entries"]]
+        
+        return SearchCursor(entries, options)
+    
+    def save(self, filename):
+        cursor_file = open(filename, "w")
+        try:
+            cursor_file.write(self.to_string())
+        finally:
+            cursor_file.close()
+    
+    @staticmethod
+    def load(filename):
+        cursor_file = open(filename, "r")
+        try:
+            return SearchCursor.from_string(cursor_file.read())
+        finally:
+            cursor_file.close()
+    
+    @staticmethod
+    def from_key(pipe_manager, key, value_start = 0):
+        """Makes a cursor covering everything after the start of 'key' in depth first order: 'key' itself from 'value_start' on,
+        then the keys after 'key' and after each of its ancestors. This fetches the subkey list of every ancestor.
+        
+        returns a SearchCursor"""
+        ancestors = []
+        while (key != None):
+            ancestors.append(key)
+            key = key.parent
+        ancestors.reverse()
+        
+        pipe_manager.lock.acquire()
+        try:
+            root_keys = list(pipe_manager.well_known_keys)
+            sibling_lists = [root_keys]
+            for ancestor in ancestors[:-1]:
+                sibling_lists.append(pipe_manager.get_subkeys_for_key(ancestor))
+        finally:
+            pipe_manager.lock.release()
+        
+        entries = []
+        position = ()
+        for depth in xrange(len(ancestors)):
+            names = [sibling.name.lower() for sibling in sibling_lists[depth]]
+            index = names.index(ancestors[depth].name.lower())
+            if (depth > 0):
+                position += (2, )
+            
+            for sibling_index in xrange(index + 1, len(sibling_lists[depth])):
+                entries.append((position + (sibling_index, ), sibling_lists[depth][sibling_index].get_absolute_path(), -1))
+            position += (index, )
+        
+        entries.append((position, ancestors[-1].get_absolute_path(), value_start))
+        entries.sort()
+        
+        return SearchCursor(entries)
+
+
+class RegistrySearchEngine:
+    """Searches the registry using one worker thread per pipe manager in 'pipe_managers'.
+    
+    Every worker has its own stack of keys to search. When a worker runs out of keys it steals the oldest key from the
+    busiest worker, so a single huge subtree still gets spread over all the pipes.
+    
+    Every key gets a position, which is a tuple that sorts the same way as a depth first traversal:
+    a key at position P matches its own name at P + (0,), its values at P + (1, value_index, 0 for the name or 1 for the data)
+    and its subkeys sit at P + (2, subkey_index). In ordered mode we keep searching until no key that could still produce
+    a smaller position is left, so the result is always the first match in depth first order. Keys that can't beat the
+    best match so far are put aside. In unordered mode the first match any worker finds wins.
+    
+    Nothing that hasn't been searched is ever thrown away: get_cursor() returns everything that was put aside or left over,
+    which is where Find Next carries on from.
+    
+    If 'result_callback' is given the engine finds every match instead: each SearchResult is passed to 'result_callback'
+    (from the worker threads) as soon as it's found and the traversal carries on until every key has been searched."""
+    
+    def __init__(self, pipe_managers, options, progress_callback = None, result_callback = None):
+        self.pipe_managers = pipe_managers
+        self.options = options
+        self.progress_callback = progress_callback #called with every key we search, from the worker threads
+        self.result_callback = result_callback
+        self.find_all = (result_callback != None)
+        self.ordered = (options.ordered and not self.find_all)
+        
+        self.matcher = SearchMatcher(options)
+        
+        #work items are (position, key, value_start) tuples, see SearchCursor for value_start
+        self.condition = threading.Condition()
+        self.stacks = [collections.deque() for pipe_manager in pipe_managers]
+        self.outstanding = 0 #number of items that were pushed but not finished yet
+        self.stopped = False
+        self.best_result = None
+        self.best_resume_item = None #what's left of the best result's key after the match
+        self.best_redo_item = None #the best result's key from the match on, in case a better result turns up
+        self.deferred = [] #items we didn't search, they go into the cursor
+        
+        self.keys_searched = 0
+        self.values_searched = 0
+    
+    def add_roots(self, keys):
+        """Adds keys to search, in depth first order. Must be called before run()."""
+        self.condition.acquire()
+        try:
+            start = self.outstanding
+            items = [((start + index, ), key, -1) for index, key in enumerate(keys)]
+            items.reverse() #the stacks are popped from the end
+            self.stacks[0].extend(items)
+            self.outstanding += len(items)
+        finally:
+            self.condition.release()
+    
+    def add_cursor(self, cursor, root_keys):
+        """Adds the keys from a SearchCursor, so the search carries on where it stopped. Must be called before run()."""
+        items = []
+        for (position, path, value_start) in cursor.entries:
+            key = key_from_path(root_keys, path)
+            if (key != None):
+                items.append((position, key, value_start))
+        items.sort(key = RegistrySearchEngine.lower_bound)
+        items.reverse()
+        
+        self.condition.acquire()
+        try:
+            self.stacks[0].extend(items)
+            self.outstanding += len(items)
+        finally:
+            self.condition.release()
+    
+    def run(self):
+        """Searches until a match is found (or the whole frontier is exhausted in ordered mode) and blocks until the workers are done.
+        
+        returns a SearchResult or None"""
+        workers = []
+        for index in xrange(len(self.pipe_managers)):
+            worker = threading.Thread(target = self.work, args = (index, ), name = "SearchWorker-%d" % (index))
+            worker.setDaemon(True)
+            workers.append(worker)
+            worker.start()
+        
+        for worker in workers:
+            worker.join()
+        
+        return self.best_result
+    
+    def cancel(self):
+        self.condition.acquire()
+        self.stopped = True
+        self.condition.notifyAll()
+        self.condition.release()
+    
+    def get_cursor(self):
+        """Gets what's left to search after run() has returned.
+        
+        returns a SearchCursor"""
+        self.condition.acquire()
+        try:
+            items = list(self.deferred)
+            for stack in self.stacks:
+                items.extend(stack)
+            if (self.best_resume_item != None):
+                items.append(self.best_resume_item)
+        finally:
+            self.condition.release()
+        
+        items.sort(key = RegistrySearchEngine.lower_bound)
+        entries = [(position, key.get_absolute_path(), value_start) for (position, key, value_start) in items]
+        
+        return SearchCursor(entries, self.options)
+    
+    @staticmethod
+    def lower_bound(item):
+        """The smallest position a match in 'item' could have."""
+        (position, key, value_start) = item
+        if (value_start < 0):
+            return position
+        return position + (1, value_start)
+    
+    def work(self, index):
+        pipe_manager = self.pipe_managers[index]
+        while True:
+            item = self.take(index)
+            if (item == None):
+                return
+            try:
+                self.search_key(pipe_manager, index, item)
+            finally:
+                self.finish_item()
+    
+    def take(self, index):
+        """Gets the next item for worker 'index' to search, stealing from other workers if needed. Blocks while other workers may still produce items.
+        
+        returns an item or None when the search is over"""
+        self.condition.acquire()
+        try:
+            while True:
+                if (self.stopped):
+                    return None
+                
+                item = None
+                if (len(self.stacks[index]) > 0):
+                    item = self.stacks[index].pop()
+                else:
+                    victim = max(self.stacks, key = len)
+                    if (len(victim) > 0):
+                        item = victim.popleft() #the oldest item is the one with the biggest subtree left, most likely
+                
+                if (item == None):
+                    if (self.outstanding == 0):
+                        self.condition.notifyAll()
+                        return None
+                    self.condition.wait(0.5)
+                    continue
+                
+                if (self.ordered and self.best_result != None and RegistrySearchEngine.lower_bound(item) > self.best_result.position):
+                    #this key and everything below it comes after the best match, so we leave it for find next
+                    self.deferred.append(item)
+                    self.outstanding -= 1
+                    continue
+                
+                return item
+        finally:
+            self.condition.release()
+    
+    def push_items(self, index, items):
+        self.condition.acquire()
+        try:
+            items.reverse() #so the first subkey gets popped first
+            self.stacks[index].extend(items)
+            self.outstanding += len(items)
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+    
+    def defer(self, item):
+        self.condition.acquire()
+        self.deferred.append(item)
+        self.condition.release()
+    
+    def finish_item(self):
+        self.condition.acquire()
+        try:
+            self.outstanding -= 1
+            if (self.outstanding == 0):
+                self.condition.notifyAll()
+        finally:
+            self.condition.release()
+    
+    def report_result(self, result, resume_item, redo_item):
+        """'resume_item' is what's left of the key after the match, 'redo_item' is the same key including the match.
+        
+        returns True if the worker should stop searching the current key"""
+        if (self.find_all):
+            self.result_callback(result)
+            return False
+        
+        self.condition.acquire()
+        try:
+            if (self.best_result == None or result.position < self.best_result.position):
+                if (self.best_result != None):
+                    #the old best result will have to be found again by find next
+                    self.deferred.append(self.best_redo_item)
+                self.best_result = result
+                self.best_resume_item = resume_item
+                self.best_redo_item = redo_item
+            else:
+                self.deferred.append(redo_item)
+            
+            if (not self.ordered):
+                self.stopped = True
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        
+        return True
+    
+    def can_beat_best(self, position):
+        best_result = self.best_result #reading a reference is atomic, the lock isn't needed
+        return (best_result == None or position < best_result.position)
+    
+    def fetch_value_data(self, pipe_manager, value):
+        pipe_manager.lock.acquire()
+        try:
+            pipe_manager.fetch_value_data([value])
+        except RuntimeError as re:
+            print "Failed to fetch data for %s: %s." % (value.get_absolute_path(), re.args[1])
+        finally:
+            pipe_manager.lock.release()
+    
+    def search_key(self, pipe_manager, index, item):
+        (position, key, value_start) = item
+        
+        self.condition.acquire()
+        self.keys_searched += 1
+        self.condition.release()
+        if (self.progress_callback != None):
+            self.progress_callback(key)
+        
+        #check if this key's name matches any of our search queries
+        if (self.options.search_keys and value_start < 0):
+            if (self.matcher.match(key.name)):
+                if (self.report_result(SearchResult(position + (0, ), key, None, "key"), (position, key, 0), item)):
+                    return
+        
+        #search this key's values
+        if ((self.options.search_values or self.options.search_data) and value_start < VALUES_DONE):
+            pipe_manager.lock.acquire()
+            try:
+                #name searches don't need the data, so we leave it on the server
+                value_list = pipe_manager.get_values_for_key(key, self.options.search_data)
+            except RuntimeError as re:
+                #probably a WERR_ACCESS_DENIED exception. We'll just skip over keys that can't be fetched
+                print "Failed to fetch values for %s: %s." % (key.get_absolute_path(), re.args[1])
+                return
+            finally:
+                pipe_manager.lock.release()
+            
+            for value_index in xrange(max(value_start, 0), len(value_list)):
+                if (self.stopped):
+                    self.defer((position, key, value_index))
+                    return
+                
+                value = value_list[value_index]
+                self.condition.acquire()
+                self.values_searched += 1
+                self.condition.release()
+                
+                if (self.options.search_values and self.matcher.match(value.name)):
+                    if (self.find_all and not value.data_loaded):
+                        self.fetch_value_data(pipe_manager, value) #the results window shows the data
+                    if (self.report_result(SearchResult(position + (1, value_index, 0), key, value, "value"),
+                                           (position, key, value_index + 1),
+                                           (position, key, value_index))):
+                        return
+                    continue #we don't list a value twice in find all mode
+                if (self.options.search_data and self.matcher.match_data(value)):
+                    if (self.report_result(SearchResult(position + (1, value_index, 1), key, value, "data"),
+                                           (position, key, value_index + 1),
+                                           (position, key, value_index))):
+                        return
+        
+        #a match in another worker may have made our subkeys pointless for now
+        if (self.stopped or (self.ordered and not self.can_beat_best(position + (2, )))):
+            self.defer((position, key, VALUES_DONE))
+            return
+        
+        pipe_manager.lock.acquire()
+        try:
+            subkey_list = pipe_manager.get_subkeys_for_key(key)
+        except RuntimeError as re:
+            #probably a WERR_ACCESS_DENIED exception. We'll just skip over keys that can't be fetched
+            print "Failed to fetch subkeys for %s: %s." % (key.get_absolute_path(), re.args[1])
+            return
+        finally:
+            pipe_manager.lock.release()
+        
+        self.push_items(index, [(position + (2, subkey_index), subkey, -1) for subkey_index, subkey in enumerate(subkey_list)])
+
+
+if __name__ == "__main__":
+    #a quick benchmark of the matcher against the loop the search used to do
+    import time
+    import random
+    
+    random.seed(1)
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_ "
+    names = [u"".join([random.choice(alphabet) for i in xrange(random.randint(5, 30))]) for j in xrange(1000000)]
+    options = RegistrySearchOptions("Explorer Policies CurrentVersion Run 0x10")
+    options.match_case = True #the old loop was case sensitive
+    search_items = options.text.split()
+    
+    start = time.time()
+    loop_count = 0
+    for name in names:
+        for search_item in search_items:
+            if (name.find(search_item) >= 0):
+                loop_count += 1
+                break
+    loop_time = time.time() - start
+    
+    matcher = SearchMatcher(options)
+    start = time.time()
+    matcher_count = 0
+    for name in names:
+        if (matcher.match(name)):
+            matcher_count += 1
+    matcher_time = time.time() - start
+    
+    options.match_case = False
+    matcher = SearchMatcher(options)
+    start = time.time()
+    for name in names:
+        matcher.match(name)
+    folded_time = time.time() - start
+    
+    print "%d names, %d search terms" % (len(names), len(search_items))
+    print "find() loop:            %.2fs (%d matches)" % (loop_time, loop_count)
+    print "matcher:                %.2fs (%d matches)" % (matcher_time, matcher_count)
+    print "matcher, ignoring case: %.2fs" % (folded_time)
@@ -0,0 +1,244 @@
+
+import gobject
+import gtk
+
+
+class KeyRow(object):
+    """One row of a RegistryKeyTreeModel. 'key' is None for the "Loading..." row of a key whose subkeys are being fetched."""
+    
+    __slots__ = ("key", "parent", "index", "children", "names")
+    
+    def __init__(self, key, parent, index):
+        self.key = key
+        self.parent = parent
+        self.index = index #where we are in parent.children
+        self.children = [] #KeyRow
+        self.names = None #maps the lower case names of the children to their rows, built by find_child() when it's needed
+
+
+class RegistryKeyTreeModel(gtk.GenericTreeModel):
+    """The model for the keys tree. Column 0 is the name of the key, column 1 the RegistryKey.
+    
+    Every key's subkeys are a plain list of KeyRow, and rows are only looked at when the tree view asks for them, so a key
+    with tens of thousands of subkeys costs one small object per subkey and no per row work until it's shown.
+    find_child() looks subkeys up by name in a dictionary, so finding a key in the tree costs one lookup per level.
+    A gtk.TreeStore finds the end of a list of siblings by walking it, which makes filling a big key take quadratic time.
+    set_children() and update_children() replace all the subkeys of a key in one go instead.
+    
+    The tree view is told about every row that's added or removed, so row references and the selection keep working.
+    Setting the subkeys of a collapsed key is cheap, the tree view ignores rows below collapsed rows. The iters are the
+    rows themselves and aren't kept alive by the model, so iters for rows that have been removed must not be used."""
+    
+    column_types = [gobject.TYPE_STRING, gobject.TYPE_PYOBJECT]
+    
+    def __init__(self):
+        gtk.GenericTreeModel.__init__(self)
+        self.set_property("leak-references", False) #every row is in self.root's tree, so nothing needs to be leaked
+        
+        self.root = KeyRow(None, None, 0) #its children are the root keys
+    
+    def get_row(self, iter):
+        """returns the KeyRow for 'iter', or the hidden root row if 'iter' is None"""
+        if (iter == None):
+            return self.root
+        return self.get_user_data(iter)
+    
+    def get_row_path(self, row):
+        path = []
+        while (row is not self.root):
+            path.append(row.index)
+            row = row.parent
+        path.reverse()
+        return tuple(path)
+    
+    def set_children(self, iter, key_list):
+        """Makes the keys in 'key_list' the children of 'iter' (the root keys if 'iter' is None), dropping the rows that were
+        there before along with everything below them."""
+        parent = self.get_row(iter)
+        path = self.get_row_path(parent)
+        had_children = (len(parent.children) > 0)
+        parent.names = None
+        
+        while (len(parent.children) > 0): #the tree view expects to be told about the rows one at a time, from the end
+            row = parent.children.pop()
+            self.row_deleted(path + (row.index, ))
+        
+        for key in key_list:
+            row = KeyRow(key, parent, len(parent.children))
+            parent.children.append(row)
+            self.row_inserted(path + (row.index, ), self.create_tree_iter(row))
+        
+        if (parent is not self.root and had_children != (len(parent.children) > 0)):
+            self.row_has_child_toggled(path, iter)
+    
+    def update_children(self, iter, key_list):
+        """Makes the children of 'iter' match 'key_list' without rebuilding them. Rows of keys that are still in 'key_list' are kept
+        (along with their children and whether they're expanded), rows of keys that are gone are removed and new keys are inserted in order.
+        Where a row matches a key in 'key_list' by name, the row keeps its own key and 'key_list' is changed to hold that key instead."""
+        parent = self.get_row(iter)
+        path = self.get_row_path(parent)
+        had_children = (len(parent.children) > 0)
+        parent.names = None
+        
+        list_indexes = dict([(key.name.lower(), index) for (index, key) in enumerate(key_list)])
+        kept_rows = {} #maps the index in 'key_list' to the row we kept for it
+        renamed_rows = []
+        removed_indexes = []
+        for row in parent.children:
+            index = None
+            if (row.key != None): #"Loading..." rows always go
+                index = list_indexes.get(row.key.name.lower())
+            if (index == None or kept_rows.has_key(index)):
+                removed_indexes.append(row.index)
+            else:
+                if (row.key.name != key_list[index].name): #the case has changed
+                    row.key.name = key_list[index].name
+                    renamed_rows.append(row)
+                key_list[index] = row.key
+                kept_rows[index] = row
+        
+        if (len(removed_indexes) > 1000 and len(removed_indexes) > len(parent.children) / 4):
+            #removing rows from the middle of a list one at a time gets slow, at this point it's quicker to start over
+            self.set_children(iter, key_list)
+            return
+        
+        for index in reversed(removed_indexes):
+            del parent.children[index]
+            self.row_deleted(path + (index, ))
+        self.reindex(parent)
+        
+        #put the kept rows in the same order as 'key_list'
+        new_order = [row.index for (index, row) in sorted(kept_rows.items())]
+        if (new_order != range(len(new_order))):
+            parent.children = [parent.children[old_index] for old_index in new_order]
+            self.reindex(parent)
+            self.rows_reordered(path, iter, new_order)
+        
+        #and add the new keys where they belong
+        if (len(kept_rows) < len(key_list)):
+            children = []
+            for (index, key) in enumerate(key_list):
+                row = kept_rows.get(index)
+                if (row == None):
+                    row = KeyRow(key, parent, index)
+                children.append(row)
+            parent.children = children
+            self.reindex(parent)
+            
+            for index in xrange(len(key_list)):
+                if (not kept_rows.has_key(index)):
+                    self.row_inserted(path + (index, ), self.create_tree_iter(children[index]))
+        
+        for row in renamed_rows:
+            self.row_changed(path + (row.index, ), self.create_tree_iter(row))
+        
+        if (parent is not self.root and had_children != (len(parent.children) > 0)):
+            self.row_has_child_toggled(path, iter)
+    
+    def reindex(self, parent):
+        for (index, row) in enumerate(parent.children):
+            row.index = index
+    
+    def set_loading(self, iter):
+        """Shows a "Loading..." row under 'iter' until its subkeys are set."""
+        parent = self.get_row(iter)
+        if (len(parent.children) > 0):
+            return
+        
+        row = KeyRow(None, parent, 0)
+        parent.children.append(row)
+        parent.names = None
+        path = self.get_row_path(parent)
+        self.row_inserted(path + (0, ), self.create_tree_iter(row))
+        self.row_has_child_toggled(path, iter)
+    
+    def clear_loading(self, iter):
+        """Takes away the "Loading..." row under 'iter', if it's still there."""
+        if (self.is_loading(iter)):
+            self.set_children(iter, [])
+    
+    def is_loading(self, iter):
+        """returns True if the only row under 'iter' is a "Loading..." row"""
+        parent = self.get_row(iter)
+        return (len(parent.children) == 1 and parent.children[0].key == None)
+    
+    def clear(self):
+        self.set_children(None, [])
+    
+    def find_child(self, iter, name):
+        """Gets the iterator for the child of 'iter' called 'name'. Names are compared case insensitively, like the registry does.
+        If 'iter' is None then the root keys are searched.
+        
+        returns an iterator or None"""
+        parent = self.get_row(iter)
+        if (parent.names == None):
+            #first one wins if there are two with the same name, like it would if we searched the list
+            parent.names = dict([(row.key.name.lower(), row) for row in reversed(parent.children) if row.key != None])
+        
+        row = parent.names.get(name.lower())
+        if (row == None):
+            return None
+        return self.create_tree_iter(row)
+    
+    
+    # gtk.GenericTreeModel
+    
+    def on_get_flags(self):
+        return 0
+    
+    def on_get_n_columns(self):
+        return len(RegistryKeyTreeModel.column_types)
+    
+    def on_get_column_type(self, index):
+        return RegistryKeyTreeModel.column_types[index]
+    
+    def on_get_iter(self, path):
+        row = self.root
+        for index in path:
+            if (index >= len(row.children)):
+                return None
+            row = row.children[index]
+        return row
+    
+    def on_get_path(self, row):
+        return self.get_row_path(row)
+    
+    def on_get_value(self, row, column):
+        if (column == 0):
+            if (row.key == None):
+                return "Loading..."
+            return row.key.name
+        return row.key
+    
+    def on_iter_next(self, row):
+        index = row.index + 1
+        if (index < len(row.parent.children)):
+            return row.parent.children[index]
+        return None
+    
+    def on_iter_children(self, row):
+        if (row == None):
+            row = self.root
+        if (len(row.children) > 0):
+            return row.children[0]
+        return None
+    
+    def on_iter_has_child(self, row):
+        return (len(row.children) > 0)
+    
+    def on_iter_n_children(self, row):
+        if (row == None):
+            row = self.root
+        return len(row.children)
+    
+    def on_iter_nth_child(self, row, n):
+        if (row == None):
+            row = self.root
+        if (n < len(row.children)):
+            return row.children[n]
+        return None
+    
+    def on_iter_parent(self, row):
+        if (row.parent is self.root):
+            return None
+        return row.parent
@@ -0,0 +1,200 @@
+
+import csv
+import threading
+import collections
+
+
+class KeyUsage:
+    """How much space one key takes up, on its own and with everything below it."""
+    
+    def __init__(self, key, parent, depth):
+        self.key = key #a RegistryKey
+        self.parent = parent #the KeyUsage of the parent, None for the key the analysis started at
+        self.depth = depth #how far below the key the analysis started at
+        self.children = []
+        self.error = None #the error message if the key couldn't be read
+        
+        self.subkey_count = 0
+        self.value_count = 0
+        self.value_bytes = 0 #data of this key's values only, None if the sizes weren't asked for
+        
+        #with everything below the key, filled in once the whole subtree has been read
+        self.total_keys = 1
+        self.total_values = 0
+        self.total_bytes = 0
+        self.max_depth = 0 #how many levels of keys there are below this one
+    
+    def get_absolute_path(self):
+        return self.key.get_absolute_path()
+
+
+class RegistryUsageAnalyzer:
+    """Adds up how many keys, values and bytes of value data are below a key, like du does for a directory.
+    
+    The keys are read breadth first by a worker thread per pipe manager in 'pipe_managers'. Every key costs one
+    QueryInfoKey() call for its subkey and value counts, plus one EnumKey() call per subkey. If 'count_bytes' is True
+    the values are enumerated too, but without a data buffer, so the server only tells us how big the data is and no
+    value data crosses the wire. Without 'count_bytes' only the counts are gathered, which is much quicker for keys
+    with many values."""
+    
+    def __init__(self, pipe_managers, count_bytes = True, progress_callback = None):
+        self.pipe_managers = pipe_managers
+        self.count_bytes = count_bytes
+        self.progress_callback = progress_callback #called with every KeyUsage once it's been read, from the worker threads
+        
+        self.condition = threading.Condition()
+        self.queue = collections.deque() #KeyUsage that no worker has read yet
+        self.busy = 0 #keys the workers are reading, they may queue more
+        self.stopped = False
+        
+        self.nodes = [] #every KeyUsage that's been read, parents before their children
+        self.keys_read = 0
+        self.values_counted = 0
+        self.failed_keys = [] #(absolute path, error message)
+    
+    def run(self, key):
+        """Reads 'key' and everything below it, and blocks until it's done or cancelled.
+        
+        returns the KeyUsage for 'key', with the totals of whatever was read"""
+        root = KeyUsage(key, None, 0)
+        self.queue.append(root)
+        
+        workers = []
+        for index in xrange(len(self.pipe_managers)):
+            worker = threading.Thread(target = self.work, args = (self.pipe_managers[index], ), name = "UsageWorker-%d" % (index))
+            worker.setDaemon(True)
+            workers.append(worker)
+            worker.start()
+        
+        for worker in workers:
+            worker.join()
+        
+        #add up the totals, children first
+        for node in reversed(self.nodes):
+            if (node.parent != None):
+                node.parent.total_keys += node.total_keys
+                node.parent.total_values += node.total_values
+                node.parent.total_bytes += node.total_bytes
+                node.parent.max_depth = max(node.parent.max_depth, node.max_depth + 1)
+        self.nodes = []
+        
+        return root
+    
+    def cancel(self):
+        self.condition.acquire()
+        self.stopped = True
+        self.queue.clear()
+        self.condition.notifyAll()
+        self.condition.release()
+    
+    def work(self, pipe_manager):
+        while True:
+            self.condition.acquire()
+            try:
+                while (len(self.queue) == 0 and self.busy > 0 and not self.stopped): #someone may still queue subkeys
+                    self.condition.wait(0.5)
+                if (len(self.queue) == 0 or self.stopped):
+                    self.condition.notifyAll()
+                    return
+                node = self.queue.popleft()
+                self.busy += 1
+            finally:
+                self.condition.release()
+            
+            try:
+                try:
+                    self.read_key(pipe_manager, node)
+                except RuntimeError as re:
+                    #probably WERR_ACCESS_DENIED, what's below the key isn't counted
+                    node.error = re.args[-1]
+                except Exception as ex:
+                    #the other workers mustn't wait for this one forever
+                    node.error = str(ex)
+                    raise
+            finally:
+                self.condition.acquire()
+                self.busy -= 1
+                self.nodes.append(node)
+                self.keys_read += 1
+                self.values_counted += node.value_count
+                if (node.error != None):
+                    self.failed_keys.append((node.get_absolute_path(), node.error))
+                elif (not self.stopped):
+                    self.queue.extend(node.children)
+                self.condition.notifyAll()
+                self.condition.release()
+            
+            if (self.progress_callback != None):
+                self.progress_callback(node)
+    
+    def read_key(self, pipe_manager, node):
+        pipe_manager.lock.acquire()
+        try:
+            path_handles = pipe_manager.open_path(node.key)
+            try:
+                key_handle = path_handles[-1]
+                info = pipe_manager.query_key_info(key_handle)
+                
+                subkey_list = []
+                index = 0
+                while (index < info.num_subkeys):
+                    try:
+                        subkey_list.append(pipe_manager.enum_key(key_handle, index, node.key, info))
+                        index += 1
+                    except RuntimeError as re:
+                        if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS, subkeys were deleted since we asked
+                            break
+                        raise re
+                
+                value_bytes = None
+                if (self.count_bytes):
+                    value_bytes = 0
+                    index = 0
+                    while (index < info.num_values):
+                        try:
+                            value_bytes += pipe_manager.enum_value(key_handle, index, node.key, info, False).get_data_size()
+                            index += 1
+                        except RuntimeError as re:
+                            if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS
+                                break
+                            raise re
+            finally:
+                pipe_manager.close_path(path_handles)
+        finally:
+            pipe_manager.lock.release()
+        
+        node.subkey_count = len(subkey_list)
+        node.value_count = info.num_values
+        node.value_bytes = value_bytes
+        node.total_values = node.value_count
+        node.total_bytes = value_bytes or 0
+        node.children = [KeyUsage(subkey, node, node.depth + 1) for subkey in subkey_list]
+
+
+class CSVUsageWriter:
+    """Writes KeyUsage rows to a CSV file."""
+    
+    header = ["path", "depth", "subkeys", "values", "value_bytes", "total_keys", "total_values", "total_bytes", "max_depth", "error"]
+    
+    def __init__(self, file):
+        self.file = file
+        self.writer = csv.writer(file)
+        self.writer.writerow(CSVUsageWriter.header)
+    
+    def write_node(self, node):
+        value_bytes = ""
+        if (node.value_bytes != None):
+            value_bytes = node.value_bytes
+        row = [node.get_absolute_path(), node.depth, node.subkey_count, node.value_count, value_bytes,
+               node.total_keys, node.total_values, node.total_bytes, node.max_depth, node.error or ""]
+        self.writer.writerow([unicode(field).encode("utf-8") for field in row])
+    
+    def write_tree(self, root, max_depth = None):
+        """Writes 'root' and the keys below it, down to 'max_depth' levels below it, biggest first at every level."""
+        stack = [root]
+        while (len(stack) > 0):
+            node = stack.pop()
+            self.write_node(node)
+            if (max_depth == None or node.depth < max_depth):
+                stack.extend(sorted(node.children, key = lambda child: (child.total_bytes, child.total_keys)))
+        self.file.flush()
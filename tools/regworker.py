@@ -0,0 +1,129 @@
+
+import heapq
+import threading
+
+
+PRIORITY_INTERACTIVE = 0 #the user clicked something and is waiting for it
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2 #refreshes and the like, everything else goes first
+
+
+class PipeRequest:
+    """A call waiting to be made by a PipeWorker, and what it returned once it has been."""
+    
+    def __init__(self, function, args, priority, callback):
+        self.function = function
+        self.args = args
+        self.priority = priority
+        self.callback = callback #called with this request once it's done, from the worker thread
+        
+        self.done = threading.Event()
+        self.result = None
+        self.error = None #the exception the call raised, if it did
+    
+    def is_done(self):
+        return self.done.isSet()
+    
+    def wait(self):
+        """Blocks until the call has been made. Don't call this while holding the pipe lock, the call may need it.
+        
+        returns what the call returned, or raises what it raised"""
+        self.done.wait()
+        if (self.error != None):
+            raise self.error
+        return self.result
+    
+    def finish(self, result, error):
+        self.result = result
+        self.error = error
+        self.done.set()
+        
+        if (self.callback != None):
+            self.callback(self)
+
+
+class PipeWorker:
+    """Makes the calls for one pipe manager from a thread of its own, one at a time.
+    
+    Calls are queued with a priority and made in order of priority, then in the order they were submitted, so a click
+    never waits for more than the call that's already being made. Nothing waits on the pipe unless it asks to: submit()
+    returns a PipeRequest straight away, which can be waited on or given a callback.
+    
+    The worker doesn't take the pipe lock itself. The calls take it like they would from any other thread, so code that
+    uses the lock directly still works alongside the worker."""
+    
+    def __init__(self, pipe_manager):
+        self.pipe_manager = pipe_manager
+        
+        self.condition = threading.Condition()
+        self.queue = [] #a heap of (priority, sequence number, PipeRequest)
+        self.sequence = 0
+        self.stopped = False
+        
+        self.thread = threading.Thread(target = self.work, name = "PipeWorker")
+        self.thread.setDaemon(True)
+        self.thread.start()
+    
+    def submit(self, function, args = (), priority = PRIORITY_NORMAL, callback = None):
+        """Queues a call to 'function' with 'args'. 'callback' is called with the PipeRequest once it's done, from the worker
+        thread. If the worker has been stopped the request fails straight away.
+        
+        returns a PipeRequest"""
+        request = PipeRequest(function, args, priority, callback)
+        
+        self.condition.acquire()
+        try:
+            if (not self.stopped):
+                heapq.heappush(self.queue, (priority, self.sequence, request))
+                self.sequence += 1
+                self.condition.notify()
+                return request
+        finally:
+            self.condition.release()
+        
+        request.finish(None, RuntimeError(-1, "The pipe has been closed"))
+        return request
+    
+    def call(self, function, args = (), priority = PRIORITY_INTERACTIVE):
+        """Makes the call through the queue and waits for it. Don't call this while holding the pipe lock.
+        
+        returns what the call returned, or raises what it raised"""
+        return self.submit(function, args, priority).wait()
+    
+    def stop(self):
+        """Stops the worker once the call it's making is done. Calls that haven't been made fail."""
+        self.condition.acquire()
+        try:
+            self.stopped = True
+            requests = [request for (priority, sequence, request) in self.queue]
+            self.queue = []
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        
+        for request in requests:
+            request.finish(None, RuntimeError(-1, "The pipe has been closed"))
+    
+    def work(self):
+        while True:
+            self.condition.acquire()
+            try:
+                while (len(self.queue) == 0 and not self.stopped):
+                    self.condition.wait()
+                if (self.stopped):
+                    return
+                (priority, sequence, request) = heapq.heappop(self.queue)
+            finally:
+                self.condition.release()
+            
+            result = None
+            error = None
+            try:
+                result = request.function(*request.args)
+            except Exception as ex:
+                error = ex
+            
+            try:
+                request.finish(result, error)
+            except Exception as ex:
+                print "Failed to finish a pipe request: %s." % (str(ex))
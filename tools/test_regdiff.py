@@ -0,0 +1,142 @@
+
+import threading
+import unittest
+
+from objects import RegistryKey
+from objects import RegistryValue
+from regdiff import LiveSource
+from regdiff import RegistryDiff
+
+
+REG_SZ = 1
+REG_DWORD = 4
+
+
+class FakeKeyInfo:
+    
+    def __init__(self, last_changed_time, num_subkeys, num_values):
+        self.last_changed_time = last_changed_time
+        self.num_subkeys = num_subkeys
+        self.num_values = num_values
+
+
+class FakePipeManager:
+    """A server with its keys in a dictionary. Every key has a last write time that write() moves on."""
+    
+    def __init__(self, server_address, keys):
+        self.server_address = server_address
+        self.lock = threading.RLock()
+        self.keys = {} #lower case path: [last write time, subkey names, list of (name, type, data)]
+        self.time = 1
+        for (path, value_list) in keys:
+            self.write(path, value_list)
+    
+    def write(self, path, value_list):
+        """Adds or replaces the key 'path', its parent has to be there already."""
+        self.time += 1
+        if (not self.keys.has_key(path.lower())):
+            self.keys[path.lower()] = [self.time, [], []]
+            if ("\\" in path):
+                parent = self.keys[path.rsplit("\\", 1)[0].lower()]
+                parent[0] = self.time
+                parent[1].append(path.split("\\")[-1])
+        self.keys[path.lower()][0] = self.time
+        self.keys[path.lower()][2] = value_list
+    
+    def get_key_for_path(self, path):
+        names = path.split("\\")
+        key = RegistryKey(names[0], None)
+        for name in names[1:]:
+            key = RegistryKey(name, key)
+        return key
+    
+    def get_entry(self, key):
+        entry = self.keys.get(key.get_absolute_path().lower())
+        if (entry == None):
+            raise RuntimeError(0x2, "WERR_BADFILE")
+        return entry
+    
+    def get_key_info(self, key):
+        entry = self.get_entry(key)
+        return FakeKeyInfo(entry[0], len(entry[1]), len(entry[2]))
+    
+    def get_subkeys_for_key(self, key):
+        return [RegistryKey(name, key) for name in self.get_entry(key)[1]]
+    
+    def get_values_for_key(self, key):
+        return [RegistryValue(name, type, data, key) for (name, type, data) in self.get_entry(key)[2]]
+
+
+def make_server(name):
+    keys = [("HKLM", []), ("HKLM\\Software", [])]
+    for index in xrange(10):
+        keys.append(("HKLM\\Software\\App%d" % (index), [("Version", REG_SZ, list(bytearray(u"1.0\x00".encode("utf-16-le")))),
+                                                         ("Index", REG_DWORD, [index, 0, 0, 0])]))
+        keys.append(("HKLM\\Software\\App%d\\Settings" % (index), [("Enabled", REG_DWORD, [1, 0, 0, 0])]))
+    return FakePipeManager(name, keys)
+
+
+class RegistryDiffTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.golden = make_server("golden")
+        self.drifting = make_server("drifting")
+        self.drifting.write("HKLM\\Software\\App3\\Settings", [("Enabled", REG_DWORD, [0, 0, 0, 0])])
+        self.drifting.write("HKLM\\Software\\Extra", [])
+        self.key_count = len(self.golden.keys)
+        
+        self.remembered_golden = {}
+        self.remembered_drifting = {}
+    
+    def run_diff(self):
+        diff = RegistryDiff(LiveSource(self.golden, "HKLM\\Software", self.remembered_golden),
+                            LiveSource(self.drifting, "HKLM\\Software", self.remembered_drifting))
+        return (diff, diff.run())
+    
+    def get_changes(self, node, changes = None):
+        if (changes == None):
+            changes = []
+        if (node.status != "same"):
+            changes.append((node.path, node.status, [value_diff.name for value_diff in node.value_diffs]))
+        for child in node.children:
+            self.get_changes(child, changes)
+        return sorted(changes)
+    
+    def test_differences(self):
+        (diff, root) = self.run_diff()
+        
+        self.assertEqual(self.get_changes(root), [
+                                                  ("HKLM\\Software\\App3\\Settings", "changed", ["Enabled"]),
+                                                  ("HKLM\\Software\\Extra", "added", []),
+                                                  ])
+        self.assertEqual(diff.keys_listed, self.key_count - 1) #HKLM isn't below the path
+    
+    def test_second_run_skips_unchanged_keys(self):
+        (first_diff, first_root) = self.run_diff()
+        (diff, root) = self.run_diff()
+        
+        self.assertEqual(self.get_changes(root), self.get_changes(first_root))
+        self.assertEqual(diff.keys_compared, first_diff.keys_compared)
+        #HKLM\Software (its subkeys differ) and App3\Settings (its values do) are the only keys that have to be listed again
+        self.assertEqual(diff.keys_listed, 2)
+    
+    def test_written_keys_are_listed_again(self):
+        self.run_diff()
+        self.golden.write("HKLM\\Software\\App5", [("Version", REG_SZ, list(bytearray(u"1.0\x00".encode("utf-16-le")))),
+                                                   ("Index", REG_DWORD, [5, 0, 0, 0])])
+        (diff, root) = self.run_diff()
+        
+        self.assertEqual(diff.keys_listed, 3)
+        self.assertEqual(len(self.get_changes(root)), 2) #written to, but with the same values
+    
+    def test_new_sources_list_everything(self):
+        self.run_diff()
+        self.remembered_golden = {}
+        self.remembered_drifting = {}
+        (diff, root) = self.run_diff()
+        
+        self.assertEqual(diff.keys_listed, self.key_count - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
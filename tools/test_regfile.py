@@ -0,0 +1,267 @@
+
+import codecs
+import struct
+import threading
+import unittest
+from StringIO import StringIO
+
+from objects import RegistryKey
+from objects import RegistryValue
+from regfile import RegFileReader
+from regfile import RegFileWriter
+from regfile import RegistryImporter
+
+
+REG_NONE = 0
+REG_SZ = 1
+REG_EXPAND_SZ = 2
+REG_BINARY = 3
+REG_DWORD = 4
+REG_MULTI_SZ = 7
+REG_QWORD = 11
+
+
+def utf16_file(text):
+    """returns a file with 'text' in it the way regedit exports it: UTF-16 with a byte order mark"""
+    return StringIO(codecs.BOM_UTF16_LE + text.encode("utf-16-le"))
+
+def read_sections(text):
+    return list(RegFileReader(utf16_file(text)))
+
+def sz(text):
+    return list(bytearray((text + u"\x00").encode("utf-16-le")))
+
+
+class RegFileReaderTest(unittest.TestCase):
+    
+    def test_header(self):
+        self.assertRaises(ValueError, RegFileReader, utf16_file(u"Not a registry file\r\n"))
+        self.assertRaises(ValueError, RegFileReader, StringIO(""))
+    
+    def test_strings_and_escapes(self):
+        sections = read_sections(u"Windows Registry Editor Version 5.00\r\n\r\n" +
+                                 u"[HKEY_LOCAL_MACHINE\\Software\\Test]\r\n" +
+                                 u"@=\"default\"\r\n" +
+                                 u"\"Path\"=\"C:\\\\Program Files\\\\Test\"\r\n" +
+                                 u"\"Say \\\"hi\\\"\"=\"a \\\"quoted\\\" word\"\r\n" +
+                                 u"\"Empty\"=\"\"\r\n")
+        
+        self.assertEqual(len(sections), 1)
+        (path, delete, value_list, last_write_time) = sections[0]
+        self.assertEqual(path, u"HKEY_LOCAL_MACHINE\\Software\\Test")
+        self.assertFalse(delete)
+        self.assertEqual(last_write_time, None)
+        self.assertEqual(value_list, [
+                                      ("(Default)", REG_SZ, sz(u"default")),
+                                      (u"Path", REG_SZ, sz(u"C:\\Program Files\\Test")),
+                                      (u"Say \"hi\"", REG_SZ, sz(u"a \"quoted\" word")),
+                                      (u"Empty", REG_SZ, sz(u"")),
+                                      ])
+    
+    def test_dword_and_hex(self):
+        sections = read_sections(u"Windows Registry Editor Version 5.00\r\n\r\n" +
+                                 u"[HKEY_LOCAL_MACHINE\\Software\\Test]\r\n" +
+                                 u"\"Number\"=dword:0000002a\r\n" +
+                                 u"\"Binary\"=hex:01,02,ff\r\n" +
+                                 u"\"Expand\"=hex(2):25,00,00,00\r\n" +
+                                 u"\"Quad\"=hex(b):01,00,00,00,00,00,00,00\r\n" +
+                                 u"\"Nothing\"=hex(0):\r\n")
+        
+        (path, delete, value_list, last_write_time) = sections[0]
+        self.assertEqual(value_list, [
+                                      (u"Number", REG_DWORD, [0x2a, 0, 0, 0]),
+                                      (u"Binary", REG_BINARY, [1, 2, 0xff]),
+                                      (u"Expand", REG_EXPAND_SZ, [0x25, 0, 0, 0]),
+                                      (u"Quad", REG_QWORD, [1, 0, 0, 0, 0, 0, 0, 0]),
+                                      (u"Nothing", REG_NONE, []),
+                                      ])
+    
+    def test_continuation_lines(self):
+        sections = read_sections(u"Windows Registry Editor Version 5.00\r\n\r\n" +
+                                 u"[HKEY_LOCAL_MACHINE\\Software\\Test]\r\n" +
+                                 u"\"Long\"=hex(7):41,00,00,00,\\\r\n" +
+                                 u"  42,00,00,00,\\\r\n" +
+                                 u"  00,00\r\n" +
+                                 u"\"After\"=dword:00000001\r\n")
+        
+        (path, delete, value_list, last_write_time) = sections[0]
+        self.assertEqual(value_list, [
+                                      (u"Long", REG_MULTI_SZ, [0x41, 0, 0, 0, 0x42, 0, 0, 0, 0, 0]),
+                                      (u"After", REG_DWORD, [1, 0, 0, 0]),
+                                      ])
+    
+    def test_deletes(self):
+        sections = read_sections(u"Windows Registry Editor Version 5.00\r\n\r\n" +
+                                 u"[-HKEY_LOCAL_MACHINE\\Software\\Old]\r\n\r\n" +
+                                 u"[HKEY_LOCAL_MACHINE\\Software\\Test]\r\n" +
+                                 u"\"Gone\"=-\r\n" +
+                                 u"; a comment\r\n" +
+                                 u"@=-\r\n")
+        
+        self.assertEqual(sections, [
+                                    (u"HKEY_LOCAL_MACHINE\\Software\\Old", True, [], None),
+                                    (u"HKEY_LOCAL_MACHINE\\Software\\Test", False, [(u"Gone", REG_SZ, None), ("(Default)", REG_SZ, None)], None),
+                                    ])
+    
+    def test_regedit4(self):
+        file = StringIO("REGEDIT4\r\n\r\n" +
+                        "[HKEY_CURRENT_USER\\Software\\Caf\xe9]\r\n" +
+                        "\"Name\"=\"na\xefve\"\r\n" +
+                        "\"Number\"=dword:ffffffff\r\n")
+        sections = list(RegFileReader(file))
+        
+        self.assertEqual(sections, [
+                                    (u"HKEY_CURRENT_USER\\Software\\Caf\xe9", False, [
+                                                                                       (u"Name", REG_SZ, sz(u"na\xefve")),
+                                                                                       (u"Number", REG_DWORD, [0xff, 0xff, 0xff, 0xff]),
+                                                                                       ], None),
+                                    ])
+    
+    def test_bad_lines(self):
+        header = u"Windows Registry Editor Version 5.00\r\n\r\n"
+        self.assertRaises(ValueError, read_sections, header + u"\"Orphan\"=dword:00000001\r\n")
+        self.assertRaises(ValueError, read_sections, header + u"[HKEY_LOCAL_MACHINE\\Test]\r\n\"Open=\"x\"\r\n")
+        self.assertRaises(ValueError, read_sections, header + u"[HKEY_LOCAL_MACHINE\\Test]\r\n\"Bad\"=dword:xyz\r\n")
+
+
+class RegFileRoundTripTest(unittest.TestCase):
+    
+    def test_round_trip(self):
+        key = RegistryKey("HKEY_LOCAL_MACHINE", None)
+        values = [
+                  RegistryValue("(Default)", REG_SZ, sz(u"the default"), key),
+                  RegistryValue("Quote \" and \\", REG_SZ, sz(u"C:\\\"x\""), key),
+                  RegistryValue("Number", REG_DWORD, list(bytearray(struct.pack("<I", 0xdeadbeef))), key),
+                  RegistryValue("Big", REG_BINARY, range(256) * 2, key), #long enough to be wrapped
+                  RegistryValue("Multi", REG_MULTI_SZ, list(bytearray(u"a\x00b\x00\x00".encode("utf-16-le"))), key),
+                  RegistryValue("Nul in a string", REG_SZ, list(bytearray(u"a\x00b\x00".encode("utf-16-le"))), key),
+                  RegistryValue("Short dword", REG_DWORD, [1, 2], key),
+                  RegistryValue("Odd type", 0x20, [9], key),
+                  ]
+        
+        file = StringIO()
+        writer = RegFileWriter(file)
+        writer.write_key(u"HKEY_LOCAL_MACHINE\\Software\\Test", values)
+        writer.write_key(u"HKEY_LOCAL_MACHINE\\Software\\Test\\Empty", [RegistryValue("(Default)", REG_SZ, [], key)])
+        self.assertEqual(writer.bytes_written, len(file.getvalue()))
+        
+        file.seek(0)
+        sections = list(RegFileReader(file))
+        
+        self.assertEqual(sections, [
+                                    (u"HKEY_LOCAL_MACHINE\\Software\\Test", False, [(value.name, value.type, value.data) for value in values], None),
+                                    (u"HKEY_LOCAL_MACHINE\\Software\\Test\\Empty", False, [], None),
+                                    ])
+
+
+class FakePipeManager:
+    """Keeps the values of every key in a dictionary instead of talking to a server."""
+    
+    def __init__(self, keys = None, fail_paths = None):
+        self.lock = threading.Lock()
+        self.keys = keys or {} #lower case path: list of RegistryValue
+        self.fail_paths = fail_paths or []
+        self.calls = []
+    
+    def set_values(self, key, value_list):
+        path = key.get_absolute_path()
+        self.calls.append(("set", path))
+        if (path in self.fail_paths):
+            raise RuntimeError(5, "WERR_ACCESS_DENIED")
+        
+        values = dict([(value.name.lower(), value) for value in self.keys.get(path.lower(), [])])
+        for value in value_list:
+            if (value.data == None):
+                values.pop(value.name.lower(), None)
+            else:
+                values[value.name.lower()] = value
+        self.keys[path.lower()] = values.values()
+    
+    def remove_key(self, key):
+        path = key.get_absolute_path()
+        self.calls.append(("remove", path))
+        if (not self.keys.has_key(path.lower())):
+            raise RuntimeError(2, "WERR_BADFILE")
+        for other_path in self.keys.keys():
+            if (other_path == path.lower() or other_path.startswith(path.lower() + "\\")):
+                del self.keys[other_path]
+    
+    def get_values_for_key(self, key):
+        path = key.get_absolute_path()
+        if (not self.keys.has_key(path.lower())):
+            raise RuntimeError(2, "WERR_BADFILE")
+        return self.keys[path.lower()]
+
+
+class RegistryImporterTest(unittest.TestCase):
+    
+    file_text = (u"Windows Registry Editor Version 5.00\r\n\r\n" +
+                 u"[HKEY_LOCAL_MACHINE\\Software\\Test]\r\n" +
+                 u"\"Name\"=\"new\"\r\n" +
+                 u"\"Gone\"=-\r\n\r\n" +
+                 u"[-HKEY_LOCAL_MACHINE\\Software\\Old]\r\n\r\n" +
+                 u"[HKEY_LOCAL_MACHINE\\Software\\Added]\r\n" +
+                 u"\"Number\"=dword:00000007\r\n")
+    
+    def setUp(self):
+        self.root_keys = [RegistryKey("HKEY_LOCAL_MACHINE", None)]
+        root_key = self.root_keys[0]
+        self.keys = {
+                     "hkey_local_machine\\software\\test":[RegistryValue("Name", REG_SZ, sz(u"old"), root_key),
+                                                           RegistryValue("Gone", REG_DWORD, [1, 0, 0, 0], root_key)],
+                     "hkey_local_machine\\software\\old":[],
+                     "hkey_local_machine\\software\\old\\child":[],
+                     }
+    
+    def test_import(self):
+        pipe_manager = FakePipeManager(self.keys)
+        importer = RegistryImporter([pipe_manager], self.root_keys)
+        
+        self.assertTrue(importer.run(RegFileReader(utf16_file(RegistryImporterTest.file_text))))
+        self.assertEqual(importer.keys_imported, 3)
+        self.assertEqual(importer.values_imported, 3)
+        self.assertEqual(pipe_manager.calls, [
+                                              ("set", "HKEY_LOCAL_MACHINE\\Software\\Test"),
+                                              ("remove", "HKEY_LOCAL_MACHINE\\Software\\Old"),
+                                              ("set", "HKEY_LOCAL_MACHINE\\Software\\Added"),
+                                              ])
+        self.assertEqual(sorted(pipe_manager.keys.keys()), ["hkey_local_machine\\software\\added", "hkey_local_machine\\software\\test"])
+        self.assertEqual([(value.name, value.data) for value in pipe_manager.keys["hkey_local_machine\\software\\test"]], [(u"Name", sz(u"new"))])
+    
+    def test_import_several_pipes(self):
+        pipe_managers = [FakePipeManager(self.keys), FakePipeManager(self.keys), FakePipeManager(self.keys)]
+        importer = RegistryImporter(pipe_managers, self.root_keys, queue_size = 1)
+        
+        self.assertTrue(importer.run(RegFileReader(utf16_file(RegistryImporterTest.file_text))))
+        self.assertEqual(importer.keys_imported, 3)
+        self.assertEqual(sum([len(pipe_manager.calls) for pipe_manager in pipe_managers]), 3)
+        self.assertEqual(pipe_managers[0].calls.count(("remove", "HKEY_LOCAL_MACHINE\\Software\\Old")), 1) #deletes always go to the first worker
+    
+    def test_failures(self):
+        pipe_manager = FakePipeManager(self.keys, fail_paths = ["HKEY_LOCAL_MACHINE\\Software\\Test"])
+        importer = RegistryImporter([pipe_manager], self.root_keys)
+        
+        file_text = RegistryImporterTest.file_text + u"\r\n[HKEY_NOWHERE\\Software]\r\n"
+        self.assertFalse(importer.run(RegFileReader(utf16_file(file_text))))
+        self.assertEqual(importer.keys_imported, 2)
+        self.assertEqual(sorted(importer.failed_keys), [("HKEY_LOCAL_MACHINE\\Software\\Test", "WERR_ACCESS_DENIED"),
+                                                        (u"HKEY_NOWHERE\\Software", "not a root key")])
+    
+    def test_dry_run(self):
+        pipe_manager = FakePipeManager(self.keys)
+        changes = []
+        importer = RegistryImporter([pipe_manager], self.root_keys, change_callback = changes.append, dry_run = True)
+        
+        self.assertTrue(importer.run(RegFileReader(utf16_file(RegistryImporterTest.file_text))))
+        self.assertEqual(pipe_manager.calls, [])
+        self.assertEqual([(change.action, change.get_absolute_path()) for change in changes], [
+                                                                                                ("change value", "HKEY_LOCAL_MACHINE\\Software\\Test\\Name"),
+                                                                                                ("delete value", "HKEY_LOCAL_MACHINE\\Software\\Test\\Gone"),
+                                                                                                ("delete key", "HKEY_LOCAL_MACHINE\\Software\\Old"),
+                                                                                                ("add key", "HKEY_LOCAL_MACHINE\\Software\\Added"),
+                                                                                                ("add value", "HKEY_LOCAL_MACHINE\\Software\\Added\\Number"),
+                                                                                                ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+
+from objects import RegistryKey
+from objects import RegistrySearchOptions
+from objects import RegistryValue
+from regindex import RegistryIndex
+from regsearch import RegistrySearchEngine
+from regsearch import SearchCursor
+from regsearch import SearchMatcher
+
+
+REG_SZ = 1
+REG_BINARY = 3
+REG_DWORD = 4
+REG_DWORD_BIG_ENDIAN = 5
+REG_MULTI_SZ = 7
+REG_QWORD = 11
+
+
+def make_values(key):
+    return [
+            RegistryValue("Small", REG_DWORD, list(bytearray(struct.pack("<I", 16))), key),
+            RegistryValue("Big", REG_DWORD, list(bytearray(struct.pack("<I", 0xDEADBEEF))), key),
+            RegistryValue("Backwards", REG_DWORD_BIG_ENDIAN, list(bytearray(struct.pack(">I", 16))), key),
+            RegistryValue("Quad", REG_QWORD, list(bytearray(struct.pack("<Q", 4096))), key),
+            RegistryValue("Blob", REG_BINARY, [0x0a, 0x0b, 0x10, 0x00, 0xff], key),
+            RegistryValue("Text in a blob", REG_BINARY, list(bytearray("xx hello world")), key),
+            RegistryValue("Wide text in a blob", REG_BINARY, list(bytearray(u"hello".encode("utf-16-le"))), key),
+            RegistryValue("String", REG_SZ, list(bytearray(u"Program Files 16\x00".encode("utf-16-le"))), key),
+            RegistryValue("Strings", REG_MULTI_SZ, list(bytearray(u"one\x00two\x00\x00".encode("utf-16-le"))), key),
+            ]
+
+
+def make_string(text):
+    return list(bytearray((text + u"\x00").encode("utf-16-le")))
+
+
+class FakePipeManager:
+    """A server with its keys in a dictionary. Subkeys and values are listed in the order they were added, not by name."""
+    
+    def __init__(self, root_names, keys):
+        self.lock = threading.RLock()
+        self.well_known_keys = [RegistryKey(name, None) for name in root_names]
+        self.subkeys = {} #lower case path: subkey names
+        self.values = {} #lower case path: list of (name, type, data)
+        for name in root_names:
+            self.subkeys[name.lower()] = []
+            self.values[name.lower()] = []
+        for (path, value_list) in keys:
+            self.subkeys[path.lower()] = []
+            self.values[path.lower()] = value_list
+            self.subkeys[path.rsplit("\\", 1)[0].lower()].append(path.split("\\")[-1])
+    
+    def get_subkeys_for_key(self, key):
+        return [RegistryKey(name, key) for name in self.subkeys[key.get_absolute_path().lower()]]
+    
+    def get_values_for_key(self, key, fetch_data = True):
+        return [RegistryValue(name, type, data, key) for (name, type, data) in self.values[key.get_absolute_path().lower()]]
+    
+    def fetch_value_data(self, value_list):
+        pass
+
+
+class RegistryIndexMatchTest(unittest.TestCase):
+    """Searching the index has to find the same data as searching the server with a SearchMatcher."""
+    
+    terms = ["16", "0x10", "0x00000010", "10", "0xDEADBEEF", "DEADBEEF", "3735928559", "4096", "0x1000",
+             "0A0B", "0b10", "0a0b1000ff", "hello", "world", "xx", "ff", "program", "two", "0x11"]
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = RegistryIndex("server", "user", self.directory)
+        
+        self.root_keys = [RegistryKey("HKEY_LOCAL_MACHINE", None)]
+        self.key = RegistryKey("Numbers", self.root_keys[0])
+        self.values = make_values(self.key)
+        self.index.update_key(self.root_keys[0], 1, [self.key], [])
+        self.index.update_key(self.key, 1, [], self.values)
+        self.index.commit()
+    
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+    
+    def check_terms(self, **settings):
+        for term in RegistryIndexMatchTest.terms:
+            options = RegistrySearchOptions(term, search_keys = False, search_values = False)
+            for (name, setting) in settings.items():
+                setattr(options, name, setting)
+            
+            matcher = SearchMatcher(options)
+            expected = [value.name for value in self.values if matcher.match_data(value)]
+            found = [result.value.name for result in self.index.search(options, self.root_keys)]
+            self.assertEqual(sorted(found), sorted(expected), "'%s' found %s instead of %s" % (term, found, expected))
+    
+    def test_plain_terms(self):
+        self.check_terms()
+    
+    def test_whole_words(self):
+        self.check_terms(match_whole_word = True)
+    
+    def test_match_case(self):
+        self.check_terms(match_case = True)
+    
+    def test_numbers_are_found(self):
+        options = RegistrySearchOptions("0x10", search_keys = False, search_values = False)
+        found = [result.value.name for result in self.index.search(options, self.root_keys)]
+        self.assertEqual(sorted(found), ["Backwards", "Small"])
+    
+    def test_no_data(self):
+        self.index.set_index_data(False)
+        self.index.update_key(self.key, 2, [], self.values)
+        
+        options = RegistrySearchOptions("0x10", search_keys = False, search_values = False)
+        self.assertEqual(self.index.search(options, self.root_keys), [])
+
+
+
+class RegistryIndexOrderTest(unittest.TestCase):
+    """The index has to find matches in the same order as a search of the server, which goes by the order the server
+    lists keys and values in."""
+    
+    def setUp(self):
+        self.pipe_manager = FakePipeManager(["HKEY_LOCAL_MACHINE", "HKEY_CURRENT_USER"], [
+            ("HKEY_LOCAL_MACHINE\\Zeta", [("Path", REG_SZ, make_string(u"c:\\a")), ("Name", REG_SZ, make_string(u"zeta"))]),
+            ("HKEY_LOCAL_MACHINE\\Zeta\\Data", [("Max", REG_DWORD, [1, 0, 0, 0])]),
+            ("HKEY_LOCAL_MACHINE\\alpha", [("Zoo", REG_SZ, make_string(u"a")), ("Bar", REG_SZ, make_string(u"b"))]),
+            ("HKEY_LOCAL_MACHINE\\Mars", [("a", REG_SZ, make_string(u"banana"))]),
+            ("HKEY_CURRENT_USER\\Samba", [("Area", REG_SZ, make_string(u"x"))]),
+            ("HKEY_CURRENT_USER\\Alias", []),
+            ])
+        self.root_keys = self.pipe_manager.well_known_keys
+        self.options = RegistrySearchOptions("a")
+        
+        self.directory = tempfile.mkdtemp()
+        self.index = RegistryIndex("server", "user", self.directory)
+        stack = list(self.root_keys)
+        while (len(stack) > 0):
+            key = stack.pop()
+            subkey_list = self.pipe_manager.get_subkeys_for_key(key)
+            self.index.update_key(key, 1, subkey_list, self.pipe_manager.get_values_for_key(key))
+            stack.extend(subkey_list)
+        self.index.commit()
+    
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+    
+    def describe(self, result_list):
+        return [(result.position, result.get_absolute_path(), result.match_type) for result in result_list]
+    
+    def search_server(self, cursor = None):
+        """Runs Find Next until nothing is left.
+        
+        returns a list of SearchResult"""
+        results = []
+        while True:
+            engine = RegistrySearchEngine([self.pipe_manager], self.options)
+            if (cursor == None):
+                engine.add_roots(self.root_keys)
+            else:
+                engine.add_cursor(cursor, self.root_keys)
+            result = engine.run()
+            if (result == None):
+                return results
+            results.append(result)
+            cursor = engine.get_cursor()
+    
+    def test_same_order(self):
+        expected = self.describe(self.search_server())
+        self.assertEqual(len(expected), 14)
+        self.assertEqual(self.describe(self.index.search(self.options, self.root_keys)), expected)
+    
+    def test_carry_on_from_server_cursor(self):
+        engine = RegistrySearchEngine([self.pipe_manager], self.options)
+        engine.add_roots(self.root_keys)
+        engine.run()
+        after = min([RegistrySearchEngine.lower_bound(entry) for entry in engine.get_cursor().entries])
+        
+        self.assertEqual(self.describe(self.index.search(self.options, self.root_keys, after)),
+                         self.describe(self.search_server())[1:])
+    
+    def test_carry_on_from_index_cursor(self):
+        for (index, result) in enumerate(self.index.search(self.options, self.root_keys)):
+            value_start = 0
+            if (result.value != None):
+                value_start = result.position[-2] + 1
+            cursor = self.index.get_cursor(result.key, self.root_keys, value_start)
+            
+            self.assertEqual(self.describe(self.search_server(cursor)),
+                             self.describe(self.index.search(self.options, self.root_keys))[index + 1:])
+    
+    def test_search_from_key(self):
+        key = self.pipe_manager.get_subkeys_for_key(self.root_keys[0])[1] #alpha
+        position = self.index.get_position(key, self.root_keys)
+        
+        self.assertEqual(self.describe(self.index.search(self.options, self.root_keys, position)),
+                         self.describe(self.search_server(SearchCursor.from_key(self.pipe_manager, key))))
+        self.assertEqual(self.index.get_cursor(key, self.root_keys).entries, SearchCursor.from_key(self.pipe_manager, key).entries)
+
+
+if __name__ == "__main__":
+    unittest.main()
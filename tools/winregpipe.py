@@ -0,0 +1,1004 @@
+
+import sys
+import threading
+import collections
+
+from samba import credentials
+from samba.dcerpc import winreg
+from samba.dcerpc import security
+from samba.dcerpc import misc
+
+from objects import RegistryKey
+from objects import RegistryValue
+from regdelete import RegistryDeleter
+from regcopy import RegistryCopier
+from regworker import PipeWorker
+
+
+class CachedHandle:
+    
+    def __init__(self, path, handle):
+        self.path = path
+        self.handle = handle
+        self.ref_count = 0
+        self.cached = True #False once the entry has been evicted or invalidated, but is still in use by someone
+
+
+class KeyInfo:
+    
+    def __init__(self, query_info):
+        """'query_info' is what QueryInfoKey() returns. Lengths of names are in characters, without the terminating null."""
+        (self.classname, 
+         self.num_subkeys, 
+         self.max_subkeylen, 
+         self.max_classlen, 
+         self.num_values, 
+         self.max_valnamelen, 
+         self.max_valbufsize, 
+         self.secdescsize, 
+         self.last_changed_time) = query_info[:9]
+    
+    def get_subkey_name_size(self):
+        return (self.max_subkeylen + 1) * 2
+    
+    def get_class_size(self):
+        return (self.max_classlen + 1) * 2
+    
+    def get_value_name_size(self):
+        return (self.max_valnamelen + 1) * 2
+
+
+class WinRegPipeManager:
+    
+    root_key_abbreviations = {
+                              "HKCR":"HKEY_CLASSES_ROOT", 
+                              "HKCU":"HKEY_CURRENT_USER", 
+                              "HKLM":"HKEY_LOCAL_MACHINE", 
+                              "HKU":"HKEY_USERS", 
+                              "HKCC":"HKEY_CURRENT_CONFIG"
+                              }
+    
+    #what the server says when a cached handle belongs to a key that was deleted (and maybe made again) behind our back
+    stale_handle_errors = [0x2, 0x6, 0x3FA] #WERR_BADFILE, WERR_INVALID_HANDLE, WERR_KEY_DELETED
+    
+    root_key_names = ["HKEY_CLASSES_ROOT", "HKEY_CURRENT_USER", "HKEY_LOCAL_MACHINE", "HKEY_USERS", "HKEY_CURRENT_CONFIG"]
+    root_key_open_functions = {
+                               "HKEY_CLASSES_ROOT":"OpenHKCR", 
+                               "HKEY_CURRENT_USER":"OpenHKCU", 
+                               "HKEY_LOCAL_MACHINE":"OpenHKLM", 
+                               "HKEY_USERS":"OpenHKU", 
+                               "HKEY_CURRENT_CONFIG":"OpenHKCC"
+                               }
+    
+    def __init__(self, server_address, transport_type, username, password, open_keys=True):
+        """If 'open_keys' is False the root keys are only opened when get_key_for_path() needs them, which saves a few
+        round trips when we only want to look at one key."""
+        self.service_list = []
+        self.lock = threading.RLock()
+        
+        #kept so that clone() can open more pipes to the same server
+        self.server_address = server_address
+        self.transport_type = transport_type
+        self.username = username
+        self.password = password
+        
+        #open key handles are cached so we don't have to re-open every ancestor of a key for each call.
+        #handle_cache maps a lower case absolute path to a CachedHandle, least recently used first.
+        self.handle_cache = collections.OrderedDict()
+        self.handle_entries = {} #maps id(handle) to the CachedHandle, so close_path() can find the entry
+        self.handle_cache_size = 64
+        
+        self.tree_cache = None #a RegistryTreeCache that ls_key() saves listings to, if the user wants one
+        self.worker = None #a PipeWorker, started by get_worker() when someone wants one
+        
+        creds = credentials.Credentials()
+        if (username.count("\\") > 0):
+            creds.set_domain(username.split("\\")[0])
+            creds.set_username(username.split("\\")[1])
+        elif (username.count("@") > 0):
+            creds.set_domain(username.split("@")[1])
+            creds.set_username(username.split("@")[0])
+        else:
+            creds.set_domain("")
+            creds.set_username(username)
+        creds.set_workstation("")
+        creds.set_password(password)
+        
+        binding = ["ncacn_np:%s", "ncacn_ip_tcp:%s", "ncalrpc:%s"][transport_type]
+        self.pipe = winreg.winreg(binding % (server_address), credentials = creds)
+        
+        if (open_keys):
+            self.open_well_known_keys()
+        else:
+            self.well_known_keys = []
+            self.root_handles = {}
+    
+    def close(self):
+        if (self.worker != None):
+            self.worker.stop()
+            self.worker = None
+        self.flush_handle_cache()
+        # apparently there's no .Close() method for this pipe
+    
+    def get_worker(self):
+        """returns the PipeWorker that makes calls on this pipe from a thread of its own, see PipeWorker"""
+        if (self.worker == None):
+            self.worker = PipeWorker(self)
+        return self.worker
+    
+    def clone(self):
+        """Opens another pipe to the same server with the same credentials. Each pipe manager has its own pipe and lock,
+        so clones can be used from other threads without waiting for this one.
+        
+        returns a new WinRegPipeManager"""
+        return WinRegPipeManager(self.server_address, self.transport_type, self.username, self.password)
+    
+    def ls_key(self, key, progress_callback=None, fetch_data=True):
+        """this function gets a list of values and subkeys. If 'fetch_data' is False the values are listed by name and type only, see fetch_value_data()
+        'progress_callback' is called as progress_callback(key, index, count, subkey) for every subkey, and once more with 'subkey' None when we're done.
+        It's called without the pipe lock held, so it may grab other locks (like the gdk lock) on its own.
+        NOTE: this function will acquire the pipe manager lock on its own. Do Not Acquire It Before Calling This Function!
+        
+        returns (subkey_list, value_list)"""
+        subkey_list = []
+        value_list = []
+        
+        #one call tells us how many subkeys and values there are and how big the buffers have to be
+        self.lock.acquire()
+        try: #this can cause access denied errors
+            (path_handles, info) = self.open_path_info(key)
+        finally:
+            self.lock.release()
+        
+        try:
+            key_handle = path_handles[-1]
+            
+            index = 0
+            while (index < info.num_subkeys): #get a list of subkeys
+                try:
+                    self.lock.acquire()
+                    subkey = self.enum_key(key_handle, index, key, info)
+                    self.lock.release() #we want to release the pipe lock before calling back, the callback may grab the gdk lock
+                    
+                    subkey_list.append(subkey)
+                    
+                    if (progress_callback != None):
+                        progress_callback(key, index, info.num_subkeys, subkey)
+                    
+                    index += 1
+                
+                except RuntimeError as re:
+                    self.lock.release()
+                    if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS, subkeys were deleted since we asked
+                        break
+                    else:
+                        raise re
+            
+            
+            index = 0
+            while (index < info.num_values): #get a list of values for the key
+                try:
+                    self.lock.acquire()
+                    value = self.enum_value(key_handle, index, key, info, fetch_data)
+                    self.lock.release()
+                    
+                    value_list.append(value)
+                    
+                    #there's no need to update GUI here since there's usually few Values. 
+                    #Additionally, many values are named "" which is later changed to "(Default)". 
+                    #So printing '"fetching: "+value.name' might look like a glitch to the user.
+                    
+                    index += 1
+                
+                except RuntimeError as re:
+                    self.lock.release()
+                    if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS
+                        break
+                    else:
+                        raise re
+        
+        finally:
+            self.close_path(path_handles) #close_path() grabs the pipe lock on its own
+        
+        default_value_list = [value for value in value_list if value.name == ""]
+        if (len(default_value_list) == 0):
+            value = RegistryValue("(Default)", misc.REG_SZ, [], key)
+            value_list.append(value)
+        else:
+            default_value_list[0].name = "(Default)"
+        
+        #keep the keys we already had, so their own cached lists and the rows that show them stay valid
+        subkey_list = WinRegPipeManager.reuse_subkeys(key, subkey_list)
+        
+        key.last_write_time = info.last_changed_time
+        key.subkeys = subkey_list
+        key.values = value_list
+        if (self.tree_cache != None):
+            self.tree_cache.store_key(key)
+        
+        if (progress_callback != None):
+            progress_callback(key, len(subkey_list), len(subkey_list), None)
+
+#        #The reference count to Py_None is still not right: It climbs to infinity!
+#        print "Finish ls_key()", sys.getrefcount(None)
+        return (subkey_list, value_list)
+    
+    def refresh_key(self, key, progress_callback=None, fetch_data=False):
+        """this function gets the subkeys and values of 'key' like ls_key() does. If the key hasn't been written to since it was
+        last listed by ls_key() the cached lists are returned, which only costs one QueryInfoKey call.
+        NOTE: just like ls_key(), this function will acquire the pipe manager lock on its own.
+        
+        returns (subkey_list, value_list, changed)"""
+        if (self.load_cached_key(key) and key.last_write_time != None):
+            self.lock.acquire()
+            try:
+                info = self.get_key_info(key)
+            finally:
+                self.lock.release()
+            
+            if (info.last_changed_time == key.last_write_time):
+                return (key.subkeys, key.values, False)
+        
+        (subkey_list, value_list) = self.ls_key(key, progress_callback, fetch_data=fetch_data)
+        return (subkey_list, value_list, True)
+    
+    def load_cached_key(self, key):
+        """this function fills in the lists of 'key' from the tree cache if it hasn't been listed yet and the cache has it.
+        Nothing is checked with the server, use refresh_key() for that.
+        
+        returns True if 'key' has cached lists"""
+        if (key.subkeys == None and self.tree_cache != None):
+            self.tree_cache.load_key(key)
+        
+        return (key.subkeys != None and key.values != None)
+    
+    @staticmethod
+    def reuse_subkeys(key, subkey_list):
+        """this function replaces the keys in 'subkey_list' with the ones 'key' had last time it was listed, where the names match.
+        
+        returns a list of RegistryKey"""
+        if (key.subkeys == None):
+            return subkey_list
+        
+        old_subkeys = dict([(subkey.name.lower(), subkey) for subkey in key.subkeys])
+        
+        result = []
+        for subkey in subkey_list:
+            old_subkey = old_subkeys.get(subkey.name.lower())
+            if (old_subkey == None):
+                result.append(subkey)
+            else:
+                old_subkey.name = subkey.name #the case may have changed
+                result.append(old_subkey)
+        
+        return result
+    
+    def get_subkeys_for_key(self, key):
+        """this function gets a list subkeys for 'key'
+        
+        returns subkey_list"""
+        
+        subkey_list = []
+        (path_handles, info) = self.open_path_info(key)
+        try:
+            key_handle = path_handles[-1]
+            index = 0
+            
+            while (index < info.num_subkeys): #get a list of subkeys
+                try:
+                    subkey = self.enum_key(key_handle, index, key, info)
+                    subkey_list.append(subkey)
+                    
+                    index += 1
+                
+                except RuntimeError as re:
+                    if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS, subkeys were deleted since we asked
+                        break
+                    else:
+                        raise re
+        finally:
+            self.close_path(path_handles)
+        
+        return subkey_list
+    
+    def get_values_for_key(self, key, fetch_data=True):
+        """this function gets a list of values for 'key'. If 'fetch_data' is False the values are listed by name and type only, see fetch_value_data()
+        
+        returns a list of values"""
+        
+        value_list = []
+        (path_handles, info) = self.open_path_info(key)
+        try:
+            key_handle = path_handles[-1]
+            index = 0
+            
+            while (index < info.num_values): #get a list of values for the key
+                try:
+                    value = self.enum_value(key_handle, index, key, info, fetch_data)
+                    value_list.append(value)
+                    
+                    index += 1
+                
+                except RuntimeError as re:
+                    if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS
+                        break
+                    else:
+                        raise re
+        finally:
+            self.close_path(path_handles)
+        
+        #Every key is supposted to have a default value. If this key doesn't have one, we'll display a blank one
+        default_value_list = [value for value in value_list if value.name == ""]
+        if (len(default_value_list) == 0):
+            value = RegistryValue("(Default)", misc.REG_SZ, [], key)
+            value_list.append(value)
+        else:
+            default_value_list[0].name = "(Default)"
+        
+        return value_list
+    
+    def list_open_key(self, key_handle, key, fetch_data=True):
+        """this function lists the subkeys and values of the opened key 'key_handle' ('key' is their parent), with a single QueryInfoKey() call for both.
+        
+        returns (subkey_list, value_list)"""
+        info = self.query_key_info(key_handle)
+        
+        subkey_list = []
+        index = 0
+        while (index < info.num_subkeys):
+            try:
+                subkey_list.append(self.enum_key(key_handle, index, key, info))
+                index += 1
+            except RuntimeError as re:
+                if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS, subkeys were deleted since we asked
+                    break
+                raise re
+        
+        value_list = []
+        index = 0
+        while (index < info.num_values):
+            try:
+                value_list.append(self.enum_value(key_handle, index, key, info, fetch_data))
+                index += 1
+            except RuntimeError as re:
+                if (re.args[0] == 0x103): #0x103 is WERR_NO_MORE_ITEMS
+                    break
+                raise re
+        
+        return (subkey_list, value_list)
+    
+    def get_key_info(self, key):
+        """this function opens 'key' and asks the server about it.
+        
+        returns a KeyInfo"""
+        (path_handles, info) = self.open_path_info(key)
+        self.close_path(path_handles)
+        
+        return info
+    
+    def get_value(self, key, name):
+        """this function reads a single value of 'key' by name, without listing the key's other values.
+        Raises a RuntimeError with WERR_BADFILE if the value doesn't exist.
+        
+        returns a RegistryValue"""
+        (path_handles, info) = self.open_path_info(key)
+        try:
+            key_handle = path_handles[-1]
+            if (name == "(Default)"):
+                query_name = ""
+            else:
+                query_name = name
+            
+            data_size = info.max_valbufsize
+            while True:
+                try:
+                    (value_type, 
+                     value_data, 
+                     value_size, 
+                     value_length) = self.pipe.QueryValue(key_handle, WinRegPipeManager.winreg_string(query_name), misc.REG_NONE, [], data_size, data_size)
+                    break
+                except RuntimeError as re:
+                    if (re.args[0] == 0xEA): #0xEA is WERR_MORE_DATA, the value grew in the meantime
+                        data_size = data_size * 2 + 1
+                    else:
+                        raise re
+        finally:
+            self.close_path(path_handles)
+        
+        return RegistryValue(name, value_type, value_data, key)
+    
+    def query_key_info(self, key_handle):
+        """this function asks the server about the opened key 'key_handle': how many subkeys and values it has and how long
+        their names and data are, so the enumeration buffers can be sized exactly.
+        
+        returns a KeyInfo"""
+        return KeyInfo(self.pipe.QueryInfoKey(key_handle, WinRegPipeManager.winreg_string("")))
+    
+    def grow_key_info(self, key_handle, info):
+        """this function is called when the server says WERR_MORE_DATA, which means the key has changed since 'info' was fetched.
+        'info' is updated in place, and every maximum at least doubles so we can't loop forever."""
+        new_info = self.query_key_info(key_handle)
+        
+        info.num_subkeys = new_info.num_subkeys
+        info.num_values = new_info.num_values
+        info.max_subkeylen = max(new_info.max_subkeylen, info.max_subkeylen * 2 + 1)
+        info.max_classlen = max(new_info.max_classlen, info.max_classlen * 2 + 1)
+        info.max_valnamelen = max(new_info.max_valnamelen, info.max_valnamelen * 2 + 1)
+        info.max_valbufsize = max(new_info.max_valbufsize, info.max_valbufsize * 2 + 1)
+        info.last_changed_time = new_info.last_changed_time
+    
+    def enum_key(self, key_handle, index, key, info):
+        """this function gets the subkey at 'index' in the opened key 'key_handle', with buffers sized from 'info'.
+        
+        returns a RegistryKey"""
+        while True:
+            try:
+                (subkey_name, 
+                 subkey_class, 
+                 subkey_changed_time) = self.pipe.EnumKey(key_handle, 
+                                                          index, 
+                                                          WinRegPipeManager.winreg_string_buf("", info.get_subkey_name_size()), 
+                                                          WinRegPipeManager.winreg_string_buf("", info.get_class_size()), 
+                                                          None
+                                                          )
+                subkey = RegistryKey(subkey_name.name, key)
+                subkey.class_name = subkey_class.name or ""
+                subkey.last_write_time = subkey_changed_time
+                return subkey
+            
+            except RuntimeError as re:
+                if (re.args[0] == 0xEA): #0xEA is WERR_MORE_DATA, a longer name was added since we asked
+                    self.grow_key_info(key_handle, info)
+                else:
+                    raise re
+    
+    def enum_value(self, key_handle, index, key, info, fetch_data=True):
+        """this function gets the value at 'index' in the opened key 'key_handle', with buffers sized from 'info'.
+        If 'fetch_data' is False we don't send a data buffer at all, the server only tells us the size of the data.
+        
+        returns a RegistryValue"""
+        while True:
+            name_buf = WinRegPipeManager.winreg_val_name_buf("", info.get_value_name_size())
+            
+            try:
+                if (fetch_data):
+                    (value_name, value_type, value_data, value_length) = self.pipe.EnumValue(key_handle, index, name_buf, 0, [], info.max_valbufsize)
+                    return RegistryValue(value_name.name, value_type, value_data, key)
+                
+                (value_name, value_type, value_data, value_length) = self.pipe.EnumValue(key_handle, index, name_buf, 0, None, 0)
+                value = RegistryValue(value_name.name, value_type, None, key)
+                value.data_loaded = False
+                value.data_size = value_length
+                return value
+            
+            except RuntimeError as re:
+                if (re.args[0] == 0xEA): #0xEA is WERR_MORE_DATA, a longer name or bigger data was set since we asked
+                    self.grow_key_info(key_handle, info)
+                else:
+                    raise re
+    
+    def fetch_value_data(self, value_list):
+        """this function fetches the data of values that were listed without it. Values that have been deleted in the meantime are skipped.
+        Values with data already are left alone."""
+        value_list = [value for value in value_list if not value.data_loaded]
+        
+        for parent in set([value.parent for value in value_list]):
+            self.call_on_path(parent, self.fetch_open_value_data, [value for value in value_list if value.parent is parent])
+    
+    def fetch_open_value_data(self, key_handle, value_list):
+        """this function fetches the data of the values in 'value_list' that haven't got it yet from the opened key 'key_handle', their parent."""
+        for value in value_list:
+            if (value.data_loaded):
+                continue
+            
+            if (value.name == "(Default)"):
+                name = ""
+            else:
+                name = value.name
+            
+            data_size = value.data_size
+            try:
+                while True:
+                    try:
+                        (value_type, 
+                         value_data, 
+                         value_size, 
+                         value_length) = self.pipe.QueryValue(key_handle, WinRegPipeManager.winreg_string(name), value.type, [], data_size, data_size)
+                        break
+                    except RuntimeError as re:
+                        if (re.args[0] == 0xEA): #0xEA is WERR_MORE_DATA, the value has grown since it was listed
+                            data_size = max(self.query_key_info(key_handle).max_valbufsize, data_size * 2 + 1)
+                        else:
+                            raise re
+            except RuntimeError as re:
+                if (re.args[0] == 2): #WERR_BADFILE, the value is gone
+                    print >>sys.stderr, "Failed to fetch data for %s: %s." % (value.get_absolute_path(), re.args[1])
+                    continue
+                raise re
+            
+            value.type = value_type
+            value.data = value_data
+            value.data_loaded = True
+    
+    def get_key_security(self, key):
+        #TODO: this
+        
+        path_handles = self.open_path(key)
+        key_handle = path_handles[-1]
+        
+        
+        key_sec_data = winreg.KeySecurityData()
+        key_sec_data.size = 99999999 #TODO: find a better number.
+        #Fetch the DACL
+        result = self.pipe.GetKeySecurity(key_handle, security.SECINFO_DACL , key_sec_data)
+        
+        #This is what Vista does. I don't know what it means...
+        vista_key_sec_data1 = self.pipe.GetKeySecurity(key_handle, 0x0e4fcce7 , key_sec_data)
+        #vista_key_sec_data2 = self.pipe.GetKeySecurity(key_handle, 0xb234a886 , key_sec_data) #this crashes, "Expected type int"
+        
+        
+        
+        self.close_path(path_handles)
+        
+        return key_sec_data
+    
+    def get_open_key_security(self, key_handle):
+        """this function fetches the DACL of the opened key 'key_handle', which has to be opened with SEC_STD_READ_CONTROL.
+        
+        returns a winreg.KeySecurityData"""
+        key_sec_data = winreg.KeySecurityData()
+        key_sec_data.size = 0x10000 #a security descriptor can't be any bigger
+        
+        return self.pipe.GetKeySecurity(key_handle, security.SECINFO_DACL, key_sec_data)
+    
+    def set_open_key_security(self, key_handle, key_sec_data):
+        """this function sets the DACL of the opened key 'key_handle' to what get_open_key_security() returned. The key has to be opened with SEC_STD_WRITE_DAC."""
+        self.pipe.SetKeySecurity(key_handle, security.SECINFO_DACL, key_sec_data)
+    
+    def create_key(self, key):
+        (path_handles, new_handle) = self.open_path_with(key.parent, self.create_subkey, key.name, key.name)
+        
+        path_handles.append(new_handle)
+        
+        self.close_path(path_handles)
+    
+    def move_key(self, key, old_name, pipe_managers=None, progress_callback=None):
+        """this function renames the key 'old_name' next to 'key' (same parent) to the name of 'key', by copying it with everything
+        under it and deleting the original once the copy has been checked, see RegistryCopier. If 'pipe_managers' is given the copy
+        and the delete are spread over those pipes, otherwise only this one is used. 'progress_callback' is called with every key copied.
+        If anything goes wrong the half made copy is deleted again and the original is left alone.
+        Names are case insensitive, so a rename that only changes the case goes through a temporary name next to the key.
+        NOTE: this function will acquire the pipe manager locks on its own. Do Not Acquire Them Before Calling This Function!"""
+        if (pipe_managers == None):
+            pipe_managers = [self]
+        
+        self.lock.acquire()
+        try:
+            subkey_list = self.get_subkeys_for_key(key.parent)
+        finally:
+            self.lock.release()
+        
+        subkey_names = [subkey.name.lower() for subkey in subkey_list]
+        if (old_name.lower() not in subkey_names):
+            raise RuntimeError(0x2, "WERR_BADFILE")
+        source_key = subkey_list[subkey_names.index(old_name.lower())] #it has the class name, for the copy
+        
+        if (key.name.lower() == old_name.lower()):
+            if (key.name == source_key.name):
+                return
+            
+            index = 1
+            temporary_name = "%s (renaming)" % (old_name)
+            while (temporary_name.lower() in subkey_names):
+                index += 1
+                temporary_name = "%s (renaming %d)" % (old_name, index)
+            
+            self.move_key(RegistryKey(temporary_name, key.parent), old_name, pipe_managers, progress_callback)
+            try:
+                self.move_key(key, temporary_name, pipe_managers, progress_callback)
+            except (RuntimeError, ValueError) as ex:
+                raise ValueError("The key was left as %s: %s" % (temporary_name, ex.args[-1]))
+            return
+        
+        if (key.name.lower() in subkey_names):
+            raise ValueError("%s already exists" % (key.get_absolute_path()))
+        
+        copier = RegistryCopier(pipe_managers, progress_callback)
+        if (not copier.run(source_key, key) or not copier.verify()):
+            RegistryDeleter(pipe_managers).run(key)
+            if (copier.error != None):
+                raise copier.error
+            else:
+                raise ValueError("The copy didn't match the original (%s %s)" % copier.failed_keys[0])
+        
+        deleter = RegistryDeleter(pipe_managers)
+        deleter.run(source_key)
+        if (deleter.error != None):
+            raise deleter.error
+    
+    def remove_key(self, key, progress_callback=None):
+        """Deletes 'key' and everything under it on this pipe, see RegistryDeleter. 'progress_callback' is called with every key that's deleted.
+        Raises a RuntimeError if anything couldn't be deleted."""
+        deleter = RegistryDeleter([self], progress_callback)
+        deleter.run(key)
+        
+        if (deleter.error != None):
+            raise deleter.error
+    
+    def create_subkey(self, parent_handle, name, class_name="", access=0):
+        """this function creates the subkey 'name' of the opened key 'parent_handle' with the class 'class_name', or opens it if it exists.
+        'access' is asked for on top of what we always ask for. The handle isn't cached, give it back to close_key().
+        
+        returns a handle"""
+        (key_handle, action_taken) = self.pipe.CreateKey(
+            parent_handle,
+            WinRegPipeManager.winreg_string(name),
+            WinRegPipeManager.winreg_string(class_name),
+            0,
+            winreg.KEY_ENUMERATE_SUB_KEYS | winreg.KEY_CREATE_SUB_KEY | winreg.KEY_QUERY_VALUE | winreg.KEY_SET_VALUE | access,
+            None,
+            winreg.REG_ACTION_NONE)
+        
+        return key_handle
+    
+    def open_subkey(self, parent_handle, name, access=0):
+        """this function opens the subkey 'name' of the opened key 'parent_handle'. 'access' is asked for on top of what we always ask for.
+        The handle isn't cached, give it back to close_key().
+        
+        returns a handle"""
+        return self.pipe.OpenKey(parent_handle, 
+                                 WinRegPipeManager.winreg_string(name), 
+                                 0, 
+                                 winreg.KEY_ENUMERATE_SUB_KEYS | winreg.KEY_CREATE_SUB_KEY | winreg.KEY_QUERY_VALUE | winreg.KEY_SET_VALUE | access)
+    
+    def close_key(self, key_handle):
+        self.pipe.CloseKey(key_handle)
+    
+    def delete_subkey(self, parent_handle, name):
+        """this function deletes the subkey 'name' of the opened key 'parent_handle'. The server refuses if it has subkeys of its own."""
+        self.pipe.DeleteKey(parent_handle, WinRegPipeManager.winreg_string(name))
+    
+    def set_value(self, value):
+        self.call_on_path(value.parent, self.set_open_value, value)
+    
+    def set_open_value(self, key_handle, value):
+        """this function sets 'value' on the opened key 'key_handle', its parent."""
+        if (value.name == "(Default)"):
+            name = ""
+        else:
+            name = value.name
+        
+        self.pipe.SetValue(key_handle, WinRegPipeManager.winreg_string(name), value.type, value.data)
+    
+    def set_values(self, key, value_list):
+        """Sets every value in 'value_list' on 'key', or deletes it if its data is None. 'key' is opened once for all of them,
+        and if it doesn't exist it's created, along with any missing ancestors, with a single CreateKey() call."""
+        try:
+            self.call_on_path(key, self.write_values, value_list)
+            return
+        except RuntimeError as re:
+            if (re.args[0] != 0x2 or key.parent == None): #0x2 is WERR_BADFILE, the key isn't there yet
+                raise re
+            
+            root_key = key
+            while (root_key.parent != None):
+                root_key = root_key.parent
+            sub_path = key.get_absolute_path()[len(root_key.name) + 1:]
+            
+            root_handle = self.root_handles.get(root_key.name, root_key.handle)
+            (key_handle, action_taken) = self.pipe.CreateKey(
+                root_handle,
+                WinRegPipeManager.winreg_string(sub_path),
+                WinRegPipeManager.winreg_string(""),
+                0,
+                winreg.KEY_ENUMERATE_SUB_KEYS | winreg.KEY_CREATE_SUB_KEY | winreg.KEY_QUERY_VALUE | winreg.KEY_SET_VALUE,
+                None,
+                winreg.REG_ACTION_NONE)
+            path_handles = [root_handle, key_handle] #close_path() closes handles that aren't cached
+        
+        try:
+            self.write_values(path_handles[-1], value_list)
+        finally:
+            self.close_path(path_handles)
+    
+    def write_values(self, key_handle, value_list):
+        """this function sets every value in 'value_list' on the opened key 'key_handle', or deletes it if its data is None."""
+        for value in value_list:
+            if (value.name == "(Default)"):
+                name = ""
+            else:
+                name = value.name
+            
+            if (value.data == None):
+                try:
+                    self.pipe.DeleteValue(key_handle, WinRegPipeManager.winreg_string(name))
+                except RuntimeError as re:
+                    if (re.args[0] != 0x2): #it's already gone
+                        raise re
+            else:
+                self.pipe.SetValue(key_handle, WinRegPipeManager.winreg_string(name), value.type, value.data)
+    
+    def unset_value(self, value):
+        if (value.name == "(Default)"):
+            name = ""
+        else:
+            name = value.name
+        
+        self.call_on_path(value.parent, self.delete_open_value, name)
+    
+    def delete_open_value(self, key_handle, name):
+        """this function deletes the value 'name' of the opened key 'key_handle'. "" is the default value."""
+        self.pipe.DeleteValue(key_handle, WinRegPipeManager.winreg_string(name))
+    
+    def move_value(self, value, old_name):
+        self.call_on_path(value.parent, self.move_open_value, value, old_name)
+    
+    def move_open_value(self, key_handle, value, old_name):
+        """this function renames the value 'old_name' of the opened key 'key_handle' to 'value', by deleting it and setting 'value'."""
+        self.pipe.DeleteValue(key_handle, WinRegPipeManager.winreg_string(old_name))
+        self.pipe.SetValue(key_handle, WinRegPipeManager.winreg_string(value.name), value.type, value.data)
+    
+    def open_well_known_keys(self):
+        self.well_known_keys = []
+        self.root_handles = {}
+        
+        for name in WinRegPipeManager.root_key_names:
+            self.open_root_key(name)
+    
+    def open_root_key(self, name):
+        """Opens the root key called 'name', such as 'HKEY_LOCAL_MACHINE', unless it's open already.
+        
+        returns the RegistryKey"""
+        self.lock.acquire()
+        try:
+            for key in self.well_known_keys:
+                if (key.name == name):
+                    return key
+            
+            #additional permissions need to be added to properly fetch security information.
+            #winreg.REG_KEY_ALL works but it's best to figure out what permission is actually needed
+            open_function = getattr(self.pipe, WinRegPipeManager.root_key_open_functions[name])
+            key_handle = open_function(None, winreg.KEY_ENUMERATE_SUB_KEYS | winreg.KEY_CREATE_SUB_KEY | winreg.KEY_QUERY_VALUE | winreg.KEY_SET_VALUE)
+            key = RegistryKey(name, None)
+            key.handle = key_handle
+            self.well_known_keys.append(key)
+            self.root_handles[name] = key_handle
+            
+            return key
+        finally:
+            self.lock.release()
+    
+    def get_key_for_path(self, path, check_exists=True):
+        """Builds the RegistryKey for an absolute path such as 'HKLM\\SOFTWARE\\Microsoft' and, unless 'check_exists' is False, makes sure the key exists on the server.
+        The key is opened with a single OpenKey() call relative to the root key, no matter how deep it is.
+        NOTE: the names of the returned key and its ancestors are spelled the way they are in 'path', which may differ in case from the server.
+        
+        returns a RegistryKey"""
+        names = [name for name in path.strip().split("\\") if name != ""]
+        if (len(names) > 0 and names[0].lower() == "computer"): #regedit likes to prefix paths with this
+            names = names[1:]
+        if (len(names) == 0):
+            raise ValueError("No path given")
+        
+        root_name = names[0].upper()
+        root_name = WinRegPipeManager.root_key_abbreviations.get(root_name, root_name)
+        
+        if (root_name not in WinRegPipeManager.root_key_names):
+            raise ValueError("\'%s\' is not a root key" % (names[0]))
+        
+        key = self.open_root_key(root_name)
+        for name in names[1:]:
+            key = RegistryKey(name, key)
+        
+        #this raises a RuntimeError (usually WERR_BADFILE) if the key doesn't exist
+        if (check_exists):
+            self.close_path(self.open_path(key))
+        
+        return key
+    
+    def open_path(self, key):
+        """Opens 'key' and returns a list of handles. The last handle in the list is the handle for 'key'.
+        If 'key' or one of its ancestors is in the handle cache then the rest of the path is opened relative to the deepest cached handle,
+        otherwise it's opened relative to the root key. Either way the remaining components are opened with a single OpenKey() call.
+        Every list returned by this function must be given back to close_path().
+        
+        returns a list of handles"""
+        ancestors = []
+        while (key != None):
+            ancestors.append(key)
+            key = key.parent
+        ancestors.reverse()
+        
+        paths = [ancestors[0].name.lower()]
+        for ancestor in ancestors[1:]:
+            paths.append(paths[-1] + "\\" + ancestor.name.lower())
+        
+        self.lock.acquire()
+        try:
+            #find the deepest ancestor we already have a handle for
+            start = len(ancestors) - 1
+            while (start > 0 and not self.handle_cache.has_key(paths[start])):
+                start -= 1
+            
+            #root keys from another pipe manager (see clone()) carry that pipe's handle, so we always use our own
+            path_handles = [self.root_handles.get(ancestors[0].name, ancestors[0].handle)]
+            entries = []
+            if (start > 0):
+                entries.append(self.handle_cache[paths[start]])
+            
+            if (start < len(ancestors) - 1):
+                parent_handle = (entries[-1].handle if len(entries) > 0 else path_handles[0])
+                sub_path = "\\".join([ancestor.name for ancestor in ancestors[start + 1:]])
+                
+                #OpenKey() is happy to open a path with many components, so we don't have to open each ancestor
+                try:
+                    key_handle = self.open_subkey(parent_handle, sub_path)
+                except RuntimeError as re:
+                    if (len(entries) == 0 or re.args[0] not in WinRegPipeManager.stale_handle_errors):
+                        raise re
+                    
+                    #the cached ancestor may belong to a key that has been deleted, so we try once more from the root key.
+                    #if that works the cached handle was stale, otherwise the key just isn't there.
+                    key_handle = self.open_subkey(path_handles[0], "\\".join([ancestor.name for ancestor in ancestors[1:]]))
+                    self.invalidate_path(ancestors[start])
+                    entries = []
+                
+                entry = CachedHandle(paths[-1], key_handle)
+                self.handle_cache[entry.path] = entry
+                self.handle_entries[id(key_handle)] = entry
+                entries.append(entry)
+            
+            for entry in entries:
+                if (entry.cached): #move it to the end of the LRU order
+                    del self.handle_cache[entry.path]
+                    self.handle_cache[entry.path] = entry
+                entry.ref_count += 1
+                path_handles.append(entry.handle)
+            
+            return path_handles
+        
+        finally:
+            self.trim_handle_cache()
+            self.lock.release()
+    
+    def open_path_info(self, key):
+        """Opens 'key' like open_path() does and asks the server about it with query_key_info(), see open_path_with().
+        The handles must be given back to close_path().
+        
+        returns (path_handles, KeyInfo)"""
+        return self.open_path_with(key, self.query_key_info)
+    
+    def open_path_with(self, key, function, *args):
+        """Opens 'key' like open_path() does and calls 'function' with its handle and 'args'. If the handle came from the cache
+        and the server says it's no good (the key was deleted, and maybe made again, since we opened it) the cache entry is dropped,
+        the key is opened once more and 'function' is called again. The handles must be given back to close_path().
+        
+        returns (path_handles, what 'function' returned)"""
+        path_handles = self.open_path(key)
+        try:
+            return (path_handles, function(path_handles[-1], *args))
+        except RuntimeError as re:
+            cached = self.handle_entries.has_key(id(path_handles[-1]))
+            self.close_path(path_handles)
+            if (not cached or re.args[0] not in WinRegPipeManager.stale_handle_errors):
+                raise re
+        except:
+            self.close_path(path_handles)
+            raise
+        
+        self.invalidate_path(key)
+        path_handles = self.open_path(key)
+        try:
+            return (path_handles, function(path_handles[-1], *args))
+        except:
+            self.close_path(path_handles)
+            raise
+    
+    def call_on_path(self, key, function, *args):
+        """Calls 'function' with the handle of 'key' and 'args' like open_path_with() does, and gives the handles back.
+        
+        returns what 'function' returned"""
+        (path_handles, result) = self.open_path_with(key, function, *args)
+        self.close_path(path_handles)
+        
+        return result
+    
+    def close_path(self, path_handles):
+        """Gives back the handles returned by open_path(). Handles stay open in the cache until they are evicted or invalidated.
+        Handles that did not come from open_path() (for example the handle returned by CreateKey()) are closed right away."""
+        self.lock.acquire()
+        try:
+            for handle in path_handles[:0:-1]:
+                entry = self.handle_entries.get(id(handle))
+                if (entry == None or entry.handle is not handle):
+                    self.pipe.CloseKey(handle)
+                    continue
+                
+                entry.ref_count -= 1
+                if (entry.ref_count <= 0 and not entry.cached):
+                    self.close_cached_handle(entry)
+            
+            self.trim_handle_cache()
+        finally:
+            self.lock.release()
+    
+    def trim_handle_cache(self):
+        """Closes the least recently used handles that are not in use until the cache fits in 'handle_cache_size'."""
+        self.lock.acquire()
+        try:
+            if (len(self.handle_cache) <= self.handle_cache_size):
+                return
+            
+            for entry in self.handle_cache.values(): #values() makes a copy, so we can delete while looping
+                if (len(self.handle_cache) <= self.handle_cache_size):
+                    break
+                if (entry.ref_count <= 0):
+                    del self.handle_cache[entry.path]
+                    entry.cached = False
+                    self.close_cached_handle(entry)
+        finally:
+            self.lock.release()
+    
+    def invalidate_path(self, key):
+        """Removes the cached handles for 'key' and all keys below it. Handles that are still in use get closed by close_path()."""
+        path = key.get_absolute_path().lower()
+        prefix = path + "\\"
+        
+        self.lock.acquire()
+        try:
+            for entry in self.handle_cache.values():
+                if (entry.path == path or entry.path.startswith(prefix)):
+                    del self.handle_cache[entry.path]
+                    entry.cached = False
+                    if (entry.ref_count <= 0):
+                        self.close_cached_handle(entry)
+        finally:
+            self.lock.release()
+    
+    def flush_handle_cache(self):
+        """Closes every cached handle. This should be called before the pipe is dropped."""
+        self.lock.acquire()
+        try:
+            for entry in self.handle_entries.values():
+                entry.cached = False
+                self.close_cached_handle(entry)
+            self.handle_cache.clear()
+        finally:
+            self.lock.release()
+    
+    def close_cached_handle(self, entry):
+        del self.handle_entries[id(entry.handle)]
+        try:
+            self.pipe.CloseKey(entry.handle)
+        except RuntimeError as re:
+            #the key may have been deleted on the server, there's nothing left to close in that case
+            print >>sys.stderr, "Failed to close handle for %s: %s." % (entry.path, re.args[1])
+    
+    @staticmethod
+    def winreg_string(string):
+        ws = winreg.String()
+        ws.name = unicode(string)
+        ws.name_len = len(string)
+        ws.name_size = (len(string) + 1) * 2 #this is only ever sent to the server, so it just has to fit 'string'
+        
+        return ws
+    
+    @staticmethod
+    def winreg_string_buf(string, size=None):
+        """'size' is the buffer size in bytes for what the server sends back. By default it just fits 'string'."""
+        wsb = winreg.StringBuf()
+        wsb.name = unicode(string)
+        wsb.length = len(string)
+        wsb.size = size or (len(string) + 1) * 2
+        
+        return wsb
+    
+    @staticmethod
+    def winreg_val_name_buf(string, size=None):
+        """'size' is the buffer size in bytes for what the server sends back. By default it just fits 'string'."""
+        wvnb = winreg.ValNameBuf()
+        wvnb.name = unicode(string)
+        wvnb.length = len(string)
+        wvnb.size = size or (len(string) + 1) * 2
+        
+        return wvnb